@@ -0,0 +1,77 @@
+"""
+Микробенчмарк: стоимость наценки на одну котировку
+
+Сравнивает прежний путь через Decimal (как в FXRatesService._apply_markup
+до перехода на целые числа: умножение, сложение, сборка словаря режимов и
+quantize на каждый вызов) с src/utils/fixed_point.
+
+Запуск:
+    python benchmarks/bench_fixed_point.py [--number 200000]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from decimal import Decimal, ROUND_HALF_UP, ROUND_DOWN, ROUND_UP, ROUND_HALF_EVEN
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils.fixed_point import Markup, get_markup, to_units  # noqa: E402
+
+PRICE = Decimal('81.53')
+PRICE_FLOAT = 81.53
+PERCENT = Decimal('2.5')
+FIXED = Decimal('0.15')
+ROUND_TO = 2
+MODE = 'ROUND_HALF_UP'
+
+
+def legacy_decimal(price=PRICE, percent=PERCENT, fixed=FIXED, round_to=ROUND_TO, mode=MODE):
+    """Прежний расчет (копия кода до рефакторинга)"""
+    final_price = price * (Decimal('1') + percent / Decimal('100')) + fixed
+    quantizer = Decimal('0.1') ** round_to
+    rounding_map = {
+        'ROUND_HALF_UP': ROUND_HALF_UP,
+        'ROUND_DOWN': ROUND_DOWN,
+        'ROUND_UP': ROUND_UP,
+        'BANKERS': ROUND_HALF_EVEN
+    }
+    return final_price.quantize(quantizer, rounding=rounding_map.get(mode, ROUND_HALF_UP))
+
+
+def legacy_float(price=PRICE_FLOAT, percent=2.5, fixed=0.15):
+    """Прежний float-расчет городов (best_rate, матрица цен)"""
+    return round(price * (1 + percent / 100) + fixed, 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=200_000, help="вызовов на замер")
+    parser.add_argument("--repeat", type=int, default=5, help="замеров (берется лучший)")
+    args = parser.parse_args()
+
+    markup = Markup(PERCENT, FIXED, ROUND_TO, MODE)
+    units = to_units(PRICE)
+    assert markup.apply_decimal(PRICE) == legacy_decimal()
+
+    cases = [
+        ("decimal (прежний FXRatesService)", legacy_decimal),
+        ("float round() (прежний best_rate)", legacy_float),
+        ("fixed_point get_markup().apply_decimal", lambda: get_markup(PERCENT, FIXED, ROUND_TO, MODE).apply_decimal(PRICE)),
+        ("fixed_point Markup.apply_decimal", lambda: markup.apply_decimal(PRICE)),
+        ("fixed_point Markup.apply_float", lambda: markup.apply_float(PRICE_FLOAT)),
+        ("fixed_point Markup.apply_units (строка матрицы)", lambda: markup.apply_units(units) / 100),
+    ]
+
+    baseline = None
+    print(f"{'path':<50} {'ns/quote':>10} {'vs decimal':>11}")
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=args.number, repeat=args.repeat))
+        ns = best / args.number * 1e9
+        baseline = baseline or ns
+        print(f"{name:<50} {ns:>10.0f} {baseline / ns:>10.1f}x")
+
+
+if __name__ == "__main__":
+    main()
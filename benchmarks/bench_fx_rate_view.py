@@ -0,0 +1,152 @@
+"""
+Бенчмарк: чтение итоговых курсов через соединение 4 таблиц и через fx_rate_view
+
+Прежний путь FXRatesService.get_final_rate / get_all_final_rates соединял
+fx_final_rate, fx_source, fx_source_pair и fx_raw_rate на каждый вызов;
+новый читает денормализованную fx_rate_view (миграция 015).
+
+Нужен PostgreSQL (настройки POSTGRES_* как у бота). Таблицы создаются
+миграциями 004 и 015 во временной схеме, которая удаляется после замера.
+
+Запуск:
+    python benchmarks/bench_fx_rate_view.py [--pairs 1000] [--number 2000]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+import asyncpg
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from src.db import PG_HOST, PG_PORT, PG_DB, PG_USER, PG_PASSWORD  # noqa: E402
+from src.services.fx_rates import _SELECT_RATE_VIEW_SQL  # noqa: E402
+
+SCHEMA = "bench_fx_rate_view"
+STALE_THRESHOLD = 180
+
+# Прежние запросы (копия кода до перехода на fx_rate_view)
+LEGACY_SELECT_SQL = """
+    SELECT
+        s.code as source_code,
+        sp.internal_symbol,
+        sp.base_currency,
+        sp.quote_currency,
+        fr.raw_price,
+        fr.final_price,
+        rr.bid_price,
+        rr.ask_price,
+        fr.applied_rule_id,
+        fr.markup_percent,
+        fr.markup_fixed,
+        fr.calculated_at,
+        fr.calculated_at < NOW() - make_interval(secs => $1) AS stale
+    FROM fx_final_rate fr
+    JOIN fx_source s ON s.id = fr.source_id
+    JOIN fx_source_pair sp ON sp.id = fr.source_pair_id
+    LEFT JOIN fx_raw_rate rr ON rr.source_id = fr.source_id AND rr.source_pair_id = fr.source_pair_id
+    WHERE s.enabled = true AND sp.enabled = true
+"""
+LEGACY_ONE_SQL = LEGACY_SELECT_SQL + """
+    AND sp.base_currency = $2 AND sp.quote_currency = $3
+    ORDER BY fr.calculated_at DESC LIMIT 1
+"""
+LEGACY_ALL_SQL = LEGACY_SELECT_SQL + " ORDER BY s.code, sp.internal_symbol"
+
+VIEW_ONE_SQL = _SELECT_RATE_VIEW_SQL + """
+    AND base_currency = $2 AND quote_currency = $3
+    ORDER BY calculated_at DESC LIMIT 1
+"""
+VIEW_ALL_SQL = _SELECT_RATE_VIEW_SQL + " ORDER BY source_code, internal_symbol"
+
+# Пары по двум источникам миграции 004: валюта C<n>/RUB есть у обоих
+SEED_SQL = """
+    INSERT INTO fx_source_pair (source_id, source_symbol, base_currency, quote_currency, internal_symbol)
+    SELECT s.id, 'c' || n || 'rub', 'C' || n, 'RUB', 'C' || n || '/RUB'
+    FROM fx_source s, generate_series(1, $1 / 2) n;
+
+    INSERT INTO fx_raw_rate (source_id, source_pair_id, raw_price, bid_price, ask_price)
+    SELECT source_id, id, 80 + random(), 80, 81 FROM fx_source_pair;
+
+    INSERT INTO fx_final_rate (source_id, source_pair_id, raw_price, final_price, markup_percent, markup_fixed,
+                               calculated_at)
+    SELECT source_id, source_pair_id, raw_price, raw_price * 1.01, 1, 0, now() - random() * interval '60 seconds'
+    FROM fx_raw_rate;
+"""
+
+
+def _migration(name: str) -> str:
+    with open(os.path.join(ROOT, "migrations", name), encoding="utf-8") as f:
+        return f.read()
+
+
+async def _timed(conn, method: str, query: str, args_factory, number: int) -> float:
+    """Средняя задержка вызова, мс"""
+    fetch = getattr(conn, method)
+    for _ in range(min(50, number)):  # прогрев кэша планов и буферов
+        await fetch(query, *args_factory())
+    started = time.perf_counter()
+    for _ in range(number):
+        await fetch(query, *args_factory())
+    return (time.perf_counter() - started) / number * 1000
+
+
+async def run(pairs: int, number: int, explain: bool):
+    conn = await asyncpg.connect(host=PG_HOST, port=PG_PORT, user=PG_USER, password=PG_PASSWORD, database=PG_DB)
+    try:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+        await conn.execute(f"SET search_path TO {SCHEMA}")
+        await conn.execute(_migration("004_fx_rates_system.sql"))
+        # asyncpg не принимает параметры в многооператорном запросе
+        await conn.execute(SEED_SQL.replace("$1", str(pairs)))
+        await conn.execute(_migration("015_fx_rate_view.sql"))
+        await conn.execute("ANALYZE")
+
+        total = await conn.fetchval("SELECT count(*) FROM fx_rate_view")
+        currencies = [f"C{n}" for n in range(1, pairs // 2 + 1)]
+
+        def one():
+            return STALE_THRESHOLD, random.choice(currencies), "RUB"
+
+        def every():
+            return (STALE_THRESHOLD,)
+
+        cases = [
+            ("get_final_rate: join", "fetchrow", LEGACY_ONE_SQL, one, number),
+            ("get_final_rate: fx_rate_view", "fetchrow", VIEW_ONE_SQL, one, number),
+            ("get_all_final_rates: join", "fetch", LEGACY_ALL_SQL, every, max(1, number // 20)),
+            ("get_all_final_rates: fx_rate_view", "fetch", VIEW_ALL_SQL, every, max(1, number // 20)),
+        ]
+
+        print(f"{total} rates in fx_rate_view")
+        print(f"{'path':<40} {'ms/call':>10} {'vs join':>9}")
+        baseline = None
+        for name, method, query, args_factory, calls in cases:
+            ms = await _timed(conn, method, query, args_factory, calls)
+            if name.endswith("join"):
+                baseline = ms
+            print(f"{name:<40} {ms:>10.3f} {baseline / ms:>8.1f}x")
+            if explain:
+                plan = await conn.fetch("EXPLAIN ANALYZE " + query, *args_factory())
+                print("\n".join("    " + row[0] for row in plan))
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, default=1000, help="пар (поровну на два источника)")
+    parser.add_argument("--number", type=int, default=2000, help="вызовов get_final_rate на замер")
+    parser.add_argument("--explain", action="store_true", help="печатать планы запросов")
+    args = parser.parse_args()
+    asyncio.run(run(args.pairs, args.number, args.explain))
+
+
+if __name__ == "__main__":
+    main()
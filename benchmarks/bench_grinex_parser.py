@@ -0,0 +1,109 @@
+"""
+Микробенчмарк: разбор ответа /api/v1/tickers Grinex
+
+Сравнивает прежний GrinexClient._parse_ticker (перебор псевдонимов ключей
+и разбор метки времени на каждый тикер) с разбором по схеме ответа
+(TickerSchema, GrinexClient._parse_tickers).
+
+Запуск:
+    python benchmarks/bench_grinex_parser.py [--tickers 5000] [--number 20]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.services.grinex import GrinexClient, GrinexTicker  # noqa: E402
+
+
+def _legacy_extract_decimal(data, keys):
+    for key in keys:
+        value = data.get(key)
+        if value is not None:
+            try:
+                return Decimal(str(value))
+            except Exception:
+                pass
+    return None
+
+
+def legacy_parse_ticker(data):
+    """Прежний разбор (копия кода до рефакторинга)"""
+    try:
+        symbol = data.get('symbol') or data.get('pair') or data.get('s')
+        if not symbol:
+            return None
+        last_price = _legacy_extract_decimal(data, ['lastPrice', 'last', 'price', 'c', 'close'])
+        bid = _legacy_extract_decimal(data, ['bid', 'bidPrice', 'b'])
+        ask = _legacy_extract_decimal(data, ['ask', 'askPrice', 'a'])
+        volume_24h = _legacy_extract_decimal(data, ['volume', 'volume24h', 'v', 'quoteVolume'])
+        high_24h = _legacy_extract_decimal(data, ['high', 'high24h', 'h'])
+        low_24h = _legacy_extract_decimal(data, ['low', 'low24h', 'l'])
+        change_24h = _legacy_extract_decimal(data, ['change', 'priceChange', 'priceChangePercent'])
+        timestamp = None
+        ts_value = data.get('timestamp') or data.get('time') or data.get('t')
+        if ts_value:
+            if isinstance(ts_value, int):
+                ts_value = ts_value / 1000 if ts_value > 10**10 else ts_value
+                timestamp = datetime.fromtimestamp(ts_value)
+            elif isinstance(ts_value, str):
+                timestamp = datetime.fromisoformat(ts_value.replace('Z', '+00:00'))
+        return GrinexTicker(symbol, last_price, bid, ask, volume_24h, high_24h, low_24h, change_24h,
+                            timestamp or datetime.now())
+    except Exception:
+        return None
+
+
+def legacy_parse_list(data):
+    tickers = {}
+    for item in data:
+        ticker = legacy_parse_ticker(item)
+        if ticker:
+            tickers[ticker.symbol] = ticker
+    return tickers
+
+
+def payload(count: int):
+    """Ответ в формате Binance-подобного /api/v1/tickers (самый длинный перебор ключей)"""
+    return [
+        {"symbol": f"C{n}RUB", "priceChangePercent": "-0.52", "lastPrice": f"{80 + n / 1000:.4f}",
+         "bidPrice": f"{79.9 + n / 1000:.4f}", "askPrice": f"{80.1 + n / 1000:.4f}",
+         "highPrice": "82.1", "lowPrice": "79.5", "quoteVolume": "1250000.75", "time": 1735787045123}
+        for n in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tickers", type=int, default=5000, help="тикеров в ответе")
+    parser.add_argument("--number", type=int, default=20, help="разборов ответа на замер")
+    parser.add_argument("--repeat", type=int, default=5, help="замеров (берется лучший)")
+    args = parser.parse_args()
+
+    data = payload(args.tickers)
+    client = GrinexClient()
+    new, old = client._parse_tickers((None, item) for item in data), legacy_parse_list(data)
+    assert {s: t.last_price for s, t in new.items()} == {s: t.last_price for s, t in old.items()}
+
+    cases = [
+        ("legacy _parse_ticker per item", lambda: legacy_parse_list(data)),
+        ("_parse_ticker per item (schema)", lambda: {t.symbol: t for t in map(client._parse_ticker, data)}),
+        ("_parse_tickers bulk", lambda: client._parse_tickers((None, item) for item in data)),
+    ]
+
+    baseline = None
+    print(f"{args.tickers} tickers per response")
+    print(f"{'path':<36} {'ms/response':>12} {'us/ticker':>10} {'vs legacy':>10}")
+    for name, func in cases:
+        best = min(timeit.repeat(func, number=args.number, repeat=args.repeat)) / args.number
+        baseline = baseline or best
+        print(f"{name:<36} {best * 1e3:>12.2f} {best / args.tickers * 1e6:>10.2f} {baseline / best:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
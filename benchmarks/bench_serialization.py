@@ -0,0 +1,141 @@
+"""
+Бенчмарк: разбор и кодирование JSON - стандартный json против src/utils/serialization
+
+Полезные нагрузки повторяют форму реальных ответов и значений:
+- rapira_plate   - ответ /market/exchange-plate-mini (стакан по 50 уровней)
+- rapira_rates   - ответ /open/market/rates
+- grinex_tickers - ответ /api/v1/tickers
+- plate_cache    - значение rapira:plate:<symbol> в Redis
+- fx_rates_api   - ответ /api/fx/rates (Decimal и datetime из FXRatesService)
+
+Свои записанные ответы можно добавить: --payload name=path/to/response.json
+(файл разбирается и кодируется так же, как встроенные).
+
+Запуск:
+    python benchmarks/bench_serialization.py [--number 2000] [--payload plate=dump.json]
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timezone
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import serialization  # noqa: E402
+
+random.seed(7)
+NOW = datetime(2025, 1, 2, 3, 4, 5, 123456, tzinfo=timezone.utc)
+
+
+def _levels(mid: float, step: float, count: int = 50):
+    return [{"price": round(mid + step * i, 2), "amount": round(random.uniform(10, 5000), 4)} for i in range(count)]
+
+
+def rapira_plate():
+    return {
+        "symbol": "USDT/RUB",
+        "ask": {"items": _levels(81.83, 0.01), "lowestPrice": 81.83, "totalVolume": 125000.5},
+        "bid": {"items": _levels(81.50, -0.01), "highestPrice": 81.50, "totalVolume": 98000.25},
+        "ts": NOW.isoformat(),
+    }
+
+
+def rapira_rates():
+    return {"rates": [
+        {"symbol": f"C{n}/USDT", "close": round(random.uniform(0.01, 60000), 6), "bid": 1.0, "ask": 1.01}
+        for n in range(200)
+    ]}
+
+
+def grinex_tickers():
+    return [
+        {"symbol": f"c{n}rub", "last": f"{random.uniform(1, 100):.4f}", "buy": f"{random.uniform(1, 100):.4f}",
+         "sell": f"{random.uniform(1, 100):.4f}", "vol": f"{random.uniform(0, 1e6):.2f}", "at": 1735787045}
+        for n in range(200)
+    ]
+
+
+def plate_cache():
+    return {
+        "symbol": "USDT/RUB", "ts": NOW.isoformat(),
+        "best_bid": {"price": 81.5, "qty": 1000.0}, "best_ask": {"price": 81.83, "qty": 250.0},
+        "bids": [[81.5 - i / 100, 100.0 + i] for i in range(50)],
+        "asks": [[81.83 + i / 100, 100.0 + i] for i in range(50)],
+        "last_price": 81.7, "last_qty": 12.5, "last_ts": NOW.isoformat(),
+    }
+
+
+def fx_rates_api(count: int = 1000):
+    return {"rates": [
+        {"base": f"C{n}", "quote": "RUB", "source": "rapira", "internal_symbol": f"C{n}/RUB",
+         "final_price": Decimal("82.6500000000"), "raw_price": Decimal("81.8300000000"),
+         "calculated_at": NOW, "stale": False}
+        for n in range(count)
+    ]}
+
+
+def fx_rates_api_legacy(payload):
+    """Прежний эндпоинт: str() и isoformat() на каждое поле, затем json"""
+    return json.dumps({"rates": [
+        dict(r, final_price=str(r["final_price"]), raw_price=str(r["raw_price"]),
+             calculated_at=r["calculated_at"].isoformat())
+        for r in payload["rates"]
+    ]}).encode()
+
+
+def _best(func, number: int, repeat: int) -> float:
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--number", type=int, default=2000, help="операций на замер")
+    parser.add_argument("--repeat", type=int, default=5, help="замеров (берется лучший)")
+    parser.add_argument("--payload", action="append", default=[], metavar="NAME=PATH",
+                        help="записанный JSON-ответ (можно несколько)")
+    args = parser.parse_args()
+
+    payloads = {
+        "rapira_plate": rapira_plate(),
+        "rapira_rates": rapira_rates(),
+        "grinex_tickers": grinex_tickers(),
+        "plate_cache": plate_cache(),
+    }
+    for item in args.payload:
+        name, _, path = item.partition("=")
+        with open(path, "rb") as f:
+            payloads[name] = json.loads(f.read())
+
+    print(f"serialization backend: {serialization.BACKEND}")
+    print(f"{'payload':<16} {'size':>8} {'op':<6} {'json us':>9} {'fast us':>9} {'speedup':>8} {'fast MB/s':>10}")
+    for name, payload in payloads.items():
+        raw = json.dumps(payload).encode()
+        number = max(1, args.number * 1024 // max(len(raw), 1024))
+        cases = [
+            ("loads", lambda: json.loads(raw), lambda: serialization.loads(raw)),
+            ("dumps", lambda: json.dumps(payload).encode(), lambda: serialization.dumps(payload)),
+        ]
+        for op, legacy, fast in cases:
+            legacy_s = _best(legacy, number, args.repeat)
+            fast_s = _best(fast, number, args.repeat)
+            print(f"{name:<16} {len(raw):>8} {op:<6} {legacy_s * 1e6:>9.1f} {fast_s * 1e6:>9.1f} "
+                  f"{legacy_s / fast_s:>7.1f}x {len(raw) / fast_s / 1e6:>10.1f}")
+
+    # Ответ /api/fx/rates: Decimal и datetime кодирует сериализатор
+    api = fx_rates_api()
+    assert json.loads(serialization.dumps(api)) == json.loads(fx_rates_api_legacy(api))
+    number = max(1, args.number // 50)
+    legacy_s = _best(lambda: fx_rates_api_legacy(api), number, args.repeat)
+    fast_s = _best(lambda: serialization.dumps(api), number, args.repeat)
+    size = len(serialization.dumps(api))
+    print(f"{'fx_rates_api':<16} {size:>8} {'render':<6} {legacy_s * 1e6:>9.1f} {fast_s * 1e6:>9.1f} "
+          f"{legacy_s / fast_s:>7.1f}x {size / fast_s / 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+-- Миграция 013: история тиков курсов
+-- fx_rate_snapshot становится партиционированной по времени (партиция в сутки),
+-- плюс OHLC-агрегаты 1m и 1h, которые пополняются при каждой записи пачки.
+-- Пишет src/services/rate_history.py (COPY пачками), он же создает партиции
+-- заранее и удаляет устаревшие по срокам хранения.
+
+-- Прежняя таблица из 004 не использовалась; если она есть и не партиционирована,
+-- сохраняем ее под другим именем
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE c.relname = 'fx_rate_snapshot' AND n.nspname = current_schema() AND c.relkind = 'r'
+    ) THEN
+        ALTER TABLE fx_rate_snapshot RENAME TO fx_rate_snapshot_legacy;
+        ALTER INDEX IF EXISTS idx_fx_rate_snapshot_time RENAME TO idx_fx_rate_snapshot_legacy_time;
+    END IF;
+END $$;
+
+-- Тики (append-only). Без внешних ключей: запись идет COPY пачками,
+-- проверка FK на каждую строку здесь не нужна
+CREATE TABLE IF NOT EXISTS fx_rate_snapshot (
+  source_id INT NOT NULL,
+  source_pair_id INT NOT NULL,
+  raw_price NUMERIC(20,10) NOT NULL,
+  final_price NUMERIC(20,10) NOT NULL,
+  applied_rule_id INT,
+  snapshot_at TIMESTAMPTZ NOT NULL
+) PARTITION BY RANGE (snapshot_at);
+
+-- Индекс создается на каждой партиции; запросы истории по паре и периоду
+-- читают только партиции нужных суток
+CREATE INDEX IF NOT EXISTS idx_fx_rate_snapshot_pair_time ON fx_rate_snapshot(source_pair_id, snapshot_at);
+
+-- Партиция на сутки: fx_rate_snapshot_YYYYMMDD
+CREATE OR REPLACE FUNCTION fx_rate_snapshot_ensure_partition(day DATE)
+RETURNS VOID AS $$
+DECLARE
+    partition_name TEXT := 'fx_rate_snapshot_' || to_char(day, 'YYYYMMDD');
+BEGIN
+    EXECUTE format(
+        'CREATE TABLE IF NOT EXISTS %I PARTITION OF fx_rate_snapshot FOR VALUES FROM (%L) TO (%L)',
+        partition_name, day::timestamptz, (day + 1)::timestamptz
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаляет партиции, целиком лежащие раньше cutoff; возвращает количество
+CREATE OR REPLACE FUNCTION fx_rate_snapshot_drop_partitions(cutoff DATE)
+RETURNS INT AS $$
+DECLARE
+    part RECORD;
+    dropped INT := 0;
+BEGIN
+    FOR part IN
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'fx_rate_snapshot'
+          AND c.relname ~ '^fx_rate_snapshot_[0-9]{8}$'
+          AND to_date(substring(c.relname from '[0-9]{8}$'), 'YYYYMMDD') < cutoff
+    LOOP
+        EXECUTE format('DROP TABLE IF EXISTS %I', part.relname);
+        dropped := dropped + 1;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT fx_rate_snapshot_ensure_partition(CURRENT_DATE);
+SELECT fx_rate_snapshot_ensure_partition(CURRENT_DATE + 1);
+
+-- OHLC-агрегаты. open/close выбираются по времени тика (open_at/close_at),
+-- поэтому пачки, пришедшие не по порядку, не портят свечу
+CREATE TABLE IF NOT EXISTS fx_rate_ohlc_1m (
+  source_pair_id INT NOT NULL,
+  bucket TIMESTAMPTZ NOT NULL,
+  open NUMERIC(20,10) NOT NULL,
+  high NUMERIC(20,10) NOT NULL,
+  low NUMERIC(20,10) NOT NULL,
+  close NUMERIC(20,10) NOT NULL,
+  open_at TIMESTAMPTZ NOT NULL,
+  close_at TIMESTAMPTZ NOT NULL,
+  ticks INT NOT NULL,
+  PRIMARY KEY (source_pair_id, bucket)
+);
+
+CREATE TABLE IF NOT EXISTS fx_rate_ohlc_1h (LIKE fx_rate_ohlc_1m INCLUDING ALL);
+
+CREATE INDEX IF NOT EXISTS idx_fx_rate_ohlc_1m_bucket ON fx_rate_ohlc_1m(bucket);
+CREATE INDEX IF NOT EXISTS idx_fx_rate_ohlc_1h_bucket ON fx_rate_ohlc_1h(bucket);
+
+COMMENT ON TABLE fx_rate_snapshot IS 'История тиков курсов (партиции по суткам, финальная цена с наценкой)';
+COMMENT ON TABLE fx_rate_ohlc_1m IS 'Минутные свечи финальной цены по парам источников';
+COMMENT ON TABLE fx_rate_ohlc_1h IS 'Часовые свечи финальной цены по парам источников';
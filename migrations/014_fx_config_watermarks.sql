@@ -0,0 +1,7 @@
+-- Миграция 014: индексы для инкрементального обновления конфигурации FX
+-- FXRatesService каждые FX_CONFIG_REFRESH_SECONDS читает только строки
+-- с updated_at позже прошлой загрузки (триггеры updated_at - в миграции 004).
+
+CREATE INDEX IF NOT EXISTS idx_fx_source_updated_at ON fx_source(updated_at);
+CREATE INDEX IF NOT EXISTS idx_fx_source_pair_updated_at ON fx_source_pair(updated_at);
+CREATE INDEX IF NOT EXISTS idx_fx_markup_rule_updated_at ON fx_markup_rule(updated_at);
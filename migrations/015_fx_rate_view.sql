@@ -0,0 +1,90 @@
+-- Миграция 015: денормализованная модель чтения итоговых курсов
+-- fx_rate_view содержит все, что отдают FXRatesService.get_final_rate и
+-- get_all_final_rates (и /api/fx/rates веб-админки), поэтому чтение - один
+-- индексный поиск вместо соединения fx_final_rate, fx_source, fx_source_pair
+-- и fx_raw_rate. Курсы пишет синхронизация (src/services/fx_rates.py) в той же
+-- транзакции, что и fx_raw_rate / fx_final_rate; код, символ и признак
+-- enabled источника и пары поддерживаются триггерами ниже.
+
+CREATE TABLE IF NOT EXISTS fx_rate_view (
+  source_id INT NOT NULL REFERENCES fx_source(id) ON DELETE CASCADE,
+  source_pair_id INT NOT NULL REFERENCES fx_source_pair(id) ON DELETE CASCADE,
+  source_code TEXT NOT NULL,
+  internal_symbol TEXT NOT NULL,
+  base_currency TEXT NOT NULL,
+  quote_currency TEXT NOT NULL,
+  raw_price NUMERIC(20,10) NOT NULL,
+  final_price NUMERIC(20,10) NOT NULL,
+  bid_price NUMERIC(20,10),
+  ask_price NUMERIC(20,10),
+  applied_rule_id INT,
+  markup_percent NUMERIC(9,4),
+  markup_fixed NUMERIC(20,10),
+  calculated_at TIMESTAMPTZ NOT NULL,
+  source_enabled BOOLEAN NOT NULL DEFAULT TRUE,
+  pair_enabled BOOLEAN NOT NULL DEFAULT TRUE,
+  PRIMARY KEY (source_id, source_pair_id)
+);
+
+-- Курс по валютам (последний рассчитанный) и список по источнику и символу
+CREATE INDEX IF NOT EXISTS idx_fx_rate_view_currencies
+  ON fx_rate_view(base_currency, quote_currency, calculated_at DESC)
+  WHERE source_enabled AND pair_enabled;
+CREATE INDEX IF NOT EXISTS idx_fx_rate_view_symbol
+  ON fx_rate_view(source_code, internal_symbol)
+  WHERE source_enabled AND pair_enabled;
+
+-- Изменения источника и пары (админка) переносятся в модель чтения
+CREATE OR REPLACE FUNCTION fx_rate_view_sync_source()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE fx_rate_view
+    SET source_code = NEW.code, source_enabled = NEW.enabled
+    WHERE source_id = NEW.id
+      AND (source_code IS DISTINCT FROM NEW.code OR source_enabled IS DISTINCT FROM NEW.enabled);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION fx_rate_view_sync_pair()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE fx_rate_view
+    SET internal_symbol = NEW.internal_symbol,
+        base_currency = NEW.base_currency,
+        quote_currency = NEW.quote_currency,
+        pair_enabled = NEW.enabled
+    WHERE source_pair_id = NEW.id
+      AND (internal_symbol IS DISTINCT FROM NEW.internal_symbol
+           OR base_currency IS DISTINCT FROM NEW.base_currency
+           OR quote_currency IS DISTINCT FROM NEW.quote_currency
+           OR pair_enabled IS DISTINCT FROM NEW.enabled);
+    RETURN NEW;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS fx_rate_view_source ON fx_source;
+CREATE TRIGGER fx_rate_view_source AFTER UPDATE ON fx_source
+FOR EACH ROW EXECUTE FUNCTION fx_rate_view_sync_source();
+
+DROP TRIGGER IF EXISTS fx_rate_view_pair ON fx_source_pair;
+CREATE TRIGGER fx_rate_view_pair AFTER UPDATE ON fx_source_pair
+FOR EACH ROW EXECUTE FUNCTION fx_rate_view_sync_pair();
+
+-- Начальное заполнение из текущих курсов
+INSERT INTO fx_rate_view (
+  source_id, source_pair_id, source_code, internal_symbol, base_currency, quote_currency,
+  raw_price, final_price, bid_price, ask_price, applied_rule_id, markup_percent, markup_fixed,
+  calculated_at, source_enabled, pair_enabled
+)
+SELECT
+  fr.source_id, fr.source_pair_id, s.code, sp.internal_symbol, sp.base_currency, sp.quote_currency,
+  fr.raw_price, fr.final_price, rr.bid_price, rr.ask_price, fr.applied_rule_id, fr.markup_percent, fr.markup_fixed,
+  fr.calculated_at, s.enabled, sp.enabled
+FROM fx_final_rate fr
+JOIN fx_source s ON s.id = fr.source_id
+JOIN fx_source_pair sp ON sp.id = fr.source_pair_id
+LEFT JOIN fx_raw_rate rr ON rr.source_id = fr.source_id AND rr.source_pair_id = fr.source_pair_id
+ON CONFLICT (source_id, source_pair_id) DO NOTHING;
+
+COMMENT ON TABLE fx_rate_view IS 'Итоговые курсы для чтения (денормализованы из fx_final_rate, fx_raw_rate, fx_source, fx_source_pair)';
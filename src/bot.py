@@ -18,16 +18,20 @@ from src.handlers.admin_content import router as admin_content_router
 from src.handlers.admin_grinex import router as admin_grinex_router
 from src.handlers.settings import router as settings_router
 from src.scheduler import start_scheduler
+from src.services.market_stream import stop_market_streams
 from src.services.fx_scheduler import start_fx_scheduler, stop_fx_scheduler
+from src.services.rate_history import FX_HISTORY_ENABLED, get_rate_history_writer
+from src.utils.http_client import close_http_clients
+from src.utils.layered_cache import get_layered_cache
+from src.utils.redis_client import get_redis, close_redis
 
 load_dotenv()
 
 BOT_TOKEN = os.getenv("BOT_TOKEN")
-REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 
 bot = Bot(token=BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN))
-storage = RedisStorage.from_url(f"redis://{REDIS_HOST}:{REDIS_PORT}/0")
+# FSM-хранилище работает через общий пул Redis (src/utils/redis_client.py)
+storage = RedisStorage(redis=get_redis())
 dp = Dispatcher(storage=storage, fsm_strategy=FSMStrategy.CHAT)
 
 async def main():
@@ -44,6 +48,13 @@ async def main():
     # Запускаем планировщик курсов FX
     await start_fx_scheduler()
     
+    # Фоновая запись истории тиков курсов
+    if FX_HISTORY_ENABLED:
+        get_rate_history_writer().start()
+    
+    # Подписка на инвалидации кэша из веб-админки
+    get_layered_cache().start_listener()
+    
     # FSM роутеры должны быть первыми (приоритет)
     dp.include_router(buy_usdt_router)
     dp.include_router(sell_usdt_router)
@@ -65,6 +76,14 @@ async def main():
     finally:
         # Останавливаем планировщик при завершении
         await stop_fx_scheduler()
+        await stop_market_streams()
+        # Дописываем остаток истории тиков
+        if FX_HISTORY_ENABLED:
+            await get_rate_history_writer().stop()
+        # Закрываем общий пул HTTP-соединений
+        await close_http_clients()
+        await get_layered_cache().stop_listener()
+        await close_redis()
 
 if __name__ == "__main__":
     asyncio.run(main()) 
\ No newline at end of file
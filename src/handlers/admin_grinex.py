@@ -266,7 +266,6 @@ async def grinex_settings(callback: types.CallbackQuery):
         from src.services.grinex import GRINEX_API_BASE, GRINEX_TIMEOUT, GRINEX_MAX_RETRIES
         from src.services.fx_scheduler import (
             FX_UPDATE_INTERVAL_SECONDS,
-            FX_STALE_CHECK_INTERVAL,
             FX_STALE_THRESHOLD_SECONDS
         )
         
@@ -279,7 +278,6 @@ async def grinex_settings(callback: types.CallbackQuery):
         
         settings_text += "**FX Scheduler:**\n"
         settings_text += f"• Update interval: {FX_UPDATE_INTERVAL_SECONDS} сек\n"
-        settings_text += f"• Stale check: {FX_STALE_CHECK_INTERVAL} сек\n"
         settings_text += f"• Stale threshold: {FX_STALE_THRESHOLD_SECONDS} сек\n\n"
         
         settings_text += "_Для изменения настроек отредактируйте переменные окружения и перезапустите бота._"
@@ -306,6 +304,7 @@ async def grinex_pairs_stats(callback: types.CallbackQuery):
         await callback.answer("📊 Загрузка статистики...")
         
         from src.db import get_pg_pool
+        from src.services.rate_freshness import FX_STALE_THRESHOLD_SECONDS
         
         pool = await get_pg_pool()
         async with pool.acquire() as conn:
@@ -322,14 +321,15 @@ async def grinex_pairs_stats(callback: types.CallbackQuery):
             
             # Самые популярные пары
             top_pairs = await conn.fetch("""
-                SELECT sp.internal_symbol, fr.final_price, fr.calculated_at, fr.stale
+                SELECT sp.internal_symbol, fr.final_price, fr.calculated_at,
+                       fr.calculated_at < NOW() - make_interval(secs => $1) AS stale
                 FROM fx_source_pair sp
                 JOIN fx_source s ON s.id = sp.source_id
                 LEFT JOIN fx_final_rate fr ON fr.source_pair_id = sp.id
                 WHERE s.code = 'grinex' AND sp.enabled = true
                 ORDER BY fr.calculated_at DESC NULLS LAST
                 LIMIT 5
-            """)
+            """, FX_STALE_THRESHOLD_SECONDS)
         
         stats_text = "📊 **Статистика пар Grinex**\n\n"
         stats_text += f"• Всего пар: {stats['total_pairs']}\n"
@@ -382,7 +382,7 @@ async def grinex_scheduler_info(callback: types.CallbackQuery):
         if status['config']:
             info_text += f"\n**Конфигурация:**\n"
             info_text += f"• Интервал: {status['config']['update_interval_seconds']}s\n"
-            info_text += f"• Stale check: {status['config']['stale_check_interval']}s\n"
+            info_text += f"• Stale: {status['freshness']['stale']} из {status['freshness']['tracked']}\n"
             info_text += f"• Stale threshold: {status['config']['stale_threshold_seconds']}s\n"
         
         # Кнопки управления
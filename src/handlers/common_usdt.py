@@ -18,6 +18,7 @@ from src.keyboards import (
     get_rate_confirm_keyboard,
 )
 from src.db import get_pg_pool
+from src.services.quotes import get_flow_quote, confirm_flow_quote, rate_snapshot_json
 
 logger = logging.getLogger(__name__)
 
@@ -99,13 +100,11 @@ async def handle_choose_city(
     data = await state.get_data()
     amount = float(data.get('amount', 0))
     
-    # Получаем курс USDT/RUB
-    from src.services.best_rate import get_best_city_rate
-    
-    rate_info = await get_best_city_rate('USDT/RUB', city_code, operation)
+    # Фиксируем курс USDT/RUB на весь сценарий
+    quote = await get_flow_quote(state, 'USDT/RUB', city_code, operation)
     
-    if rate_info:
-        rate = rate_info['final_rate']
+    if quote:
+        rate = quote.final_rate
         rub_amount = amount * rate
         
         if operation == "buy":
@@ -154,6 +153,20 @@ async def handle_confirm_order(
 ):
     """Подтверждение и создание заявки"""
     logger.info(f"Confirming {order_type} order from user {callback.from_user.id}")
+    
+    # Курс сохраняется тем, который клиент видел; истекший - показываем заново
+    quote, expired = await confirm_flow_quote(state)
+    if expired:
+        data = await state.get_data()
+        operation = order_type.split('_', 1)[0]
+        await callback.answer("⏱ Курс обновился, проверьте заявку ещё раз", show_alert=True)
+        await callback.message.answer(
+            await format_order_summary(data, callback.from_user.id, operation, state),
+            reply_markup=get_confirm_keyboard_v2(),
+            parse_mode="HTML"
+        )
+        return
+    
     data = await state.get_data()
     logger.info(f"Order data: {data}")
     
@@ -181,9 +194,10 @@ async def handle_confirm_order(
                 currency, 
                 amount, 
                 status, 
-                username
+                username,
+                rate_snapshot
             )
-            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
             RETURNING id
         """,
             user_id,
@@ -192,7 +206,8 @@ async def handle_confirm_order(
             data.get('currency'),
             float(data.get('amount', 0)),
             'new',
-            data.get('username')
+            data.get('username'),
+            rate_snapshot_json(quote)
         )
     
     await state.clear()
@@ -215,9 +230,10 @@ async def handle_confirm_order(
 async def format_order_summary(
     data: Dict,
     user_id: int,
-    operation: str
+    operation: str,
+    state: Optional[FSMContext] = None
 ) -> str:
-    """Формирует текст итоговой заявки"""
+    """Формирует текст итоговой заявки (с state - по котировке сценария)"""
     from src.services.best_rate import get_best_city_rate
     
     amount = float(data.get('amount', 0))
@@ -227,10 +243,14 @@ async def format_order_summary(
     city_name = data.get('city_name', 'N/A')
     
     # Получаем курс USDT/RUB
-    rate_info = await get_best_city_rate('USDT/RUB', city, operation)
+    if state is not None:
+        quote = await get_flow_quote(state, 'USDT/RUB', city, operation)
+        rate = quote.final_rate if quote else None
+    else:
+        rate_info = await get_best_city_rate('USDT/RUB', city, operation)
+        rate = rate_info['final_rate'] if rate_info else None
     
-    if rate_info:
-        rate = rate_info['final_rate']
+    if rate:
         rub_amount = amount * rate
         
         if operation == "buy":
@@ -20,6 +20,8 @@ from src.keyboards import (
     main_menu
 )
 from src.db import get_pg_pool
+from src.services.quotes import get_flow_quote, confirm_flow_quote, rate_snapshot_json
+from typing import Optional
 import logging
 from src.utils.logger import log_handler, log_user_action, log_order_event
 
@@ -361,9 +363,15 @@ async def enter_username(message: Message, state: FSMContext):
     username = message.text.strip()
     
     await state.update_data(username=username)
+    await show_confirmation(message, state)
+
+
+async def show_confirmation(message: Message, state: FSMContext, user_id: Optional[int] = None):
+    """Показать подтверждение заявки"""
     await state.set_state(PayInvoiceStates.confirm)
-    
     data = await state.get_data()
+    user_id = user_id or message.from_user.id
+    username = data.get('username', 'N/A')
     
     # Получаем курс для отображения (если наличные)
     amount = float(data.get('amount', 0))
@@ -371,19 +379,17 @@ async def enter_username(message: Message, state: FSMContext):
     
     if data.get('payment_method') == 'cash':
         # Для наличных - показываем курс и расчёт
-        from src.services.best_rate import get_best_city_rate
-        
         city = data.get('city', 'moscow')
-        # Получаем курс USDT/RUB для покупки (клиент покупает USDT за рубли)
-        rate_info = await get_best_city_rate('USDT/RUB', city, 'buy')
+        # Фиксируем курс USDT/RUB для покупки (клиент покупает USDT за рубли)
+        quote = await get_flow_quote(state, 'USDT/RUB', city, 'buy')
         
-        if rate_info:
-            rate = rate_info['final_rate']
+        if quote:
+            rate = quote.final_rate
             # Рассчитываем сколько USDT получит клиент за рубли
             usdt_amount = amount / rate
             
             summary = (
-                f"📋 <b>Заявка #{message.from_user.id}</b>\n\n"
+                f"📋 <b>Заявка #{user_id}</b>\n\n"
                 f"🔄 Операция: <b>Оплата инвойса</b>\n"
                 f"💰 Отдаете: {amount:,.0f} {currency}\n"
                 f"💎 Получаете: {usdt_amount:,.2f} USDT\n"
@@ -411,7 +417,7 @@ async def enter_username(message: Message, state: FSMContext):
     else:
         # Для USDT - просто показываем сумму
         summary = (
-            f"📋 <b>Заявка #{message.from_user.id}</b>\n\n"
+            f"📋 <b>Заявка #{user_id}</b>\n\n"
             f"🔄 Операция: <b>Оплата инвойса</b>\n"
             f"💎 Сумма: {amount:,.2f} USDT\n"
             f"🎯 Цель: {data.get('purpose_name', 'N/A')}\n"
@@ -435,6 +441,13 @@ async def enter_username(message: Message, state: FSMContext):
 @router.callback_query(PayInvoiceStates.confirm, F.data == "confirm:yes")
 async def confirm_order(callback: CallbackQuery, state: FSMContext):
     """Подтверждение заявки"""
+    # Курс сохраняется тем, который клиент видел; истекший - показываем заново
+    quote, expired = await confirm_flow_quote(state)
+    if expired:
+        await callback.answer("⏱ Курс обновился, проверьте заявку ещё раз", show_alert=True)
+        await show_confirmation(callback.message, state, user_id=callback.from_user.id)
+        return
+    
     data = await state.get_data()
     
     pool = await get_pg_pool()
@@ -463,9 +476,10 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext):
                 amount, 
                 invoice_file_id,
                 status, 
-                username
+                username,
+                rate_snapshot
             )
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10)
             RETURNING id
         """,
             user_id,
@@ -476,7 +490,8 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext):
             float(data.get('amount', 0)),
             data.get('invoice_file_id'),
             'new',
-            data.get('username')
+            data.get('username'),
+            rate_snapshot_json(quote)
         )
     
     await state.clear()
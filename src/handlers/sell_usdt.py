@@ -19,6 +19,8 @@ from src.keyboards import (
     main_menu
 )
 from src.db import get_pg_pool
+from src.services.quotes import get_flow_quote, confirm_flow_quote, rate_snapshot_json
+from typing import Optional
 import logging
 from src.utils.logger import log_handler, log_user_action, log_order_event
 
@@ -182,13 +184,11 @@ async def choose_city(callback: CallbackQuery, state: FSMContext):
     data = await state.get_data()
     amount = float(data.get('amount', 0))
     
-    # Получаем курс USDT/RUB для продажи
-    from src.services.best_rate import get_best_city_rate
+    # Фиксируем курс USDT/RUB для продажи на весь сценарий
+    quote = await get_flow_quote(state, 'USDT/RUB', city_code, 'sell')
     
-    rate_info = await get_best_city_rate('USDT/RUB', city_code, 'sell')
-    
-    if rate_info:
-        rate = rate_info['final_rate']
+    if quote:
+        rate = quote.final_rate
         # Рассчитываем сколько рублей получит клиент
         rub_amount = amount * rate
         
@@ -280,13 +280,11 @@ async def back_from_currency(callback: CallbackQuery, state: FSMContext):
     city_code = data.get('city')
     city_name = data.get('city_name')
     
-    # Получаем курс USDT/RUB для продажи
-    from src.services.best_rate import get_best_city_rate
-    
-    rate_info = await get_best_city_rate('USDT/RUB', city_code, 'sell')
+    # Курс из котировки сценария (без повторного расчета)
+    quote = await get_flow_quote(state, 'USDT/RUB', city_code, 'sell')
     
-    if rate_info:
-        rate = rate_info['final_rate']
+    if quote:
+        rate = quote.final_rate
         rub_amount = amount * rate
         
         rate_text = (
@@ -379,29 +377,27 @@ async def skip_photo(message: Message, state: FSMContext):
     await show_confirmation(message, state)
 
 
-async def show_confirmation(message: Message, state: FSMContext):
+async def show_confirmation(message: Message, state: FSMContext, user_id: Optional[int] = None):
     """Показать подтверждение заявки"""
     await state.set_state(SellUSDTStates.confirm)
     data = await state.get_data()
-    
-    # Получаем курс для отображения
-    from src.services.best_rate import get_best_city_rate
+    user_id = user_id or message.from_user.id
     
     amount = float(data.get('amount', 0))
     city = data.get('city', 'moscow')
     currency = data.get('currency', 'RUB')
     username = data.get('username', 'N/A')
     
-    # Получаем курс USDT/RUB для продажи
-    rate_info = await get_best_city_rate('USDT/RUB', city, 'sell')
+    # Курс из котировки сценария
+    quote = await get_flow_quote(state, 'USDT/RUB', city, 'sell')
     
-    if rate_info:
-        rate = rate_info['final_rate']
+    if quote:
+        rate = quote.final_rate
         # Рассчитываем сколько рублей получит клиент
         rub_amount = amount * rate
         
         summary = (
-            f"📋 <b>Заявка #{message.from_user.id}</b>\n\n"
+            f"📋 <b>Заявка #{user_id}</b>\n\n"
             f"🔄 Операция: <b>Продажа USDT</b>\n"
             f"💎 Отдаете: {amount:,.0f} USDT\n"
             f"💰 Получаете: {rub_amount:,.0f} {currency}\n"
@@ -447,6 +443,13 @@ async def back_from_confirm(callback: CallbackQuery, state: FSMContext):
 @router.callback_query(SellUSDTStates.confirm, F.data == "confirm:yes")
 async def confirm_order(callback: CallbackQuery, state: FSMContext):
     """Подтверждение заявки"""
+    # Курс сохраняется тем, который клиент видел; истекший - показываем заново
+    quote, expired = await confirm_flow_quote(state)
+    if expired:
+        await callback.answer("⏱ Курс обновился, проверьте заявку ещё раз", show_alert=True)
+        await show_confirmation(callback.message, state, user_id=callback.from_user.id)
+        return
+    
     data = await state.get_data()
     
     pool = await get_pg_pool()
@@ -473,9 +476,10 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext):
                 currency, 
                 amount, 
                 status, 
-                username
+                username,
+                rate_snapshot
             )
-            VALUES ($1, $2, $3, $4, $5, $6, $7)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
             RETURNING id
         """,
             user_id,
@@ -484,7 +488,8 @@ async def confirm_order(callback: CallbackQuery, state: FSMContext):
             data.get('currency'),
             float(data.get('amount', 0)),
             'new',
-            data.get('username')
+            data.get('username'),
+            rate_snapshot_json(quote)
         )
     
     await state.clear()
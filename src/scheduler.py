@@ -2,19 +2,11 @@ import asyncio
 import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from src.services.rates_scheduler import start_rates_scheduler, get_scheduler_status
-from src.services.rates import import_rapira_rates
+from src.services.market_stream import start_market_streams, stop_market_streams, RAPIRA_WS_URL, GRINEX_WS_URL
 
 logger = logging.getLogger(__name__)
 scheduler = AsyncIOScheduler()
 
-async def update_rates_job():
-    """Legacy job для совместимости"""
-    try:
-        await import_rapira_rates()
-        logger.info("[Scheduler] Курсы обновлены из Rapira (legacy)")
-    except Exception as e:
-        logger.error(f"[Scheduler] Ошибка обновления курсов (legacy): {e}")
-
 async def start_rapira_scheduler():
     """Запускает планировщик Rapira API"""
     try:
@@ -23,6 +15,25 @@ async def start_rapira_scheduler():
     except Exception as e:
         logger.error(f"[Scheduler] Ошибка запуска Rapira scheduler: {e}")
 
+async def start_streams():
+    """Запускает WebSocket-потоки курсов (если заданы RAPIRA_WS_URL / GRINEX_WS_URL)"""
+    if not (RAPIRA_WS_URL or GRINEX_WS_URL):
+        return
+    try:
+        from src.db import get_pg_pool
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            rapira_symbols = [row["pair"] for row in await conn.fetch("SELECT pair FROM rates")]
+            grinex_symbols = [row["source_symbol"] for row in await conn.fetch("""
+                SELECT sp.source_symbol FROM fx_source_pair sp
+                JOIN fx_source s ON s.id = sp.source_id
+                WHERE s.code = 'grinex' AND sp.enabled = true
+            """)]
+        await start_market_streams(rapira_symbols, grinex_symbols)
+        logger.info("[Scheduler] Потоки курсов запущены")
+    except Exception as e:
+        logger.error(f"[Scheduler] Ошибка запуска потоков курсов: {e}")
+
 async def get_rapira_scheduler_status():
     """Получает статус планировщика Rapira"""
     try:
@@ -33,8 +44,8 @@ async def get_rapira_scheduler_status():
         logger.error(f"[Scheduler] Ошибка получения статуса Rapira scheduler: {e}")
         return None
 
-# Добавляем legacy job (можно отключить позже)
-scheduler.add_job(update_rates_job, "interval", seconds=60)
+# Legacy job обновления курсов удален: таблицу rates пишет подписчик шины
+# рыночных данных (src/services/market_data_bus.py) в цикле RatesScheduler
 
 def start_scheduler():
     """Запускает все планировщики"""
@@ -46,6 +57,9 @@ def start_scheduler():
         # Запускаем Rapira scheduler в отдельной задаче
         asyncio.create_task(start_rapira_scheduler())
         
+        # WebSocket-потоки курсов (опрос остается fallback'ом)
+        asyncio.create_task(start_streams())
+        
     except Exception as e:
         logger.error(f"[Scheduler] Ошибка запуска планировщиков: {e}")
 
@@ -58,6 +72,7 @@ async def stop_scheduler():
         # Останавливаем Rapira scheduler
         from src.services.rates_scheduler import stop_rates_scheduler
         await stop_rates_scheduler()
+        await stop_market_streams()
         
     except Exception as e:
         logger.error(f"[Scheduler] Ошибка остановки планировщиков: {e}") 
\ No newline at end of file
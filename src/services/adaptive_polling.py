@@ -0,0 +1,207 @@
+"""
+Адаптивный интервал опроса бирж по спросу и волатильности
+
+Для каждого символа ведутся две оценки:
+
+- спрос: сколько раз хендлеры запрашивали курс за последнее время
+  (счетчик с экспоненциальным затуханием, период полураспада
+  ADAPTIVE_DEMAND_HALF_LIFE);
+- волатильность: EWMA модуля изменения mid-цены между тиками (в б.п.).
+
+"Нагрев" символа - большая из двух оценок, нормированная к порогам
+ADAPTIVE_HOT_DEMAND и ADAPTIVE_HOT_VOLATILITY_BPS (0..1). Интервал опроса
+линейно сдвигается от максимального (холодный символ) к минимальному
+(горячий). Планировщики опрашивают только символы, у которых подошел срок.
+"""
+
+import os
+import math
+import time
+import logging
+from typing import Dict, Iterable, List, Optional
+
+from src.services.rate_snapshot import RateQuote, get_rate_snapshot_store
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+ADAPTIVE_POLLING_ENABLED = os.getenv("ADAPTIVE_POLLING_ENABLED", "true").lower() == "true"
+ADAPTIVE_DEMAND_HALF_LIFE = float(os.getenv("ADAPTIVE_DEMAND_HALF_LIFE", 60))  # секунды
+ADAPTIVE_HOT_DEMAND = float(os.getenv("ADAPTIVE_HOT_DEMAND", 10))  # запросов за период полураспада
+ADAPTIVE_HOT_VOLATILITY_BPS = float(os.getenv("ADAPTIVE_HOT_VOLATILITY_BPS", 5))  # б.п. за тик
+ADAPTIVE_VOLATILITY_ALPHA = float(os.getenv("ADAPTIVE_VOLATILITY_ALPHA", 0.2))
+
+_DECAY = math.log(2) / ADAPTIVE_DEMAND_HALF_LIFE
+
+
+class SymbolActivity:
+    """Спрос и волатильность одного символа"""
+    __slots__ = ('demand', 'demand_at', 'volatility_bps', 'last_mid', 'lookups', 'ticks')
+
+    def __init__(self):
+        self.demand = 0.0
+        self.demand_at = time.monotonic()
+        self.volatility_bps = 0.0
+        self.last_mid: Optional[float] = None
+        self.lookups = 0
+        self.ticks = 0
+
+    def current_demand(self, now: float) -> float:
+        """Счетчик спроса на момент now (с затуханием)"""
+        return self.demand * math.exp(-_DECAY * (now - self.demand_at))
+
+    def heat(self, now: float) -> float:
+        """Нагрев 0..1: большее из нормированных спроса и волатильности"""
+        demand = min(1.0, self.current_demand(now) / ADAPTIVE_HOT_DEMAND)
+        volatility = min(1.0, self.volatility_bps / ADAPTIVE_HOT_VOLATILITY_BPS)
+        return max(demand, volatility)
+
+
+class AdaptivePoller:
+    """Учет активности символов и расчет интервалов опроса"""
+
+    def __init__(self, enabled: bool = ADAPTIVE_POLLING_ENABLED):
+        self.enabled = enabled
+        self._symbols: Dict[str, SymbolActivity] = {}
+
+    def _activity(self, symbol: str) -> SymbolActivity:
+        activity = self._symbols.get(symbol)
+        if activity is None:
+            activity = self._symbols[symbol] = SymbolActivity()
+        return activity
+
+    def record_lookup(self, symbol: str):
+        """Хендлер запросил курс символа"""
+        activity = self._activity(symbol)
+        now = time.monotonic()
+        activity.demand = activity.current_demand(now) + 1
+        activity.demand_at = now
+        activity.lookups += 1
+
+    def on_tick(self, quote: RateQuote):
+        """Подписчик снапшота: обновляет волатильность по mid-цене"""
+        if not quote.best_bid or not quote.best_ask:
+            return
+        mid = float(quote.best_bid + quote.best_ask) / 2
+        activity = self._activity(quote.symbol)
+        if activity.last_mid:
+            move_bps = abs(mid / activity.last_mid - 1) * 10_000
+            activity.volatility_bps += ADAPTIVE_VOLATILITY_ALPHA * (move_bps - activity.volatility_bps)
+        activity.last_mid = mid
+        activity.ticks += 1
+
+    def interval(self, symbols, min_interval: float, max_interval: float) -> float:
+        """Интервал опроса для символа или группы символов (по самому горячему)"""
+        if isinstance(symbols, str):
+            symbols = (symbols,)
+        now = time.monotonic()
+        heat = max(
+            (self._symbols[s].heat(now) for s in symbols if s in self._symbols),
+            default=0.0
+        )
+        return max_interval - heat * (max_interval - min_interval)
+
+    def get_intervals(self, min_interval: float, max_interval: float) -> Dict[str, Dict]:
+        """Эффективные интервалы и оценки по символам"""
+        now = time.monotonic()
+        return {
+            symbol: {
+                'interval_seconds': round(self.interval(symbol, min_interval, max_interval), 2),
+                'demand': round(activity.current_demand(now), 2),
+                'volatility_bps': round(activity.volatility_bps, 2),
+                'lookups': activity.lookups,
+                'ticks': activity.ticks,
+            }
+            for symbol, activity in sorted(self._symbols.items())
+        }
+
+
+class PollSchedule:
+    """
+    Сроки опроса одного планировщика
+
+    Ключ - символ или группа символов (например, источник FX со всеми его
+    парами). Срок считается от последнего опроса по текущему интервалу,
+    поэтому символ, который только что стал горячим, опрашивается сразу,
+    не дожидаясь назначенного ранее срока. При ADAPTIVE_POLLING_ENABLED=false
+    интервал всегда base_interval.
+    """
+
+    def __init__(
+        self,
+        poller: AdaptivePoller,
+        min_interval: float,
+        max_interval: float,
+        base_interval: Optional[float] = None
+    ):
+        self.poller = poller
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.base_interval = base_interval if base_interval is not None else self.max_interval
+        self._polled_at: Dict[str, float] = {}
+        self._groups: Dict[str, List[str]] = {}
+        self._polls = 0
+        self._skipped = 0
+
+    def interval(self, key: str) -> float:
+        """Текущий интервал ключа"""
+        if not self.poller.enabled:
+            return self.base_interval
+        return self.poller.interval(self._groups.get(key, key), self.min_interval, self.max_interval)
+
+    def set_group(self, key: str, symbols: Iterable[str]):
+        """Задает символы группы (интервал - по самому горячему из них)"""
+        self._groups[key] = list(symbols)
+
+    def is_due(self, key: str) -> bool:
+        """Подошел ли срок опроса ключа (новые - сразу)"""
+        polled_at = self._polled_at.get(key)
+        if polled_at is None or time.monotonic() - polled_at >= self.interval(key):
+            return True
+        self._skipped += 1
+        return False
+
+    def due(self, keys: Iterable[str]) -> List[str]:
+        """Ключи, у которых подошел срок опроса"""
+        return [key for key in keys if self.is_due(key)]
+
+    def mark_polled(self, keys: Iterable[str]):
+        """Запоминает время опроса"""
+        now = time.monotonic()
+        for key in keys:
+            self._polled_at[key] = now
+            self._polls += 1
+
+    def get_stats(self) -> Dict:
+        """Эффективные интервалы по ключам и счетчики опросов"""
+        now = time.monotonic()
+        activity = self.poller.get_intervals(self.min_interval, self.max_interval)
+        intervals = {}
+        for key, polled_at in sorted(self._polled_at.items()):
+            interval = self.interval(key)
+            intervals[key] = {
+                'interval_seconds': round(interval, 2),
+                'next_in': round(max(0.0, polled_at + interval - now), 2),
+                **{k: v for k, v in activity.get(key, {}).items() if k != 'interval_seconds'},
+            }
+        return {
+            'adaptive': self.poller.enabled,
+            'min_interval': self.min_interval,
+            'max_interval': self.max_interval,
+            'polls': self._polls,
+            'skipped': self._skipped,
+            'intervals': intervals,
+        }
+
+
+# Глобальный экземпляр
+_adaptive_poller: Optional[AdaptivePoller] = None
+
+
+def get_adaptive_poller() -> AdaptivePoller:
+    """Получает глобальный учет активности (подписан на снапшот курсов)"""
+    global _adaptive_poller
+    if _adaptive_poller is None:
+        _adaptive_poller = AdaptivePoller()
+        get_rate_snapshot_store().subscribe(_adaptive_poller.on_tick)
+    return _adaptive_poller
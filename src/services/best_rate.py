@@ -1,15 +1,15 @@
 """
-Сервис получения лучшего курса из Rapira + Grinex с наценкой по городу
-ОПТИМИЗИРОВАНО: добавлено кэширование запросов к БД
+Сервис получения лучшего курса из Rapira + Grinex (и других включенных источников) с наценкой по городу
+Наценки городов берутся из матрицы цен (src/services/pricing_matrix.py)
 """
 
 import logging
 from decimal import Decimal
 from typing import Optional, Dict
 from datetime import datetime
-from src.services.rapira_simple import get_city_rate, get_rapira_simple_client
-from src.services.grinex import get_grinex_client
-from src.utils.cache import cached_query
+from src.services.rate_aggregator import get_rate_aggregator
+from src.services.pricing_matrix import get_pricing_engine
+from src.utils.fixed_point import apply_markup_float
 from src.utils.logger import log_api_call, PerformanceLogger
 
 logger = logging.getLogger(__name__)
@@ -17,7 +17,10 @@ logger = logging.getLogger(__name__)
 
 async def get_best_city_rate(symbol: str, city: str, operation: str = "buy") -> Optional[Dict]:
     """
-    Получает лучший курс из Rapira + Grinex с применением наценки города
+    Получает лучший курс из включенных источников с применением наценки города
+    
+    Источники опрашиваются параллельно (src/services/rate_aggregator.py),
+    источники, не уложившиеся в BEST_RATE_DEADLINE, в выборе не участвуют.
     
     Args:
         symbol: Пара, например "USDT/RUB"
@@ -36,117 +39,58 @@ async def get_best_city_rate(symbol: str, city: str, operation: str = "buy") ->
             'operation': 'buy',
             'rapira_rate': 81.83,     # для сравнения
             'grinex_rate': 81.85,     # для сравнения
+            'source_rates': {'rapira': 81.83, 'grinex': 81.85},
+            'late_sources': [],       # не ответили в срок
             'timestamp': datetime
         }
     """
     start_time = datetime.now()
     logger.debug(f"Getting best rate: {symbol} for {city}, operation={operation}")
     
-    rapira_rate = None
-    grinex_rate = None
-    base_rate = None
-    best_source = None
-    rapira_timestamp = None
-    
-    # Получаем курс из Rapira
-    try:
-        rapira_client = await get_rapira_simple_client()
-        rapira_data = await rapira_client.get_base_rate(symbol)
-        if rapira_data:
-            rapira_timestamp = rapira_data.get('timestamp')
-            # Для buy берем ask, для sell берем bid
-            if operation == "buy" and rapira_data['best_ask']:
-                rapira_rate = float(rapira_data['best_ask'])
-            elif operation == "sell" and rapira_data['best_bid']:
-                rapira_rate = float(rapira_data['best_bid'])
-    except Exception as e:
-        logger.warning(f"Failed to get Rapira rate: {e}")
-    
-    # ВРЕМЕННО ОТКЛЮЧЕНО: Grinex API возвращает 404
-    # Получаем курс из Grinex
-    # try:
-    #     grinex_client = await get_grinex_client()
-    #     
-    #     # Преобразуем символ для Grinex (USDT/RUB → USDTRUB)
-    #     grinex_symbol = symbol.replace("/", "")
-    #     
-    #     ticker = await grinex_client.get_ticker(grinex_symbol)
-    #     if ticker:
-    #         # Для buy берем ask, для sell берем bid
-    #         if operation == "buy" and ticker.ask:
-    #             grinex_rate = float(ticker.ask)
-    #         elif operation == "sell" and ticker.bid:
-    #             grinex_rate = float(ticker.bid)
-    #         elif ticker.last_price:
-    #             # Fallback на last_price
-    #             grinex_rate = float(ticker.last_price)
-    # except Exception as e:
-    #     logger.warning(f"Failed to get Grinex rate: {e}")
-    
-    # Выбираем лучший курс
-    if operation == "buy":
-        # Для покупки - чем ниже цена, тем лучше
-        if rapira_rate and grinex_rate:
-            if rapira_rate <= grinex_rate:
-                base_rate = rapira_rate
-                best_source = "rapira"
-            else:
-                base_rate = grinex_rate
-                best_source = "grinex"
-        elif rapira_rate:
-            base_rate = rapira_rate
-            best_source = "rapira"
-        elif grinex_rate:
-            base_rate = grinex_rate
-            best_source = "grinex"
-    else:
-        # Для продажи - чем выше цена, тем лучше
-        if rapira_rate and grinex_rate:
-            if rapira_rate >= grinex_rate:
-                base_rate = rapira_rate
-                best_source = "rapira"
-            else:
-                base_rate = grinex_rate
-                best_source = "grinex"
-        elif rapira_rate:
-            base_rate = rapira_rate
-            best_source = "rapira"
-        elif grinex_rate:
-            base_rate = grinex_rate
-            best_source = "grinex"
+    # Все включенные источники параллельно, с общим deadline
+    aggregated = await get_rate_aggregator().collect(symbol)
+    best = aggregated.best(operation)
+    base_rate = best.side(operation) if best else None
     
-    if not base_rate:
-        logger.error(f"No rates available for {symbol}")
+    # Без курса нужной стороны наценку применять не к чему
+    if base_rate is None:
+        logger.error(
+            f"No {operation} rate available for {symbol} "
+            f"(failed: {aggregated.failed or '-'}, late: {aggregated.late or '-'})"
+        )
         return None
     
-    # Применяем наценку города из таблицы cities (раздельно на buy/sell)
-    # ОПТИМИЗАЦИЯ: Кэшируем данные города на 60 секунд
-    city_data = await _get_city_markup(city)
+    best_source = best.source
+    source_rates = {source: rate.side(operation) for source, rate in aggregated.rates.items()}
     
-    if city_data:
-        # Выбираем наценку в зависимости от операции
-        if operation == "buy":
-            markup_percent = float(city_data['markup_buy'])
-        else:
-            markup_percent = float(city_data['markup_sell'])
-        markup_fixed = float(city_data['markup_fixed'])
-    else:
-        logger.warning(f"City {city} not found in DB, using 0%")
-        markup_percent = 0.0
-        markup_fixed = 0.0
+    # Наценка города (с учетом наценки пары) из матрицы цен
+    engine = await get_pricing_engine()
+    price = engine.lookup(symbol, city, operation, max_age=None)
     
-    # Применяем формулу
-    final_rate = base_rate * (1 + markup_percent / 100) + markup_fixed
-    # Округляем до 2 знаков
-    final_rate = round(final_rate, 2)
+    if price and best_source == price.source and price.base_rate == base_rate:
+        # Курс уже посчитан матрицей на этом тике
+        final_rate = price.final_rate
+        markup_percent = price.markup_percent
+        markup_fixed = price.markup_fixed
+    else:
+        markup = engine.markup(symbol, city, operation)
+        if markup:
+            markup_percent, markup_fixed = markup
+        else:
+            logger.warning(f"City {city} not found in DB, using 0%")
+            markup_percent, markup_fixed = 0.0, 0.0
+        
+        # Применяем формулу, округляем до 2 знаков
+        final_rate = apply_markup_float(base_rate, markup_percent, markup_fixed, 2)
     
     from src.services.rapira_simple import CITIES
-    city_name = CITIES.get(city, city)
+    city_name = engine.city_name(city) or CITIES.get(city, city)
     
     duration = (datetime.now() - start_time).total_seconds() * 1000
     logger.info(
         f"Best rate calculated: {symbol} {operation} @ {city} = {final_rate:.2f} "
-        f"(source: {best_source}, markup: {markup_percent}%, {duration:.0f}ms)"
+        f"(source: {best_source}, markup: {markup_percent}%, {duration:.0f}ms"
+        + (f", late: {', '.join(aggregated.late)}" if aggregated.late else "") + ")"
     )
     
     return {
@@ -159,36 +103,10 @@ async def get_best_city_rate(symbol: str, city: str, operation: str = "buy") ->
         'markup_percent': markup_percent,
         'markup_fixed': markup_fixed,
         'operation': operation,
-        'rapira_rate': rapira_rate,
-        'grinex_rate': grinex_rate,
-        'timestamp': rapira_timestamp
+        'rapira_rate': source_rates.get('rapira'),
+        'grinex_rate': source_rates.get('grinex'),
+        'source_rates': source_rates,
+        'late_sources': aggregated.late,
+        'timestamp': best.timestamp
     }
 
-
-# ============================================================================
-# Вспомогательные функции с кэшированием
-# ============================================================================
-
-async def _get_city_markup(city: str) -> Optional[Dict]:
-    """
-    Получает данные наценки города с кэшированием
-    Кэш на 60 секунд (города меняются редко)
-    """
-    from src.db import get_pg_pool
-    
-    async def query():
-        pool = await get_pg_pool()
-        async with pool.acquire() as conn:
-            return await conn.fetchrow("""
-                SELECT markup_buy, markup_sell, markup_fixed
-                FROM cities
-                WHERE code = $1 AND enabled = true
-                LIMIT 1
-            """, city)
-    
-    return await cached_query(
-        key=f"city_markup:{city}",
-        query_func=query,
-        ttl_seconds=60  # Кэш на 60 секунд
-    )
-
@@ -5,6 +5,7 @@
 
 import logging
 from typing import List, Optional, Dict
+from src.services.adaptive_polling import get_adaptive_poller
 from src.services.best_rate import get_best_city_rate
 from src.db import get_pg_pool
 
@@ -29,7 +30,7 @@ async def get_available_pairs() -> List[str]:
 
 async def get_client_rates(city: str) -> Dict[str, Dict]:
     """
-    Получает курсы для клиента с учетом его города (ОПТИМИЗИРОВАННАЯ ВЕРСИЯ)
+    Получает курсы для клиента с учетом его города (поиск по матрице цен)
     
     Args:
         city: Код города (moscow, rostov и т.д.)
@@ -44,86 +45,54 @@ async def get_client_rates(city: str) -> Dict[str, Dict]:
         }
     """
     from src.services.rapira_simple import get_rapira_simple_client
-    from decimal import Decimal
+    from src.services.pricing_matrix import get_pricing_engine
     
     # Получаем все пары
     pairs = await get_available_pairs()
     if not pairs:
         return {}
     
-    # Получаем курсы для всех пар ИЗ RAPIRA ОДИН РАЗ
-    client = await get_rapira_simple_client()
-    base_rates = await client.get_multiple_rates(pairs)
+    engine = await get_pricing_engine()
+    if engine.city_name(city) is None:
+        logger.warning(f"City {city} not found")
+        return {}
     
-    # Получаем наценки города для всех пар ОДНИМ ЗАПРОСОМ
-    pool = await get_pg_pool()
-    async with pool.acquire() as conn:
-        # Получаем базовую наценку города (раздельно на buy/sell)
-        city_data = await conn.fetchrow("""
-            SELECT id, name, markup_buy, markup_sell, markup_fixed
-            FROM cities
-            WHERE code = $1 AND enabled = true
-        """, city)
-        
-        if not city_data:
-            logger.warning(f"City {city} not found")
-            return {}
-        
-        # Получаем специфичные наценки для всех пар
-        pair_markups = await conn.fetch("""
-            SELECT pair_symbol, markup_buy, markup_sell, markup_fixed
-            FROM city_pair_markups
-            WHERE city_id = $1 AND enabled = true
-        """, city_data['id'])
-        
-        # Создаем словарь наценок по парам
-        markups_dict = {pm['pair_symbol']: pm for pm in pair_markups}
+    # Спрос на пары ускоряет их опрос планировщиком
+    poller = get_adaptive_poller()
+    for pair in pairs:
+        poller.record_lookup(pair)
+    
+    # Пары без свежей котировки обновляем одним пакетом - новые тики
+    # пересчитывают строки матрицы
+    stale = [pair for pair in pairs if engine.lookup(pair, city, "buy") is None
+             and engine.lookup(pair, city, "sell") is None]
+    if stale:
+        client = await get_rapira_simple_client()
+        await client.get_multiple_rates(stale)
     
     result = {}
     
     for pair in pairs:
-        base_rate_data = base_rates.get(pair)
-        if not base_rate_data:
+        # Курс покупки (ask) - клиент покупает крипту, продажи (bid) - продает
+        buy = engine.lookup(pair, city, "buy", max_age=None)
+        sell = engine.lookup(pair, city, "sell", max_age=None)
+        if not buy and not sell:
             continue
         
-        # Получаем наценки для этой пары (специфичные или базовые)
-        if pair in markups_dict:
-            markup_buy = float(markups_dict[pair]['markup_buy'])
-            markup_sell = float(markups_dict[pair]['markup_sell'])
-            markup_fixed = float(markups_dict[pair]['markup_fixed'])
-        else:
-            markup_buy = float(city_data['markup_buy'])
-            markup_sell = float(city_data['markup_sell'])
-            markup_fixed = float(city_data['markup_fixed'])
-        
-        # Курс покупки (ask) - клиент покупает крипту
-        if base_rate_data.get('best_ask'):
-            buy_base = float(base_rate_data['best_ask'])
-            buy_final = buy_base * (1 + markup_buy / 100) + markup_fixed
-            buy_final = round(buy_final, 2)
-        else:
-            buy_base = None
-            buy_final = None
-        
-        # Курс продажи (bid) - клиент продает крипту
-        if base_rate_data.get('best_bid'):
-            sell_base = float(base_rate_data['best_bid'])
-            sell_final = sell_base * (1 + markup_sell / 100) + markup_fixed
-            sell_final = round(sell_final, 2)
-        else:
-            sell_base = None
-            sell_final = None
+        # Наценки нет в матрице (город или пара не настроены) - 0%, как в best_rate
+        markup_buy, _ = engine.markup(pair, city, "buy") or (0.0, 0.0)
+        markup_sell, _ = engine.markup(pair, city, "sell") or (0.0, 0.0)
         
         result[pair] = {
             'buy': {
-                'rate': buy_final,
-                'base_rate': buy_base,
+                'rate': buy.final_rate if buy else None,
+                'base_rate': buy.base_rate if buy else None,
                 'source': 'rapira',
                 'markup': markup_buy
             },
             'sell': {
-                'rate': sell_final,
-                'base_rate': sell_base,
+                'rate': sell.final_rate if sell else None,
+                'base_rate': sell.base_rate if sell else None,
                 'source': 'rapira',
                 'markup': markup_sell
             }
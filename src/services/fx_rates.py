@@ -2,21 +2,71 @@
 Сервис управления валютными курсами с интеграцией бирж и наценками
 """
 
+import os
 import asyncio
 import json
+import time
 import logging
+from bisect import bisect_right
 from datetime import datetime, timedelta
-from decimal import Decimal, ROUND_HALF_UP, ROUND_DOWN, ROUND_UP, ROUND_HALF_EVEN
+from decimal import Decimal
 from typing import Dict, List, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 
 from src.db import get_pg_pool
 from src.services.grinex import get_grinex_client, GrinexTicker
-from src.services.rapira_simple import get_rapira_simple_client
+from src.services.market_stream import get_market_stream
+from src.services.rate_snapshot import get_rate_snapshot_store
+from src.services.rate_history import FX_HISTORY_ENABLED, get_rate_history_writer
+from src.services.rate_freshness import FX_STALE_THRESHOLD_SECONDS, get_freshness_tracker
+from src.utils.fixed_point import get_markup, round_decimal
 
 logger = logging.getLogger(__name__)
 
+# Конфигурация кэша источников, пар и правил
+FX_CONFIG_REFRESH_SECONDS = float(os.getenv("FX_CONFIG_REFRESH_SECONDS", 5))          # проверка изменений (дельта)
+FX_CONFIG_FULL_RELOAD_SECONDS = float(os.getenv("FX_CONFIG_FULL_RELOAD_SECONDS", 300))  # полная перезагрузка
+FX_CONFIG_WATERMARK_OVERLAP = float(os.getenv("FX_CONFIG_WATERMARK_OVERLAP", 30))      # перекрытие окна дельты
+
+# Приоритет уровней правил наценки
+_RULE_LEVEL_ORDER = {'pair': 1, 'source': 2, 'global': 3}
+
+# Модель чтения итоговых курсов (миграция 015): одна таблица вместо соединения
+# fx_final_rate, fx_source, fx_source_pair и fx_raw_rate. $1 - порог свежести
+_SELECT_RATE_VIEW_SQL = """
+    SELECT source_code, internal_symbol, base_currency, quote_currency,
+           raw_price, final_price, bid_price, ask_price,
+           applied_rule_id, markup_percent, markup_fixed, calculated_at,
+           calculated_at < NOW() - make_interval(secs => $1) AS stale
+    FROM fx_rate_view
+    WHERE source_enabled AND pair_enabled
+"""
+
+_UPSERT_RATE_VIEW_SQL = """
+    INSERT INTO fx_rate_view
+    (source_id, source_pair_id, source_code, internal_symbol, base_currency, quote_currency,
+     raw_price, final_price, bid_price, ask_price, applied_rule_id, markup_percent, markup_fixed,
+     calculated_at, source_enabled, pair_enabled)
+    VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13, $14, $15, $16)
+    ON CONFLICT (source_id, source_pair_id)
+    DO UPDATE SET
+        source_code = EXCLUDED.source_code,
+        internal_symbol = EXCLUDED.internal_symbol,
+        base_currency = EXCLUDED.base_currency,
+        quote_currency = EXCLUDED.quote_currency,
+        raw_price = EXCLUDED.raw_price,
+        final_price = EXCLUDED.final_price,
+        bid_price = EXCLUDED.bid_price,
+        ask_price = EXCLUDED.ask_price,
+        applied_rule_id = EXCLUDED.applied_rule_id,
+        markup_percent = EXCLUDED.markup_percent,
+        markup_fixed = EXCLUDED.markup_fixed,
+        calculated_at = EXCLUDED.calculated_at,
+        source_enabled = EXCLUDED.source_enabled,
+        pair_enabled = EXCLUDED.pair_enabled
+"""
+
 
 class RoundingMode(Enum):
     """Режимы округления"""
@@ -93,6 +143,79 @@ class FXRate:
     stale: bool = False
 
 
+class RuleIndex:
+    """
+    Скомпилированный индекс правил наценки
+
+    Правила разложены по pair_id / source_id / global. Границы действия
+    (valid_from / valid_to) собраны в отсортированное расписание: пока
+    текущее время между двумя соседними границами, набор активных правил
+    не меняется, и найденное правило для пары берется из кэша.
+    """
+
+    def __init__(self, rules: List[FXMarkupRule]):
+        self.rules = list(rules)
+        self._by_pair: Dict[int, List[Tuple]] = {}
+        self._by_source: Dict[int, List[Tuple]] = {}
+        self._global: List[Tuple] = []
+        boundaries = set()
+
+        for rule in self.rules:
+            # Эпоха: работает и для TIMESTAMPTZ из БД, и для naive datetime
+            start = rule.valid_from.timestamp() if rule.valid_from else None
+            end = rule.valid_to.timestamp() if rule.valid_to else None
+            entry = (start, end, rule)
+            if rule.level == 'pair':
+                self._by_pair.setdefault(rule.source_pair_id, []).append(entry)
+            elif rule.level == 'source':
+                self._by_source.setdefault(rule.source_id, []).append(entry)
+            elif rule.level == 'global':
+                self._global.append(entry)
+            boundaries.update(t for t in (start, end) if t is not None)
+
+        self._boundaries = sorted(boundaries)
+        self._resolved: Dict[Tuple[int, int], Optional[FXMarkupRule]] = {}
+        self._window = (float('inf'), float('-inf'))  # [начало, конец) окна кэша
+
+    @staticmethod
+    def _first_active(entries: Optional[List[Tuple]], now: float) -> Optional[FXMarkupRule]:
+        for start, end, rule in entries or ():
+            if (start is None or start <= now) and (end is None or now <= end):
+                return rule
+        return None
+
+    def _enter_window(self, now: float):
+        """Сбрасывает кэш и вычисляет окно до следующей границы действия правил"""
+        i = bisect_right(self._boundaries, now)
+        start = self._boundaries[i - 1] if i else float('-inf')
+        end = self._boundaries[i] if i < len(self._boundaries) else float('inf')
+        self._window = (start, end)
+        self._resolved.clear()
+
+    def find(self, source_id: int, pair_id: int, now: Optional[float] = None) -> Optional[FXMarkupRule]:
+        """Правило для пары с учетом приоритета pair > source > global"""
+        if now is None:
+            now = time.time()
+        start, end = self._window
+        if not start <= now < end:
+            self._enter_window(now)
+            start, end = self._window
+
+        key = (source_id, pair_id)
+        if key in self._resolved:
+            return self._resolved[key]
+
+        rule = (
+            self._first_active(self._by_pair.get(pair_id), now)
+            or self._first_active(self._by_source.get(source_id), now)
+            or self._first_active(self._global, now)
+        )
+        # Ровно на границе активность может отличаться от остального окна - не кэшируем
+        if now != start:
+            self._resolved[key] = rule
+        return rule
+
+
 class FXRatesService:
     """Сервис управления курсами"""
     
@@ -100,9 +223,20 @@ class FXRatesService:
         self._pool = None
         self._sources_cache: Dict[str, FXSource] = {}
         self._pairs_cache: Dict[int, List[FXSourcePair]] = {}
-        self._rules_cache: List[FXMarkupRule] = []
+        self._rules_cache: List[FXMarkupRule] = []  # через setter строит RuleIndex
         self._cache_updated_at: Optional[datetime] = None
-        self._cache_ttl = timedelta(minutes=5)
+        self._cache_ttl = timedelta(seconds=FX_CONFIG_REFRESH_SECONDS)
+        # Активные строки конфигурации по id; из них строятся кэши выше
+        self._source_rows: Dict[int, FXSource] = {}
+        self._pair_rows: Dict[int, FXSourcePair] = {}
+        self._rule_rows: Dict[int, FXMarkupRule] = {}
+        self._watermark: Optional[datetime] = None     # now() БД на момент прошлой загрузки
+        self._full_loaded_at: Optional[datetime] = None
+        self._refresh_lock = asyncio.Lock()
+        self._refresh_stats = {'full': 0, 'delta': 0, 'changed_rows': 0}
+        # Последние котировки шины рыночных данных по источникам (MarketBatch),
+        # в БД их пишет синхронизация по расписанию FX
+        self._market_pending: Dict[str, object] = {}
     
     async def get_pool(self):
         """Получает пул подключений к БД"""
@@ -110,52 +244,168 @@ class FXRatesService:
             self._pool = await get_pg_pool()
         return self._pool
     
+    @property
+    def _rules_cache(self) -> List[FXMarkupRule]:
+        return self._rule_index.rules
+    
+    @_rules_cache.setter
+    def _rules_cache(self, rules: List[FXMarkupRule]):
+        self._rule_index = RuleIndex(rules)
+    
+    def invalidate_cache(self, key: Optional[str] = None):
+        """
+        Помечает кэш конфигурации устаревшим (вызывается при изменениях в админке)
+        
+        Следующее обновление - полное: удаленные строки дельтой не видны.
+        """
+        self._cache_updated_at = None
+        self._full_loaded_at = None
+        logger.info(f"FX config cache invalidated ({key or 'manual'})")
+    
+    def _cache_fresh(self, now: datetime) -> bool:
+        return self._cache_updated_at is not None and (now - self._cache_updated_at) < self._cache_ttl
+    
     async def _refresh_cache(self, force: bool = False):
-        """Обновляет кэш источников, пар и правил"""
-        now = datetime.now()
-        if not force and self._cache_updated_at and (now - self._cache_updated_at) < self._cache_ttl:
+        """
+        Обновляет кэш источников, пар и правил
+        
+        Обновляет только один вызов: остальные ждут его и используют результат.
+        Обычно загружаются только строки, измененные после прошлой загрузки
+        (updated_at поддерживается триггерами миграции 004); раз в
+        FX_CONFIG_FULL_RELOAD_SECONDS и после инвалидации - полная загрузка.
+        """
+        if not force and self._cache_fresh(datetime.now()):
             return
         
-        pool = await self.get_pool()
-        async with pool.acquire() as conn:
-            # Загружаем источники
-            sources = await conn.fetch("SELECT * FROM fx_source WHERE enabled = true")
-            self._sources_cache = {row['code']: FXSource(**dict(row)) for row in sources}
+        async with self._refresh_lock:
+            now = datetime.now()
+            if not force and self._cache_fresh(now):
+                # Кэш обновил вызов, которого мы ждали
+                return
             
-            # ОПТИМИЗАЦИЯ: Загружаем все пары одним запросом вместо N+1
-            if sources:
-                source_ids = [s['id'] for s in sources]
-                all_pairs = await conn.fetch("""
-                    SELECT * FROM fx_source_pair 
-                    WHERE source_id = ANY($1) AND enabled = true
-                """, source_ids)
-                
-                # Группируем пары по source_id
-                self._pairs_cache = {}
-                for pair in all_pairs:
-                    source_id = pair['source_id']
-                    if source_id not in self._pairs_cache:
-                        self._pairs_cache[source_id] = []
-                    self._pairs_cache[source_id].append(FXSourcePair(**dict(pair)))
+            full = (
+                force
+                or self._watermark is None
+                or self._full_loaded_at is None
+                or (now - self._full_loaded_at).total_seconds() >= FX_CONFIG_FULL_RELOAD_SECONDS
+            )
+            pool = await self.get_pool()
+            async with pool.acquire() as conn:
+                if full:
+                    changed = await self._load_full(conn)
+                else:
+                    changed = await self._load_delta(conn)
             
-            # Загружаем активные правила наценки
-            rules = await conn.fetch("""
-                SELECT * FROM fx_markup_rule 
-                WHERE enabled = true AND deleted_at IS NULL
-                ORDER BY 
-                    CASE level 
-                        WHEN 'pair' THEN 1
-                        WHEN 'source' THEN 2
-                        WHEN 'global' THEN 3
-                    END
-            """)
-            self._rules_cache = [FXMarkupRule(**dict(row)) for row in rules]
+            self._cache_updated_at = now
+            if full:
+                self._full_loaded_at = now
+                logger.info(
+                    f"Cache refreshed: {len(self._sources_cache)} sources, "
+                    f"{sum(len(p) for p in self._pairs_cache.values())} pairs, {len(self._rules_cache)} rules"
+                )
+            elif changed:
+                logger.info(f"FX config delta applied: {changed} changed rows")
+    
+    async def _load_full(self, conn) -> int:
+        """Полная загрузка активных источников, пар и правил"""
+        watermark = await conn.fetchval("SELECT now()")
+        sources = await conn.fetch("SELECT * FROM fx_source WHERE enabled = true")
+        # ОПТИМИЗАЦИЯ: все пары одним запросом вместо N+1
+        pairs = await conn.fetch("SELECT * FROM fx_source_pair WHERE enabled = true")
+        rules = await conn.fetch("SELECT * FROM fx_markup_rule WHERE enabled = true AND deleted_at IS NULL")
+        
+        self._source_rows = {row['id']: FXSource(**dict(row)) for row in sources}
+        self._pair_rows = {row['id']: FXSourcePair(**dict(row)) for row in pairs}
+        self._rule_rows = {row['id']: FXMarkupRule(**dict(row)) for row in rules}
+        self._apply_rows(rules_changed=True)
+        self._watermark = watermark
+        self._refresh_stats['full'] += 1
+        return len(sources) + len(pairs) + len(rules)
+    
+    async def _load_delta(self, conn) -> int:
+        """
+        Загрузка строк, измененных после прошлой загрузки
+        
+        updated_at - время начала транзакции, поэтому изменение, закоммиченное
+        после прошлой загрузки, может иметь updated_at раньше нее. Окно
+        FX_CONFIG_WATERMARK_OVERLAP перечитывает такие строки (повторное
+        применение ничего не меняет).
+        """
+        watermark = await conn.fetchval("SELECT now()")
+        since = self._watermark - timedelta(seconds=FX_CONFIG_WATERMARK_OVERLAP)
+        sources = await conn.fetch("SELECT * FROM fx_source WHERE updated_at > $1", since)
+        pairs = await conn.fetch("SELECT * FROM fx_source_pair WHERE updated_at > $1", since)
+        rules = await conn.fetch("SELECT * FROM fx_markup_rule WHERE updated_at > $1", since)
+        
+        sources_changed = self._merge_rows(self._source_rows, sources, FXSource, lambda r: r['enabled'])
+        pairs_changed = self._merge_rows(self._pair_rows, pairs, FXSourcePair, lambda r: r['enabled'])
+        rules_changed = self._merge_rows(
+            self._rule_rows, rules, FXMarkupRule, lambda r: r['enabled'] and r['deleted_at'] is None
+        )
+        changed = sources_changed + pairs_changed + rules_changed
+        if changed:
+            self._apply_rows(rules_changed=bool(rules_changed))
+        self._watermark = watermark
+        self._refresh_stats['delta'] += 1
+        self._refresh_stats['changed_rows'] += changed
+        return changed
+    
+    @staticmethod
+    def _merge_rows(target: Dict[int, any], rows, factory, active) -> int:
+        """Добавляет/заменяет активные строки, убирает выключенные; возвращает число изменений"""
+        changed = 0
+        for row in rows:
+            if active(row):
+                item = factory(**dict(row))
+                if target.get(row['id']) != item:
+                    target[row['id']] = item
+                    changed += 1
+            elif target.pop(row['id'], None) is not None:
+                changed += 1
+        return changed
+    
+    def _apply_rows(self, rules_changed: bool):
+        """
+        Строит кэши из строк и подменяет их целиком
+        
+        Новые словари собираются заранее и присваиваются без await между
+        присваиваниями, поэтому читатели видят либо старую, либо новую
+        конфигурацию, но не смесь.
+        """
+        sources = {source.code: source for source in self._source_rows.values()}
+        enabled_ids = {source.id for source in self._source_rows.values()}
+        pairs: Dict[int, List[FXSourcePair]] = {}
+        for pair in sorted(self._pair_rows.values(), key=lambda p: p.id):
+            if pair.source_id in enabled_ids:
+                pairs.setdefault(pair.source_id, []).append(pair)
+        rules = sorted(self._rule_rows.values(), key=lambda r: (_RULE_LEVEL_ORDER.get(r.level, 4), r.id)) \
+            if rules_changed else None
         
-        self._cache_updated_at = now
-        logger.info(f"Cache refreshed: {len(self._sources_cache)} sources, {sum(len(p) for p in self._pairs_cache.values())} pairs, {len(self._rules_cache)} rules")
+        self._sources_cache = sources
+        self._pairs_cache = pairs
+        if rules is not None:
+            self._rules_cache = rules
+    
+    def get_config_stats(self) -> Dict:
+        """Статистика обновления конфигурации"""
+        return {
+            **self._refresh_stats,
+            'refresh_seconds': self._cache_ttl.total_seconds(),
+            'watermark': self._watermark.isoformat() if self._watermark else None,
+            'sources': len(self._sources_cache),
+            'pairs': sum(len(p) for p in self._pairs_cache.values()),
+            'rules': len(self._rules_cache),
+        }
     
-    async def sync_source_rates(self, source_code: str) -> Dict[str, any]:
-        """Синхронизирует курсы от одного источника"""
+    async def sync_source_rates(self, source_code: str, market_batch=None) -> Dict[str, any]:
+        """
+        Синхронизирует курсы от одного источника
+        
+        Args:
+            source_code: Код источника
+            market_batch: Пакет шины рыночных данных (Rapira) - курсы берутся
+                из него, запрос к бирже не делается
+        """
         await self._refresh_cache()
         
         source = self._sources_cache.get(source_code)
@@ -167,44 +417,80 @@ class FXRatesService:
             logger.warning(f"No pairs configured for source {source_code}")
             return {"pairs_processed": 0, "pairs_succeeded": 0, "pairs_failed": 0}
         
+        if source_code == 'rapira' and market_batch is None:
+            # Rapira опрашивает шина; пишем накопленные с прошлой синхронизации
+            # котировки, а если их нет (шина не опрашивала) - один цикл шины
+            market_batch = self._market_pending.pop(source_code, None)
+            if market_batch is None:
+                from src.services.market_data_bus import get_market_data_bus
+                symbols = list(dict.fromkeys(self._to_rapira_symbol(pair.source_symbol) for pair in pairs))
+                polled = await get_market_data_bus().poll('rapira', symbols=symbols)
+                market_batch = self._market_pending.pop(source_code, None) or polled
+            if market_batch is None:
+                return {"pairs_processed": 0, "pairs_succeeded": 0, "pairs_failed": 0}
+        
+        if market_batch is not None:
+            # Только пары, которые были в этом цикле шины
+            requested = set(market_batch.requested)
+            pairs = [pair for pair in pairs if self._to_rapira_symbol(pair.source_symbol) in requested]
+            if not pairs:
+                return {"pairs_processed": 0, "pairs_succeeded": 0, "pairs_failed": 0}
+        
         pool = await self.get_pool()
         started_at = datetime.now()
-        pairs_succeeded = 0
-        pairs_failed = 0
         errors = []
         
-        # Создаем запись лога
-        async with pool.acquire() as conn:
-            log_id = await conn.fetchval("""
-                INSERT INTO fx_sync_log (source_id, started_at, status, pairs_processed)
-                VALUES ($1, $2, 'running', 0)
-                RETURNING id
-            """, source.id, started_at)
-        
         try:
-            # Получаем курсы из источника
-            if source_code == 'grinex':
+            # Получаем курсы из источника (соединение с БД на это время не держим)
+            if market_batch is not None:
+                rates_data = self._rapira_rates_from_batch(pairs, market_batch.rates)
+            elif source_code == 'grinex':
                 rates_data = await self._fetch_grinex_rates(pairs)
-            elif source_code == 'rapira':
-                rates_data = await self._fetch_rapira_rates(pairs)
             else:
                 raise ValueError(f"Unknown source: {source_code}")
             
-            # Сохраняем сырые курсы
+            # Готовим строки в памяти: сырые курсы и финальные с наценкой
+            received_at = datetime.now()
+            raw_rows = []
+            final_rows = []
+            view_rows = []
+            synced_pairs = []
+            for pair in pairs:
+                rate_info = rates_data.get(pair.source_symbol)
+                if not rate_info or rate_info.get('price') is None:
+                    errors.append(f"{pair.source_symbol}: no data")
+                    continue
+                
+                # Ошибка расчета одной пары не прерывает синхронизацию источника
+                try:
+                    metadata = rate_info.get('metadata', {})
+                    raw_row = (
+                        source.id, pair.id, rate_info['price'],
+                        rate_info.get('bid'), rate_info.get('ask'),
+                        rate_info.get('volume'),
+                        json.dumps(metadata) if metadata else None,
+                        received_at
+                    )
+                    final_row = self._build_final_rate_row(source, pair, rate_info['price'], received_at)
+                    view_row = self._build_view_row(source, pair, final_row, rate_info.get('bid'), rate_info.get('ask'))
+                except Exception as e:
+                    logger.error(f"Failed to process {source_code} pair {pair.source_symbol}: {e}")
+                    errors.append(f"{pair.source_symbol}: {e}")
+                    continue
+                raw_rows.append(raw_row)
+                final_rows.append(final_row)
+                view_rows.append(view_row)
+                synced_pairs.append(pair)
+            
+            pairs_succeeded = len(raw_rows)
+            pairs_failed = len(pairs) - pairs_succeeded
+            status = 'success' if pairs_failed == 0 else ('partial' if pairs_succeeded > 0 else 'error')
+            
+            # Пишем все одной транзакцией: пакетные upsert и запись лога
             async with pool.acquire() as conn:
-                for pair in pairs:
-                    try:
-                        rate_info = rates_data.get(pair.source_symbol)
-                        if not rate_info:
-                            pairs_failed += 1
-                            errors.append(f"{pair.source_symbol}: no data")
-                            continue
-                        
-                        # Вставляем/обновляем сырой курс
-                        metadata = rate_info.get('metadata', {})
-                        metadata_json = json.dumps(metadata) if metadata else None
-                        
-                        await conn.execute("""
+                async with conn.transaction():
+                    if raw_rows:
+                        await conn.executemany("""
                             INSERT INTO fx_raw_rate 
                             (source_id, source_pair_id, raw_price, bid_price, ask_price, volume_24h, metadata, received_at)
                             VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
@@ -216,39 +502,49 @@ class FXRatesService:
                                 volume_24h = EXCLUDED.volume_24h,
                                 metadata = EXCLUDED.metadata,
                                 received_at = EXCLUDED.received_at
-                        """, source.id, pair.id, rate_info['price'], 
-                             rate_info.get('bid'), rate_info.get('ask'),
-                             rate_info.get('volume'), metadata_json,
-                             datetime.now())
-                        
-                        # Вычисляем и сохраняем финальный курс
-                        await self._calculate_and_save_final_rate(
-                            conn, source, pair, rate_info['price'],
-                            rate_info.get('bid'), rate_info.get('ask')
-                        )
+                        """, raw_rows)
                         
-                        pairs_succeeded += 1
+                        await conn.executemany("""
+                            INSERT INTO fx_final_rate 
+                            (source_id, source_pair_id, raw_price, final_price, applied_rule_id, 
+                             markup_percent, markup_fixed, calculated_at, stale)
+                            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, false)
+                            ON CONFLICT (source_id, source_pair_id) 
+                            DO UPDATE SET 
+                                raw_price = EXCLUDED.raw_price,
+                                final_price = EXCLUDED.final_price,
+                                applied_rule_id = EXCLUDED.applied_rule_id,
+                                markup_percent = EXCLUDED.markup_percent,
+                                markup_fixed = EXCLUDED.markup_fixed,
+                                calculated_at = EXCLUDED.calculated_at,
+                                stale = false
+                        """, final_rows)
                         
-                    except Exception as e:
-                        pairs_failed += 1
-                        error_msg = f"{pair.source_symbol}: {str(e)}"
-                        errors.append(error_msg)
-                        logger.error(f"Failed to save rate for {pair.source_symbol}: {e}")
+                        # Модель чтения для get_final_rate / get_all_final_rates
+                        await conn.executemany(_UPSERT_RATE_VIEW_SQL, view_rows)
+                    
+                    finished_at = datetime.now()
+                    duration_ms = int((finished_at - started_at).total_seconds() * 1000)
+                    await conn.execute("""
+                        INSERT INTO fx_sync_log 
+                        (source_id, started_at, finished_at, status, pairs_processed,
+                         pairs_succeeded, pairs_failed, duration_ms, error_message)
+                        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+                    """, source.id, started_at, finished_at, status, len(pairs),
+                         pairs_succeeded, pairs_failed, duration_ms,
+                         '; '.join(errors[:10]) if errors else None)
             
-            # Обновляем лог
-            finished_at = datetime.now()
-            duration_ms = int((finished_at - started_at).total_seconds() * 1000)
-            status = 'success' if pairs_failed == 0 else ('partial' if pairs_succeeded > 0 else 'error')
+            # Продлеваем сроки годности обновленных пар
+            tracker = get_freshness_tracker()
+            for pair in synced_pairs:
+                tracker.touch(source.id, pair.id, received_at, f"{source.code}/{pair.internal_symbol}")
             
-            async with pool.acquire() as conn:
-                await conn.execute("""
-                    UPDATE fx_sync_log 
-                    SET finished_at = $1, status = $2, pairs_processed = $3,
-                        pairs_succeeded = $4, pairs_failed = $5, duration_ms = $6,
-                        error_message = $7
-                    WHERE id = $8
-                """, finished_at, status, len(pairs), pairs_succeeded, pairs_failed,
-                     duration_ms, '; '.join(errors[:10]) if errors else None, log_id)
+            # История тиков пишется фоном пачками, синхронизацию не задерживает
+            if FX_HISTORY_ENABLED:
+                get_rate_history_writer().add_many(
+                    (source_id, pair_id, raw, final, rule_id, calculated_at)
+                    for source_id, pair_id, raw, final, rule_id, _, _, calculated_at in final_rows
+                )
             
             return {
                 "pairs_processed": len(pairs),
@@ -260,13 +556,17 @@ class FXRatesService:
             }
             
         except Exception as e:
-            # Обновляем лог с ошибкой
-            async with pool.acquire() as conn:
-                await conn.execute("""
-                    UPDATE fx_sync_log 
-                    SET finished_at = $1, status = 'error', error_message = $2
-                    WHERE id = $3
-                """, datetime.now(), str(e), log_id)
+            # Транзакция откатилась - фиксируем ошибку в логе отдельно
+            logger.error(f"Failed to sync {source_code} rates: {e}")
+            try:
+                async with pool.acquire() as conn:
+                    await conn.execute("""
+                        INSERT INTO fx_sync_log 
+                        (source_id, started_at, finished_at, status, pairs_processed, error_message)
+                        VALUES ($1, $2, $3, 'error', $4, $5)
+                    """, source.id, started_at, datetime.now(), len(pairs), str(e))
+            except Exception as log_error:
+                logger.error(f"Failed to write sync log for {source_code}: {log_error}")
             raise
     
     async def _fetch_grinex_rates(self, pairs: List[FXSourcePair]) -> Dict[str, Dict]:
@@ -274,6 +574,23 @@ class FXRatesService:
         client = await get_grinex_client()
         rates = {}
         
+        # Пары, которые обслуживает WebSocket-поток, берем из снапшота без запроса
+        stream = get_market_stream("grinex")
+        if stream:
+            store = get_rate_snapshot_store()
+            for pair in pairs:
+                quote = store.get(pair.source_symbol, source="grinex") if stream.is_live(pair.source_symbol) else None
+                if quote and quote.best_bid and quote.best_ask:
+                    rates[pair.source_symbol] = {
+                        'price': (quote.best_bid + quote.best_ask) / 2,
+                        'bid': quote.best_bid,
+                        'ask': quote.best_ask,
+                        'volume': None
+                    }
+            pairs = [pair for pair in pairs if pair.source_symbol not in rates]
+            if not pairs:
+                return rates
+        
         try:
             # Пробуем получить все тикеры за раз
             all_tickers = await client.get_all_tickers()
@@ -310,62 +627,57 @@ class FXRatesService:
         
         return rates
     
-    async def _fetch_rapira_rates(self, pairs: List[FXSourcePair]) -> Dict[str, Dict]:
-        """Получает курсы из Rapira (публичный API)"""
-        client = await get_rapira_simple_client()
+    def _rapira_rates_from_batch(self, pairs: List[FXSourcePair], batch_rates: Dict[str, Dict]) -> Dict[str, Dict]:
+        """Курсы пар Rapira из пакета шины рыночных данных"""
         rates = {}
         
-        for pair in pairs:
-            try:
-                # source_symbol может быть в формате 'usdtrub' или 'USDT/RUB'
-                # Rapira API принимает оба формата
-                symbol = pair.source_symbol.upper()
-                if '/' not in symbol:
-                    # Конвертируем btcusdt -> BTC/USDT
-                    if symbol.endswith('USDT'):
-                        base = symbol[:-4]
-                        symbol = f"{base}/USDT"
-                    elif symbol.endswith('RUB'):
-                        base = symbol[:-3]
-                        symbol = f"{base}/RUB"
-                
-                rate_data = await client.get_base_rate(symbol)
-                if rate_data and (rate_data['best_ask'] or rate_data['best_bid']):
-                    # Используем mid price как основной курс
-                    bid = rate_data['best_bid']
-                    ask = rate_data['best_ask']
-                    
-                    if bid and ask:
-                        price = (bid + ask) / 2
-                    elif ask:
-                        price = ask
-                    elif bid:
-                        price = bid
-                    else:
-                        continue
-                    
-                    rates[pair.source_symbol] = {
-                        'price': Decimal(str(price)),
-                        'bid': Decimal(str(bid)) if bid else None,
-                        'ask': Decimal(str(ask)) if ask else None,
-                        'volume': None  # Публичный API не возвращает volume
-                    }
-                    
-            except Exception as e:
-                logger.error(f"Failed to fetch Rapira rate for {pair.source_symbol}: {e}")
+        # source_symbol может быть в формате 'usdtrub' или 'USDT/RUB'
+        symbols = {pair.source_symbol: self._to_rapira_symbol(pair.source_symbol) for pair in pairs}
+        
+        for source_symbol, symbol in symbols.items():
+            rate_data = batch_rates.get(symbol)
+            if not rate_data or not (rate_data['best_ask'] or rate_data['best_bid']):
+                continue
+            
+            # Используем mid price как основной курс
+            bid = rate_data['best_bid']
+            ask = rate_data['best_ask']
+            
+            if bid and ask:
+                price = (bid + ask) / 2
+            elif ask:
+                price = ask
+            else:
+                price = bid
+            
+            rates[source_symbol] = {
+                'price': Decimal(str(price)),
+                'bid': Decimal(str(bid)) if bid else None,
+                'ask': Decimal(str(ask)) if ask else None,
+                'volume': None  # Публичный API не возвращает volume
+            }
         
         return rates
     
-    async def _calculate_and_save_final_rate(
+    @staticmethod
+    def _to_rapira_symbol(source_symbol: str) -> str:
+        """Конвертирует btcusdt -> BTC/USDT (Rapira API принимает оба формата)"""
+        symbol = source_symbol.upper()
+        if '/' not in symbol:
+            if symbol.endswith('USDT'):
+                symbol = f"{symbol[:-4]}/USDT"
+            elif symbol.endswith('RUB'):
+                symbol = f"{symbol[:-3]}/RUB"
+        return symbol
+    
+    def _build_final_rate_row(
         self, 
-        conn, 
         source: FXSource, 
         pair: FXSourcePair, 
         raw_price: Decimal,
-        bid_price: Optional[Decimal] = None,
-        ask_price: Optional[Decimal] = None
-    ):
-        """Вычисляет и сохраняет финальный курс с наценкой"""
+        calculated_at: datetime
+    ) -> tuple:
+        """Вычисляет финальный курс с наценкой, возвращает строку для fx_final_rate"""
         # Находим подходящее правило наценки
         rule = self._find_applicable_rule(source.id, pair.id)
         
@@ -382,69 +694,29 @@ class FXRatesService:
             markup_fixed = Decimal('0')
             rule_id = None
         
-        # Сохраняем финальный курс
-        await conn.execute("""
-            INSERT INTO fx_final_rate 
-            (source_id, source_pair_id, raw_price, final_price, applied_rule_id, 
-             markup_percent, markup_fixed, calculated_at, stale)
-            VALUES ($1, $2, $3, $4, $5, $6, $7, $8, false)
-            ON CONFLICT (source_id, source_pair_id) 
-            DO UPDATE SET 
-                raw_price = EXCLUDED.raw_price,
-                final_price = EXCLUDED.final_price,
-                applied_rule_id = EXCLUDED.applied_rule_id,
-                markup_percent = EXCLUDED.markup_percent,
-                markup_fixed = EXCLUDED.markup_fixed,
-                calculated_at = EXCLUDED.calculated_at,
-                stale = false
-        """, source.id, pair.id, raw_price, final_price, rule_id,
-             markup_percent, markup_fixed, datetime.now())
+        return (source.id, pair.id, raw_price, final_price, rule_id,
+                markup_percent, markup_fixed, calculated_at)
+    
+    @staticmethod
+    def _build_view_row(source: FXSource, pair: FXSourcePair, final_row: tuple, bid, ask) -> tuple:
+        """Строка fx_rate_view из строки fx_final_rate и данных источника и пары"""
+        source_id, pair_id, raw_price, final_price, rule_id, markup_percent, markup_fixed, calculated_at = final_row
+        return (source_id, pair_id, source.code, pair.internal_symbol, pair.base_currency, pair.quote_currency,
+                raw_price, final_price, bid, ask, rule_id, markup_percent, markup_fixed, calculated_at,
+                source.enabled, pair.enabled)
     
     def _find_applicable_rule(self, source_id: int, pair_id: int) -> Optional[FXMarkupRule]:
-        """Находит применимое правило наценки с учетом приоритета"""
-        now = datetime.now()
-        
-        for rule in self._rules_cache:
-            # Проверяем срок действия
-            if rule.valid_from and rule.valid_from > now:
-                continue
-            if rule.valid_to and rule.valid_to < now:
-                continue
-            
-            # Проверяем соответствие по уровню (приоритет: pair > source > global)
-            if rule.level == 'pair' and rule.source_pair_id == pair_id:
-                return rule
-            elif rule.level == 'source' and rule.source_id == source_id:
-                return rule
-            elif rule.level == 'global':
-                return rule
-        
-        return None
+        """Находит применимое правило наценки с учетом приоритета (через индекс)"""
+        return self._rule_index.find(source_id, pair_id)
     
     def _apply_markup(self, raw_price: Decimal, rule: FXMarkupRule) -> Decimal:
-        """Применяет наценку к курсу"""
-        # Шаг 1: применяем процент
-        price_with_percent = raw_price * (Decimal('1') + rule.percent / Decimal('100'))
-        
-        # Шаг 2: добавляем фиксированную наценку
-        final_price = price_with_percent + rule.fixed
-        
-        # Шаг 3: округляем
-        return self._round_price(final_price, rule.rounding_mode, rule.round_to)
+        """Применяет наценку к курсу: процент, фикс и округление (в целых числах)"""
+        markup = get_markup(rule.percent, rule.fixed, rule.round_to, rule.rounding_mode)
+        return markup.apply_decimal(raw_price)
     
     def _round_price(self, price: Decimal, mode: str, decimals: int) -> Decimal:
         """Округляет цену по заданному режиму"""
-        quantizer = Decimal('0.1') ** decimals
-        
-        rounding_map = {
-            'ROUND_HALF_UP': ROUND_HALF_UP,
-            'ROUND_DOWN': ROUND_DOWN,
-            'ROUND_UP': ROUND_UP,
-            'BANKERS': ROUND_HALF_EVEN
-        }
-        
-        rounding = rounding_map.get(mode, ROUND_HALF_UP)
-        return price.quantize(quantizer, rounding=rounding)
+        return round_decimal(price, decimals, mode)
     
     async def get_final_rate(
         self, 
@@ -453,43 +725,21 @@ class FXRatesService:
         source_code: str = None,
         allow_stale: bool = False
     ) -> Optional[FXRate]:
-        """Получает финальный курс для пары"""
-        await self._refresh_cache()
-        
+        """Получает финальный курс для пары (один индексный поиск в fx_rate_view)"""
         pool = await self.get_pool()
         async with pool.acquire() as conn:
-            query = """
-                SELECT 
-                    s.code as source_code,
-                    sp.internal_symbol,
-                    sp.base_currency,
-                    sp.quote_currency,
-                    fr.raw_price,
-                    fr.final_price,
-                    rr.bid_price,
-                    rr.ask_price,
-                    fr.applied_rule_id,
-                    fr.markup_percent,
-                    fr.markup_fixed,
-                    fr.calculated_at,
-                    fr.stale
-                FROM fx_final_rate fr
-                JOIN fx_source s ON s.id = fr.source_id
-                JOIN fx_source_pair sp ON sp.id = fr.source_pair_id
-                LEFT JOIN fx_raw_rate rr ON rr.source_id = fr.source_id AND rr.source_pair_id = fr.source_pair_id
-                WHERE sp.base_currency = $1 AND sp.quote_currency = $2
-                    AND s.enabled = true AND sp.enabled = true
-            """
-            params = [base, quote]
+            query = _SELECT_RATE_VIEW_SQL + " AND base_currency = $2 AND quote_currency = $3"
+            params = [FX_STALE_THRESHOLD_SECONDS, base, quote]
             
             if source_code:
-                query += " AND s.code = $3"
+                query += " AND source_code = $4"
                 params.append(source_code)
             
+            # Свежесть выводится из calculated_at на момент чтения
             if not allow_stale:
-                query += f" AND fr.stale = false"
+                query += " AND calculated_at >= NOW() - make_interval(secs => $1)"
             
-            query += " ORDER BY fr.calculated_at DESC LIMIT 1"
+            query += " ORDER BY calculated_at DESC LIMIT 1"
             
             row = await conn.fetchrow(query, *params)
             
@@ -503,47 +753,57 @@ class FXRatesService:
         source_code: Optional[str] = None,
         allow_stale: bool = False
     ) -> List[FXRate]:
-        """Получает все финальные курсы"""
-        await self._refresh_cache()
-        
+        """Получает все финальные курсы (из fx_rate_view)"""
         pool = await self.get_pool()
         async with pool.acquire() as conn:
-            query = """
-                SELECT 
-                    s.code as source_code,
-                    sp.internal_symbol,
-                    sp.base_currency,
-                    sp.quote_currency,
-                    fr.raw_price,
-                    fr.final_price,
-                    rr.bid_price,
-                    rr.ask_price,
-                    fr.applied_rule_id,
-                    fr.markup_percent,
-                    fr.markup_fixed,
-                    fr.calculated_at,
-                    fr.stale
-                FROM fx_final_rate fr
-                JOIN fx_source s ON s.id = fr.source_id
-                JOIN fx_source_pair sp ON sp.id = fr.source_pair_id
-                LEFT JOIN fx_raw_rate rr ON rr.source_id = fr.source_id AND rr.source_pair_id = fr.source_pair_id
-                WHERE s.enabled = true AND sp.enabled = true
-            """
-            params = []
+            query = _SELECT_RATE_VIEW_SQL
+            params = [FX_STALE_THRESHOLD_SECONDS]
             
             if source_code:
-                query += " AND s.code = $1"
+                query += " AND source_code = $2"
                 params.append(source_code)
             
             if not allow_stale:
-                query += " AND fr.stale = false"
+                query += " AND calculated_at >= NOW() - make_interval(secs => $1)"
             
-            query += " ORDER BY s.code, sp.internal_symbol"
+            query += " ORDER BY source_code, internal_symbol"
             
             rows = await conn.fetch(query, *params)
             return [FXRate(**dict(row)) for row in rows]
 
 
+    async def ingest_market_batch(self, batch) -> Optional[int]:
+        """
+        Запоминает курсы пакета шины, если источник подключен к FX
+        
+        Шина опрашивает биржу каждые 2-30 секунд, а писать fx_raw_rate /
+        fx_final_rate и fx_sync_log нужно с интервалом FX источника: пакеты
+        объединяются (по символу - последняя котировка), запись делает
+        sync_source_rates по расписанию FXRatesScheduler.
+        
+        Returns:
+            Сколько символов накоплено для источника
+        """
+        await self._refresh_cache()
+        if batch.source not in self._sources_cache:
+            return None
+        from src.services.market_data_bus import MarketBatch
+        pending = self._market_pending.get(batch.source)
+        if pending is None:
+            pending = self._market_pending[batch.source] = MarketBatch(source=batch.source)
+        pending.rates.update(batch.rates)
+        pending.requested = list(dict.fromkeys([*pending.requested, *batch.requested]))
+        return len(pending.rates)
+    
+    async def market_symbols(self) -> Dict[str, List[str]]:
+        """Символы пар FX, которые опрашивает шина рыночных данных"""
+        await self._refresh_cache()
+        source = self._sources_cache.get('rapira')
+        if not source:
+            return {}
+        return {'rapira': [self._to_rapira_symbol(pair.source_symbol) for pair in self._pairs_cache.get(source.id, [])]}
+
+
 # Глобальный экземпляр сервиса
 _fx_service: Optional[FXRatesService] = None
 
@@ -553,5 +813,20 @@ async def get_fx_service() -> FXRatesService:
     global _fx_service
     if not _fx_service:
         _fx_service = FXRatesService()
+        # Изменения источников/пар/правил в админке сбрасывают кэш сразу
+        from src.utils.layered_cache import get_layered_cache, FX_CONFIG_CACHE_PREFIX
+        get_layered_cache().on_invalidate(FX_CONFIG_CACHE_PREFIX, _fx_service.invalidate_cache)
     return _fx_service
 
+
+
+async def ingest_market_batch(batch) -> Optional[Dict[str, any]]:
+    """Подписчик шины рыночных данных: курсы для записи в fx_raw_rate / fx_final_rate"""
+    service = await get_fx_service()
+    return await service.ingest_market_batch(batch)
+
+
+async def fx_market_symbols() -> Dict[str, List[str]]:
+    """Символы FX для шины рыночных данных"""
+    service = await get_fx_service()
+    return await service.market_symbols()
@@ -3,21 +3,92 @@
 """
 
 import os
+import json
+import time
 import asyncio
 import logging
+from collections import deque
 from datetime import datetime
+from typing import Dict, List, Optional
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 
+from src.services.adaptive_polling import PollSchedule, get_adaptive_poller
 from src.services.fx_rates import get_fx_service
+from src.services.market_data_bus import get_market_data_bus
+from src.services.rate_aggregator import get_rate_aggregator
+from src.utils.redis_client import get_redis_stats
+from src.services.rate_freshness import FX_STALE_THRESHOLD_SECONDS, get_freshness_tracker
 from src.db import get_pg_pool
+from src.utils.call_policy import get_call_policies_stats
+from src.utils.single_flight import get_single_flight
 
 logger = logging.getLogger(__name__)
 
 # Конфигурация
 FX_UPDATE_INTERVAL_SECONDS = int(os.getenv("FX_UPDATE_INTERVAL_SECONDS", 60))
-FX_STALE_CHECK_INTERVAL = int(os.getenv("FX_STALE_CHECK_INTERVAL", 300))  # 5 минут
-FX_STALE_THRESHOLD_SECONDS = int(os.getenv("FX_STALE_THRESHOLD_SECONDS", 180))  # 3 минуты
+FX_SYNC_TIMEOUT_SECONDS = float(os.getenv("FX_SYNC_TIMEOUT_SECONDS", 30))  # бюджет одной синхронизации
+FX_SOURCES_REFRESH_INTERVAL = int(os.getenv("FX_SOURCES_REFRESH_INTERVAL", 300))  # пересборка задач по источникам
+FX_SYNC_LATENCY_WINDOW = 100  # сколько последних замеров хранить на источник
+# Адаптивный опрос: источник с горячими парами синхронизируется раз в MIN секунд,
+# без спроса и движения цены - раз в interval источника
+FX_SYNC_MIN_INTERVAL = float(os.getenv("FX_SYNC_MIN_INTERVAL", 15))
+
+
+def _source_setting(code: str, config, name: str, default: float) -> float:
+    """
+    Настройка источника: fx_source.config -> env FX_SYNC_<NAME>_<CODE> -> default
+
+    Например, FX_SYNC_INTERVAL_GRINEX=120 или config {"sync_interval_seconds": 120}.
+    """
+    if isinstance(config, str):
+        try:
+            config = json.loads(config)
+        except ValueError:
+            config = {}
+    value = (config or {}).get(f"sync_{name}_seconds")
+    if value is None:
+        value = os.getenv(f"FX_SYNC_{name.upper()}_{code.upper()}")
+    return float(value) if value is not None else default
+
+
+class SourceSyncStats:
+    """Статистика синхронизаций одного источника"""
+    
+    def __init__(self, interval: float, timeout: float):
+        self.interval = interval
+        self.timeout = timeout
+        self.latencies_ms = deque(maxlen=FX_SYNC_LATENCY_WINDOW)
+        self.runs = 0
+        self.failures = 0
+        self.timeouts = 0
+        self.last_error: Optional[str] = None
+        self.last_status: Optional[str] = None
+    
+    def record(self, duration_ms: float, status: str, error: Optional[str] = None):
+        self.runs += 1
+        self.latencies_ms.append(duration_ms)
+        self.last_status = status
+        if status == 'timeout':
+            self.timeouts += 1
+        if status in ('timeout', 'exception', 'error'):
+            self.failures += 1
+            self.last_error = error
+    
+    def as_dict(self) -> dict:
+        latencies = sorted(self.latencies_ms)
+        return {
+            'interval_seconds': self.interval,
+            'timeout_seconds': self.timeout,
+            'runs': self.runs,
+            'failures': self.failures,
+            'timeouts': self.timeouts,
+            'last_status': self.last_status,
+            'last_error': self.last_error,
+            'last_ms': round(self.latencies_ms[-1]) if self.latencies_ms else None,
+            'avg_ms': round(sum(latencies) / len(latencies)) if latencies else None,
+            'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]) if latencies else None,
+        }
 
 
 class FXRatesScheduler:
@@ -27,6 +98,8 @@ class FXRatesScheduler:
         self.scheduler = AsyncIOScheduler()
         self._running = False
         self._last_sync: dict = {}  # {source_code: datetime}
+        self._source_stats: Dict[str, SourceSyncStats] = {}
+        self._schedules: Dict[str, PollSchedule] = {}
     
     async def start(self):
         """Запускает планировщик"""
@@ -34,24 +107,15 @@ class FXRatesScheduler:
             logger.warning("FX scheduler already running")
             return
         
-        logger.info(f"Starting FX rates scheduler with {FX_UPDATE_INTERVAL_SECONDS}s interval")
+        logger.info(f"Starting FX rates scheduler with {FX_UPDATE_INTERVAL_SECONDS}s default interval")
         
-        # Добавляем задачу синхронизации всех источников
+        # Каждый источник синхронизируется своей задачей со своим интервалом,
+        # поэтому медленная биржа не задерживает остальные
         self.scheduler.add_job(
-            self._sync_all_sources,
-            trigger=IntervalTrigger(seconds=FX_UPDATE_INTERVAL_SECONDS),
-            id='fx_sync_all',
-            name='Sync all FX sources',
-            replace_existing=True,
-            max_instances=1  # Не запускать параллельно
-        )
-        
-        # Добавляем задачу проверки устаревших данных
-        self.scheduler.add_job(
-            self._check_stale_rates,
-            trigger=IntervalTrigger(seconds=FX_STALE_CHECK_INTERVAL),
-            id='fx_check_stale',
-            name='Check stale FX rates',
+            self._schedule_sources,
+            trigger=IntervalTrigger(seconds=FX_SOURCES_REFRESH_INTERVAL),
+            id='fx_schedule_sources',
+            name='Refresh FX source jobs',
             replace_existing=True,
             max_instances=1
         )
@@ -60,7 +124,11 @@ class FXRatesScheduler:
         self.scheduler.start()
         self._running = True
         
-        # Выполняем первую синхронизацию сразу
+        # Устаревание курсов отслеживается по срокам, без периодического UPDATE
+        await get_freshness_tracker().start()
+        
+        # Планируем задачи источников и выполняем первую синхронизацию сразу
+        await self._schedule_sources()
         asyncio.create_task(self._sync_all_sources())
         
         logger.info("FX rates scheduler started successfully")
@@ -72,102 +140,166 @@ class FXRatesScheduler:
         
         logger.info("Stopping FX rates scheduler")
         self.scheduler.shutdown(wait=False)
+        await get_freshness_tracker().stop()
         self._running = False
         logger.info("FX rates scheduler stopped")
     
-    async def _sync_all_sources(self):
-        """Синхронизирует все активные источники"""
+    async def _get_enabled_sources(self) -> List:
+        """Список активных источников (code, config)"""
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            return await conn.fetch("SELECT code, config FROM fx_source WHERE enabled = true")
+    
+    async def _get_source_symbols(self) -> Dict[str, List[str]]:
+        """Внутренние символы активных пар по источникам"""
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT s.code, sp.internal_symbol
+                FROM fx_source_pair sp
+                JOIN fx_source s ON s.id = sp.source_id
+                WHERE sp.enabled = true
+            """)
+        symbols: Dict[str, List[str]] = {}
+        for row in rows:
+            symbols.setdefault(row['code'], []).append(row['internal_symbol'])
+        return symbols
+    
+    async def _schedule_sources(self):
+        """Создает/обновляет задачи синхронизации по источникам, удаляет отключенные"""
         try:
-            fx_service = await get_fx_service()
-            pool = await get_pg_pool()
+            sources = await self._get_enabled_sources()
+            source_symbols = await self._get_source_symbols()
+        except Exception as e:
+            logger.error(f"Failed to load FX sources for scheduling: {e}", exc_info=True)
+            return
+        
+        codes = set()
+        for source in sources:
+            code = source['code']
+            # Источники шины рыночных данных тоже: шина копит котировки,
+            # задача пишет их в БД с интервалом FX источника
+            codes.add(code)
+            interval = _source_setting(code, source['config'], 'interval', FX_UPDATE_INTERVAL_SECONDS)
+            min_interval = _source_setting(code, source['config'], 'min_interval', min(FX_SYNC_MIN_INTERVAL, interval))
+            timeout = _source_setting(code, source['config'], 'timeout', min(FX_SYNC_TIMEOUT_SECONDS, interval))
             
-            # Получаем список активных источников
-            async with pool.acquire() as conn:
-                sources = await conn.fetch("SELECT code, name FROM fx_source WHERE enabled = true")
+            # Интервал источника - по самой горячей из его пар
+            schedule = self._schedules.get(code)
+            changed = schedule is None or schedule.min_interval != min_interval or schedule.max_interval != interval
+            if changed:
+                schedule = self._schedules[code] = PollSchedule(
+                    get_adaptive_poller(), min_interval, interval, base_interval=interval
+                )
+            schedule.set_group(code, source_symbols.get(code, []))
             
-            if not sources:
-                logger.warning("No enabled FX sources found")
-                return
+            stats = self._source_stats.get(code)
+            if stats and not changed and stats.interval == interval and stats.timeout == timeout \
+                    and self.scheduler.get_job(f'fx_sync_{code}'):
+                continue
             
-            # Синхронизируем каждый источник
-            for source in sources:
-                source_code = source['code']
-                try:
-                    logger.debug(f"Syncing FX source: {source_code}")
-                    result = await fx_service.sync_source_rates(source_code)
-                    
-                    self._last_sync[source_code] = datetime.now()
-                    
-                    # Проверка формата результата
-                    if not isinstance(result, dict):
-                        logger.error(f"FX sync {source_code}: invalid result format")
-                        continue
-                    
-                    # Если нет пар - просто логируем
-                    if result.get('pairs_processed', 0) == 0:
-                        logger.info(f"FX sync {source_code}: no pairs configured, skipped")
-                        continue
-                    
-                    # Обработка результата синхронизации
-                    status = result.get('status', 'unknown')
-                    if status == 'success':
-                        logger.info(
-                            f"FX sync {source_code}: {result.get('pairs_succeeded', 0)}/{result.get('pairs_processed', 0)} pairs, "
-                            f"{result.get('duration_ms', 0)}ms"
-                        )
-                    elif status == 'partial':
-                        logger.warning(
-                            f"FX sync {source_code} partial: {result.get('pairs_succeeded', 0)}/{result.get('pairs_processed', 0)} succeeded, "
-                            f"{result.get('pairs_failed', 0)} failed"
-                        )
-                    else:
-                        logger.error(f"FX sync {source_code} failed: {result.get('errors', [])}")
-                
-                except Exception as e:
-                    logger.error(f"Failed to sync FX source {source_code}: {e}", exc_info=True)
+            if stats:
+                stats.interval, stats.timeout = interval, timeout
+            else:
+                self._source_stats[code] = SourceSyncStats(interval, timeout)
             
+            # Задача проверяет срок с шагом min_interval, сам интервал - адаптивный
+            self.scheduler.add_job(
+                self._sync_source,
+                trigger=IntervalTrigger(seconds=min_interval if schedule.poller.enabled else interval),
+                args=[code],
+                id=f'fx_sync_{code}',
+                name=f'Sync FX source {code}',
+                replace_existing=True,
+                max_instances=1,  # Не запускать один источник параллельно
+                coalesce=True
+            )
+            logger.info(f"FX source {code}: sync every {min_interval:g}-{interval:g}s, timeout {timeout:g}s")
+        
+        # Удаляем задачи отключенных источников
+        for job in self.scheduler.get_jobs():
+            if job.id.startswith('fx_sync_') and job.id[len('fx_sync_'):] not in codes:
+                job.remove()
+                logger.info(f"FX source {job.id[len('fx_sync_'):]} disabled, job removed")
+    
+    async def _sync_source(self, source_code: str, force: bool = False) -> Optional[dict]:
+        """
+        Синхронизирует один источник в пределах его бюджета времени
+        
+        Без force источник пропускается, если по адаптивному расписанию
+        срок еще не подошел.
+        """
+        schedule = self._schedules.get(source_code)
+        if schedule is not None:
+            if not force and not schedule.is_due(source_code):
+                return None
+            schedule.mark_polled([source_code])
+        
+        stats = self._source_stats.get(source_code)
+        if stats is None:
+            stats = self._source_stats[source_code] = SourceSyncStats(
+                FX_UPDATE_INTERVAL_SECONDS, FX_SYNC_TIMEOUT_SECONDS
+            )
+        
+        fx_service = await get_fx_service()
+        started = time.monotonic()
+        try:
+            logger.debug(f"Syncing FX source: {source_code}")
+            result = await asyncio.wait_for(fx_service.sync_source_rates(source_code), stats.timeout)
+        except asyncio.TimeoutError:
+            stats.record((time.monotonic() - started) * 1000, 'timeout', f"timeout after {stats.timeout:g}s")
+            logger.error(f"FX sync {source_code} timed out after {stats.timeout:g}s")
+            return None
         except Exception as e:
-            logger.error(f"Failed to sync FX sources: {e}", exc_info=True)
+            stats.record((time.monotonic() - started) * 1000, 'exception', str(e))
+            logger.error(f"Failed to sync FX source {source_code}: {e}", exc_info=True)
+            return None
+        
+        duration_ms = (time.monotonic() - started) * 1000
+        self._last_sync[source_code] = datetime.now()
+        
+        # Проверка формата результата
+        if not isinstance(result, dict):
+            stats.record(duration_ms, 'error', 'invalid result format')
+            logger.error(f"FX sync {source_code}: invalid result format")
+            return None
+        
+        status = result.get('status', 'skipped')
+        errors = result.get('errors') or []
+        stats.record(duration_ms, status, '; '.join(errors[:3]) if errors else None)
+        
+        # Если нет пар - просто логируем
+        if result.get('pairs_processed', 0) == 0:
+            logger.info(f"FX sync {source_code}: no pairs configured, skipped")
+        elif status == 'success':
+            logger.info(
+                f"FX sync {source_code}: {result.get('pairs_succeeded', 0)}/{result.get('pairs_processed', 0)} pairs, "
+                f"{duration_ms:.0f}ms"
+            )
+        elif status == 'partial':
+            logger.warning(
+                f"FX sync {source_code} partial: {result.get('pairs_succeeded', 0)}/{result.get('pairs_processed', 0)} succeeded, "
+                f"{result.get('pairs_failed', 0)} failed"
+            )
+        else:
+            logger.error(f"FX sync {source_code} failed: {errors}")
+        
+        return result
     
-    async def _check_stale_rates(self):
-        """Проверяет и помечает устаревшие курсы"""
+    async def _sync_all_sources(self):
+        """Синхронизирует все активные источники параллельно"""
         try:
-            pool = await get_pg_pool()
+            sources = await self._get_enabled_sources()
+            
+            if not sources:
+                logger.warning("No enabled FX sources found")
+                return
+            
+            # Ошибки и таймауты изолированы внутри _sync_source
+            await asyncio.gather(*(self._sync_source(source['code'], force=True) for source in sources))
             
-            async with pool.acquire() as conn:
-                # Помечаем курсы как stale если они старше порога
-                result = await conn.execute(f"""
-                    UPDATE fx_final_rate
-                    SET stale = true
-                    WHERE stale = false 
-                        AND calculated_at < NOW() - INTERVAL '{FX_STALE_THRESHOLD_SECONDS} seconds'
-                """)
-                
-                # Парсим результат (формат: "UPDATE N")
-                rows_updated = int(result.split()[-1]) if result else 0
-                
-                if rows_updated > 0:
-                    logger.warning(f"Marked {rows_updated} FX rates as stale")
-                    
-                    # Логируем какие пары устарели
-                    stale_rates = await conn.fetch("""
-                        SELECT s.code, sp.internal_symbol, fr.calculated_at
-                        FROM fx_final_rate fr
-                        JOIN fx_source s ON s.id = fr.source_id
-                        JOIN fx_source_pair sp ON sp.id = fr.source_pair_id
-                        WHERE fr.stale = true
-                        ORDER BY fr.calculated_at
-                        LIMIT 10
-                    """)
-                    
-                    for rate in stale_rates:
-                        logger.warning(
-                            f"Stale rate: {rate['code']}/{rate['internal_symbol']} "
-                            f"(last update: {rate['calculated_at']})"
-                        )
-        
         except Exception as e:
-            logger.error(f"Failed to check stale rates: {e}", exc_info=True)
+            logger.error(f"Failed to sync FX sources: {e}", exc_info=True)
     
     async def trigger_sync(self, source_code: str = None):
         """Принудительно запускает синхронизацию"""
@@ -197,9 +329,21 @@ class FXRatesScheduler:
             'last_sync': {
                 code: dt.isoformat() for code, dt in self._last_sync.items()
             },
+            'sources': {
+                code: stats.as_dict() for code, stats in self._source_stats.items()
+            },
+            'polling': {
+                code: schedule.get_stats() for code, schedule in self._schedules.items()
+            },
+            'single_flight': get_single_flight().get_stats(),
+            'call_policies': get_call_policies_stats(),
+            'freshness': get_freshness_tracker().get_stats(),
+            'market_bus': get_market_data_bus().get_stats(),
+            'best_rate': get_rate_aggregator().get_stats(),
+            'redis': get_redis_stats(),
             'config': {
                 'update_interval_seconds': FX_UPDATE_INTERVAL_SECONDS,
-                'stale_check_interval': FX_STALE_CHECK_INTERVAL,
+                'sync_timeout_seconds': FX_SYNC_TIMEOUT_SECONDS,
                 'stale_threshold_seconds': FX_STALE_THRESHOLD_SECONDS
             }
         }
@@ -4,20 +4,29 @@
 """
 
 import os
-import httpx
+import time
 import asyncio
 import logging
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
 from dataclasses import dataclass
 from datetime import datetime
 from decimal import Decimal
+from operator import itemgetter
+
+import httpx
+
+from src.utils.http_client import get_http_client
+from src.utils.call_policy import get_call_policy
+from src.utils.single_flight import flight_key
+from src.utils.serialization import response_json
 
 logger = logging.getLogger(__name__)
 
 # Конфигурация
 GRINEX_API_BASE = os.getenv("GRINEX_API_BASE", "https://api.grinex.io")
 GRINEX_TIMEOUT = int(os.getenv("GRINEX_TIMEOUT", 5))  # секунды
-GRINEX_MAX_RETRIES = int(os.getenv("GRINEX_MAX_RETRIES", 3))
+GRINEX_MAX_RETRIES = int(os.getenv("GRINEX_MAX_RETRIES", 3))  # повторов в пределах deadline (см. call_policy)
+GRINEX_MISSING_TICKER_TTL = float(os.getenv("GRINEX_MISSING_TICKER_TTL", 300))  # не запрашивать пару после 404/410
 
 
 @dataclass
@@ -45,6 +54,145 @@ class GrinexHealth:
     last_error: Optional[str] = None
 
 
+# ----------------------------------------------------------------------
+# Разбор тикеров
+# ----------------------------------------------------------------------
+
+# Варианты ключей (в порядке приоритета): API отдает тикеры в разных форматах
+_SYMBOL_KEYS = ('symbol', 'pair', 's')
+_DECIMAL_FIELD_KEYS = (
+    ('lastPrice', 'last', 'price', 'c', 'close'),          # last_price
+    ('bid', 'bidPrice', 'b'),                              # bid
+    ('ask', 'askPrice', 'a'),                              # ask
+    ('volume', 'volume24h', 'v', 'quoteVolume'),           # volume_24h
+    ('high', 'high24h', 'h'),                              # high_24h
+    ('low', 'low24h', 'l'),                                # low_24h
+    ('change', 'priceChange', 'priceChangePercent'),       # change_24h
+)
+_TIMESTAMP_KEYS = ('timestamp', 'time', 't')
+
+TICKER_SCHEMA_CACHE_SIZE = 64  # разных форм ответа на клиента
+
+
+def _to_decimal(value: Any) -> Optional[Decimal]:
+    """Decimal из значения API (строки и целые - без промежуточного str())"""
+    try:
+        return Decimal(value) if type(value) in (str, int) else Decimal(str(value))
+    except Exception:
+        return None
+
+
+def _first_decimal(data: Dict, keys: Tuple[str, ...]) -> Optional[Decimal]:
+    """Первое непустое и разбираемое значение среди ключей keys (все есть в data)"""
+    for key in keys:
+        raw = data[key]
+        if raw is not None:
+            value = _to_decimal(raw)
+            if value is not None:
+                return value
+    return None
+
+
+def _values_getter(keys: Tuple[str, ...]) -> Callable[[Dict], Tuple]:
+    """itemgetter по ключам keys, всегда возвращающий кортеж"""
+    if not keys:
+        return lambda data: ()
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda data: (data[key],)
+    return itemgetter(*keys)
+
+
+def _to_timestamp(value: Any) -> Optional[datetime]:
+    if isinstance(value, int):
+        # Миллисекунды или секунды
+        return datetime.fromtimestamp(value / 1000 if value > 10**10 else value)
+    if isinstance(value, str):
+        return datetime.fromisoformat(value.replace('Z', '+00:00'))
+    return None
+
+
+def _cached_timestamp(value: Any, timestamps: Optional[Dict]) -> Optional[datetime]:
+    """Метка времени; в пачке одинаковые значения разбираются один раз"""
+    if timestamps is None:
+        return _to_timestamp(value)
+    timestamp = timestamps.get(value)
+    if timestamp is None:
+        timestamp = timestamps[value] = _to_timestamp(value)
+    return timestamp
+
+
+class TickerSchema:
+    """
+    Разбор тикеров одной формы (одного набора ключей)
+    
+    Какие из вариантов ключей есть в тикере, определяется один раз при
+    создании схемы: для каждого поля запоминаются только присутствующие
+    ключи в порядке приоритета, и разбор не перебирает остальные псевдонимы.
+    Схема применима только к словарям с тем же набором ключей (keys).
+    """
+    
+    __slots__ = ('keys', 'symbol_keys', 'field_keys', 'timestamp_keys',
+                 '_single_key_fields', '_single_key_values', '_multi_key_fields')
+    
+    def __init__(self, keys: Tuple[str, ...]):
+        present = set(keys)
+        self.keys = keys
+        self.symbol_keys = tuple(k for k in _SYMBOL_KEYS if k in present)
+        self.field_keys = tuple(
+            tuple(k for k in aliases if k in present) for aliases in _DECIMAL_FIELD_KEYS
+        )
+        self.timestamp_keys = tuple(k for k in _TIMESTAMP_KEYS if k in present)
+        # Поля этой формы: с единственным ключом (частый случай, значения берутся
+        # одним itemgetter) и с несколькими вариантами
+        single = [(n, aliases[0]) for n, aliases in enumerate(self.field_keys) if len(aliases) == 1]
+        self._single_key_fields = tuple(n for n, _ in single)
+        self._single_key_values = _values_getter(tuple(key for _, key in single))
+        self._multi_key_fields = tuple(
+            (n, aliases) for n, aliases in enumerate(self.field_keys) if len(aliases) > 1
+        )
+    
+    def parse(
+        self,
+        data: Dict,
+        symbol: Optional[str] = None,
+        now: Optional[datetime] = None,
+        timestamps: Optional[Dict] = None
+    ) -> Optional[GrinexTicker]:
+        """
+        Тикер из словаря этой формы (некорректные значения полей - None)
+        
+        symbol - символ снаружи (ответ-словарь {symbol: {...}});
+        timestamps - общий на пачку кэш разобранных меток времени.
+        """
+        if symbol is None:
+            for key in self.symbol_keys:
+                symbol = data[key]
+                if symbol:
+                    break
+            if not symbol:
+                return None
+        
+        values: List[Optional[Decimal]] = [None] * len(_DECIMAL_FIELD_KEYS)
+        for n, raw in zip(self._single_key_fields, self._single_key_values(data)):
+            if raw is not None:
+                # То же, что _to_decimal, без вызова функции на каждое поле
+                try:
+                    values[n] = Decimal(raw) if type(raw) is str else Decimal(str(raw))
+                except Exception:
+                    pass
+        for n, keys in self._multi_key_fields:
+            values[n] = _first_decimal(data, keys)
+        
+        timestamp = None
+        for key in self.timestamp_keys:
+            if data[key]:
+                timestamp = _cached_timestamp(data[key], timestamps)
+                break
+        
+        return GrinexTicker(symbol, *values, timestamp=timestamp or now or datetime.now())
+
+
 class GrinexClient:
     """Клиент для работы с Grinex API"""
     
@@ -56,58 +204,76 @@ class GrinexClient:
             last_update=datetime.now()
         )
         self._fallback_tickers: Dict[str, GrinexTicker] = {}
+        self._ticker_schemas: Dict[Tuple[str, ...], TickerSchema] = {}
+        # Пары, на которые биржа ответила 404/410: символ -> monotonic-время повторной попытки
+        self._missing_tickers: Dict[str, float] = {}
     
     async def _make_request(
         self, 
         endpoint: str, 
         params: Optional[Dict] = None,
-        retries: int = 0
+        deadline: Optional[float] = None
+    ) -> Tuple[Dict, float]:
+        """
+        Выполняет HTTP-запрос по политике вызовов Grinex
+        
+        Одинаковые одновременные запросы объединяются; повторы, hedging и
+        circuit breaker - в CallPolicy, общая длительность ограничена deadline.
+        """
+        return await get_call_policy("grinex", max_attempts=GRINEX_MAX_RETRIES + 1).call(
+            lambda: self._do_request(endpoint, params),
+            deadline=deadline,
+            key=flight_key("grinex", endpoint, params)
+        )
+    
+    async def _do_request(
+        self, 
+        endpoint: str, 
+        params: Optional[Dict] = None
     ) -> Tuple[Dict, float]:
-        """Выполняет HTTP-запрос с retry логикой"""
+        """Одна попытка HTTP-запроса с обновлением health"""
         url = f"{GRINEX_API_BASE}{endpoint}"
         start_time = asyncio.get_event_loop().time()
         
         try:
-            async with httpx.AsyncClient(timeout=GRINEX_TIMEOUT) as client:
-                response = await client.get(url, params=params)
-                latency_ms = (asyncio.get_event_loop().time() - start_time) * 1000
-                
-                response.raise_for_status()
-                
-                # Обновляем health статус
-                self.health.latency_ms = latency_ms
-                self.health.http_code = response.status_code
-                self.health.is_available = True
-                self.health.last_update = datetime.now()
-                self.health.error_count = 0
-                self.health.last_error = None
-                
-                return response.json(), latency_ms
-                
-        except Exception as e:
+            client = get_http_client(url, timeout=GRINEX_TIMEOUT)
+            response = await client.get(url, params=params, timeout=GRINEX_TIMEOUT)
             latency_ms = (asyncio.get_event_loop().time() - start_time) * 1000
-            error_msg = str(e)
             
-            self.health.error_count += 1
-            self.health.last_error = error_msg
+            response.raise_for_status()
+            
+            # Обновляем health статус
+            self.health.latency_ms = latency_ms
+            self.health.http_code = response.status_code
+            self.health.is_available = True
             self.health.last_update = datetime.now()
-            self.health.is_available = False
+            self.health.error_count = 0
+            self.health.last_error = None
             
-            if retries < GRINEX_MAX_RETRIES:
-                # Экспоненциальная пауза: 1s, 2s, 4s
-                delay = 2 ** retries
-                logger.warning(f"Grinex API retry {retries + 1}/{GRINEX_MAX_RETRIES} after {delay}s: {error_msg}")
-                await asyncio.sleep(delay)
-                return await self._make_request(endpoint, params, retries + 1)
+            return response_json(response), latency_ms
             
-            logger.error(f"Grinex API request failed after {retries} retries: {error_msg}")
+        except Exception as e:
+            self.health.error_count += 1
+            self.health.last_error = str(e)
+            self.health.last_update = datetime.now()
+            self.health.is_available = False
             raise
     
-    async def get_ticker(self, symbol: str) -> Optional[GrinexTicker]:
-        """Получает тикер для конкретной пары"""
+    async def get_ticker(self, symbol: str, deadline: Optional[float] = None) -> Optional[GrinexTicker]:
+        """
+        Получает тикер для конкретной пары (при ошибке или открытом breaker - последний известный)
+        
+        После 404/410 пара не запрашивается GRINEX_MISSING_TICKER_TTL секунд.
+        """
+        retry_at = self._missing_tickers.get(symbol)
+        if retry_at is not None:
+            if time.monotonic() < retry_at:
+                return self._fallback_tickers.get(symbol)
+            del self._missing_tickers[symbol]
+        
         try:
             # Стандартный эндпоинт для тикеров (может отличаться)
-            data, _ = await self._make_request(f"/api/v1/ticker/{symbol}")
+            data, _ = await self._make_request(f"/api/v1/ticker/{symbol}", deadline=deadline)
             
             ticker = self._parse_ticker(data)
             if ticker:
@@ -115,32 +281,35 @@ class GrinexClient:
             
             return ticker
             
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in (404, 410):
+                self._missing_tickers[symbol] = time.monotonic() + GRINEX_MISSING_TICKER_TTL
+                logger.warning(
+                    f"Grinex ticker {symbol} not found (HTTP {e.response.status_code}), "
+                    f"skipping for {GRINEX_MISSING_TICKER_TTL:.0f}s"
+                )
+            else:
+                logger.error(f"Failed to get ticker for {symbol}: {e}")
+            return self._fallback_tickers.get(symbol)
         except Exception as e:
             logger.error(f"Failed to get ticker for {symbol}: {e}")
             # Возвращаем fallback если есть
             return self._fallback_tickers.get(symbol)
     
-    async def get_all_tickers(self) -> Dict[str, GrinexTicker]:
+    async def get_all_tickers(self, deadline: Optional[float] = None) -> Dict[str, GrinexTicker]:
         """Получает все тикеры одним запросом"""
         try:
             # Bulk endpoint для всех тикеров
-            data, _ = await self._make_request("/api/v1/tickers")
+            data, _ = await self._make_request("/api/v1/tickers", deadline=deadline)
             
-            tickers = {}
             # Поддержка разных форматов ответа
             if isinstance(data, list):
-                for item in data:
-                    ticker = self._parse_ticker(item)
-                    if ticker:
-                        tickers[ticker.symbol] = ticker
+                tickers = self._parse_tickers((None, item) for item in data)
             elif isinstance(data, dict):
                 # Если ответ в виде словаря {symbol: {...}}
-                for symbol, item in data.items():
-                    if isinstance(item, dict):
-                        item['symbol'] = symbol
-                    ticker = self._parse_ticker(item)
-                    if ticker:
-                        tickers[ticker.symbol] = ticker
+                tickers = self._parse_tickers(data.items())
+            else:
+                tickers = {}
             
             # Обновляем fallback
             self._fallback_tickers.update(tickers)
@@ -166,60 +335,49 @@ class GrinexClient:
             logger.error(f"Failed to get 24h ticker for {symbol}: {e}")
             return self._fallback_tickers.get(symbol)
     
+    def _ticker_schema(self, keys: Tuple[str, ...]) -> TickerSchema:
+        """Схема разбора для набора ключей (определяется один раз на форму ответа)"""
+        schema = self._ticker_schemas.get(keys)
+        if schema is None:
+            if len(self._ticker_schemas) >= TICKER_SCHEMA_CACHE_SIZE:
+                self._ticker_schemas.clear()
+            schema = self._ticker_schemas[keys] = TickerSchema(keys)
+            logger.debug(f"Grinex ticker schema detected: {keys}")
+        return schema
+    
     def _parse_ticker(self, data: Dict) -> Optional[GrinexTicker]:
         """Парсит данные тикера из разных форматов API"""
         try:
-            # Поддержка разных форматов ключей
-            symbol = data.get('symbol') or data.get('pair') or data.get('s')
-            if not symbol:
-                return None
-            
-            # Различные варианты названий полей
-            last_price = self._extract_decimal(data, ['lastPrice', 'last', 'price', 'c', 'close'])
-            bid = self._extract_decimal(data, ['bid', 'bidPrice', 'b'])
-            ask = self._extract_decimal(data, ['ask', 'askPrice', 'a'])
-            volume_24h = self._extract_decimal(data, ['volume', 'volume24h', 'v', 'quoteVolume'])
-            high_24h = self._extract_decimal(data, ['high', 'high24h', 'h'])
-            low_24h = self._extract_decimal(data, ['low', 'low24h', 'l'])
-            change_24h = self._extract_decimal(data, ['change', 'priceChange', 'priceChangePercent'])
-            
-            # Timestamp
-            timestamp = None
-            ts_value = data.get('timestamp') or data.get('time') or data.get('t')
-            if ts_value:
-                if isinstance(ts_value, int):
-                    # Миллисекунды или секунды
-                    ts_value = ts_value / 1000 if ts_value > 10**10 else ts_value
-                    timestamp = datetime.fromtimestamp(ts_value)
-                elif isinstance(ts_value, str):
-                    timestamp = datetime.fromisoformat(ts_value.replace('Z', '+00:00'))
-            
-            return GrinexTicker(
-                symbol=symbol,
-                last_price=last_price,
-                bid=bid,
-                ask=ask,
-                volume_24h=volume_24h,
-                high_24h=high_24h,
-                low_24h=low_24h,
-                change_24h=change_24h,
-                timestamp=timestamp or datetime.now()
-            )
-            
+            return self._ticker_schema(tuple(data)).parse(data)
         except Exception as e:
             logger.error(f"Failed to parse ticker data: {e}, data: {data}")
             return None
     
-    def _extract_decimal(self, data: Dict, keys: List[str]) -> Optional[Decimal]:
-        """Извлекает Decimal значение из словаря по списку возможных ключей"""
-        for key in keys:
-            value = data.get(key)
-            if value is not None:
-                try:
-                    return Decimal(str(value))
-                except:
-                    pass
-        return None
+    def _parse_tickers(self, items: Iterable[Tuple[Optional[str], Any]]) -> Dict[str, GrinexTicker]:
+        """
+        Разбор пачки тикеров за один проход
+        
+        items - пары (символ или None, словарь тикера). Схема меняется только
+        при смене набора ключей, метки времени разбираются один раз на значение.
+        """
+        tickers = {}
+        now = datetime.now()
+        timestamps: Dict[Any, datetime] = {}
+        schema = None
+        for symbol, item in items:
+            if not isinstance(item, dict):
+                continue
+            try:
+                keys = tuple(item)
+                if schema is None or keys != schema.keys:
+                    schema = self._ticker_schema(keys)
+                ticker = schema.parse(item, symbol, now, timestamps)
+            except Exception as e:
+                logger.error(f"Failed to parse ticker data: {e}, data: {item}")
+                continue
+            if ticker:
+                tickers[ticker.symbol] = ticker
+        return tickers
     
     def get_health(self) -> GrinexHealth:
         """Возвращает статус здоровья API"""
@@ -0,0 +1,264 @@
+"""
+Шина рыночных данных: один опрос биржи на цикл, рассылка подписчикам
+
+Раньше одни и те же курсы Rapira запрашивали независимо legacy-задача
+(таблица rates), RatesScheduler и FXRatesScheduler (fx_raw_rate /
+fx_final_rate). Теперь опрос один: шина собирает символы всех подписчиков,
+запрашивает каждый (source, symbol) один раз за цикл (символы WebSocket-потока
+берутся из снапшота без запроса) и передает пакет подписчикам:
+
+- rates_table   - таблица rates (src/services/rates.py);
+- fx            - копит котировки для fx_raw_rate / fx_final_rate; пишет их
+  синхронизация FX с интервалом источника (fx_rates.py, fx_scheduler.py);
+- redis         - последние котировки в Redis-хэше market:<source> для других
+  процессов (веб-админка).
+
+In-memory снапшот и матрица цен обновляются раньше - при публикации
+котировки клиентом биржи. Ошибка подписчика не влияет на остальных.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+from src.services.rate_snapshot import get_rate_snapshot_store
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+MARKET_BUS_SYMBOLS_TTL = float(os.getenv("MARKET_BUS_SYMBOLS_TTL", 60))  # кэш списка символов подписчиков
+MARKET_BUS_REDIS_ENABLED = os.getenv("MARKET_BUS_REDIS_ENABLED", "true").lower() == "true"
+MARKET_BUS_REDIS_PREFIX = "market:"
+
+
+@dataclass
+class MarketBatch:
+    """Пакет котировок одного цикла опроса источника"""
+    source: str
+    rates: Dict[str, Dict] = field(default_factory=dict)   # symbol -> {'best_bid', 'best_ask', 'timestamp', ...}
+    errors: Dict[str, str] = field(default_factory=dict)
+    requested: List[str] = field(default_factory=list)     # символы этого цикла (опрошенные и из потока)
+    fetched_at: datetime = field(default_factory=datetime.now)
+    duration_ms: float = 0.0
+    results: Dict[str, Any] = field(default_factory=dict)  # результаты подписчиков (или исключения)
+
+
+Fetcher = Callable[[List[str]], Awaitable[Any]]           # -> BatchRatesResult
+Handler = Callable[[MarketBatch], Awaitable[Any]]
+SymbolsProvider = Callable[[], Awaitable[Dict[str, Iterable[str]]]]
+
+
+class _Subscriber:
+    __slots__ = ('name', 'handler', 'symbols', 'calls', 'errors', 'last_error', 'last_ms')
+
+    def __init__(self, name: str, handler: Handler, symbols: Optional[SymbolsProvider]):
+        self.name = name
+        self.handler = handler
+        self.symbols = symbols
+        self.calls = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.last_ms: Optional[float] = None
+
+
+class MarketDataBus:
+    """Единая точка опроса бирж с рассылкой пакетов подписчикам"""
+
+    def __init__(self):
+        self._fetchers: Dict[str, Fetcher] = {}
+        self._subscribers: Dict[str, _Subscriber] = {}
+        self._symbols: Dict[str, List[str]] = {}
+        self._symbols_at: Optional[float] = None
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def register_source(self, source: str, fetcher: Fetcher):
+        """Регистрирует функцию пакетного запроса котировок источника"""
+        self._fetchers[source] = fetcher
+        self._locks.setdefault(source, asyncio.Lock())
+        self._stats.setdefault(source, {'cycles': 0, 'fetched': 0, 'from_stream': 0, 'errors': 0})
+
+    def feeds(self, source: str) -> bool:
+        """Опрашивает ли шина этот источник"""
+        return source in self._fetchers
+
+    def subscribe(self, name: str, handler: Handler, symbols: Optional[SymbolsProvider] = None):
+        """
+        Подписывает handler(batch) на пакеты
+
+        symbols() возвращает нужные подписчику символы по источникам:
+        {'rapira': ['USDT/RUB', ...]}.
+        """
+        self._subscribers[name] = _Subscriber(name, handler, symbols)
+        self._symbols_at = None
+
+    def invalidate_symbols(self):
+        """Перечитать символы подписчиков в следующем цикле (изменились пары)"""
+        self._symbols_at = None
+
+    async def symbols(self, source: str) -> List[str]:
+        """Объединение символов подписчиков и символов, запрошенных хендлерами"""
+        if self._symbols_at is None or time.monotonic() - self._symbols_at >= MARKET_BUS_SYMBOLS_TTL:
+            collected: Dict[str, List[str]] = {}
+            for subscriber in self._subscribers.values():
+                if subscriber.symbols is None:
+                    continue
+                try:
+                    provided = await subscriber.symbols()
+                except Exception as e:
+                    logger.error(f"Market bus: failed to get symbols of {subscriber.name}: {e}")
+                    # Оставляем прежний список, чтобы не потерять символы до следующей попытки
+                    provided = self._symbols
+                for src, symbols in provided.items():
+                    collected.setdefault(src, []).extend(symbols)
+            self._symbols = {src: list(dict.fromkeys(symbols)) for src, symbols in collected.items()}
+            self._symbols_at = time.monotonic()
+
+        symbols = list(self._symbols.get(source, []))
+        if source == 'rapira':
+            known = set(symbols)
+            symbols += [s for s in get_rate_snapshot_store().tracked_symbols() if s not in known]
+        return symbols
+
+    async def poll(self, source: str, schedule=None, symbols: Optional[List[str]] = None) -> Optional[MarketBatch]:
+        """
+        Один цикл опроса источника
+
+        Args:
+            source: код источника
+            schedule: PollSchedule - запрашиваются только символы с подошедшим сроком
+            symbols: явный список символов (по умолчанию - все символы подписчиков)
+
+        Returns:
+            Пакет или None, если опрашивать было нечего
+        """
+        fetcher = self._fetchers.get(source)
+        if fetcher is None:
+            raise ValueError(f"Market bus: unknown source {source}")
+
+        async with self._locks[source]:
+            if symbols is None:
+                symbols = await self.symbols(source)
+            if schedule is not None:
+                symbols = schedule.due(symbols)
+            if not symbols:
+                return None
+
+            started = time.monotonic()
+            batch = MarketBatch(source=source, requested=list(symbols))
+
+            # Символы WebSocket-потока берем из снапшота без запроса
+            from src.services.market_stream import get_market_stream
+            stream = get_market_stream(source)
+            live = [s for s in symbols if stream and stream.is_live(s)]
+            store = get_rate_snapshot_store()
+            for symbol in live:
+                quote = store.get(symbol, source=source)
+                if quote:
+                    batch.rates[symbol] = quote.as_dict()
+
+            to_fetch = [s for s in symbols if s not in batch.rates]
+            if to_fetch:
+                result = await fetcher(to_fetch)
+                batch.rates.update(result.rates)
+                batch.errors.update(result.errors)
+
+            # Срок сдвигаем только символам с котировкой: неудачные опрашиваются в следующем цикле
+            if schedule is not None:
+                schedule.mark_polled([s for s in symbols if s in batch.rates])
+
+            batch.duration_ms = (time.monotonic() - started) * 1000
+            stats = self._stats[source]
+            stats['cycles'] += 1
+            stats['fetched'] += len(to_fetch)
+            stats['from_stream'] += len(symbols) - len(to_fetch)
+            stats['errors'] += len(batch.errors)
+
+        batch.results = await self.publish(batch)
+        return batch
+
+    async def publish(self, batch: MarketBatch) -> Dict[str, Any]:
+        """Передает пакет всем подписчикам параллельно; возвращает их результаты"""
+        subscribers = list(self._subscribers.values())
+        results = await asyncio.gather(
+            *(self._deliver(subscriber, batch) for subscriber in subscribers),
+            return_exceptions=True
+        )
+        return {subscriber.name: result for subscriber, result in zip(subscribers, results)}
+
+    async def _deliver(self, subscriber: _Subscriber, batch: MarketBatch) -> Any:
+        started = time.monotonic()
+        subscriber.calls += 1
+        try:
+            return await subscriber.handler(batch)
+        except Exception as e:
+            subscriber.errors += 1
+            subscriber.last_error = str(e)
+            logger.error(f"Market bus subscriber {subscriber.name} failed on {batch.source}: {e}")
+            raise
+        finally:
+            subscriber.last_ms = (time.monotonic() - started) * 1000
+
+    def get_stats(self) -> Dict:
+        """Статистика для мониторинга"""
+        return {
+            'sources': {source: dict(stats) for source, stats in self._stats.items()},
+            'symbols': {source: len(symbols) for source, symbols in self._symbols.items()},
+            'subscribers': {
+                s.name: {
+                    'calls': s.calls,
+                    'errors': s.errors,
+                    'last_error': s.last_error,
+                    'last_ms': round(s.last_ms, 1) if s.last_ms is not None else None,
+                }
+                for s in self._subscribers.values()
+            },
+        }
+
+
+# ----------------------------------------------------------------------
+# Источники и подписчики по умолчанию
+# ----------------------------------------------------------------------
+
+async def _fetch_rapira(symbols: List[str]):
+    from src.services.rapira_simple import get_rapira_simple_client
+    client = await get_rapira_simple_client()
+    return await client.get_multiple_rates_detailed(symbols)
+
+
+async def publish_to_redis(batch: MarketBatch) -> int:
+    """Последние котировки пакета в хэш market:<source> (одна команда на пакет)"""
+    if not batch.rates:
+        return 0
+    from src.utils.redis_client import get_redis, pack
+    mapping = {
+        symbol: pack({'bid': rate.get('best_bid'), 'ask': rate.get('best_ask'), 'timestamp': rate.get('timestamp')})
+        for symbol, rate in batch.rates.items()
+    }
+    await get_redis().hset(f"{MARKET_BUS_REDIS_PREFIX}{batch.source}", mapping=mapping)
+    return len(mapping)
+
+
+# Глобальный экземпляр
+_market_data_bus: Optional[MarketDataBus] = None
+
+
+def get_market_data_bus() -> MarketDataBus:
+    """Получает глобальную шину (Rapira и стандартные подписчики регистрируются при создании)"""
+    global _market_data_bus
+    if _market_data_bus is None:
+        from src.services.rates import write_rates_table, rates_table_symbols
+        from src.services.fx_rates import ingest_market_batch, fx_market_symbols
+
+        bus = MarketDataBus()
+        bus.register_source('rapira', _fetch_rapira)
+        bus.subscribe('rates_table', write_rates_table, rates_table_symbols)
+        bus.subscribe('fx', ingest_market_batch, fx_market_symbols)
+        if MARKET_BUS_REDIS_ENABLED:
+            bus.subscribe('redis', publish_to_redis)
+        _market_data_bus = bus
+    return _market_data_bus
@@ -0,0 +1,380 @@
+"""
+Потоковое получение рыночных данных через WebSocket биржи
+
+MarketStream держит живой стакан по каждому символу из push-фида и
+публикует лучшие bid/ask в снапшот курсов. При обрыве соединения поток
+переподключается с экспоненциальной паузой и заново запрашивает снапшот
+стакана (resync), а пока потока нет - курсы берутся прежним опросом
+REST API (get_plate_mini / get_all_tickers).
+
+Формат сообщений конкретной биржи описывается адаптером MarketFeed.
+JsonBookFeed понимает общий формат:
+    {"type": "snapshot" | "update", "symbol": "USDT/RUB", "seq": 42,
+     "bids": [[price, qty], ...], "asks": [[price, qty], ...]}
+В update уровень с qty = 0 удаляется.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from dataclasses import dataclass, field
+from decimal import Decimal
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import websockets
+
+from src.services.order_book import OrderBook
+from src.services.rate_snapshot import get_rate_snapshot_store
+from src.utils.serialization import dumps_str, loads
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+RAPIRA_WS_URL = os.getenv("RAPIRA_WS_URL", "")  # пусто - поток выключен, только опрос
+GRINEX_WS_URL = os.getenv("GRINEX_WS_URL", "")
+MARKET_STREAM_STALE_SECONDS = float(os.getenv("MARKET_STREAM_STALE_SECONDS", 10))  # тишина = обрыв
+MARKET_STREAM_POLL_INTERVAL = float(os.getenv("MARKET_STREAM_POLL_INTERVAL", 5))  # опрос при отказе потока
+MARKET_STREAM_MAX_BACKOFF = float(os.getenv("MARKET_STREAM_MAX_BACKOFF", 30))
+
+
+@dataclass
+class BookMessage:
+    """Разобранное сообщение фида"""
+    symbol: str
+    is_snapshot: bool
+    bids: List[Tuple[float, float]] = field(default_factory=list)
+    asks: List[Tuple[float, float]] = field(default_factory=list)
+    seq: Optional[int] = None
+
+
+class LiveOrderBook:
+    """Стакан одного символа, обновляемый снапшотами и дельтами"""
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+        self.book = OrderBook(symbol)
+        self.seq: Optional[int] = None
+        self.synced = False  # получен снапшот
+        self.updated_at: float = 0.0
+
+    def apply(self, message: BookMessage) -> bool:
+        """
+        Применяет сообщение к стакану
+
+        Returns:
+            False, если обнаружен разрыв последовательности (нужен resync)
+        """
+        if message.is_snapshot:
+            self.book.apply_snapshot(message.bids, message.asks)
+            self.synced = True
+        else:
+            if not self.synced:
+                # Дельты до снапшота пропускаем - снапшот придет после подписки
+                return True
+            if message.seq is not None and self.seq is not None and message.seq != self.seq + 1:
+                return False
+            self.book.apply_delta(message.bids, message.asks)
+
+        self.seq = message.seq
+        self.updated_at = time.monotonic()
+        return True
+
+    def best_bid(self) -> Optional[float]:
+        return self.book.best_bid()
+
+    def best_ask(self) -> Optional[float]:
+        return self.book.best_ask()
+
+
+class MarketFeed(ABC):
+    """Адаптер push-фида биржи: URL, подписка и разбор сообщений"""
+
+    source = "unknown"
+
+    def __init__(self, url: str):
+        self.url = url
+
+    @abstractmethod
+    def subscribe_messages(self, symbols: Iterable[str]) -> List[Dict]:
+        """Сообщения подписки, отправляемые после подключения"""
+
+    @abstractmethod
+    def parse(self, raw: str) -> List[BookMessage]:
+        """Разбирает сырое сообщение (служебные сообщения -> пустой список)"""
+
+
+class JsonBookFeed(MarketFeed):
+    """Фид в общем JSON-формате (см. описание модуля)"""
+
+    def __init__(self, url: str, source: str):
+        super().__init__(url)
+        self.source = source
+
+    def subscribe_messages(self, symbols: Iterable[str]) -> List[Dict]:
+        return [{"op": "subscribe", "channel": "book", "symbols": sorted(symbols)}]
+
+    def parse(self, raw: str) -> List[BookMessage]:
+        data = loads(raw)
+        if data.get("type") not in ("snapshot", "update") or not data.get("symbol"):
+            return []
+        return [BookMessage(
+            symbol=data["symbol"],
+            is_snapshot=data["type"] == "snapshot",
+            bids=[(float(p), float(q)) for p, q in data.get("bids", [])],
+            asks=[(float(p), float(q)) for p, q in data.get("asks", [])],
+            seq=data.get("seq"),
+        )]
+
+
+# Опрос REST API: возвращает {symbol: (best_bid, best_ask)}
+Poller = Callable[[List[str]], Awaitable[Dict[str, Tuple[Optional[float], Optional[float]]]]]
+
+
+class MarketStream:
+    """Живые стаканы по символам из WebSocket с fallback на опрос"""
+
+    def __init__(
+        self,
+        feed: MarketFeed,
+        symbols: Iterable[str],
+        poller: Optional[Poller] = None,
+        stale_seconds: float = MARKET_STREAM_STALE_SECONDS,
+        poll_interval: float = MARKET_STREAM_POLL_INTERVAL,
+        max_backoff: float = MARKET_STREAM_MAX_BACKOFF
+    ):
+        self.feed = feed
+        self.symbols = set(symbols)
+        self.poller = poller
+        self.stale_seconds = stale_seconds
+        self.poll_interval = poll_interval
+        self.max_backoff = max_backoff
+        self.books: Dict[str, LiveOrderBook] = {}
+        self.connected = False
+        self._task: Optional[asyncio.Task] = None
+        self._poll_task: Optional[asyncio.Task] = None
+        self._polled_symbols = 0
+        self._stats = {"messages": 0, "reconnects": 0, "resyncs": 0, "polls": 0, "poll_errors": 0}
+
+    # ------------------------------------------------------------------
+    # Жизненный цикл
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """Запускает поток и опрос символов, которые поток не обслуживает"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        self._ensure_polling()
+
+    async def stop(self):
+        """Останавливает поток и опрос"""
+        for task in (self._task, self._poll_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = None
+        self._poll_task = None
+        self.connected = False
+
+    def is_live(self, symbol: str) -> bool:
+        """Символ обновляется потоком и данные свежие"""
+        book = self.books.get(symbol)
+        return (
+            self.connected
+            and book is not None
+            and book.synced
+            and time.monotonic() - book.updated_at <= self.stale_seconds
+        )
+
+    def get_book(self, symbol: str) -> Optional[OrderBook]:
+        """Живой стакан символа (None, если поток его сейчас не обслуживает)"""
+        return self.books[symbol].book if self.is_live(symbol) else None
+
+    # ------------------------------------------------------------------
+    # WebSocket
+    # ------------------------------------------------------------------
+
+    async def _run(self):
+        """Цикл подключения: connect -> subscribe -> читаем до обрыва -> backoff"""
+        backoff = 1.0
+        while True:
+            try:
+                async with websockets.connect(self.feed.url, open_timeout=10) as ws:
+                    # Resync: после (пере)подключения стаканы строятся с нуля
+                    self.books.clear()
+                    for message in self.feed.subscribe_messages(self.symbols):
+                        await ws.send(dumps_str(message))
+                    logger.info(f"Market stream {self.feed.source} connected ({len(self.symbols)} symbols)")
+                    self.connected = True
+                    backoff = 1.0
+                    await self._read(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Market stream {self.feed.source} dropped: {e}")
+            finally:
+                if self.connected:
+                    self._stats["reconnects"] += 1
+                self.connected = False
+
+            self._ensure_polling()
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    async def _read(self, ws):
+        """Читает сообщения; тишина дольше stale_seconds считается обрывом"""
+        while True:
+            raw = await asyncio.wait_for(ws.recv(), timeout=self.stale_seconds)
+            self._stats["messages"] += 1
+            try:
+                messages = self.feed.parse(raw)
+            except Exception as e:
+                logger.error(f"Market stream {self.feed.source}: bad message {raw!r:.200}: {e}")
+                continue
+
+            for message in messages:
+                if message.symbol not in self.symbols:
+                    continue
+                book = self.books.get(message.symbol)
+                if book is None:
+                    book = self.books[message.symbol] = LiveOrderBook(message.symbol)
+                if not book.apply(message):
+                    # Пропущена дельта - переподключаемся за свежим снапшотом
+                    self._stats["resyncs"] += 1
+                    raise ConnectionError(f"sequence gap for {message.symbol}, resync")
+                if book.synced:
+                    self._publish(message.symbol, book.best_bid(), book.best_ask())
+
+    def _publish(self, symbol: str, bid: Optional[float], ask: Optional[float]):
+        if bid is None and ask is None:
+            return
+        get_rate_snapshot_store().publish(
+            symbol,
+            Decimal(str(bid)) if bid is not None else None,
+            Decimal(str(ask)) if ask is not None else None,
+            source=self.feed.source,
+        )
+
+    # ------------------------------------------------------------------
+    # Fallback на опрос REST
+    # ------------------------------------------------------------------
+
+    def _ensure_polling(self):
+        if self.poller is not None and (self._poll_task is None or self._poll_task.done()):
+            self._poll_task = asyncio.create_task(self._poll_loop())
+
+    async def _poll_loop(self):
+        """
+        Опрашивает символы, которые поток сейчас не обслуживает
+
+        Цикл не завершается, пока жив поток: символ без обновлений дольше
+        stale_seconds перестает быть живым и снова опрашивается, даже если
+        другие символы держат соединение активным.
+        """
+        while True:
+            symbols = [s for s in self.symbols if not self.is_live(s)]
+            self._polled_symbols = len(symbols)
+            if symbols:
+                try:
+                    self._stats["polls"] += 1
+                    quotes = await self.poller(symbols)
+                    for symbol, (bid, ask) in quotes.items():
+                        self._publish(symbol, bid, ask)
+                except Exception as e:
+                    self._stats["poll_errors"] += 1
+                    logger.error(f"Market stream {self.feed.source} polling failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    def get_stats(self) -> Dict:
+        """Статистика потока"""
+        return {
+            "source": self.feed.source,
+            "connected": self.connected,
+            "symbols": len(self.symbols),
+            "live_symbols": sum(1 for s in self.symbols if self.is_live(s)),
+            "polling": self._poll_task is not None and not self._poll_task.done() and self._polled_symbols > 0,
+            "polled_symbols": self._polled_symbols,
+            **self._stats,
+        }
+
+
+# ============================================================================
+# Опрос REST API как fallback
+# ============================================================================
+
+async def poll_rapira_plates(symbols: List[str]) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """Лучшие bid/ask из get_plates_mini (кэш в Redis - один пайплайн на цикл)"""
+    from src.services.rapira import get_rapira_provider
+
+    provider = await get_rapira_provider()
+    plates = await provider.get_plates_mini(symbols)
+
+    quotes = {}
+    for symbol, plate in plates.items():
+        quotes[symbol] = (
+            plate.best_bid.price if plate.best_bid else None,
+            plate.best_ask.price if plate.best_ask else None,
+        )
+    return quotes
+
+
+async def poll_grinex_tickers(symbols: List[str]) -> Dict[str, Tuple[Optional[float], Optional[float]]]:
+    """Лучшие bid/ask из get_all_tickers (один запрос на все символы)"""
+    from src.services.grinex import get_grinex_client
+
+    client = await get_grinex_client()
+    tickers = await client.get_all_tickers()
+
+    quotes = {}
+    for symbol in symbols:
+        ticker = tickers.get(symbol)
+        if ticker:
+            quotes[symbol] = (
+                float(ticker.bid) if ticker.bid is not None else None,
+                float(ticker.ask) if ticker.ask is not None else None,
+            )
+    return quotes
+
+
+# ============================================================================
+# Глобальные потоки
+# ============================================================================
+
+_streams: Dict[str, MarketStream] = {}
+
+
+def get_market_stream(source: str) -> Optional[MarketStream]:
+    """Поток источника (None, если поток не настроен)"""
+    return _streams.get(source)
+
+
+async def start_market_streams(rapira_symbols: Iterable[str] = (), grinex_symbols: Iterable[str] = ()):
+    """Запускает потоки для источников, у которых задан WebSocket URL"""
+    config = (
+        ("rapira", RAPIRA_WS_URL, rapira_symbols, poll_rapira_plates),
+        ("grinex", GRINEX_WS_URL, grinex_symbols, poll_grinex_tickers),
+    )
+    for source, url, symbols, poller in config:
+        symbols = list(symbols)
+        if not url or not symbols or source in _streams:
+            continue
+        stream = MarketStream(JsonBookFeed(url, source), symbols, poller)
+        stream.start()
+        _streams[source] = stream
+        logger.info(f"Market stream {source} started: {url}")
+
+
+async def stop_market_streams():
+    """Останавливает все потоки"""
+    for stream in list(_streams.values()):
+        await stream.stop()
+    _streams.clear()
+
+
+def get_market_streams_stats() -> Dict[str, Dict]:
+    """Статистика всех потоков"""
+    return {source: stream.get_stats() for source, stream in _streams.items()}
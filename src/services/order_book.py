@@ -0,0 +1,178 @@
+"""
+Компактный стакан в памяти
+
+Каждая сторона стакана хранится параллельными массивами цен и объемов
+(array('d')) в порядке от лучшей цены, плюс накопленные объем и оборот
+по уровням. VWAP на любую сумму считается бинарным поиском по
+накопленному объему, а не проходом по уровням. Дельты (изменение или
+удаление уровня) применяются на месте с пересчетом хвоста накоплений.
+"""
+
+from array import array
+from bisect import bisect_left
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+
+class BookLevel:
+    """Уровень стакана (создается только при обращении к отдельному уровню)"""
+    __slots__ = ('price', 'qty')
+
+    def __init__(self, price: float, qty: float):
+        self.price = price
+        self.qty = qty
+
+    def __repr__(self) -> str:
+        return f"BookLevel(price={self.price}, qty={self.qty})"
+
+
+class BookSide:
+    """
+    Одна сторона стакана
+
+    Ведет себя как последовательность уровней (len, индексы, итерация),
+    поэтому может стоять на месте списка OrderLevel в PlateMini.
+    """
+    __slots__ = ('descending', 'prices', 'qtys', 'cum_qty', 'cum_notional', '_keys')
+
+    def __init__(self, descending: bool):
+        self.descending = descending  # bids: True (лучшая - максимальная цена)
+        self.prices = array('d')
+        self.qtys = array('d')
+        self.cum_qty = array('d')
+        self.cum_notional = array('d')
+        self._keys = array('d')  # возрастающие ключи для bisect (-price для bids)
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[Tuple[float, float]], descending: bool) -> "BookSide":
+        """Строит сторону из пар (price, qty) в любом порядке"""
+        side = cls(descending)
+        levels = sorted(
+            ((float(p), float(q)) for p, q in pairs if float(q) > 0),
+            key=lambda level: level[0],
+            reverse=descending
+        )
+        for price, qty in levels:
+            side.prices.append(price)
+            side.qtys.append(qty)
+            side._keys.append(-price if descending else price)
+        side._recompute(0)
+        return side
+
+    def _recompute(self, start: int):
+        """Пересчитывает накопленные объем и оборот начиная с уровня start"""
+        del self.cum_qty[start:]
+        del self.cum_notional[start:]
+        qty_total = self.cum_qty[-1] if start else 0.0
+        notional_total = self.cum_notional[-1] if start else 0.0
+        for i in range(start, len(self.prices)):
+            qty_total += self.qtys[i]
+            notional_total += self.prices[i] * self.qtys[i]
+            self.cum_qty.append(qty_total)
+            self.cum_notional.append(notional_total)
+
+    def apply(self, price: float, qty: float):
+        """Устанавливает объем уровня (qty <= 0 - удалить уровень)"""
+        key = -price if self.descending else price
+        i = bisect_left(self._keys, key)
+        exists = i < len(self._keys) and self._keys[i] == key
+
+        if qty <= 0:
+            if not exists:
+                return
+            del self.prices[i]
+            del self.qtys[i]
+            del self._keys[i]
+        elif exists:
+            self.qtys[i] = qty
+        else:
+            self.prices.insert(i, price)
+            self.qtys.insert(i, qty)
+            self._keys.insert(i, key)
+        self._recompute(i)
+
+    def best(self) -> Optional[float]:
+        """Лучшая цена стороны"""
+        return self.prices[0] if self.prices else None
+
+    @property
+    def depth(self) -> float:
+        """Суммарный объем стороны"""
+        return self.cum_qty[-1] if self.cum_qty else 0.0
+
+    def vwap(self, amount: float) -> Optional[float]:
+        """
+        Средневзвешенная цена исполнения объема amount
+
+        Если глубины не хватает - VWAP по всей стороне. None для пустой стороны.
+        """
+        if not self.prices or amount <= 0:
+            return None
+        total = self.cum_qty[-1]
+        if amount >= total:
+            return self.cum_notional[-1] / total
+
+        # Первый уровень, на котором накопленный объем покрывает amount
+        i = bisect_left(self.cum_qty, amount)
+        qty_before = self.cum_qty[i - 1] if i else 0.0
+        notional_before = self.cum_notional[i - 1] if i else 0.0
+        return (notional_before + (amount - qty_before) * self.prices[i]) / amount
+
+    def to_pairs(self) -> List[List[float]]:
+        """[[price, qty], ...] от лучшей цены (для сериализации)"""
+        return [[p, q] for p, q in zip(self.prices, self.qtys)]
+
+    def __len__(self) -> int:
+        return len(self.prices)
+
+    def __getitem__(self, index: int) -> BookLevel:
+        return BookLevel(self.prices[index], self.qtys[index])
+
+    def __iter__(self) -> Iterator[BookLevel]:
+        for price, qty in zip(self.prices, self.qtys):
+            yield BookLevel(price, qty)
+
+
+class OrderBook:
+    """Стакан символа: bids по убыванию цены, asks по возрастанию"""
+    __slots__ = ('symbol', 'bids', 'asks')
+
+    def __init__(
+        self,
+        symbol: str,
+        bids: Iterable[Tuple[float, float]] = (),
+        asks: Iterable[Tuple[float, float]] = ()
+    ):
+        self.symbol = symbol
+        self.bids = BookSide.from_pairs(bids, descending=True)
+        self.asks = BookSide.from_pairs(asks, descending=False)
+
+    @classmethod
+    def from_levels(cls, symbol: str, bids=None, asks=None) -> "OrderBook":
+        """Строит стакан из объектов с атрибутами price/qty (OrderLevel)"""
+        return cls(
+            symbol,
+            ((level.price, level.qty) for level in bids or ()),
+            ((level.price, level.qty) for level in asks or ()),
+        )
+
+    def apply_snapshot(self, bids: Iterable[Tuple[float, float]], asks: Iterable[Tuple[float, float]]):
+        """Полностью заменяет стакан"""
+        self.bids = BookSide.from_pairs(bids, descending=True)
+        self.asks = BookSide.from_pairs(asks, descending=False)
+
+    def apply_delta(self, bids: Iterable[Tuple[float, float]] = (), asks: Iterable[Tuple[float, float]] = ()):
+        """Применяет изменения уровней (qty = 0 - удаление)"""
+        for price, qty in bids:
+            self.bids.apply(float(price), float(qty))
+        for price, qty in asks:
+            self.asks.apply(float(price), float(qty))
+
+    def best_bid(self) -> Optional[float]:
+        return self.bids.best()
+
+    def best_ask(self) -> Optional[float]:
+        return self.asks.best()
+
+    def vwap(self, is_bid: bool, amount: float) -> Optional[float]:
+        """VWAP стороны bid/ask на объем amount"""
+        return (self.bids if is_bid else self.asks).vwap(amount)
@@ -0,0 +1,335 @@
+"""
+Матрица цен город × пара × сторона
+
+Наценки городов (cities + city_pair_markups) загружаются один раз и
+перезагружаются при изменении в админке. На каждый новый базовый тик из
+снапшота курсов пересчитывается вся строка пары: финальные курсы
+покупки и продажи для всех городов одним пакетом. Хендлеры и админка
+получают готовый курс поиском по матрице, без запросов к БД и бирже.
+
+Формула: final = base * (1 + percent/100) + fixed, округление до 2 знаков
+(в целых числах, см. src/utils/fixed_point.py).
+Наценка пары в городе (city_pair_markups) перекрывает наценку города.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.services.adaptive_polling import get_adaptive_poller
+from src.services.rate_snapshot import RateQuote, RATE_SNAPSHOT_MAX_AGE, get_rate_snapshot_store
+from src.utils.fixed_point import Markup, get_markup, to_units
+
+logger = logging.getLogger(__name__)
+
+# Страховочный интервал перезагрузки наценок (основной путь - инвалидация из админки)
+PRICING_MARKUPS_TTL = float(os.getenv("PRICING_MARKUPS_TTL", 3600))
+
+# Финальные курсы городов округляются до копеек
+CITY_PRICE_DECIMALS = 2
+_CITY_PRICE_SCALE = 10 ** CITY_PRICE_DECIMALS
+
+
+@dataclass(frozen=True)
+class CityPrice:
+    """Финальный курс для города"""
+    symbol: str
+    city: str
+    city_name: str
+    operation: str          # buy | sell
+    base_rate: float
+    final_rate: float
+    markup_percent: float
+    markup_fixed: float
+    source: str
+    timestamp: datetime
+    version: int            # версия котировки в снапшоте
+
+
+class _Columns:
+    """Наценки всех городов для одной пары (столбцы матрицы)"""
+    __slots__ = ('codes', 'names', 'index', 'buy_pct', 'sell_pct', 'buy_markups', 'sell_markups', 'fixed')
+
+    def __init__(self, cities: List[Tuple[str, str, float, float, float]]):
+        self.codes = [c[0] for c in cities]
+        self.names = [c[1] for c in cities]
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.buy_pct = [c[2] for c in cities]
+        self.sell_pct = [c[3] for c in cities]
+        self.fixed = [c[4] for c in cities]
+        self.buy_markups = [get_markup(p, f, CITY_PRICE_DECIMALS) for p, f in zip(self.buy_pct, self.fixed)]
+        self.sell_markups = [get_markup(p, f, CITY_PRICE_DECIMALS) for p, f in zip(self.sell_pct, self.fixed)]
+
+
+class _Row:
+    """Строка матрицы: курсы пары по всем городам для одной котировки"""
+    __slots__ = ('quote', 'columns', 'buy', 'sell')
+
+    def __init__(self, quote: RateQuote, columns: _Columns):
+        self.quote = quote
+        self.columns = columns
+        self.buy = self._prices(quote.best_ask, columns.buy_markups)
+        self.sell = self._prices(quote.best_bid, columns.sell_markups)
+
+    @staticmethod
+    def _prices(base, markups: List[Markup]) -> Optional[List[float]]:
+        if not base:
+            return None
+        # Базовый курс приводится к целым один раз на всю строку
+        units = to_units(base)
+        return [m.apply_units(units) / _CITY_PRICE_SCALE for m in markups]
+
+
+class PricingEngine:
+    """Пересчитывает матрицу цен на каждый тик и отдает курсы поиском"""
+
+    def __init__(self, source: str = "rapira"):
+        self.source = source
+        # code -> (name, buy_pct, sell_pct, fixed), в порядке sort_order
+        self._cities: Dict[str, Tuple[str, float, float, float]] = {}
+        # symbol -> {code: (buy_pct, sell_pct, fixed)}
+        self._overrides: Dict[str, Dict[str, Tuple[float, float, float]]] = {}
+        self._columns: Dict[str, _Columns] = {}
+        self._rows: Dict[str, _Row] = {}
+        self._loaded_at: Optional[float] = None
+        self._reload_task: Optional[asyncio.Task] = None
+        self._recomputes = 0
+
+    # ------------------------------------------------------------------
+    # Наценки
+    # ------------------------------------------------------------------
+
+    async def load(self):
+        """Загружает наценки городов и пар из БД и пересчитывает матрицу"""
+        from src.db import get_pg_pool
+
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            cities = await conn.fetch("""
+                SELECT id, code, name, markup_buy, markup_sell, markup_fixed
+                FROM cities
+                WHERE enabled = true
+                ORDER BY sort_order, name
+            """)
+            pair_markups = await conn.fetch("""
+                SELECT city_id, pair_symbol, markup_buy, markup_sell, markup_fixed
+                FROM city_pair_markups
+                WHERE enabled = true
+            """)
+
+        codes = {c['id']: c['code'] for c in cities}
+        self.set_markups(
+            [
+                (c['code'], c['name'], float(c['markup_buy'] or 0),
+                 float(c['markup_sell'] or 0), float(c['markup_fixed'] or 0))
+                for c in cities
+            ],
+            [
+                (codes[pm['city_id']], pm['pair_symbol'], float(pm['markup_buy'] or 0),
+                 float(pm['markup_sell'] or 0), float(pm['markup_fixed'] or 0))
+                for pm in pair_markups
+                if pm['city_id'] in codes
+            ]
+        )
+
+    def set_markups(
+        self,
+        cities: Iterable[Tuple[str, str, float, float, float]],
+        pair_markups: Iterable[Tuple[str, str, float, float, float]] = ()
+    ):
+        """
+        Устанавливает наценки и пересчитывает всю матрицу
+
+        Args:
+            cities: (code, name, markup_buy, markup_sell, markup_fixed) в порядке показа
+            pair_markups: (city_code, pair_symbol, markup_buy, markup_sell, markup_fixed)
+        """
+        self._cities = {code: (name, buy, sell, fixed) for code, name, buy, sell, fixed in cities}
+        self._overrides = {}
+        for code, symbol, buy, sell, fixed in pair_markups:
+            self._overrides.setdefault(symbol, {})[code] = (buy, sell, fixed)
+        self._columns = {}
+        self._loaded_at = time.monotonic()
+
+        # Пересчитываем все строки по последним котировкам
+        rows = list(self._rows.values())
+        self._rows = {}
+        for row in rows:
+            self.on_tick(row.quote)
+
+        logger.info(f"Pricing matrix markups loaded: {len(self._cities)} cities, "
+                    f"{sum(len(o) for o in self._overrides.values())} pair overrides")
+
+    def invalidate(self, key: Optional[str] = None):
+        """Наценки изменились - перезагружаем в фоне"""
+        if self._reload_task is None or self._reload_task.done():
+            self._reload_task = asyncio.ensure_future(self._reload())
+
+    async def _reload(self):
+        try:
+            await self.load()
+        except Exception as e:
+            logger.error(f"Failed to reload pricing matrix markups: {e}")
+
+    def _columns_for(self, symbol: str) -> _Columns:
+        columns = self._columns.get(symbol)
+        if columns is None:
+            overrides = self._overrides.get(symbol, {})
+            columns = _Columns([
+                (code, name, *overrides.get(code, (buy, sell, fixed)))
+                for code, (name, buy, sell, fixed) in self._cities.items()
+            ])
+            self._columns[symbol] = columns
+        return columns
+
+    # ------------------------------------------------------------------
+    # Пересчет
+    # ------------------------------------------------------------------
+
+    def on_tick(self, quote: RateQuote):
+        """Подписчик снапшота: пересчитывает строку пары по новой котировке"""
+        if quote.source != self.source or self._loaded_at is None:
+            return
+        self._rows[quote.symbol] = _Row(quote, self._columns_for(quote.symbol))
+        self._recomputes += 1
+
+    # ------------------------------------------------------------------
+    # Поиск
+    # ------------------------------------------------------------------
+
+    def _fresh_row(self, symbol: str, max_age: Optional[float]) -> Optional[_Row]:
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at > PRICING_MARKUPS_TTL:
+            self.invalidate()
+        row = self._rows.get(symbol)
+        if row is None or (max_age is not None and row.quote.age > max_age):
+            return None
+        return row
+
+    def lookup(
+        self,
+        symbol: str,
+        city: str,
+        operation: str = "buy",
+        max_age: Optional[float] = RATE_SNAPSHOT_MAX_AGE
+    ) -> Optional[CityPrice]:
+        """Курс из матрицы (None - нет свежей котировки, города или стороны)"""
+        row = self._fresh_row(symbol, max_age)
+        if row is None:
+            return None
+        i = row.columns.index.get(city)
+        prices = row.buy if operation == "buy" else row.sell
+        if i is None or prices is None:
+            return None
+        return self._cell(row, i, operation, prices)
+
+    def lookup_all(
+        self,
+        symbol: str,
+        operation: str = "buy",
+        max_age: Optional[float] = RATE_SNAPSHOT_MAX_AGE
+    ) -> Optional[Dict[str, CityPrice]]:
+        """Курсы пары по всем городам в порядке показа"""
+        row = self._fresh_row(symbol, max_age)
+        if row is None:
+            return None
+        prices = row.buy if operation == "buy" else row.sell
+        if prices is None:
+            return None
+        return {code: self._cell(row, i, operation, prices) for i, code in enumerate(row.columns.codes)}
+
+    @staticmethod
+    def _cell(row: _Row, i: int, operation: str, prices: List[float]) -> CityPrice:
+        columns = row.columns
+        quote = row.quote
+        base = quote.best_ask if operation == "buy" else quote.best_bid
+        return CityPrice(
+            symbol=quote.symbol,
+            city=columns.codes[i],
+            city_name=columns.names[i],
+            operation=operation,
+            base_rate=float(base),
+            final_rate=prices[i],
+            markup_percent=columns.buy_pct[i] if operation == "buy" else columns.sell_pct[i],
+            markup_fixed=columns.fixed[i],
+            source=quote.source,
+            timestamp=quote.timestamp,
+            version=quote.version,
+        )
+
+    def markup(self, symbol: str, city: str, operation: str = "buy") -> Optional[Tuple[float, float]]:
+        """(percent, fixed) для города и пары (None - город неизвестен)"""
+        columns = self._columns_for(symbol)
+        i = columns.index.get(city)
+        if i is None:
+            return None
+        return (columns.buy_pct[i] if operation == "buy" else columns.sell_pct[i]), columns.fixed[i]
+
+    def city_name(self, city: str) -> Optional[str]:
+        entry = self._cities.get(city)
+        return entry[0] if entry else None
+
+    async def quote(self, symbol: str, city: str, operation: str = "buy") -> Optional[CityPrice]:
+        """
+        Курс из матрицы; если котировка устарела - обновляет базовый курс
+
+        Новая котировка публикуется в снапшот, и строка пересчитывается
+        подпиской до того, как мы ищем курс повторно.
+        """
+        get_adaptive_poller().record_lookup(symbol)
+        price = self.lookup(symbol, city, operation)
+        if price is not None:
+            return price
+
+        from src.services.rapira_simple import get_base_rate_snapshot
+        await get_base_rate_snapshot(symbol)
+        return self.lookup(symbol, city, operation, max_age=None)
+
+    async def quote_all(self, symbol: str, operation: str = "buy") -> Optional[Dict[str, CityPrice]]:
+        """Курсы по всем городам; обновляет базовый курс, если он устарел"""
+        get_adaptive_poller().record_lookup(symbol)
+        prices = self.lookup_all(symbol, operation)
+        if prices is not None:
+            return prices
+
+        from src.services.rapira_simple import get_base_rate_snapshot
+        await get_base_rate_snapshot(symbol)
+        return self.lookup_all(symbol, operation, max_age=None)
+
+    def get_stats(self) -> Dict:
+        """Статистика матрицы"""
+        return {
+            'cities': len(self._cities),
+            'symbols': len(self._rows),
+            'cells': sum(len(row.columns.codes) * 2 for row in self._rows.values()),
+            'recomputes': self._recomputes,
+            'markups_age_seconds': round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+        }
+
+
+# Глобальный экземпляр
+_pricing_engine: Optional[PricingEngine] = None
+_pricing_engine_lock = asyncio.Lock()
+
+
+async def get_pricing_engine() -> PricingEngine:
+    """Получает глобальную матрицу цен (при первом вызове загружает наценки)"""
+    global _pricing_engine
+    if _pricing_engine is None:
+        async with _pricing_engine_lock:
+            if _pricing_engine is None:
+                engine = PricingEngine()
+                await engine.load()
+                store = get_rate_snapshot_store()
+                store.subscribe(engine.on_tick)
+                for quote in store.quotes(engine.source):
+                    engine.on_tick(quote)
+
+                from src.utils.layered_cache import get_layered_cache, CITY_CACHE_PREFIX
+                get_layered_cache().on_invalidate(CITY_CACHE_PREFIX, engine.invalidate)
+
+                _pricing_engine = engine
+    return _pricing_engine
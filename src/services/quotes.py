@@ -0,0 +1,251 @@
+"""
+Котировки для заявок: курс фиксируется один раз на весь FSM-сценарий
+
+При выборе города выдается котировка (курс, источник, наценка, срок
+действия), подписанная HMAC и сохраненная в Redis на QUOTE_TTL_SECONDS.
+В FSM хранится только токен. Следующие шаги (возврат назад, экран
+подтверждения) показывают тот же курс без повторного расчета, а заявка
+сохраняет котировку в orders.rate_snapshot. Если срок истек к моменту
+подтверждения, клиенту показывается новый курс.
+
+При недоступности Redis токен в FSM не сохраняется: каждый шаг рассчитывает
+курс заново, а заявка подтверждается без зафиксированной котировки.
+"""
+
+import os
+import hmac
+import json
+import time
+import uuid
+import hashlib
+import logging
+from dataclasses import dataclass, asdict, field, replace
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from src.utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+QUOTE_TTL_SECONDS = int(os.getenv("QUOTE_TTL_SECONDS", 300))
+# Ключ подписи (по умолчанию - токен бота, чтобы не требовать новой переменной)
+QUOTE_SECRET = os.getenv("QUOTE_SECRET") or os.getenv("BOT_TOKEN") or "quote-secret"
+QUOTE_KEY_PREFIX = "quote:"
+
+
+class QuoteStoreError(Exception):
+    """Хранилище котировок (Redis) недоступно"""
+    pass
+
+
+@dataclass(frozen=True)
+class Quote:
+    """Зафиксированный курс для заявки"""
+    quote_id: str
+    symbol: str
+    city: str
+    operation: str
+    source: str
+    base_rate: float
+    final_rate: float
+    markup_percent: float
+    markup_fixed: float
+    issued_at: float   # unix time
+    expires_at: float  # unix time
+    # Сохранена ли котировка в Redis (не входит в подпись и снапшот)
+    stored: bool = field(default=True, compare=False, repr=False)
+
+    @property
+    def expired(self) -> bool:
+        return time.time() >= self.expires_at
+
+    @property
+    def ttl(self) -> int:
+        """Оставшийся срок действия в секундах"""
+        return max(0, int(self.expires_at - time.time()))
+
+    def matches(self, symbol: str, city: str, operation: str) -> bool:
+        return (self.symbol, self.city, self.operation) == (symbol, city, operation)
+
+    def as_snapshot(self) -> Dict:
+        """Данные для orders.rate_snapshot"""
+        return {
+            **_fields(self),
+            'issued_at': datetime.fromtimestamp(self.issued_at).isoformat(),
+            'expires_at': datetime.fromtimestamp(self.expires_at).isoformat(),
+        }
+
+
+def _fields(quote: Quote) -> Dict:
+    data = asdict(quote)
+    del data['stored']
+    return data
+
+
+def _payload(quote: Quote) -> str:
+    return json.dumps(_fields(quote), sort_keys=True, separators=(',', ':'))
+
+
+def sign_quote(quote: Quote, secret: str = QUOTE_SECRET) -> str:
+    """HMAC-SHA256 подпись котировки (hex, 32 символа)"""
+    return hmac.new(secret.encode(), _payload(quote).encode(), hashlib.sha256).hexdigest()[:32]
+
+
+class QuoteService:
+    """Выдача и проверка котировок"""
+
+    def __init__(self, ttl_seconds: int = QUOTE_TTL_SECONDS, secret: str = QUOTE_SECRET, redis=None):
+        self.ttl_seconds = ttl_seconds
+        self.secret = secret
+        self._redis = redis
+        self._stats = {'issued': 0, 'reused': 0, 'expired': 0, 'invalid': 0, 'unavailable': 0}
+
+    @property
+    def redis(self):
+        return self._redis if self._redis is not None else get_redis()
+
+    def token(self, quote: Quote) -> str:
+        """Токен для FSM: id и подпись"""
+        return f"{quote.quote_id}.{sign_quote(quote, self.secret)}"
+
+    async def issue(self, symbol: str, city: str, operation: str) -> Optional[Quote]:
+        """
+        Рассчитывает курс и выдает котировку (None - курс недоступен)
+
+        Если сохранить котировку в Redis не удалось, она возвращается
+        со stored=False: курс показывается, но токен выдавать нельзя.
+        """
+        from src.services.best_rate import get_best_city_rate
+
+        rate_info = await get_best_city_rate(symbol, city, operation)
+        if not rate_info:
+            self._stats['unavailable'] += 1
+            return None
+
+        now = time.time()
+        quote = Quote(
+            quote_id=uuid.uuid4().hex,
+            symbol=symbol,
+            city=city,
+            operation=operation,
+            source=rate_info['best_source'],
+            base_rate=float(rate_info['base_rate']),
+            final_rate=float(rate_info['final_rate']),
+            markup_percent=float(rate_info.get('markup_percent') or 0),
+            markup_fixed=float(rate_info.get('markup_fixed') or 0),
+            issued_at=now,
+            expires_at=now + self.ttl_seconds,
+        )
+        try:
+            await self.redis.set(f"{QUOTE_KEY_PREFIX}{quote.quote_id}", _payload(quote), ex=self.ttl_seconds)
+        except Exception as e:
+            logger.error(f"Failed to store quote {quote.quote_id}, rate is not fixed: {e}")
+            quote = replace(quote, stored=False)
+        self._stats['issued'] += 1
+        logger.info(
+            f"Quote {quote.quote_id}: {symbol} {operation} @ {city} = {quote.final_rate:.2f} "
+            f"({quote.source}, valid {self.ttl_seconds}s)"
+        )
+        return quote
+
+    async def get(self, token: Optional[str]) -> Optional[Quote]:
+        """
+        Действующая котировка по токену (None - нет, истекла или подпись неверна)
+
+        Raises:
+            QuoteStoreError: Redis недоступен (срок котировки неизвестен)
+        """
+        if not token or '.' not in token:
+            return None
+        quote_id, signature = token.split('.', 1)
+        try:
+            raw = await self.redis.get(f"{QUOTE_KEY_PREFIX}{quote_id}")
+        except Exception as e:
+            logger.error(f"Failed to load quote {quote_id}: {e}")
+            raise QuoteStoreError(str(e)) from e
+        if raw is None:
+            self._stats['expired'] += 1
+            return None
+
+        quote = Quote(**json.loads(raw))
+        if quote.quote_id != quote_id or not hmac.compare_digest(sign_quote(quote, self.secret), signature):
+            self._stats['invalid'] += 1
+            logger.warning(f"Quote {quote_id}: invalid signature")
+            return None
+        if quote.expired:
+            self._stats['expired'] += 1
+            return None
+        return quote
+
+    async def get_or_issue(self, token: Optional[str], symbol: str, city: str, operation: str) -> Optional[Quote]:
+        """Действующая котировка для тех же параметров или новая"""
+        try:
+            quote = await self.get(token)
+        except QuoteStoreError:
+            quote = None
+        if quote and quote.matches(symbol, city, operation):
+            self._stats['reused'] += 1
+            return quote
+        return await self.issue(symbol, city, operation)
+
+    def get_stats(self) -> Dict:
+        """Статистика для мониторинга"""
+        return {**self._stats, 'ttl_seconds': self.ttl_seconds}
+
+
+# ----------------------------------------------------------------------
+# FSM-сценарии заявок
+# ----------------------------------------------------------------------
+
+async def get_flow_quote(state, symbol: str, city: str, operation: str) -> Optional[Quote]:
+    """
+    Котировка сценария: из FSM (если действует) или новая
+
+    Токен сохраняется в FSM только для котировки, записанной в Redis, иначе
+    подтверждение не смогло бы отличить сбой Redis от истекшего курса.
+    """
+    data = await state.get_data()
+    service = get_quote_service()
+    quote = await service.get_or_issue(data.get('quote_token'), symbol, city, operation)
+    token = service.token(quote) if quote and quote.stored else None
+    if token != data.get('quote_token'):
+        await state.update_data(quote_token=token)
+    return quote
+
+
+async def confirm_flow_quote(state) -> Tuple[Optional[Quote], bool]:
+    """
+    Котировка для сохранения заявки
+
+    Returns:
+        (quote, expired): expired=True - котировка была, но истекла, и клиенту
+        нужно показать новый курс перед подтверждением. При сбое Redis
+        возвращается (None, False): заявка подтверждается без котировки.
+    """
+    token = (await state.get_data()).get('quote_token')
+    if not token:
+        return None, False
+    try:
+        quote = await get_quote_service().get(token)
+    except QuoteStoreError:
+        logger.warning("Quote store unavailable, confirming order without fixed rate")
+        return None, False
+    return quote, quote is None
+
+
+def rate_snapshot_json(quote: Optional[Quote]) -> Optional[str]:
+    """Значение для orders.rate_snapshot (JSONB)"""
+    return json.dumps(quote.as_snapshot()) if quote else None
+
+
+# Глобальный экземпляр
+_quote_service: Optional[QuoteService] = None
+
+
+def get_quote_service() -> QuoteService:
+    """Получает глобальный сервис котировок"""
+    global _quote_service
+    if _quote_service is None:
+        _quote_service = QuoteService()
+    return _quote_service
@@ -1,21 +1,25 @@
 import os
 import httpx
 import asyncio
-import json
-import redis.asyncio as aioredis
 import logging
-from typing import Dict, List, Optional, Tuple, Union
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 from dataclasses import dataclass
 from datetime import datetime, timedelta
 from enum import Enum
 from src.db import get_pg_pool
+from src.services.order_book import OrderBook
+from src.services.rapira_simple import RAPIRA_RATE_LIMIT_RPS, RAPIRA_RATE_LIMIT_BURST
+from src.utils.http_client import get_http_client
+from src.utils.rate_limiter import get_host_bucket
+from src.utils.call_policy import get_call_policy
+from src.utils.single_flight import flight_key
+from src.utils.redis_client import get_redis, pack, unpack, set_many
+from src.utils.serialization import response_json
 
 # Конфигурация
 RAPIRA_API_BASE = os.getenv("RAPIRA_API_BASE", "https://api.rapira.net")
 RAPIRA_PLATE_MINI_URL = f"{RAPIRA_API_BASE}/market/exchange-plate-mini"
 RAPIRA_RATES_URL = f"{RAPIRA_API_BASE}/open/market/rates"
-REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 ADMIN_IDS = [int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x]
 
 # Настройки
@@ -42,11 +46,37 @@ class PlateMini:
     ts: str  # ISO8601
     best_bid: Optional[OrderLevel] = None
     best_ask: Optional[OrderLevel] = None
-    bids: Optional[List[OrderLevel]] = None
-    asks: Optional[List[OrderLevel]] = None
+    bids: Optional[Sequence[OrderLevel]] = None  # список OrderLevel или BookSide
+    asks: Optional[Sequence[OrderLevel]] = None
     last_price: Optional[float] = None
     last_qty: Optional[float] = None
     last_ts: Optional[str] = None
+    book: Optional[OrderBook] = None  # компактный стакан для VWAP (строится при первом расчете)
+
+
+def _level_pairs(levels) -> List[Tuple[float, float]]:
+    """Уровни стакана в пары (price, qty): из {"price", "qty"} или [price, qty]"""
+    return [
+        (level["price"], level["qty"]) if isinstance(level, dict) else (level[0], level[1])
+        for level in levels or []
+    ]
+
+
+def _plate_from_cache(data: Dict) -> "PlateMini":
+    """Восстанавливает PlateMini из кэша Redis"""
+    book = OrderBook(data["symbol"], _level_pairs(data.get("bids")), _level_pairs(data.get("asks")))
+    return PlateMini(
+        symbol=data["symbol"],
+        ts=data["ts"],
+        best_bid=OrderLevel(**data["best_bid"]) if data.get("best_bid") else None,
+        best_ask=OrderLevel(**data["best_ask"]) if data.get("best_ask") else None,
+        bids=book.bids,
+        asks=book.asks,
+        last_price=data.get("last_price"),
+        last_qty=data.get("last_qty"),
+        last_ts=data.get("last_ts"),
+        book=book
+    )
 
 @dataclass
 class ProviderHealth:
@@ -65,82 +95,95 @@ class RapiraProvider:
             is_fresh=True,
             last_update=datetime.now()
         )
-        self._redis_pool = None
         self._fallback_rates = {}
+        # Общий с RapiraSimpleClient token bucket хоста: лимит действует на весь трафик к Rapira
+        self._bucket = get_host_bucket(RAPIRA_API_BASE, RAPIRA_RATE_LIMIT_RPS, RAPIRA_RATE_LIMIT_BURST)
     
     async def get_redis(self):
-        if not self._redis_pool:
-            self._redis_pool = aioredis.Redis(
-                host=REDIS_HOST,
-                port=REDIS_PORT,
-                decode_responses=True
-            )
-        return self._redis_pool
+        """Общий Redis-клиент приложения (src/utils/redis_client.py)"""
+        return get_redis()
     
     async def close(self):
-        if self._redis_pool:
-            await self._redis_pool.close()
-            self._redis_pool = None
+        """Собственных соединений нет: общий клиент закрывает close_redis()"""
     
-    async def _make_request(self, url: str, params: Optional[Dict] = None, retries: int = 0) -> Tuple[Dict, float]:
-        """Выполняет HTTP-запрос с retry логикой и измерением latency"""
+    async def _make_request(
+        self,
+        url: str,
+        params: Optional[Dict] = None,
+        deadline: Optional[float] = None
+    ) -> Tuple[Dict, float]:
+        """
+        Выполняет HTTP-запрос по политике вызовов Rapira
+        
+        Одинаковые одновременные запросы объединяются; повторы, hedging и
+        circuit breaker - в CallPolicy, общая длительность ограничена deadline.
+        """
+        return await get_call_policy("rapira", max_attempts=MAX_RETRIES + 1).call(
+            lambda: self._do_request(url, params),
+            deadline=deadline,
+            key=flight_key("rapira", url, params)
+        )
+    
+    async def _do_request(self, url: str, params: Optional[Dict] = None) -> Tuple[Dict, float]:
+        """Одна попытка HTTP-запроса с измерением latency (ожидание token bucket не входит)"""
+        await self._bucket.acquire()
         start_time = asyncio.get_event_loop().time()
         
         try:
-            async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
-                response = await client.get(url, params=params)
-                latency = (asyncio.get_event_loop().time() - start_time) * 1000  # в миллисекундах
-                
-                if response.status_code >= 400:
-                    raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=None, response=response)
-                
-                self.health.latency = latency
-                self.health.http_code = response.status_code
-                self.health.last_update = datetime.now()
-                self.health.error_count = 0
-                self.health.last_error = None
-                
-                return response.json(), latency
-                
-        except Exception as e:
-            latency = (asyncio.get_event_loop().time() - start_time) * 1000
-            error_msg = str(e)
+            client = get_http_client(url, timeout=REQUEST_TIMEOUT)
+            response = await client.get(url, params=params, timeout=REQUEST_TIMEOUT)
+            latency = (asyncio.get_event_loop().time() - start_time) * 1000  # в миллисекундах
             
-            self.health.error_count += 1
-            self.health.last_error = error_msg
+            if response.status_code >= 400:
+                raise httpx.HTTPStatusError(f"HTTP {response.status_code}", request=response.request, response=response)
+            
+            self.health.latency = latency
+            self.health.http_code = response.status_code
             self.health.last_update = datetime.now()
+            self.health.error_count = 0
+            self.health.last_error = None
             
-            if retries < MAX_RETRIES and isinstance(e, (httpx.TimeoutException, httpx.HTTPStatusError)):
-                # Экспоненциальная пауза
-                delay = (2 ** retries) * 0.5
-                logger.warning(f"Rapira API retry {retries + 1}/{MAX_RETRIES} after {delay}s: {error_msg}")
-                await asyncio.sleep(delay)
-                return await self._make_request(url, params, retries + 1)
+            return response_json(response), latency
             
-            logger.error(f"Rapira API request failed after {retries} retries: {error_msg}")
+        except Exception as e:
+            self.health.error_count += 1
+            self.health.last_error = str(e)
+            self.health.last_update = datetime.now()
             raise
     
-    async def get_plate_mini(self, symbol: str) -> Optional[PlateMini]:
-        """Получает мини-стакан по паре"""
+    async def get_plate_mini(
+        self,
+        symbol: str,
+        deadline: Optional[float] = None,
+        cache: bool = True
+    ) -> Optional[PlateMini]:
+        """
+        Получает мини-стакан по паре (при ошибке или открытом breaker - из кэша)
+        
+        cache=False - не писать в Redis (пачку кэширует get_plates_mini)
+        """
         try:
             params = {"symbol": symbol}
-            data, _ = await self._make_request(RAPIRA_PLATE_MINI_URL, params)
+            data, _ = await self._make_request(RAPIRA_PLATE_MINI_URL, params, deadline=deadline)
             
-            # Парсим ответ
+            # Парсим ответ: уровни сразу в компактный стакан, без объекта на уровень
+            book = OrderBook(symbol, _level_pairs(data.get("bids")), _level_pairs(data.get("asks")))
             plate = PlateMini(
                 symbol=symbol,
                 ts=data.get("ts", datetime.now().isoformat()),
                 best_bid=OrderLevel(**data["bestBid"]) if data.get("bestBid") else None,
                 best_ask=OrderLevel(**data["bestAsk"]) if data.get("bestAsk") else None,
-                bids=[OrderLevel(**bid) for bid in data.get("bids", [])],
-                asks=[OrderLevel(**ask) for ask in data.get("asks", [])],
+                bids=book.bids,
+                asks=book.asks,
                 last_price=data.get("lastPrice"),
                 last_qty=data.get("lastQty"),
-                last_ts=data.get("lastTs")
+                last_ts=data.get("lastTs"),
+                book=book
             )
             
             # Кэшируем
-            await self._cache_plate_mini(symbol, plate)
+            if cache:
+                await self._cache_plate_mini(symbol, plate)
             return plate
             
         except Exception as e:
@@ -148,6 +191,23 @@ class RapiraProvider:
             # Fallback на кэш или rates endpoint
             return await self._get_fallback_plate(symbol)
     
+    async def get_plates_mini(self, symbols: List[str]) -> Dict[str, PlateMini]:
+        """
+        Мини-стаканы по нескольким парам: запросы параллельно, кэш - одним пайплайном
+        
+        Пары без данных в результат не попадают.
+        """
+        plates = await asyncio.gather(
+            *(self.get_plate_mini(symbol, cache=False) for symbol in symbols),
+            return_exceptions=True
+        )
+        result = {
+            symbol: plate for symbol, plate in zip(symbols, plates)
+            if plate is not None and not isinstance(plate, BaseException)
+        }
+        await self._cache_plates(result.values())
+        return result
+    
     async def get_rates(self) -> Dict[str, float]:
         """Получает сводные курсы по всем парам (fallback источник)"""
         try:
@@ -176,28 +236,15 @@ class RapiraProvider:
             # Fallback на top-of-book
             return self._get_top_of_book(plate, side)
         
-        levels = plate.asks if side == Side.ASK else plate.bids
-        if not levels:
-            return self._get_top_of_book(plate, side)
-        
-        # Сортируем уровни (asks - по возрастанию, bids - по убыванию)
-        sorted_levels = sorted(levels, key=lambda x: x.price, reverse=(side == Side.BID))
+        # Стакан строится один раз на plate, дальше VWAP - бинарный поиск
+        if plate.book is None:
+            plate.book = OrderBook.from_levels(plate.symbol, plate.bids, plate.asks)
         
-        total_qty = 0.0
-        weighted_sum = 0.0
-        
-        for level in sorted_levels:
-            if total_qty >= amount_usd:
-                break
-            
-            qty_to_use = min(level.qty, amount_usd - total_qty)
-            weighted_sum += level.price * qty_to_use
-            total_qty += qty_to_use
-        
-        if total_qty == 0:
+        vwap = plate.book.vwap(side == Side.BID, amount_usd)
+        if vwap is None:
             return self._get_top_of_book(plate, side)
         
-        return weighted_sum / total_qty
+        return vwap
     
     def _get_top_of_book(self, plate: PlateMini, side: Side) -> float:
         """Получает top-of-book цену"""
@@ -210,33 +257,45 @@ class RapiraProvider:
         else:
             raise ValueError(f"No price available for {plate.symbol} {side.value}")
     
+    @staticmethod
+    def _plate_cache_data(plate: PlateMini) -> Dict:
+        """Данные plate mini для кэша Redis"""
+        book = plate.book or OrderBook.from_levels(plate.symbol, plate.bids, plate.asks)
+        return {
+            "symbol": plate.symbol,
+            "ts": plate.ts,
+            "best_bid": {"price": plate.best_bid.price, "qty": plate.best_bid.qty} if plate.best_bid else None,
+            "best_ask": {"price": plate.best_ask.price, "qty": plate.best_ask.qty} if plate.best_ask else None,
+            # Уровни компактно: [[price, qty], ...]
+            "bids": book.bids.to_pairs(),
+            "asks": book.asks.to_pairs(),
+            "last_price": plate.last_price,
+            "last_qty": plate.last_qty,
+            "last_ts": plate.last_ts
+        }
+    
     async def _cache_plate_mini(self, symbol: str, plate: PlateMini):
         """Кэширует plate mini в Redis"""
         try:
             redis = await self.get_redis()
-            key = f"rapira:plate:{symbol}"
-            data = {
-                "symbol": plate.symbol,
-                "ts": plate.ts,
-                "best_bid": {"price": plate.best_bid.price, "qty": plate.best_bid.qty} if plate.best_bid else None,
-                "best_ask": {"price": plate.best_ask.price, "qty": plate.best_ask.qty} if plate.best_ask else None,
-                "bids": [{"price": b.price, "qty": b.qty} for b in (plate.bids or [])],
-                "asks": [{"price": a.price, "qty": a.qty} for a in (plate.asks or [])],
-                "last_price": plate.last_price,
-                "last_qty": plate.last_qty,
-                "last_ts": plate.last_ts
-            }
-            await redis.set(key, json.dumps(data), ex=CACHE_TTL)
+            await redis.set(f"rapira:plate:{symbol}", pack(self._plate_cache_data(plate)), ex=CACHE_TTL)
         except Exception as e:
             logger.error(f"Failed to cache plate mini: {e}")
     
+    async def _cache_plates(self, plates):
+        """Кэширует пачку plate mini за один round-trip"""
+        try:
+            await set_many(
+                {f"rapira:plate:{plate.symbol}": self._plate_cache_data(plate) for plate in plates},
+                ttl=CACHE_TTL
+            )
+        except Exception as e:
+            logger.error(f"Failed to cache plates: {e}")
+    
     async def _cache_rates(self, rates: Dict[str, float]):
-        """Кэширует rates в Redis"""
+        """Кэширует rates в Redis (один пайплайн на все пары)"""
         try:
-            redis = await self.get_redis()
-            for symbol, rate in rates.items():
-                key = f"rapira:rate:{symbol}"
-                await redis.set(key, str(rate), ex=CACHE_TTL)
+            await set_many({f"rapira:rate:{symbol}": rate for symbol, rate in rates.items()}, ttl=CACHE_TTL)
         except Exception as e:
             logger.error(f"Failed to cache rates: {e}")
     
@@ -249,18 +308,7 @@ class RapiraProvider:
             cached = await redis.get(key)
             
             if cached:
-                data = json.loads(cached)
-                return PlateMini(
-                    symbol=data["symbol"],
-                    ts=data["ts"],
-                    best_bid=OrderLevel(**data["best_bid"]) if data.get("best_bid") else None,
-                    best_ask=OrderLevel(**data["best_ask"]) if data.get("best_ask") else None,
-                    bids=[OrderLevel(**b) for b in data.get("bids", [])],
-                    asks=[OrderLevel(**a) for a in data.get("asks", [])],
-                    last_price=data.get("last_price"),
-                    last_qty=data.get("last_qty"),
-                    last_ts=data.get("last_ts")
-                )
+                return _plate_from_cache(unpack(cached))
             
             # Fallback на rates endpoint
             rates = await self.get_rates()
@@ -284,24 +332,14 @@ class RapiraProvider:
             cached = await redis.get(key)
             
             if cached:
-                data = json.loads(cached)
+                data = unpack(cached)
                 # Проверяем свежесть
                 cache_time = datetime.fromisoformat(data["ts"])
                 age = (datetime.now() - cache_time).total_seconds()
                 
                 self.health.is_fresh = age <= STALE_TTL
                 
-                return PlateMini(
-                    symbol=data["symbol"],
-                    ts=data["ts"],
-                    best_bid=OrderLevel(**data["best_bid"]) if data.get("best_bid") else None,
-                    best_ask=OrderLevel(**data["best_ask"]) if data.get("best_ask") else None,
-                    bids=[OrderLevel(**b) for b in data.get("bids", [])],
-                    asks=[OrderLevel(**a) for a in data.get("asks", [])],
-                    last_price=data.get("last_price"),
-                    last_qty=data.get("last_qty"),
-                    last_ts=data.get("last_ts")
-                )
+                return _plate_from_cache(data)
                 
         except Exception as e:
             logger.error(f"Failed to get cached plate: {e}")
@@ -4,19 +4,40 @@
 """
 
 import os
-import httpx
 import asyncio
 import logging
 from typing import Dict, Optional
+from dataclasses import dataclass, field
 from decimal import Decimal
 from datetime import datetime
 
+from src.services.adaptive_polling import get_adaptive_poller
+from src.services.rate_snapshot import get_rate_snapshot_store, RATE_SNAPSHOT_MAX_AGE
+from src.utils.http_client import get_http_client
+from src.utils.rate_limiter import get_host_bucket
+from src.utils.call_policy import get_call_policy
+from src.utils.single_flight import flight_key
+from src.utils.serialization import response_json
+
 logger = logging.getLogger(__name__)
 
 # Конфигурация
 RAPIRA_API_BASE = os.getenv("RAPIRA_API_BASE", "https://api.rapira.net")
 RAPIRA_TIMEOUT = int(os.getenv("RAPIRA_TIMEOUT", 10))
 RAPIRA_MAX_RETRIES = int(os.getenv("RAPIRA_MAX_RETRIES", 3))
+# Бюджет запроса к бирже из пользовательского пути (при промахе снапшота)
+RAPIRA_USER_DEADLINE = float(os.getenv("RAPIRA_USER_DEADLINE", 2))
+RAPIRA_MAX_CONCURRENCY = int(os.getenv("RAPIRA_MAX_CONCURRENCY", 32))  # одновременных запросов
+RAPIRA_RATE_LIMIT_RPS = float(os.getenv("RAPIRA_RATE_LIMIT_RPS", 20))  # запросов в секунду
+RAPIRA_RATE_LIMIT_BURST = float(os.getenv("RAPIRA_RATE_LIMIT_BURST", 32))
+
+
+@dataclass
+class BatchRatesResult:
+    """Результат пакетного запроса курсов: успешные пары и ошибки по символам"""
+    rates: Dict[str, Dict] = field(default_factory=dict)
+    errors: Dict[str, str] = field(default_factory=dict)
+    duration_ms: float = 0.0
 
 
 class RapiraSimpleClient:
@@ -26,13 +47,78 @@ class RapiraSimpleClient:
         self.base_url = RAPIRA_API_BASE
         self._error_count = 0
         self._last_error = None
+        self._bucket = get_host_bucket(self.base_url, RAPIRA_RATE_LIMIT_RPS, RAPIRA_RATE_LIMIT_BURST)
+        self._semaphore = asyncio.Semaphore(RAPIRA_MAX_CONCURRENCY)
     
-    async def get_base_rate(self, symbol: str) -> Optional[Dict]:
+    async def _fetch_base_rate(self, symbol: str, deadline: Optional[float] = None) -> Dict:
+        """
+        Запрашивает стакан и извлекает лучшие цены (ошибки пробрасываются)
+        
+        Одинаковые одновременные запросы объединяются в один; повторы,
+        hedging и circuit breaker - в политике вызовов Rapira.
+        """
+        endpoint = "/market/exchange-plate-mini"
+        params = {"symbol": symbol}
+        
+        return await get_call_policy("rapira", max_attempts=RAPIRA_MAX_RETRIES + 1).call(
+            lambda: self._request_base_rate(endpoint, params),
+            deadline=deadline,
+            key=flight_key("rapira", endpoint, params)
+        )
+    
+    async def _request_base_rate(self, endpoint: str, params: Dict) -> Dict:
+        """Один HTTP-запрос стакана Rapira"""
+        symbol = params["symbol"]
+        url = f"{self.base_url}{endpoint}"
+        
+        async with self._semaphore:
+            await self._bucket.acquire()
+            client = get_http_client(url, timeout=RAPIRA_TIMEOUT)
+            response = await client.get(url, params=params, timeout=RAPIRA_TIMEOUT)
+            response.raise_for_status()
+            data = response_json(response)
+        
+        # Извлекаем лучшие цены
+        result = {
+            'symbol': symbol,
+            'best_ask': None,
+            'best_bid': None,
+            'timestamp': datetime.now()
+        }
+        
+        # Best Ask - цена по которой клиент может купить USDT (самая низкая ask)
+        # Берем из items[0], т.к. lowestPrice может быть placeholder (99999)
+        if 'ask' in data and 'items' in data['ask'] and len(data['ask']['items']) > 0:
+            result['best_ask'] = Decimal(str(data['ask']['items'][0]['price']))
+        elif 'ask' in data and 'lowestPrice' in data['ask']:
+            price = Decimal(str(data['ask']['lowestPrice']))
+            # Игнорируем явные placeholder значения
+            if price < 90000:
+                result['best_ask'] = price
+        
+        # Best Bid - цена по которой клиент может продать USDT (самая высокая bid)
+        # Берем из items[0], т.к. highestPrice может быть placeholder
+        if 'bid' in data and 'items' in data['bid'] and len(data['bid']['items']) > 0:
+            result['best_bid'] = Decimal(str(data['bid']['items'][0]['price']))
+        elif 'bid' in data and 'highestPrice' in data['bid']:
+            result['best_bid'] = Decimal(str(data['bid']['highestPrice']))
+        
+        # Публикуем в снапшот - хендлеры читают курсы оттуда без I/O
+        if result['best_ask'] or result['best_bid']:
+            get_rate_snapshot_store().publish(
+                symbol, result['best_bid'], result['best_ask'],
+                source='rapira', timestamp=result['timestamp']
+            )
+        
+        return result
+    
+    async def get_base_rate(self, symbol: str, deadline: Optional[float] = None) -> Optional[Dict]:
         """
         Получает базовый курс (московский) из Rapira
         
         Args:
             symbol: Символ пары, например "USDT/RUB"
+            deadline: Бюджет времени запроса в секундах (по умолчанию политики)
             
         Returns:
             {
@@ -43,38 +129,7 @@ class RapiraSimpleClient:
             }
         """
         try:
-            url = f"{self.base_url}/market/exchange-plate-mini"
-            params = {"symbol": symbol}
-            
-            async with httpx.AsyncClient(timeout=RAPIRA_TIMEOUT) as client:
-                response = await client.get(url, params=params)
-                response.raise_for_status()
-                data = response.json()
-            
-            # Извлекаем лучшие цены
-            result = {
-                'symbol': symbol,
-                'best_ask': None,
-                'best_bid': None,
-                'timestamp': datetime.now()
-            }
-            
-            # Best Ask - цена по которой клиент может купить USDT (самая низкая ask)
-            # Берем из items[0], т.к. lowestPrice может быть placeholder (99999)
-            if 'ask' in data and 'items' in data['ask'] and len(data['ask']['items']) > 0:
-                result['best_ask'] = Decimal(str(data['ask']['items'][0]['price']))
-            elif 'ask' in data and 'lowestPrice' in data['ask']:
-                price = Decimal(str(data['ask']['lowestPrice']))
-                # Игнорируем явные placeholder значения
-                if price < 90000:
-                    result['best_ask'] = price
-            
-            # Best Bid - цена по которой клиент может продать USDT (самая высокая bid)
-            # Берем из items[0], т.к. highestPrice может быть placeholder
-            if 'bid' in data and 'items' in data['bid'] and len(data['bid']['items']) > 0:
-                result['best_bid'] = Decimal(str(data['bid']['items'][0]['price']))
-            elif 'bid' in data and 'highestPrice' in data['bid']:
-                result['best_bid'] = Decimal(str(data['bid']['highestPrice']))
+            result = await self._fetch_base_rate(symbol, deadline)
             
             self._error_count = 0
             self._last_error = None
@@ -88,6 +143,48 @@ class RapiraSimpleClient:
             logger.error(f"Failed to get Rapira base rate for {symbol}: {e}")
             return None
     
+    async def get_multiple_rates_detailed(self, symbols: list[str]) -> BatchRatesResult:
+        """
+        Получает базовые курсы для нескольких пар параллельно
+        
+        Параллельность ограничена RAPIRA_MAX_CONCURRENCY, частота запросов -
+        token bucket хоста (RAPIRA_RATE_LIMIT_RPS / RAPIRA_RATE_LIMIT_BURST).
+        Ошибка по одной паре не мешает остальным.
+        
+        Returns:
+            BatchRatesResult(rates={'USDT/RUB': {...}}, errors={'BTC/USDT': 'HTTP 502 ...'})
+        """
+        start_time = asyncio.get_event_loop().time()
+        unique_symbols = list(dict.fromkeys(symbols))
+        
+        responses = await asyncio.gather(
+            *(self._fetch_base_rate(symbol) for symbol in unique_symbols),
+            return_exceptions=True
+        )
+        
+        batch = BatchRatesResult()
+        for symbol, response in zip(unique_symbols, responses):
+            if isinstance(response, BaseException):
+                batch.errors[symbol] = str(response) or type(response).__name__
+            else:
+                batch.rates[symbol] = response
+        
+        batch.duration_ms = (asyncio.get_event_loop().time() - start_time) * 1000
+        
+        if batch.errors:
+            self._error_count += len(batch.errors)
+            self._last_error = next(iter(batch.errors.values()))
+            logger.warning(
+                f"Rapira batch: {len(batch.rates)}/{len(unique_symbols)} pairs, "
+                f"errors: {batch.errors}"
+            )
+        else:
+            self._error_count = 0
+            self._last_error = None
+        
+        logger.debug(f"Rapira batch of {len(unique_symbols)} pairs took {batch.duration_ms:.0f}ms")
+        return batch
+    
     async def get_multiple_rates(self, symbols: list[str]) -> Dict[str, Dict]:
         """
         Получает базовые курсы для нескольких пар
@@ -98,16 +195,8 @@ class RapiraSimpleClient:
         Returns:
             {'USDT/RUB': {...}, 'BTC/USDT': {...}}
         """
-        results = {}
-        
-        for symbol in symbols:
-            rate = await self.get_base_rate(symbol)
-            if rate:
-                results[symbol] = rate
-            # Небольшая пауза между запросами
-            await asyncio.sleep(0.1)
-        
-        return results
+        batch = await self.get_multiple_rates_detailed(symbols)
+        return batch.rates
     
     def get_error_count(self) -> int:
         """Возвращает количество ошибок"""
@@ -130,6 +219,49 @@ async def get_rapira_simple_client() -> RapiraSimpleClient:
     return _rapira_simple_client
 
 
+async def get_base_rate_snapshot(
+    symbol: str,
+    max_age: Optional[float] = None,
+    deadline: Optional[float] = RAPIRA_USER_DEADLINE
+) -> Optional[Dict]:
+    """
+    Базовый курс из in-memory снапшота, при промахе - запрос к Rapira
+    
+    Снапшот обновляется планировщиками, поэтому в обычном режиме функция
+    не делает сетевых запросов. Символ с полученной котировкой запоминается,
+    чтобы планировщик продолжал его обновлять. Если биржа не ответила за
+    deadline или ее breaker разомкнут, возвращается последний известный курс
+    (с флагом 'stale').
+    
+    Args:
+        symbol: Символ пары, например "USDT/RUB"
+        max_age: Допустимый возраст котировки (по умолчанию RATE_SNAPSHOT_MAX_AGE)
+        deadline: Бюджет запроса к бирже в секундах
+    """
+    store = get_rate_snapshot_store()
+    get_adaptive_poller().record_lookup(symbol)
+    
+    quote = store.get(symbol, source='rapira', max_age=max_age if max_age is not None else RATE_SNAPSHOT_MAX_AGE)
+    if quote:
+        store.track(symbol)
+        return quote.as_dict()
+    
+    logger.debug(f"Rate snapshot miss for {symbol}, fetching from Rapira")
+    client = await get_rapira_simple_client()
+    result = await client.get_base_rate(symbol, deadline=deadline)
+    if result:
+        store.track(symbol)
+        return result
+    
+    # Последний известный курс
+    quote = store.get(symbol, source='rapira')
+    if quote:
+        store.track(symbol)
+        logger.warning(f"Rapira unavailable, serving last known {symbol} rate ({quote.age:.0f}s old)")
+        return {**quote.as_dict(), 'stale': True}
+    return None
+
+
 async def get_city_rate(symbol: str, city: str, operation: str = "buy") -> Optional[Dict]:
     """
     Получает курс для конкретного города с наценкой
@@ -150,68 +282,51 @@ async def get_city_rate(symbol: str, city: str, operation: str = "buy") -> Optio
             'timestamp': datetime
         }
     """
-    from src.db import get_pg_pool
+    from src.services.pricing_matrix import get_pricing_engine
     
-    # Получаем базовый курс
-    client = await get_rapira_simple_client()
-    base_data = await client.get_base_rate(symbol)
+    # Курс из матрицы цен (при устаревшей котировке базовый курс обновляется)
+    engine = await get_pricing_engine()
+    price = await engine.quote(symbol, city, operation)
     
-    if not base_data:
-        logger.error(f"Failed to get base rate for {symbol}")
-        return None
-    
-    # Выбираем базовую цену в зависимости от операции
-    if operation == "buy":
-        # Клиент покупает USDT - берем ask (цена продавца)
-        base_rate = base_data['best_ask']
+    if price:
+        base_rate = price.base_rate
+        markup_percent = price.markup_percent
+        final_rate = price.final_rate
+        result = {
+            'symbol': symbol,
+            'city': city,
+            'base_rate': base_rate,
+            'markup_percent': markup_percent,
+            'markup_fixed': price.markup_fixed,
+            'final_rate': final_rate,
+            'operation': operation,
+            'timestamp': price.timestamp
+        }
     else:
-        # Клиент продает USDT - берем bid (цена покупателя)
-        base_rate = base_data['best_bid']
-    
-    if not base_rate:
-        logger.error(f"No base rate available for {symbol} operation {operation}")
-        return None
-    
-    # Получаем наценку для города из таблицы cities (раздельно на покупку/продажу)
-    pool = await get_pg_pool()
-    async with pool.acquire() as conn:
-        city_data = await conn.fetchrow("""
-            SELECT markup_buy, markup_sell, markup_fixed
-            FROM cities
-            WHERE code = $1 AND enabled = true
-            LIMIT 1
-        """, city)
+        # Города нет в матрице - дефолтная наценка 0%
+        base_data = await get_base_rate_snapshot(symbol)
+        base_rate = None
+        if base_data:
+            # buy - клиент покупает USDT (ask), sell - продает (bid)
+            base_rate = base_data['best_ask'] if operation == "buy" else base_data['best_bid']
         
-        if city_data:
-            # Выбираем наценку в зависимости от операции
-            if operation == "buy":
-                markup_percent = Decimal(str(city_data['markup_buy']))
-            else:
-                markup_percent = Decimal(str(city_data['markup_sell']))
-            markup_fixed = Decimal(str(city_data['markup_fixed']))
-        else:
-            # Дефолтная наценка если город не найден
-            logger.warning(f"City {city} not found in DB, using default 0%")
-            markup_percent = Decimal('0')
-            markup_fixed = Decimal('0')
-    
-    # Применяем наценку
-    # Формула: final = base * (1 + percent/100) + fixed
-    final_rate = base_rate * (Decimal('1') + markup_percent / Decimal('100')) + markup_fixed
-    
-    # Округляем до 2 знаков
-    final_rate = final_rate.quantize(Decimal('0.01'))
-    
-    result = {
-        'symbol': symbol,
-        'city': city,
-        'base_rate': float(base_rate),
-        'markup_percent': float(markup_percent),
-        'markup_fixed': float(markup_fixed),
-        'final_rate': float(final_rate),
-        'operation': operation,
-        'timestamp': base_data['timestamp']
-    }
+        if not base_rate:
+            logger.error(f"No base rate available for {symbol} operation {operation}")
+            return None
+        
+        logger.warning(f"City {city} not found in DB, using default 0%")
+        markup_percent = 0.0
+        final_rate = float(Decimal(str(base_rate)).quantize(Decimal('0.01')))
+        result = {
+            'symbol': symbol,
+            'city': city,
+            'base_rate': float(base_rate),
+            'markup_percent': markup_percent,
+            'markup_fixed': 0.0,
+            'final_rate': final_rate,
+            'operation': operation,
+            'timestamp': base_data['timestamp']
+        }
     
     logger.info(f"City rate for {city}: {symbol} {operation} = {final_rate} (base: {base_rate}, markup: {markup_percent}%)")
     
@@ -219,38 +334,30 @@ async def get_city_rate(symbol: str, city: str, operation: str = "buy") -> Optio
 
 
 # Кэш городов
-_cities_cache = None
-_cities_cache_time = None
-
 async def get_cities_dict() -> Dict[str, str]:
     """
-    Получает словарь городов из БД с кэшированием
+    Получает словарь городов из БД с кэшированием (L1 + Redis)
+    
+    Кэш сбрасывается веб-админкой при изменении городов.
     
     Returns:
         {'moscow': 'Москва', 'rostov': 'Ростов-на-Дону', ...}
     """
-    global _cities_cache, _cities_cache_time
-    
-    # Кэш на 60 секунд
-    if _cities_cache and _cities_cache_time:
-        if (datetime.now() - _cities_cache_time).total_seconds() < 60:
-            return _cities_cache
-    
     from src.db import get_pg_pool
+    from src.utils.layered_cache import get_layered_cache, CITY_CACHE_PREFIX
     
-    pool = await get_pg_pool()
-    async with pool.acquire() as conn:
-        rows = await conn.fetch("""
-            SELECT code, name 
-            FROM cities 
-            WHERE enabled = true
-            ORDER BY sort_order, name
-        """)
-        
-        _cities_cache = {r['code']: r['name'] for r in rows}
-        _cities_cache_time = datetime.now()
-        
-        return _cities_cache
+    async def query():
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT code, name 
+                FROM cities 
+                WHERE enabled = true
+                ORDER BY sort_order, name
+            """)
+            return {r['code']: r['name'] for r in rows}
+    
+    return await get_layered_cache().get_or_load(f"{CITY_CACHE_PREFIX}dict", query, ttl_seconds=3600)
 
 # Для обратной совместимости - статичный словарь как fallback
 CITIES = {
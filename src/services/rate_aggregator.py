@@ -0,0 +1,281 @@
+"""
+Агрегатор курсов нескольких бирж с общим deadline
+
+Все включенные источники (fx_source.enabled) опрашиваются параллельно, и
+ответы ждутся не дольше общего BEST_RATE_DEADLINE: задержка определяется
+самым медленным источником в пределах бюджета, а не суммой вызовов, поэтому
+новая биржа не добавляет задержки, а упавшая или зависшая не блокирует
+остальные. Лучший курс выбирается по стороне среди свежих ответов (buy -
+минимальный ask, sell - максимальный bid); устаревшие (последний известный
+курс) используются, только если свежих нет.
+
+Источники, не уложившиеся в deadline, отменяются не сразу: их ответ
+дописывается в статистику как опоздавший и прогревает кэши клиентов для
+следующих запросов. На (источник, символ) идет не больше одного запроса -
+новые вызовы присоединяются к нему, а опоздавший запрос отменяется через
+deadline × BEST_RATE_LATE_FACTOR, поэтому зависшая биржа не копит задачи.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from src.services.rate_snapshot import get_rate_snapshot_store, RATE_SNAPSHOT_MAX_AGE
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+BEST_RATE_DEADLINE = float(os.getenv("BEST_RATE_DEADLINE", 2))          # общий бюджет опроса, секунды
+BEST_RATE_SOURCES_TTL = float(os.getenv("BEST_RATE_SOURCES_TTL", 60))   # кэш списка включенных источников
+BEST_RATE_LATE_FACTOR = float(os.getenv("BEST_RATE_LATE_FACTOR", 5))    # отмена опоздавшего: deadline × factor
+
+
+@dataclass
+class SourceRate:
+    """Ответ одного источника"""
+    source: str
+    bid: Optional[float]
+    ask: Optional[float]
+    timestamp: Optional[datetime] = None
+    stale: bool = False
+    latency_ms: float = 0.0
+
+    def side(self, operation: str) -> Optional[float]:
+        """ask для покупки клиентом, bid - для продажи"""
+        return self.ask if operation == "buy" else self.bid
+
+
+@dataclass
+class AggregatedRate:
+    """Результат опроса всех источников по символу"""
+    symbol: str
+    rates: Dict[str, SourceRate] = field(default_factory=dict)  # ответившие в срок
+    late: List[str] = field(default_factory=list)               # не уложились в deadline
+    failed: Dict[str, str] = field(default_factory=dict)        # ошибка или пустой ответ
+    duration_ms: float = 0.0
+
+    def best(self, operation: str) -> Optional[SourceRate]:
+        """Лучший курс по стороне: свежие ответы, при их отсутствии - устаревшие"""
+        candidates = [r for r in self.rates.values() if r.side(operation)]
+        fresh = [r for r in candidates if not r.stale]
+        candidates = fresh or candidates
+        if not candidates:
+            return None
+        if operation == "buy":
+            # Для покупки - чем ниже цена, тем лучше
+            return min(candidates, key=lambda r: r.ask)
+        # Для продажи - чем выше цена, тем лучше
+        return max(candidates, key=lambda r: r.bid)
+
+
+Fetcher = Callable[[str, float], Awaitable[Optional[SourceRate]]]  # (symbol, deadline) -> SourceRate
+
+
+class RateAggregator:
+    """Параллельный опрос источников с общим deadline"""
+
+    def __init__(self, deadline: float = BEST_RATE_DEADLINE, late_factor: float = BEST_RATE_LATE_FACTOR):
+        self.deadline = deadline
+        self.late_factor = max(late_factor, 1.0)
+        self._inflight: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._late_tasks: Set[asyncio.Task] = set()
+        self._fetchers: Dict[str, Fetcher] = {}
+        self._enabled: Optional[List[str]] = None
+        self._enabled_at: Optional[float] = None
+        self._stats: Dict[str, Dict] = {}
+
+    def register(self, source: str, fetcher: Fetcher):
+        """Регистрирует функцию получения курса источника"""
+        self._fetchers[source] = fetcher
+        self._stats.setdefault(source, {'answered': 0, 'stale': 0, 'late': 0, 'late_arrived': 0,
+                                        'late_cancelled': 0, 'failed': 0, 'last_ms': None})
+
+    async def sources(self) -> List[str]:
+        """Зарегистрированные источники, включенные в fx_source"""
+        if self._enabled_at is None or time.monotonic() - self._enabled_at >= BEST_RATE_SOURCES_TTL:
+            try:
+                from src.db import get_pg_pool
+                pool = await get_pg_pool()
+                async with pool.acquire() as conn:
+                    rows = await conn.fetch("SELECT code FROM fx_source WHERE enabled = true")
+                self._enabled = [row['code'] for row in rows]
+            except Exception as e:
+                # Без БД опрашиваем прежний список (или все зарегистрированные)
+                logger.error(f"Failed to load enabled FX sources: {e}")
+            self._enabled_at = time.monotonic()
+
+        if self._enabled is None:
+            return list(self._fetchers)
+        return [source for source in self._fetchers if source in self._enabled]
+
+    def invalidate_sources(self):
+        """Перечитать включенные источники при следующем запросе"""
+        self._enabled_at = None
+
+    async def collect(self, symbol: str, deadline: Optional[float] = None,
+                      sources: Optional[List[str]] = None) -> AggregatedRate:
+        """
+        Опрашивает источники параллельно и ждет не дольше deadline
+
+        Args:
+            symbol: внутренний символ пары, например "USDT/RUB"
+            deadline: общий бюджет в секундах (по умолчанию BEST_RATE_DEADLINE)
+            sources: явный список источников (по умолчанию - включенные)
+        """
+        deadline = self.deadline if deadline is None else deadline
+        sources = await self.sources() if sources is None else sources
+        result = AggregatedRate(symbol=symbol)
+        if not sources:
+            return result
+
+        started = time.monotonic()
+        tasks = {self._start(source, symbol, deadline, started): source for source in sources}
+        done, pending = await asyncio.wait(tasks, timeout=deadline)
+
+        for task in done:
+            source = tasks[task]
+            stats = self._stats[source]
+            if task.cancelled():
+                # Общий запрос, отмененный как опоздавший для прежнего вызова
+                stats['failed'] += 1
+                result.failed[source] = "cancelled"
+                continue
+            error = task.exception()
+            rate = None if error else task.result()
+            if rate is None:
+                stats['failed'] += 1
+                result.failed[source] = str(error) if error else "no rate"
+                continue
+            stats['answered'] += 1
+            stats['stale'] += rate.stale
+            result.rates[source] = rate
+
+        for task in pending:
+            source = tasks[task]
+            self._stats[source]['late'] += 1
+            result.late.append(source)
+            self._watch_late(source, symbol, task, deadline)
+
+        result.duration_ms = (time.monotonic() - started) * 1000
+        if result.late:
+            logger.warning(
+                f"Rate sources late for {symbol} (deadline {deadline:.1f}s): {', '.join(sorted(result.late))}"
+            )
+        return result
+
+    def _start(self, source: str, symbol: str, deadline: float, started: float) -> asyncio.Task:
+        """Запрос к источнику или уже идущий запрос того же символа"""
+        key = (source, symbol)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._fetch(source, symbol, deadline, started))
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._inflight.pop(key, None) if self._inflight.get(key) is t else None)
+        return task
+
+    def _watch_late(self, source: str, symbol: str, task: asyncio.Task, deadline: float):
+        """Ограничивает опоздавший запрос сроком deadline × late_factor (один раз на запрос)"""
+        if task in self._late_tasks:
+            return
+        self._late_tasks.add(task)
+        cancel = asyncio.get_running_loop().call_later(deadline * (self.late_factor - 1), task.cancel)
+        task.add_done_callback(lambda t: self._late_arrival(source, symbol, t, cancel))
+
+    async def _fetch(self, source: str, symbol: str, deadline: float, started: float) -> Optional[SourceRate]:
+        rate = await self._fetchers[source](symbol, deadline)
+        latency_ms = (time.monotonic() - started) * 1000
+        self._stats[source]['last_ms'] = round(latency_ms, 1)
+        if rate is not None:
+            rate.latency_ms = latency_ms
+        return rate
+
+    def _late_arrival(self, source: str, symbol: str, task: asyncio.Task, cancel: asyncio.TimerHandle):
+        """Опоздавший ответ: только статистика (курс уже прогрел кэш клиента)"""
+        cancel.cancel()
+        self._late_tasks.discard(task)
+        if task.cancelled():
+            self._stats[source]['late_cancelled'] += 1
+            logger.warning(f"Late {source} request for {symbol} cancelled")
+            return
+        error = task.exception()
+        if error:
+            logger.debug(f"Late {source} request for {symbol} failed: {error}")
+            return
+        self._stats[source]['late_arrived'] += 1
+
+    def get_stats(self) -> Dict:
+        """Статистика для мониторинга"""
+        return {
+            'deadline_seconds': self.deadline,
+            'enabled': self._enabled,
+            'sources': {source: dict(stats) for source, stats in self._stats.items()},
+        }
+
+
+# ----------------------------------------------------------------------
+# Источники
+# ----------------------------------------------------------------------
+
+def _to_float(value) -> Optional[float]:
+    return float(value) if value else None
+
+
+async def fetch_rapira_rate(symbol: str, deadline: float) -> Optional[SourceRate]:
+    """Rapira: in-memory снапшот, при промахе - запрос к бирже"""
+    from src.services.rapira_simple import get_base_rate_snapshot
+
+    data = await get_base_rate_snapshot(symbol, deadline=deadline)
+    if not data:
+        return None
+    return SourceRate(
+        source="rapira",
+        bid=_to_float(data.get('best_bid')),
+        ask=_to_float(data.get('best_ask')),
+        timestamp=data.get('timestamp'),
+        stale=bool(data.get('stale')),
+    )
+
+
+async def fetch_grinex_rate(symbol: str, deadline: float) -> Optional[SourceRate]:
+    """Grinex: котировка WebSocket-потока из снапшота, иначе тикер REST API"""
+    from src.services.grinex import get_grinex_client
+
+    # USDT/RUB -> USDTRUB
+    grinex_symbol = symbol.replace("/", "")
+    quote = get_rate_snapshot_store().get(grinex_symbol, source="grinex", max_age=RATE_SNAPSHOT_MAX_AGE)
+    if quote:
+        return SourceRate("grinex", _to_float(quote.best_bid), _to_float(quote.best_ask), quote.timestamp)
+
+    client = await get_grinex_client()
+    ticker = await client.get_ticker(grinex_symbol, deadline=deadline)
+    if not ticker:
+        return None
+    # При ошибке клиент отдает последний известный тикер - отмечаем его как устаревший
+    # Сравнение в секундах эпохи: метка из ISO-строки с Z - aware datetime
+    stale = ticker.timestamp is not None and ticker.timestamp.timestamp() + RATE_SNAPSHOT_MAX_AGE < time.time()
+    return SourceRate(
+        source="grinex",
+        bid=_to_float(ticker.bid or ticker.last_price),
+        ask=_to_float(ticker.ask or ticker.last_price),
+        timestamp=ticker.timestamp,
+        stale=stale,
+    )
+
+
+# Глобальный экземпляр
+_rate_aggregator: Optional[RateAggregator] = None
+
+
+def get_rate_aggregator() -> RateAggregator:
+    """Получает глобальный агрегатор (Rapira и Grinex регистрируются при создании)"""
+    global _rate_aggregator
+    if _rate_aggregator is None:
+        aggregator = RateAggregator()
+        aggregator.register("rapira", fetch_rapira_rate)
+        aggregator.register("grinex", fetch_grinex_rate)
+        _rate_aggregator = aggregator
+    return _rate_aggregator
@@ -0,0 +1,213 @@
+"""
+Отслеживание свежести курсов по событиям
+
+Признак "устарел" не хранится как источник истины: он выводится при чтении
+из calculated_at (см. is_stale и запросы FXRatesService). Трекер держит в
+памяти срок годности каждой пары (calculated_at + FX_STALE_THRESHOLD_SECONDS)
+в куче и просыпается ровно к ближайшему сроку. В БД пишутся только переходы
+fresh -> stale (для админки и внешних читателей fx_final_rate.stale); обратный
+переход делает upsert синхронизации, который выставляет stale = false.
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from src.db import get_pg_pool
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+FX_STALE_THRESHOLD_SECONDS = int(os.getenv("FX_STALE_THRESHOLD_SECONDS", 180))  # 3 минуты
+
+PairKey = Tuple[int, int]  # (source_id, source_pair_id)
+
+
+def is_stale(calculated_at: datetime, threshold: float = FX_STALE_THRESHOLD_SECONDS,
+             now: Optional[float] = None) -> bool:
+    """Устарел ли курс, рассчитанный в calculated_at"""
+    now = time.time() if now is None else now
+    return calculated_at.timestamp() + threshold <= now
+
+
+class FreshnessTracker:
+    """Сроки годности курсов по парам с пробуждением к ближайшему сроку"""
+
+    def __init__(self, threshold: float = FX_STALE_THRESHOLD_SECONDS):
+        self.threshold = threshold
+        self._expires: Dict[PairKey, float] = {}
+        self._calculated: Dict[PairKey, datetime] = {}
+        self._labels: Dict[PairKey, str] = {}
+        self._stale: set = set()
+        # (срок, ключ); устаревшие записи отбрасываются при извлечении
+        self._heap: List[Tuple[float, PairKey]] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {'touches': 0, 'became_stale': 0, 'recovered': 0, 'persisted': 0, 'errors': 0}
+
+    # ------------------------------------------------------------------
+    # События
+    # ------------------------------------------------------------------
+
+    def touch(self, source_id: int, source_pair_id: int, calculated_at: datetime, label: Optional[str] = None):
+        """Пара получила новый курс: продлевает срок годности"""
+        key = (source_id, source_pair_id)
+        expires_at = calculated_at.timestamp() + self.threshold
+        self._expires[key] = expires_at
+        self._calculated[key] = calculated_at
+        if label:
+            self._labels[key] = label
+        self._stats['touches'] += 1
+
+        if key in self._stale and expires_at > time.time():
+            self._stale.discard(key)
+            self._stats['recovered'] += 1
+            logger.info(f"FX rate is fresh again: {self._label(key)}")
+
+        # Новый срок раньше текущего ближайшего - трекер должен проснуться раньше
+        if not self._heap or expires_at < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (expires_at, key))
+
+    def forget(self, source_id: int, source_pair_id: int):
+        """Пара отключена или удалена"""
+        key = (source_id, source_pair_id)
+        self._expires.pop(key, None)
+        self._calculated.pop(key, None)
+        self._labels.pop(key, None)
+        self._stale.discard(key)
+
+    def expire(self, now: Optional[float] = None) -> List[Tuple[PairKey, datetime]]:
+        """Извлекает пары, у которых истек срок; возвращает переходы fresh -> stale"""
+        now = time.time() if now is None else now
+        transitions = []
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            # Запись устарела: курс пары обновлялся после нее
+            if self._expires.get(key) != expires_at or key in self._stale:
+                continue
+            self._stale.add(key)
+            transitions.append((key, self._calculated[key]))
+        self._stats['became_stale'] += len(transitions)
+        return transitions
+
+    def next_deadline(self) -> Optional[float]:
+        """Ближайший актуальный срок годности"""
+        while self._heap and self._expires.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        return self._heap[0][0] if self._heap else None
+
+    def is_stale(self, source_id: int, source_pair_id: int) -> Optional[bool]:
+        """Устарел ли курс пары (None - пара не отслеживается)"""
+        expires_at = self._expires.get((source_id, source_pair_id))
+        if expires_at is None:
+            return None
+        return expires_at <= time.time()
+
+    def _label(self, key: PairKey) -> str:
+        return self._labels.get(key, f"{key[0]}/{key[1]}")
+
+    # ------------------------------------------------------------------
+    # Фоновая задача
+    # ------------------------------------------------------------------
+
+    async def load(self):
+        """Заполняет сроки из fx_final_rate (при старте)"""
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            rows = await conn.fetch("""
+                SELECT fr.source_id, fr.source_pair_id, fr.calculated_at, fr.stale,
+                       s.code, sp.internal_symbol
+                FROM fx_final_rate fr
+                JOIN fx_source s ON s.id = fr.source_id
+                JOIN fx_source_pair sp ON sp.id = fr.source_pair_id
+                WHERE s.enabled = true AND sp.enabled = true
+            """)
+        for row in rows:
+            self.touch(row['source_id'], row['source_pair_id'], row['calculated_at'],
+                       f"{row['code']}/{row['internal_symbol']}")
+            if row['stale']:
+                # Переход уже записан - повторно не пишем
+                self._stale.add((row['source_id'], row['source_pair_id']))
+        logger.info(f"Freshness tracker loaded {len(rows)} FX rates")
+
+    async def _persist(self, transitions: List[Tuple[PairKey, datetime]]):
+        """Записывает переходы в stale (только если курс с тех пор не обновлялся)"""
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            await conn.executemany("""
+                UPDATE fx_final_rate
+                SET stale = true
+                WHERE source_id = $1 AND source_pair_id = $2
+                    AND calculated_at = $3 AND stale = false
+            """, [(key[0], key[1], calculated_at) for key, calculated_at in transitions])
+        self._stats['persisted'] += len(transitions)
+
+    async def _run(self):
+        """Спит до ближайшего срока (или до нового, более раннего) и фиксирует переходы"""
+        while True:
+            deadline = self.next_deadline()
+            timeout = None if deadline is None else max(0.0, deadline - time.time())
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            transitions = self.expire()
+            if not transitions:
+                continue
+            for key, calculated_at in transitions:
+                logger.warning(f"Stale FX rate: {self._label(key)} (last update: {calculated_at})")
+            try:
+                await self._persist(transitions)
+            except Exception as e:
+                self._stats['errors'] += 1
+                logger.error(f"Failed to persist {len(transitions)} stale FX rates: {e}")
+
+    async def start(self):
+        """Загружает сроки и запускает отслеживание"""
+        if self._task is not None and not self._task.done():
+            return
+        try:
+            await self.load()
+        except Exception as e:
+            logger.error(f"Failed to load FX rates for freshness tracking: {e}")
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает отслеживание"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def get_stats(self) -> Dict:
+        """Статистика для мониторинга"""
+        deadline = self.next_deadline()
+        return {
+            **self._stats,
+            'tracked': len(self._expires),
+            'stale': len(self._stale),
+            'threshold_seconds': self.threshold,
+            'next_expiry_in': round(max(0.0, deadline - time.time()), 1) if deadline is not None else None,
+        }
+
+
+# Глобальный экземпляр
+_freshness_tracker: Optional[FreshnessTracker] = None
+
+
+def get_freshness_tracker() -> FreshnessTracker:
+    """Получает глобальный трекер свежести курсов"""
+    global _freshness_tracker
+    if _freshness_tracker is None:
+        _freshness_tracker = FreshnessTracker()
+    return _freshness_tracker
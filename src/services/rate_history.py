@@ -0,0 +1,356 @@
+"""
+История тиков курсов: буферизованная запись в fx_rate_snapshot
+
+Синхронизация FX добавляет тики в буфер в памяти (без I/O на горячем пути).
+Фоновая задача сбрасывает буфер одной транзакцией, когда набралось
+FX_HISTORY_BATCH_SIZE тиков или прошло FX_HISTORY_FLUSH_INTERVAL секунд:
+
+- тики - через COPY в партиционированную fx_rate_snapshot;
+- OHLC-свечи 1m и 1h - пакетным upsert агрегатов этой же пачки.
+
+Раз в FX_HISTORY_MAINTENANCE_INTERVAL создаются партиции на ближайшие сутки
+и удаляется все, что старше сроков хранения своего разрешения.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from src.db import get_pg_pool
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+FX_HISTORY_ENABLED = os.getenv("FX_HISTORY_ENABLED", "true").lower() == "true"
+FX_HISTORY_BATCH_SIZE = int(os.getenv("FX_HISTORY_BATCH_SIZE", 500))
+FX_HISTORY_FLUSH_INTERVAL = float(os.getenv("FX_HISTORY_FLUSH_INTERVAL", 5))  # секунды
+FX_HISTORY_MAX_BUFFER = int(os.getenv("FX_HISTORY_MAX_BUFFER", 50000))  # при недоступной БД
+FX_HISTORY_MAINTENANCE_INTERVAL = float(os.getenv("FX_HISTORY_MAINTENANCE_INTERVAL", 3600))
+
+# Сроки хранения по разрешениям (дни)
+FX_HISTORY_RETENTION_RAW_DAYS = int(os.getenv("FX_HISTORY_RETENTION_RAW_DAYS", 7))
+FX_HISTORY_RETENTION_1M_DAYS = int(os.getenv("FX_HISTORY_RETENTION_1M_DAYS", 30))
+FX_HISTORY_RETENTION_1H_DAYS = int(os.getenv("FX_HISTORY_RETENTION_1H_DAYS", 365))
+
+# Период, для которого история отдается сырыми тиками (дальше - свечами)
+RAW_MAX_SPAN = timedelta(hours=1)
+
+SNAPSHOT_COLUMNS = ['source_id', 'source_pair_id', 'raw_price', 'final_price', 'applied_rule_id', 'snapshot_at']
+CHECK_VIOLATION = '23514'  # SQLSTATE: строке нет подходящей партиции
+
+# Разрешение -> (таблица, размер свечи)
+ROLLUPS: Dict[str, Tuple[str, timedelta]] = {
+    '1m': ('fx_rate_ohlc_1m', timedelta(minutes=1)),
+    '1h': ('fx_rate_ohlc_1h', timedelta(hours=1)),
+}
+
+Tick = Tuple[int, int, Decimal, Decimal, Optional[int], datetime]
+
+
+@dataclass
+class Candle:
+    """Свеча одной пары за один интервал"""
+    source_pair_id: int
+    bucket: datetime
+    open: Decimal
+    high: Decimal
+    low: Decimal
+    close: Decimal
+    open_at: datetime
+    close_at: datetime
+    ticks: int = 1
+
+    def add(self, price: Decimal, at: datetime):
+        if at < self.open_at:
+            self.open, self.open_at = price, at
+        if at >= self.close_at:
+            self.close, self.close_at = price, at
+        self.high = max(self.high, price)
+        self.low = min(self.low, price)
+        self.ticks += 1
+
+    def as_row(self) -> tuple:
+        return (self.source_pair_id, self.bucket, self.open, self.high, self.low, self.close,
+                self.open_at, self.close_at, self.ticks)
+
+
+def floor_time(at: datetime, size: timedelta) -> datetime:
+    """Начало интервала размера size, в который попадает at"""
+    if size >= timedelta(hours=1):
+        return at.replace(minute=0, second=0, microsecond=0)
+    return at.replace(second=0, microsecond=0)
+
+
+def build_candles(ticks: Iterable[Tick], size: timedelta) -> List[Candle]:
+    """Свечи финальной цены по тикам пачки"""
+    candles: Dict[Tuple[int, datetime], Candle] = {}
+    for _, pair_id, _, final_price, _, at in ticks:
+        key = (pair_id, floor_time(at, size))
+        candle = candles.get(key)
+        if candle is None:
+            candles[key] = Candle(pair_id, key[1], final_price, final_price, final_price, final_price, at, at)
+        else:
+            candle.add(final_price, at)
+    return list(candles.values())
+
+
+def _upsert_candles_sql(table: str) -> str:
+    """Слияние свечи пачки с уже накопленной (порядок пачек не важен)"""
+    return f"""
+        INSERT INTO {table} AS t
+        (source_pair_id, bucket, open, high, low, close, open_at, close_at, ticks)
+        VALUES ($1, $2, $3, $4, $5, $6, $7, $8, $9)
+        ON CONFLICT (source_pair_id, bucket) DO UPDATE SET
+            open = CASE WHEN EXCLUDED.open_at < t.open_at THEN EXCLUDED.open ELSE t.open END,
+            open_at = LEAST(t.open_at, EXCLUDED.open_at),
+            close = CASE WHEN EXCLUDED.close_at >= t.close_at THEN EXCLUDED.close ELSE t.close END,
+            close_at = GREATEST(t.close_at, EXCLUDED.close_at),
+            high = GREATEST(t.high, EXCLUDED.high),
+            low = LEAST(t.low, EXCLUDED.low),
+            ticks = t.ticks + EXCLUDED.ticks
+    """
+
+
+class RateHistoryWriter:
+    """Буфер тиков с фоновой пакетной записью"""
+
+    def __init__(
+        self,
+        batch_size: int = FX_HISTORY_BATCH_SIZE,
+        flush_interval: float = FX_HISTORY_FLUSH_INTERVAL,
+        max_buffer: int = FX_HISTORY_MAX_BUFFER
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self._buffer: List[Tick] = []
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._flush_lock = asyncio.Lock()
+        self._maintained_at: Optional[float] = None
+        self._stats = {'ticks': 0, 'flushes': 0, 'written': 0, 'dropped': 0, 'errors': 0}
+        self._last_flush_ms: Optional[float] = None
+        self._last_error: Optional[str] = None
+
+    # ------------------------------------------------------------------
+    # Горячий путь
+    # ------------------------------------------------------------------
+
+    def add(self, source_id: int, source_pair_id: int, raw_price: Decimal, final_price: Decimal,
+            applied_rule_id: Optional[int], snapshot_at: datetime):
+        """Добавляет тик в буфер (без I/O)"""
+        self._buffer.append((source_id, source_pair_id, raw_price, final_price, applied_rule_id, snapshot_at))
+        self._stats['ticks'] += 1
+        self._trim()
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def add_many(self, ticks: Iterable[Tick]):
+        """Добавляет пачку тиков (source_id, source_pair_id, raw, final, rule_id, at)"""
+        for tick in ticks:
+            self.add(*tick)
+
+    def _trim(self):
+        """Ограничивает буфер, пока БД недоступна (старые тики отбрасываются)"""
+        overflow = len(self._buffer) - self.max_buffer
+        if overflow > 0:
+            del self._buffer[:overflow]
+            self._stats['dropped'] += overflow
+
+    # ------------------------------------------------------------------
+    # Запись
+    # ------------------------------------------------------------------
+
+    async def flush(self) -> int:
+        """Сбрасывает буфер в БД; при ошибке тики возвращаются в буфер"""
+        async with self._flush_lock:
+            if not self._buffer:
+                return 0
+            batch, self._buffer = self._buffer, []
+            started = time.monotonic()
+            try:
+                await self._write(batch)
+            except Exception as e:
+                self._buffer[:0] = batch
+                self._trim()
+                self._stats['errors'] += 1
+                self._last_error = str(e)
+                logger.error(f"Failed to write {len(batch)} FX history ticks: {e}")
+                return 0
+
+            self._last_flush_ms = (time.monotonic() - started) * 1000
+            self._stats['flushes'] += 1
+            self._stats['written'] += len(batch)
+            logger.debug(f"FX history: {len(batch)} ticks written in {self._last_flush_ms:.0f}ms")
+            return len(batch)
+
+    async def _write(self, batch: List[Tick]):
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            try:
+                await self._write_batch(conn, batch)
+            except Exception as e:
+                # Нет партиции (check_violation, например тики за сутки, до которых
+                # не дошло обслуживание, или буфер за несколько дней простоя БД)
+                if getattr(e, 'sqlstate', None) != CHECK_VIOLATION:
+                    raise
+                await self._ensure_partitions(conn, sorted({tick[5].date() for tick in batch}))
+                await self._write_batch(conn, batch)
+
+    async def _write_batch(self, conn, batch: List[Tick]):
+        async with conn.transaction():
+            await conn.copy_records_to_table('fx_rate_snapshot', records=batch, columns=SNAPSHOT_COLUMNS)
+            for table, size in ROLLUPS.values():
+                await conn.executemany(
+                    _upsert_candles_sql(table),
+                    [candle.as_row() for candle in build_candles(batch, size)]
+                )
+
+    async def _ensure_partitions(self, conn, days: Iterable[date]):
+        for day in days:
+            await conn.execute("SELECT fx_rate_snapshot_ensure_partition($1::date)", day)
+
+    # ------------------------------------------------------------------
+    # Обслуживание
+    # ------------------------------------------------------------------
+
+    async def maintain(self) -> Dict[str, int]:
+        """Создает партиции на сегодня и завтра, удаляет данные старше сроков хранения"""
+        pool = await get_pg_pool()
+        async with pool.acquire() as conn:
+            await conn.execute("SELECT fx_rate_snapshot_ensure_partition(CURRENT_DATE)")
+            await conn.execute("SELECT fx_rate_snapshot_ensure_partition(CURRENT_DATE + 1)")
+            dropped = await conn.fetchval(
+                "SELECT fx_rate_snapshot_drop_partitions(CURRENT_DATE - $1::int)",
+                FX_HISTORY_RETENTION_RAW_DAYS
+            )
+            result = {'raw_partitions_dropped': dropped or 0}
+            for resolution, days in (('1m', FX_HISTORY_RETENTION_1M_DAYS), ('1h', FX_HISTORY_RETENTION_1H_DAYS)):
+                table, _ = ROLLUPS[resolution]
+                status = await conn.execute(
+                    f"DELETE FROM {table} WHERE bucket < now() - make_interval(days => $1)", days
+                )
+                result[f'{resolution}_deleted'] = int(status.split()[-1]) if status else 0
+
+        self._maintained_at = time.monotonic()
+        if any(result.values()):
+            logger.info(f"FX history retention: {result}")
+        return result
+
+    async def _run(self):
+        """Фоновая задача: сброс по размеру или таймеру и периодическое обслуживание"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            await self.flush()
+
+            if self._maintained_at is None or time.monotonic() - self._maintained_at >= FX_HISTORY_MAINTENANCE_INTERVAL:
+                try:
+                    await self.maintain()
+                except Exception as e:
+                    self._maintained_at = time.monotonic()
+                    logger.error(f"FX history maintenance failed: {e}")
+
+    def start(self):
+        """Запускает фоновую запись"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"FX history writer started: batch {self.batch_size}, flush every {self.flush_interval:g}s"
+            )
+
+    async def stop(self):
+        """Останавливает фоновую запись и сбрасывает остаток буфера"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def get_stats(self) -> Dict:
+        """Статистика для мониторинга"""
+        return {
+            **self._stats,
+            'buffered': len(self._buffer),
+            'last_flush_ms': round(self._last_flush_ms, 1) if self._last_flush_ms is not None else None,
+            'last_error': self._last_error,
+        }
+
+
+# ----------------------------------------------------------------------
+# Чтение истории
+# ----------------------------------------------------------------------
+
+def pick_resolution(start: datetime, end: datetime, max_points: int = 1000) -> str:
+    """Самое подробное разрешение, при котором в ответе не больше ~max_points точек на пару"""
+    span = end - start
+    if span <= RAW_MAX_SPAN:
+        return 'raw'
+    if span <= timedelta(minutes=max_points):
+        return '1m'
+    return '1h'
+
+
+async def get_rate_history(
+    source_pair_id: int,
+    start: datetime,
+    end: Optional[datetime] = None,
+    resolution: Optional[str] = None
+) -> List[Dict]:
+    """
+    История финальной цены пары за период
+
+    Запрос идет только в таблицу нужного разрешения и с условием по времени,
+    поэтому из fx_rate_snapshot читаются лишь партиции за эти сутки.
+
+    Args:
+        source_pair_id: ID пары источника
+        start, end: период (end по умолчанию - сейчас)
+        resolution: 'raw', '1m' или '1h' (по умолчанию - по длине периода)
+    """
+    end = end or datetime.now()
+    resolution = resolution or pick_resolution(start, end)
+
+    pool = await get_pg_pool()
+    async with pool.acquire() as conn:
+        if resolution == 'raw':
+            rows = await conn.fetch("""
+                SELECT snapshot_at AS at, raw_price, final_price
+                FROM fx_rate_snapshot
+                WHERE source_pair_id = $1 AND snapshot_at >= $2 AND snapshot_at < $3
+                ORDER BY snapshot_at
+            """, source_pair_id, start, end)
+        else:
+            table, _ = ROLLUPS[resolution]
+            rows = await conn.fetch(f"""
+                SELECT bucket AS at, open, high, low, close, ticks
+                FROM {table}
+                WHERE source_pair_id = $1 AND bucket >= $2 AND bucket < $3
+                ORDER BY bucket
+            """, source_pair_id, start, end)
+
+    return [dict(row) for row in rows]
+
+
+# Глобальный экземпляр
+_rate_history_writer: Optional[RateHistoryWriter] = None
+
+
+def get_rate_history_writer() -> RateHistoryWriter:
+    """Получает глобальный писатель истории тиков"""
+    global _rate_history_writer
+    if _rate_history_writer is None:
+        _rate_history_writer = RateHistoryWriter()
+    return _rate_history_writer
@@ -0,0 +1,177 @@
+"""
+In-memory снапшот базовых курсов (bid/ask по символу)
+
+Снапшот пополняется фоновыми планировщиками (каждый успешный запрос к бирже
+публикует котировку), а хендлеры читают его за O(1) без сетевых запросов.
+Каждая публикация увеличивает версию снапшота.
+"""
+
+import os
+import time
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Максимальный возраст котировки для чтения из снапшота (секунды)
+RATE_SNAPSHOT_MAX_AGE = float(os.getenv("RATE_SNAPSHOT_MAX_AGE", 15))
+# Символ хендлеров перестает обновляться, если его не запрашивали столько секунд
+RATE_SNAPSHOT_TRACK_TTL = float(os.getenv("RATE_SNAPSHOT_TRACK_TTL", 3600))
+# Максимум отслеживаемых символов (при переполнении вытесняется давно не запрошенный)
+RATE_SNAPSHOT_MAX_TRACKED = int(os.getenv("RATE_SNAPSHOT_MAX_TRACKED", 500))
+
+
+@dataclass(frozen=True)
+class RateQuote:
+    """Котировка в снапшоте"""
+    symbol: str
+    source: str
+    best_bid: Optional[Decimal]
+    best_ask: Optional[Decimal]
+    timestamp: datetime   # время получения (для отображения)
+    received_at: float    # time.monotonic() момента публикации
+    version: int
+
+    @property
+    def age(self) -> float:
+        """Возраст котировки в секундах"""
+        return time.monotonic() - self.received_at
+
+    def as_dict(self) -> Dict:
+        """Формат, совместимый с RapiraSimpleClient.get_base_rate"""
+        return {
+            'symbol': self.symbol,
+            'best_ask': self.best_ask,
+            'best_bid': self.best_bid,
+            'timestamp': self.timestamp,
+            'source': self.source,
+            'snapshot_version': self.version,
+        }
+
+
+class RateSnapshotStore:
+    """Версионированное хранилище последних котировок по (source, symbol)"""
+
+    def __init__(
+        self,
+        track_ttl: float = RATE_SNAPSHOT_TRACK_TTL,
+        max_tracked: int = RATE_SNAPSHOT_MAX_TRACKED
+    ):
+        self._quotes: Dict[Tuple[str, str], RateQuote] = {}
+        self._version = 0
+        self.track_ttl = track_ttl
+        self.max_tracked = max_tracked
+        # symbol -> time.monotonic() последнего запроса, от давних к свежим
+        self._tracked: "OrderedDict[str, float]" = OrderedDict()
+        self._subscribers: List[Callable[[RateQuote], None]] = []
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    def publish(
+        self,
+        symbol: str,
+        best_bid: Optional[Decimal],
+        best_ask: Optional[Decimal],
+        source: str = "rapira",
+        timestamp: Optional[datetime] = None
+    ) -> RateQuote:
+        """Публикует новую котировку и уведомляет подписчиков"""
+        self._version += 1
+        quote = RateQuote(
+            symbol=symbol,
+            source=source,
+            best_bid=best_bid,
+            best_ask=best_ask,
+            timestamp=timestamp or datetime.now(),
+            received_at=time.monotonic(),
+            version=self._version,
+        )
+        self._quotes[(source, symbol)] = quote
+
+        for callback in self._subscribers:
+            try:
+                callback(quote)
+            except Exception as e:
+                logger.error(f"Rate snapshot subscriber failed for {symbol}: {e}")
+
+        return quote
+
+    def get(
+        self,
+        symbol: str,
+        source: str = "rapira",
+        max_age: Optional[float] = None
+    ) -> Optional[RateQuote]:
+        """
+        Возвращает котировку или None, если ее нет или она старше max_age
+
+        Args:
+            symbol: Символ пары, например "USDT/RUB"
+            source: Код источника
+            max_age: Допустимый возраст в секундах (None - без ограничения)
+        """
+        quote = self._quotes.get((source, symbol))
+        if quote is None:
+            return None
+        if max_age is not None and quote.age > max_age:
+            return None
+        return quote
+
+    def quotes(self, source: Optional[str] = None) -> List[RateQuote]:
+        """Все последние котировки (опционально одного источника)"""
+        return [q for q in self._quotes.values() if source is None or q.source == source]
+
+    def track(self, symbol: str):
+        """
+        Помечает символ как нужный хендлерам (планировщик будет его обновлять)
+
+        Вызывается только для символов, по которым получена котировка.
+        Запись живет track_ttl секунд с последнего запроса; сверх max_tracked
+        вытесняется давно не запрошенный символ.
+        """
+        self._tracked[symbol] = time.monotonic()
+        self._tracked.move_to_end(symbol)
+        while len(self._tracked) > self.max_tracked:
+            self._tracked.popitem(last=False)
+
+    def tracked_symbols(self) -> List[str]:
+        """Символы, запрошенные хендлерами за последние track_ttl секунд"""
+        expired_before = time.monotonic() - self.track_ttl
+        while self._tracked:
+            symbol, tracked_at = next(iter(self._tracked.items()))
+            if tracked_at >= expired_before:
+                break
+            del self._tracked[symbol]
+        return sorted(self._tracked)
+
+    def subscribe(self, callback: Callable[[RateQuote], None]):
+        """Подписывает callback(quote) на каждую публикацию"""
+        self._subscribers.append(callback)
+
+    def get_stats(self) -> Dict:
+        """Статистика снапшота"""
+        ages = [quote.age for quote in self._quotes.values()]
+        return {
+            'version': self._version,
+            'quotes': len(self._quotes),
+            'tracked_symbols': len(self._tracked),
+            'max_age_seconds': round(max(ages), 1) if ages else None,
+        }
+
+
+# Глобальный экземпляр снапшота
+_rate_snapshot_store: Optional[RateSnapshotStore] = None
+
+
+def get_rate_snapshot_store() -> RateSnapshotStore:
+    """Получает глобальный снапшот курсов"""
+    global _rate_snapshot_store
+    if _rate_snapshot_store is None:
+        _rate_snapshot_store = RateSnapshotStore()
+    return _rate_snapshot_store
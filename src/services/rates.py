@@ -38,62 +38,90 @@ async def add_rate(pair, ask, bid):
     async with pool.acquire() as conn:
         await conn.execute("INSERT INTO rates (pair, ask, bid, source, updated_at) VALUES ($1, $2, $3, 'manual', now()) ON CONFLICT (pair) DO NOTHING", pair, ask, bid)
 
-async def import_rapira_rates():
-    """Импортирует курсы из Rapira API"""
-    from src.db import get_pg_pool
-    from src.services.rapira_simple import get_rapira_simple_client
+async def import_rapira_rates(schedule=None):
+    """
+    Импортирует курсы из Rapira API через шину рыночных данных
+    
+    Один цикл шины обновляет таблицу rates, FX-курсы и Redis.
+    
+    Args:
+        schedule: PollSchedule адаптивного опроса - запрашиваются только пары,
+            у которых подошел срок (None - все пары)
+    
+    Returns:
+        Количество обновленных строк таблицы rates
+    """
+    from src.services.market_data_bus import get_market_data_bus
     
     try:
-        client = await get_rapira_simple_client()
-        pool = await get_pg_pool()
-        
-        # Получаем все пары из БД
-        async with pool.acquire() as conn:
-            pairs = [row["pair"] for row in await conn.fetch("SELECT pair FROM rates")]
-        
-        updated_count = 0
-        for pair in pairs:
-            try:
-                # Получаем базовые курсы из Rapira API
-                base_data = await client.get_base_rate(pair)
-                
-                if base_data and base_data.get('best_ask') and base_data.get('best_bid'):
-                    # Валидация значений перед сохранением (предотвращение overflow)
-                    ask = float(base_data['best_ask'])
-                    bid = float(base_data['best_bid'])
-                    
-                    # Проверка на разумные значения (курс должен быть < 1,000,000)
-                    if ask > 1_000_000 or bid > 1_000_000:
-                        logger.error(f"Курс для {pair} слишком большой (ask={ask}, bid={bid}), пропускаем")
-                        continue
-                    
-                    if ask <= 0 or bid <= 0:
-                        logger.error(f"Курс для {pair} некорректен (ask={ask}, bid={bid}), пропускаем")
-                        continue
-                    
-                    # Обновляем БД с базовыми курсами
-                    async with pool.acquire() as conn:
-                        await conn.execute(
-                            "UPDATE rates SET ask=$1, bid=$2, source='rapira', updated_at=now() WHERE pair=$3",
-                            ask,  # ask для покупки USDT
-                            bid,  # bid для продажи USDT
-                            pair
-                        )
-                        updated_count += 1
-                else:
-                    logger.warning(f"No rate data for {pair}")
-                    
-            except Exception as e:
-                logger.error(f"Failed to import rate for {pair}: {e}")
-                continue
-        
-        logger.info(f"Successfully imported {updated_count}/{len(pairs)} rates from Rapira")
-        return updated_count
-        
+        batch = await get_market_data_bus().poll('rapira', schedule=schedule)
+        if batch is None:
+            return 0
+        for pair, error in batch.errors.items():
+            logger.error(f"Failed to import rate for {pair}: {error}")
+        updated = batch.results.get('rates_table')
+        return updated if isinstance(updated, int) else 0
     except Exception as e:
         logger.error(f"Failed to import Rapira rates: {e}")
         return 0
 
+async def rates_table_symbols() -> Dict[str, List[str]]:
+    """Символы таблицы rates для шины рыночных данных"""
+    from src.db import get_pg_pool
+    pool = await get_pg_pool()
+    async with pool.acquire() as conn:
+        return {'rapira': [row["pair"] for row in await conn.fetch("SELECT pair FROM rates")]}
+
+def _valid_rate_row(pair: str, rate: Dict) -> Optional[tuple]:
+    """(ask, bid, pair) для UPDATE или None, если значения некорректны"""
+    if not rate or not rate.get('best_ask') or not rate.get('best_bid'):
+        return None
+    
+    # Валидация значений перед сохранением (предотвращение overflow)
+    ask = float(rate['best_ask'])
+    bid = float(rate['best_bid'])
+    
+    # Проверка на разумные значения (курс должен быть < 1,000,000)
+    if ask > 1_000_000 or bid > 1_000_000:
+        logger.error(f"Курс для {pair} слишком большой (ask={ask}, bid={bid}), пропускаем")
+        return None
+    
+    if ask <= 0 or bid <= 0:
+        logger.error(f"Курс для {pair} некорректен (ask={ask}, bid={bid}), пропускаем")
+        return None
+    
+    # ask - для покупки USDT, bid - для продажи USDT
+    return ask, bid, pair
+
+async def write_rates_table(batch) -> int:
+    """
+    Подписчик шины: обновляет таблицу rates одним пакетным UPDATE
+    
+    Пары, которых нет в таблице (символы хендлеров и FX), не затрагиваются.
+    """
+    if batch.source != 'rapira' or not batch.rates:
+        return 0
+    
+    rows = [row for row in (_valid_rate_row(pair, rate) for pair, rate in batch.rates.items()) if row]
+    if not rows:
+        return 0
+    
+    from src.db import get_pg_pool
+    pool = await get_pg_pool()
+    async with pool.acquire() as conn:
+        pairs = {row["pair"] for row in await conn.fetch(
+            "SELECT pair FROM rates WHERE pair = ANY($1::text[])", [row[2] for row in rows]
+        )}
+        rows = [row for row in rows if row[2] in pairs]
+        if rows:
+            await conn.executemany(
+                "UPDATE rates SET ask=$1, bid=$2, source='rapira', updated_at=now() WHERE pair=$3",
+                rows
+            )
+    
+    logger.info(f"Successfully imported {len(rows)} rates from Rapira")
+    return len(rows)
+
 async def get_payout_methods(pair: str):
     """Получает доступные методы выплат для пары"""
     # В реальности — фильтрация по паре
@@ -3,6 +3,8 @@ from typing import Dict, Optional, Tuple
 from dataclasses import dataclass
 from enum import Enum
 from src.services.rapira import RapiraProvider, Side, get_rapira_provider
+from src.services.market_stream import get_market_stream
+from src.utils.fixed_point import quote_decimals, round_float
 
 logger = logging.getLogger(__name__)
 
@@ -124,13 +126,21 @@ class RatesCalculator:
     ) -> float:
         """Получает VWAP курс для заданной суммы"""
         try:
+            # Определяем сторону для VWAP
+            side = Side.BID if operation == OperationType.CASH_IN else Side.ASK
+            
+            # Живой стакан из WebSocket-потока - без HTTP-запроса
+            stream = get_market_stream("rapira")
+            book = stream.get_book(pair) if stream else None
+            if book is not None:
+                vwap = book.vwap(side == Side.BID, amount_usd)
+                if vwap is not None:
+                    return vwap
+            
             plate = await provider.get_plate_mini(pair)
             if not plate:
                 raise ValueError(f"No plate data for {pair}")
             
-            # Определяем сторону для VWAP
-            side = Side.BID if operation == OperationType.CASH_IN else Side.ASK
-            
             return await provider.calculate_vwap(plate, side, amount_usd)
             
         except Exception as e:
@@ -217,25 +227,8 @@ class RatesCalculator:
         return rate
     
     def _round_by_quote_currency(self, rate: float, pair: str, operation: OperationType) -> float:
-        """Округляет курс согласно валюте котировки"""
-        # Определяем валюту котировки
-        if "/" in pair:
-            quote_currency = pair.split("/")[1]
-        else:
-            quote_currency = "RUB"  # По умолчанию
-        
-        if quote_currency == "RUB":
-            # Округляем до копеек (2 знака после запятой)
-            return round(rate, 2)
-        elif quote_currency == "USD":
-            # Округляем до центов (2 знака после запятой)
-            return round(rate, 2)
-        elif quote_currency == "USDT":
-            # Округляем до 4 знаков после запятой
-            return round(rate, 4)
-        else:
-            # По умолчанию округляем до 4 знаков
-            return round(rate, 4)
+        """Округляет курс согласно валюте котировки (RUB/USD - 2 знака, USDT и прочие - 4)"""
+        return round_float(rate, quote_decimals(pair))
     
     async def _get_fallback_rate(
         self,
@@ -1,12 +1,19 @@
+import os
 import asyncio
 import logging
 from typing import Optional, Dict, Any
 from datetime import datetime, timedelta
+from src.services.adaptive_polling import PollSchedule, get_adaptive_poller
 from src.services.rapira import get_rapira_provider
 from src.services.rates import import_rapira_rates, get_rapira_health_status
 
 logger = logging.getLogger(__name__)
 
+# Адаптивный опрос: горячие пары - раз в MIN, невостребованные - раз в MAX секунд
+RAPIRA_POLL_MIN_INTERVAL = float(os.getenv("RAPIRA_POLL_MIN_INTERVAL", 2))
+RAPIRA_POLL_MAX_INTERVAL = float(os.getenv("RAPIRA_POLL_MAX_INTERVAL", 30))
+RAPIRA_POLL_TICK = float(os.getenv("RAPIRA_POLL_TICK", 1))  # как часто проверять сроки
+
 class RatesScheduler:
     def __init__(self):
         self._task: Optional[asyncio.Task] = None
@@ -16,22 +23,38 @@ class RatesScheduler:
         self._update_count = 0
         self._error_count = 0
         self._last_error = None
+        self._schedule: Optional[PollSchedule] = None
     
     async def start(self, update_interval: int = 5):
-        """Запускает планировщик обновления курсов"""
+        """
+        Запускает планировщик обновления курсов
+        
+        Каждая пара опрашивается со своим интервалом между RAPIRA_POLL_MIN_INTERVAL
+        и RAPIRA_POLL_MAX_INTERVAL в зависимости от спроса и волатильности;
+        update_interval - интервал при выключенном адаптивном опросе.
+        """
         if self._is_running:
             logger.warning("Rates scheduler is already running")
             return
         
         self._update_interval = update_interval
+        self._schedule = PollSchedule(
+            get_adaptive_poller(),
+            min_interval=min(RAPIRA_POLL_MIN_INTERVAL, update_interval),
+            max_interval=RAPIRA_POLL_MAX_INTERVAL,
+            base_interval=update_interval
+        )
         self._is_running = True
         
-        logger.info(f"Starting rates scheduler with {update_interval}s interval")
+        logger.info(
+            f"Starting rates scheduler: {self._schedule.min_interval:g}-{self._schedule.max_interval:g}s adaptive "
+            f"interval ({update_interval}s when adaptive polling is disabled)"
+        )
         
         self._task = asyncio.create_task(self._scheduler_loop())
         
-        # Первое обновление сразу
-        await self._update_rates()
+        # Первое обновление сразу (все пары - новые для расписания)
+        await self._update_rates(self._schedule)
     
     async def stop(self):
         """Останавливает планировщик"""
@@ -53,10 +76,10 @@ class RatesScheduler:
         """Основной цикл планировщика"""
         while self._is_running:
             try:
-                await asyncio.sleep(self._update_interval)
+                await asyncio.sleep(RAPIRA_POLL_TICK)
                 
                 if self._is_running:
-                    await self._update_rates()
+                    await self._update_rates(self._schedule)
                     
             except asyncio.CancelledError:
                 break
@@ -66,15 +89,17 @@ class RatesScheduler:
                 self._last_error = str(e)
                 await asyncio.sleep(1)  # Пауза перед следующей попыткой
     
-    async def _update_rates(self):
-        """Выполняет обновление курсов"""
+    async def _update_rates(self, schedule: Optional[PollSchedule] = None):
+        """Выполняет обновление курсов (с расписанием - только пары с подошедшим сроком)"""
         try:
             start_time = datetime.now()
             
             logger.debug("Starting rates update from Rapira")
             
             # Обновляем курсы
-            updated_count = await import_rapira_rates()
+            updated_count = await import_rapira_rates(schedule)
+            if schedule is not None and updated_count == 0:
+                return
             
             # Обновляем статистику
             self._last_update = start_time
@@ -154,7 +179,8 @@ class RatesScheduler:
             "last_update": self._last_update.isoformat() if self._last_update else None,
             "update_count": self._update_count,
             "error_count": self._error_count,
-            "last_error": self._last_error
+            "last_error": self._last_error,
+            "polling": self._schedule.get_stats() if self._schedule else None
         }
     
     async def get_full_status(self) -> Dict[str, Any]:
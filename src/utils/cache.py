@@ -1,96 +1,273 @@
 """
 Модуль кэширования для оптимизации запросов к БД
+
+In-process кэш без блокировок: записи разложены по шардам (OrderedDict),
+время - монотонные часы, размер ограничен (LRU/LFU вытеснение),
+память учитывается приблизительно. cached_query поддерживает
+stale-while-revalidate и кэширование пустых результатов.
 """
 
 import asyncio
-from typing import Optional, Dict, Any, Callable
-from datetime import datetime, timedelta
+import os
+import sys
+import time
 import logging
+from collections import OrderedDict
+from typing import Optional, Dict, Any, Callable, List
+
+from src.utils.single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+# Конфигурация
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+CACHE_MAX_MEMORY_MB = float(os.getenv("CACHE_MAX_MEMORY_MB", 64))
+CACHE_SHARDS = int(os.getenv("CACHE_SHARDS", 16))
+CACHE_EVICTION_POLICY = os.getenv("CACHE_EVICTION_POLICY", "lru").lower()  # lru | lfu
+
+# Маркер закэшированного пустого результата (negative caching)
+_NEGATIVE = object()
+
+
+class _Entry:
+    """Запись кэша"""
+    __slots__ = ('value', 'expires_at', 'stale_until', 'size', 'hits')
+
+    def __init__(self, value: Any, expires_at: float, stale_until: float, size: int):
+        self.value = value
+        self.expires_at = expires_at
+        self.stale_until = stale_until
+        self.size = size
+        self.hits = 0
+
+
+class _FrequencyIndex:
+    """
+    Ключи шарда по числу обращений для LFU за O(1)
+
+    Корзины hits -> ключи в порядке добавления (из равных вытесняется
+    давний). Указатель минимальной частоты поддерживается при вставке
+    и обращении; после удаления пустой корзины он пересчитывается лениво.
+    """
+    __slots__ = ('buckets', 'min_hits')
 
-class TTLCache:
-    """Простой кэш с TTL (Time To Live)"""
-    
     def __init__(self):
-        self._cache: Dict[str, Dict[str, Any]] = {}
-        self._lock = asyncio.Lock()
-    
-    async def get(self, key: str) -> Optional[Any]:
-        """Получить значение из кэша"""
-        async with self._lock:
-            if key not in self._cache:
-                return None
-            
-            entry = self._cache[key]
-            
-            # Проверяем TTL
-            if datetime.now() > entry['expires_at']:
-                del self._cache[key]
+        self.buckets: Dict[int, OrderedDict] = {}
+        self.min_hits = 0
+
+    def add(self, key: str):
+        self.buckets.setdefault(0, OrderedDict())[key] = None
+        self.min_hits = 0
+
+    def discard(self, key: str, hits: int):
+        bucket = self.buckets.get(hits)
+        if bucket is not None:
+            bucket.pop(key, None)
+            if not bucket:
+                del self.buckets[hits]
+
+    def touch(self, key: str, hits: int):
+        """Переносит ключ из корзины hits в hits + 1"""
+        self.discard(key, hits)
+        self.buckets.setdefault(hits + 1, OrderedDict())[key] = None
+        if self.min_hits == hits and hits not in self.buckets:
+            self.min_hits = hits + 1
+
+    def least(self) -> Optional[str]:
+        """Ключ с наименьшим числом обращений (None - индекс пуст)"""
+        if not self.buckets:
+            return None
+        if self.min_hits not in self.buckets:
+            self.min_hits = min(self.buckets)
+        return next(iter(self.buckets[self.min_hits]))
+
+    def clear(self):
+        self.buckets.clear()
+        self.min_hits = 0
+
+
+def _approx_size(key: str, value: Any) -> int:
+    """Приблизительный размер записи в байтах (без глубокого обхода)"""
+    size = sys.getsizeof(key) + sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(k) + sys.getsizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(sys.getsizeof(v) for v in value)
+    return size
+
+
+class TTLCache:
+    """
+    Шардированный ограниченный кэш с TTL
+
+    Чтение не берет блокировок: все операции синхронны внутри event loop,
+    а async-методы оставлены для совместимости.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = CACHE_MAX_ENTRIES,
+        max_memory_bytes: Optional[int] = int(CACHE_MAX_MEMORY_MB * 1024 * 1024),
+        shards: int = CACHE_SHARDS,
+        policy: str = CACHE_EVICTION_POLICY
+    ):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self._shards: List[OrderedDict] = [OrderedDict() for _ in range(max(shards, 1))]
+        self._shard_max_entries = max(1, -(-max_entries // len(self._shards)))
+        self._shard_max_bytes = (max_memory_bytes // len(self._shards)) if max_memory_bytes else None
+        self._shard_bytes = [0] * len(self._shards)
+        self._policy = policy
+        self._frequencies = [_FrequencyIndex() for _ in self._shards] if policy == 'lfu' else None
+        self._max_entries = max_entries
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _shard_index(self, key: str) -> int:
+        return hash(key) % len(self._shards)
+
+    def get_entry(self, key: str, allow_stale: bool = False) -> Optional[_Entry]:
+        """Возвращает запись (свежую или, при allow_stale, устаревшую в пределах stale-окна)"""
+        index = self._shard_index(key)
+        shard = self._shards[index]
+        entry = shard.get(key)
+        if entry is None:
+            self._misses += 1
+            return None
+
+        now = time.monotonic()
+        if now > entry.expires_at:
+            if now > entry.stale_until:
+                self._remove(index, key)
+                self._misses += 1
                 logger.debug(f"Cache expired for key: {key}")
                 return None
-            
-            logger.debug(f"Cache hit for key: {key}")
-            return entry['value']
-    
-    async def set(self, key: str, value: Any, ttl_seconds: int = 60):
+            if not allow_stale:
+                self._misses += 1
+                return None
+
+        if self._policy == 'lru':
+            shard.move_to_end(key)
+        else:
+            self._frequencies[index].touch(key, entry.hits)
+        entry.hits += 1
+        self._hits += 1
+        return entry
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Получить значение из кэша"""
+        entry = self.get_entry(key)
+        if entry is None or entry.value is _NEGATIVE:
+            return None
+        return entry.value
+
+    def set_nowait(self, key: str, value: Any, ttl_seconds: float = 60, stale_ttl_seconds: float = 0):
+        """Сохранить значение в кэш с TTL (синхронно)"""
+        index = self._shard_index(key)
+        shard = self._shards[index]
+        if key in shard:
+            self._remove(index, key)
+
+        now = time.monotonic()
+        expires_at = now + ttl_seconds
+        entry = _Entry(value, expires_at, expires_at + stale_ttl_seconds, _approx_size(key, value))
+        shard[key] = entry
+        self._shard_bytes[index] += entry.size
+        # Новый ключ попадает в LFU-индекс после вытеснения, чтобы не стать его жертвой
+        self._evict(index)
+        if self._frequencies is not None:
+            self._frequencies[index].add(key)
+
+    async def set(self, key: str, value: Any, ttl_seconds: float = 60, stale_ttl_seconds: float = 0):
         """Сохранить значение в кэш с TTL"""
-        async with self._lock:
-            self._cache[key] = {
-                'value': value,
-                'expires_at': datetime.now() + timedelta(seconds=ttl_seconds),
-                'created_at': datetime.now()
-            }
-            logger.debug(f"Cache set for key: {key}, TTL: {ttl_seconds}s")
-    
+        self.set_nowait(key, value, ttl_seconds, stale_ttl_seconds)
+        logger.debug(f"Cache set for key: {key}, TTL: {ttl_seconds}s")
+
+    def _remove(self, index: int, key: str):
+        entry = self._shards[index].pop(key, None)
+        if entry is not None:
+            self._shard_bytes[index] -= entry.size
+            if self._frequencies is not None:
+                self._frequencies[index].discard(key, entry.hits)
+
+    def _evict(self, index: int):
+        """Вытесняет записи из шарда сверх лимитов (LRU - давний, LFU - редкий ключ)"""
+        shard = self._shards[index]
+        while len(shard) > self._shard_max_entries or (
+            self._shard_max_bytes is not None
+            and self._shard_bytes[index] > self._shard_max_bytes
+            and len(shard) > 1
+        ):
+            if self._policy == 'lru':
+                victim = next(iter(shard))
+            else:
+                victim = self._frequencies[index].least()
+                if victim is None:
+                    break
+            self._remove(index, victim)
+            self._evictions += 1
+
     async def delete(self, key: str):
         """Удалить значение из кэша"""
-        async with self._lock:
-            if key in self._cache:
-                del self._cache[key]
-                logger.debug(f"Cache deleted for key: {key}")
-    
+        self._remove(self._shard_index(key), key)
+        logger.debug(f"Cache deleted for key: {key}")
+
+    def delete_prefix(self, prefix: str) -> int:
+        """Удалить все ключи с префиксом, возвращает количество удаленных"""
+        removed = 0
+        for index, shard in enumerate(self._shards):
+            for key in [k for k in shard if k.startswith(prefix)]:
+                self._remove(index, key)
+                removed += 1
+        return removed
+
     async def clear(self):
         """Очистить весь кэш"""
-        async with self._lock:
-            self._cache.clear()
-            logger.info("Cache cleared")
-    
+        for index, shard in enumerate(self._shards):
+            shard.clear()
+            self._shard_bytes[index] = 0
+            if self._frequencies is not None:
+                self._frequencies[index].clear()
+        logger.info("Cache cleared")
+
     async def clear_expired(self):
-        """Удалить все истекшие записи"""
-        async with self._lock:
-            now = datetime.now()
-            expired_keys = [
-                key for key, entry in self._cache.items()
-                if now > entry['expires_at']
-            ]
-            
-            for key in expired_keys:
-                del self._cache[key]
-            
-            if expired_keys:
-                logger.info(f"Cleared {len(expired_keys)} expired cache entries")
-    
+        """Удалить все записи, у которых истекло и stale-окно"""
+        now = time.monotonic()
+        removed = 0
+        for index, shard in enumerate(self._shards):
+            for key in [k for k, e in shard.items() if now > e.stale_until]:
+                self._remove(index, key)
+                removed += 1
+
+        if removed:
+            logger.info(f"Cleared {removed} expired cache entries")
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self._shards)
+
     def get_stats(self) -> Dict[str, Any]:
-        """Получить статистику кэша"""
+        """Получить статистику кэша (без перебора записей)"""
+        lookups = self._hits + self._misses
         return {
-            'total_entries': len(self._cache),
-            'entries': [
-                {
-                    'key': key,
-                    'created_at': entry['created_at'].isoformat(),
-                    'expires_at': entry['expires_at'].isoformat(),
-                    'ttl_remaining': int((entry['expires_at'] - datetime.now()).total_seconds())
-                }
-                for key, entry in self._cache.items()
-            ]
+            'total_entries': len(self),
+            'max_entries': self._max_entries,
+            'approx_memory_bytes': sum(self._shard_bytes),
+            'shards': len(self._shards),
+            'policy': self._policy,
+            'hits': self._hits,
+            'misses': self._misses,
+            'hit_rate': round(self._hits / lookups, 3) if lookups else None,
+            'evictions': self._evictions,
         }
 
 
 # Глобальный экземпляр кэша
 _global_cache: Optional[TTLCache] = None
 
+# Объединение одновременных загрузок одного ключа
+_loads = SingleFlight()
+
 
 def get_cache() -> TTLCache:
     """Получить глобальный кэш"""
@@ -100,47 +277,78 @@ def get_cache() -> TTLCache:
     return _global_cache
 
 
+async def _load(
+    cache: TTLCache,
+    key: str,
+    query_func: Callable,
+    ttl_seconds: float,
+    stale_ttl_seconds: float,
+    negative_ttl_seconds: Optional[float]
+) -> Any:
+    """Выполняет запрос и сохраняет результат (одна загрузка на ключ)"""
+    async def load():
+        logger.debug(f"Cache miss for key: {key}, executing query...")
+        result = await query_func()
+        if result is None:
+            if negative_ttl_seconds:
+                cache.set_nowait(key, _NEGATIVE, negative_ttl_seconds)
+        else:
+            cache.set_nowait(key, result, ttl_seconds, stale_ttl_seconds)
+        return result
+
+    return await _loads.do(("cache", key), load)
+
+
+def _log_refresh_error(task: asyncio.Task):
+    """Логирует ошибку фонового обновления значения"""
+    if not task.cancelled() and task.exception():
+        logger.error(f"Background cache refresh failed: {task.exception()}")
+
+
 async def cached_query(
     key: str,
     query_func: Callable,
     ttl_seconds: int = 60,
-    force_refresh: bool = False
+    force_refresh: bool = False,
+    stale_ttl_seconds: int = 0,
+    negative_ttl_seconds: Optional[int] = None
 ) -> Any:
     """
     Декоратор для кэширования результатов запросов
-    
+
     Args:
         key: Ключ кэша
         query_func: Async функция для выполнения запроса
         ttl_seconds: Время жизни кэша в секундах
         force_refresh: Принудительно обновить кэш
-        
+        stale_ttl_seconds: Сколько еще отдавать устаревшее значение,
+            обновляя его в фоне (stale-while-revalidate)
+        negative_ttl_seconds: TTL для пустого результата (None - не кэшировать)
+
     Returns:
         Результат запроса (из кэша или свежий)
     """
     cache = get_cache()
-    
+
     if not force_refresh:
-        cached_value = await cache.get(key)
-        if cached_value is not None:
-            return cached_value
-    
-    # Выполняем запрос
-    logger.debug(f"Cache miss for key: {key}, executing query...")
-    result = await query_func()
-    
-    # Сохраняем в кэш
-    await cache.set(key, result, ttl_seconds)
-    
-    return result
+        entry = cache.get_entry(key, allow_stale=stale_ttl_seconds > 0)
+        if entry is not None:
+            if time.monotonic() > entry.expires_at:
+                # Отдаем устаревшее значение и обновляем в фоне
+                task = asyncio.ensure_future(
+                    _load(cache, key, query_func, ttl_seconds, stale_ttl_seconds, negative_ttl_seconds)
+                )
+                task.add_done_callback(_log_refresh_error)
+            return None if entry.value is _NEGATIVE else entry.value
+
+    return await _load(cache, key, query_func, ttl_seconds, stale_ttl_seconds, negative_ttl_seconds)
 
 
 # Периодическая очистка истекших записей
 async def start_cache_cleaner(interval_seconds: int = 300):
     """Запускает периодическую очистку истекших записей кэша"""
     cache = get_cache()
-    
+
     while True:
         await asyncio.sleep(interval_seconds)
         await cache.clear_expired()
-
@@ -0,0 +1,349 @@
+"""
+Политика вызовов внешних бирж: deadline, повторы, hedging, circuit breaker
+
+Каждый источник (rapira, grinex) получает свою политику. Вызов через
+CallPolicy.call():
+
+- ограничен deadline вызывающего: повторы и паузы укладываются в бюджет,
+  поэтому задержка для пользователя не превышает deadline, а не растет
+  по расписанию повторов;
+- при отсутствии ответа дольше p95 последних запросов отправляется
+  страхующий (hedged) запрос, побеждает первый успешный;
+- после CALL_BREAKER_FAILURES неудач подряд breaker размыкается, и вызовы
+  сразу падают с CircuitOpenError (вызывающий отдает последний известный
+  курс); через CALL_BREAKER_RESET секунд пропускается один пробный запрос.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, List, Optional
+
+import httpx
+
+from src.utils.single_flight import get_single_flight
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация по умолчанию (переопределяется переменными <SOURCE>_CALL_*)
+CALL_DEADLINE_SECONDS = float(os.getenv("CALL_DEADLINE_SECONDS", 5))
+CALL_MAX_ATTEMPTS = int(os.getenv("CALL_MAX_ATTEMPTS", 3))
+CALL_RETRY_BACKOFF = float(os.getenv("CALL_RETRY_BACKOFF", 0.2))  # первая пауза, далее x2
+CALL_BREAKER_FAILURES = int(os.getenv("CALL_BREAKER_FAILURES", 5))
+CALL_BREAKER_RESET = float(os.getenv("CALL_BREAKER_RESET", 30))
+CALL_HEDGE_ENABLED = os.getenv("CALL_HEDGE_ENABLED", "true").lower() == "true"
+CALL_HEDGE_MIN_DELAY = float(os.getenv("CALL_HEDGE_MIN_DELAY", 0.05))
+CALL_HEDGE_MIN_SAMPLES = int(os.getenv("CALL_HEDGE_MIN_SAMPLES", 20))
+
+
+def _setting(source: str, name: str, default):
+    """<SOURCE>_CALL_<NAME> из окружения или значение по умолчанию"""
+    value = os.getenv(f"{source.upper()}_CALL_{name}")
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() == "true"
+    return type(default)(value)
+
+
+class CircuitOpenError(Exception):
+    """Breaker источника разомкнут - запрос не отправлялся"""
+
+    def __init__(self, source: str, retry_in: float):
+        super().__init__(f"Circuit breaker for {source} is open (retry in {retry_in:.1f}s)")
+        self.source = source
+        self.retry_in = retry_in
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Бюджет времени вызова исчерпан"""
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Сетевые ошибки, таймауты, 429 и 5xx имеет смысл повторить; прочие 4xx - нет"""
+    if isinstance(error, httpx.HTTPStatusError):
+        status = error.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError, ConnectionError))
+
+
+class CircuitBreaker:
+    """Breaker: closed -> open после N неудач подряд -> half_open (один пробный запрос)"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = CALL_BREAKER_FAILURES, reset_timeout: float = CALL_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self.opens = 0
+
+    @property
+    def state(self) -> str:
+        if self._opened_at is None:
+            return self.CLOSED
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def retry_in(self) -> float:
+        """Через сколько секунд будет пропущен пробный запрос"""
+        if self._opened_at is None:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+
+    def allow(self) -> bool:
+        """Можно ли отправить запрос (в half_open - только один пробный)"""
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        if self._opened_at is not None:
+            logger.info("Circuit breaker closed after successful probe")
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._failures += 1
+        if self._probe_in_flight or (self._opened_at is None and self._failures >= self.failure_threshold):
+            self._opened_at = time.monotonic()
+            self.opens += 1
+        self._probe_in_flight = False
+
+    def record_rejected(self):
+        """
+        Источник ответил, но не результатом (4xx, неожиданный формат)
+
+        Счетчик неудач подряд не меняется; пробный запрос с таким ответом
+        не замыкает breaker, а снова размыкает его.
+        """
+        if self._probe_in_flight:
+            self._opened_at = time.monotonic()
+            self.opens += 1
+        self._probe_in_flight = False
+
+    def record_cancelled(self):
+        """
+        Вызов отменен (deadline вызывающего, single-flight, остановка)
+
+        Пробный запрос без ответа считается неудачным: breaker снова
+        размыкается, иначе флаг пробы остался бы навсегда и источник
+        больше не получил бы ни одного запроса.
+        """
+        self.record_rejected()
+
+
+class CallPolicy:
+    """Политика вызовов одного источника"""
+
+    def __init__(
+        self,
+        source: str,
+        deadline: Optional[float] = None,
+        max_attempts: Optional[int] = None,
+        backoff: Optional[float] = None,
+        hedge: Optional[bool] = None,
+        breaker: Optional[CircuitBreaker] = None
+    ):
+        self.source = source
+        self.deadline = deadline if deadline is not None else _setting(source, "DEADLINE", CALL_DEADLINE_SECONDS)
+        self.max_attempts = max_attempts or _setting(source, "MAX_ATTEMPTS", CALL_MAX_ATTEMPTS)
+        self.backoff = backoff if backoff is not None else _setting(source, "RETRY_BACKOFF", CALL_RETRY_BACKOFF)
+        self.hedge = hedge if hedge is not None else _setting(source, "HEDGE_ENABLED", CALL_HEDGE_ENABLED)
+        self.breaker = breaker or CircuitBreaker(
+            _setting(source, "BREAKER_FAILURES", CALL_BREAKER_FAILURES),
+            _setting(source, "BREAKER_RESET", CALL_BREAKER_RESET),
+        )
+        self._latencies: Deque[float] = deque(maxlen=200)
+        self._stats = {
+            "calls": 0, "successes": 0, "failures": 0, "retries": 0,
+            "hedges": 0, "hedge_wins": 0, "short_circuits": 0, "deadline_exceeded": 0,
+        }
+
+    # ------------------------------------------------------------------
+    # Вызов
+    # ------------------------------------------------------------------
+
+    async def call(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        deadline: Optional[float] = None,
+        key: Optional[Hashable] = None
+    ) -> Any:
+        """
+        Выполняет func() по политике источника
+
+        Args:
+            func: фабрика корутины одного запроса (вызывается на каждую попытку)
+            deadline: бюджет в секундах от вызывающего (по умолчанию политики)
+            key: ключ single-flight - одинаковые одновременные вызовы объединяются
+
+        Raises:
+            CircuitOpenError: breaker разомкнут
+            DeadlineExceeded: бюджет исчерпан
+        """
+        budget = deadline if deadline is not None else self.deadline
+        if not self.breaker.allow():
+            self._stats["short_circuits"] += 1
+            raise CircuitOpenError(self.source, self.breaker.retry_in())
+
+        deadline_at = time.monotonic() + budget
+        if key is None:
+            return await self._execute(func, deadline_at)
+
+        # Общий запрос выполняется с бюджетом первого вызывающего,
+        # остальные ждут его не дольше своего deadline
+        try:
+            return await asyncio.wait_for(
+                get_single_flight().do(key, lambda: self._execute(func, deadline_at)),
+                timeout=budget
+            )
+        except asyncio.TimeoutError as e:
+            if isinstance(e, DeadlineExceeded):
+                raise
+            self._stats["deadline_exceeded"] += 1
+            raise DeadlineExceeded(f"{self.source}: deadline {budget:.2f}s exceeded") from None
+        except asyncio.CancelledError:
+            # Отмена до запуска общего запроса: пробный запрос так и не ушел
+            self.breaker.record_cancelled()
+            raise
+
+    async def _execute(self, func: Callable[[], Awaitable[Any]], deadline_at: float) -> Any:
+        """Вызов целиком; отмена на любом шаге (попытка, пауза) освобождает пробу breaker"""
+        self._stats["calls"] += 1
+        try:
+            return await self._attempts(func, deadline_at)
+        except asyncio.CancelledError:
+            self.breaker.record_cancelled()
+            raise
+
+    async def _attempts(self, func: Callable[[], Awaitable[Any]], deadline_at: float) -> Any:
+        """Попытки с паузами, пока позволяет бюджет"""
+        attempt = 0
+        delay = self.backoff
+        while True:
+            attempt += 1
+            try:
+                result = await self._attempt(func, deadline_at)
+                self._stats["successes"] += 1
+                self.breaker.record_success()
+                return result
+            except Exception as e:
+                retryable = is_retryable(e)
+                if retryable:
+                    self.breaker.record_failure()
+                else:
+                    # Биржа ответила (4xx, неожиданный формат): не недоступность, но и не успех
+                    self.breaker.record_rejected()
+                remaining = deadline_at - time.monotonic()
+                if isinstance(e, DeadlineExceeded):
+                    self._stats["deadline_exceeded"] += 1
+                if (attempt >= self.max_attempts or not retryable
+                        or remaining <= delay or not self.breaker.allow()):
+                    self._stats["failures"] += 1
+                    logger.warning(f"{self.source} call failed after {attempt} attempt(s): {e!r}")
+                    raise
+                self._stats["retries"] += 1
+                logger.debug(f"{self.source} retry {attempt}/{self.max_attempts - 1} after {delay:.2f}s: {e!r}")
+                await asyncio.sleep(delay)
+                delay *= 2
+
+    async def _attempt(self, func: Callable[[], Awaitable[Any]], deadline_at: float) -> Any:
+        """Одна попытка: основной запрос и, при задержке дольше p95, страхующий"""
+        started = time.monotonic()
+        tasks: List[asyncio.Task] = [asyncio.ensure_future(func())]
+        hedge_at = self._hedge_delay()
+        hedge_at = started + hedge_at if hedge_at is not None else None
+        hedge_task: Optional[asyncio.Task] = None
+        last_error: Optional[BaseException] = None
+
+        try:
+            while tasks:
+                now = time.monotonic()
+                if now >= deadline_at:
+                    raise DeadlineExceeded(f"{self.source}: deadline exceeded")
+
+                wait_until = deadline_at
+                if hedge_at is not None and hedge_task is None and last_error is None:
+                    wait_until = min(deadline_at, hedge_at)
+                done, _ = await asyncio.wait(
+                    tasks, timeout=max(0.0, wait_until - now), return_when=asyncio.FIRST_COMPLETED
+                )
+
+                if not done:
+                    if wait_until < deadline_at:
+                        self._stats["hedges"] += 1
+                        hedge_task = asyncio.ensure_future(func())
+                        tasks.append(hedge_task)
+                    continue
+
+                for task in done:
+                    tasks.remove(task)
+                    error = task.exception()
+                    if error is None:
+                        if task is hedge_task:
+                            self._stats["hedge_wins"] += 1
+                        self._latencies.append(time.monotonic() - started)
+                        return task.result()
+                    last_error = error
+
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def _hedge_delay(self) -> Optional[float]:
+        """Задержка страхующего запроса (p95), None - hedging выключен или мало данных"""
+        if not self.hedge or len(self._latencies) < CALL_HEDGE_MIN_SAMPLES:
+            return None
+        return max(CALL_HEDGE_MIN_DELAY, self.p95())
+
+    def p95(self) -> float:
+        """p95 длительности успешных попыток (секунды)"""
+        if not self._latencies:
+            return 0.0
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+    def get_stats(self) -> Dict:
+        """Статистика для мониторинга"""
+        return {
+            **self._stats,
+            "breaker": self.breaker.state,
+            "breaker_opens": self.breaker.opens,
+            "p95_ms": round(self.p95() * 1000, 1),
+            "deadline_seconds": self.deadline,
+        }
+
+
+# Политики по источникам
+_policies: Dict[str, CallPolicy] = {}
+
+
+def get_call_policy(source: str, **defaults) -> CallPolicy:
+    """
+    Получает политику вызовов источника
+
+    defaults (max_attempts, deadline, ...) применяются при первом создании.
+    """
+    policy = _policies.get(source)
+    if policy is None:
+        policy = _policies[source] = CallPolicy(source, **defaults)
+    return policy
+
+
+def get_call_policies_stats() -> Dict[str, Dict]:
+    """Статистика всех политик: {"rapira": {...}, "grinex": {...}}"""
+    return {source: policy.get_stats() for source, policy in _policies.items()}
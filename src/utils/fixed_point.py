@@ -0,0 +1,229 @@
+"""
+Арифметика цен в целых числах с фиксированной точкой
+
+Цена хранится целым числом единиц 10^-PRICE_DECIMALS, процент наценки -
+единицами 10^-PERCENT_DECIMALS. Наценка
+
+    final = price * (1 + percent/100) + fixed
+
+считается одной целочисленной дробью и округляется один раз до точности
+валюты котировки. Результат точный (без двоичной погрешности float) и
+совпадает с Decimal.quantize для всех четырех режимов округления.
+Параметры наценки приводятся к целым один раз (Markup), а на каждую
+котировку остаются умножение, сложение и divmod над небольшими целыми -
+это в разы дешевле Decimal (см. benchmarks/bench_fixed_point.py).
+"""
+
+from decimal import Decimal
+from functools import lru_cache
+from math import gcd
+from typing import Callable, Dict, Tuple, Union
+
+Number = Union[Decimal, float, int, str]
+
+# Точность хранения цен и фиксированных наценок (знаков после запятой)
+PRICE_DECIMALS = 8
+PRICE_SCALE = 10 ** PRICE_DECIMALS
+
+# Точность процента наценки (2.5% -> 2_500_000)
+PERCENT_DECIMALS = 6
+PERCENT_SCALE = 10 ** PERCENT_DECIMALS
+_HUNDRED_PERCENT = 100 * PERCENT_SCALE
+
+# Точность валют котировки (знаков после запятой)
+CURRENCY_DECIMALS: Dict[str, int] = {
+    'RUB': 2,
+    'USD': 2,
+    'EUR': 2,
+    'USDT': 4,
+}
+DEFAULT_CURRENCY_DECIMALS = 4
+
+# Режимы округления (названия совпадают с RoundingMode в fx_rates)
+ROUND_HALF_UP = 'ROUND_HALF_UP'
+ROUND_DOWN = 'ROUND_DOWN'
+ROUND_UP = 'ROUND_UP'
+BANKERS = 'BANKERS'
+
+
+# ----------------------------------------------------------------------
+# Округление целочисленной дроби num/den (den > 0)
+# ----------------------------------------------------------------------
+
+def _div_half_up(num: int, den: int) -> int:
+    """Половина - от нуля"""
+    q, r = divmod(num, den)
+    r2 = 2 * r
+    if r2 > den or (r2 == den and num > 0):
+        q += 1
+    return q
+
+
+def _div_down(num: int, den: int) -> int:
+    """К нулю"""
+    q, r = divmod(num, den)
+    if r and num < 0:
+        q += 1
+    return q
+
+
+def _div_up(num: int, den: int) -> int:
+    """От нуля"""
+    q, r = divmod(num, den)
+    if r and num > 0:
+        q += 1
+    return q
+
+
+def _div_half_even(num: int, den: int) -> int:
+    """Банковское: половина - к четному"""
+    q, r = divmod(num, den)
+    r2 = 2 * r
+    if r2 > den or (r2 == den and q & 1):
+        q += 1
+    return q
+
+
+_DIVIDERS: Dict[str, Callable[[int, int], int]] = {
+    ROUND_HALF_UP: _div_half_up,
+    ROUND_DOWN: _div_down,
+    ROUND_UP: _div_up,
+    BANKERS: _div_half_even,
+}
+
+
+def get_divider(mode) -> Callable[[int, int], int]:
+    """Функция округления по режиму (строка или RoundingMode, по умолчанию ROUND_HALF_UP)"""
+    return _DIVIDERS.get(getattr(mode, 'value', mode), _div_half_up)
+
+
+# ----------------------------------------------------------------------
+# Преобразования
+# ----------------------------------------------------------------------
+
+def to_ratio(value: Number) -> Tuple[int, int]:
+    """
+    Точная дробь (numerator, denominator) для значения
+
+    float приводится к PRICE_DECIMALS знакам: 81.53 - это 81.53, а не
+    ближайшее двоичное 81.5299999...
+    """
+    if isinstance(value, int):
+        return value, 1
+    if isinstance(value, float):
+        return round(value * PRICE_SCALE), PRICE_SCALE
+    if not isinstance(value, Decimal):
+        value = Decimal(value)
+    return value.as_integer_ratio()
+
+
+def to_units(value: Number, decimals: int = PRICE_DECIMALS, mode=BANKERS) -> int:
+    """Значение в целых единицах 10^-decimals"""
+    num, den = to_ratio(value)
+    return get_divider(mode)(num * 10 ** decimals, den)
+
+
+def from_units(units: int, decimals: int) -> Decimal:
+    """Целые единицы 10^-decimals -> Decimal с decimals знаками"""
+    return Decimal(units).scaleb(-decimals)
+
+
+def quote_decimals(pair: str) -> int:
+    """Точность валюты котировки пары (USDT/RUB -> 2)"""
+    quote = pair.split('/')[1] if '/' in pair else 'RUB'
+    return CURRENCY_DECIMALS.get(quote.upper(), DEFAULT_CURRENCY_DECIMALS)
+
+
+def round_decimal(value: Number, decimals: int, mode=ROUND_HALF_UP) -> Decimal:
+    """Округляет значение до decimals знаков (аналог Decimal.quantize)"""
+    return from_units(to_units(value, decimals, mode), decimals)
+
+
+def round_float(value: Number, decimals: int, mode=ROUND_HALF_UP) -> float:
+    """Округляет значение до decimals знаков и возвращает float"""
+    return to_units(value, decimals, mode) / 10 ** decimals
+
+
+# ----------------------------------------------------------------------
+# Наценка
+# ----------------------------------------------------------------------
+
+class Markup:
+    """
+    Наценка, приведенная к целым числам
+
+    Для цены p = n/d результат в единицах 10^-round_to:
+
+        (n * A + B * d) / (D * d)
+
+    где A, B и D вычисляются один раз при создании и сокращаются на общий
+    делитель, чтобы на горячем пути числа оставались маленькими. Для цены в
+    единицах PRICE_DECIMALS (float и матрица цен) знаменатель d известен
+    заранее и тоже свернут в константы.
+    """
+    __slots__ = ('percent', 'fixed', 'round_to', 'mode', '_a', '_b', '_d',
+                 '_ua', '_ub', '_ud', '_div', '_scale')
+
+    def __init__(self, percent: Number = 0, fixed: Number = 0, round_to: int = 2, mode=ROUND_HALF_UP):
+        self.percent = percent
+        self.fixed = fixed
+        self.round_to = round_to
+        self.mode = getattr(mode, 'value', mode)
+
+        percent_units = to_units(percent, PERCENT_DECIMALS)
+        fixed_units = to_units(fixed, PRICE_DECIMALS)
+        self._scale = 10 ** round_to
+        self._div = get_divider(self.mode)
+
+        a = (_HUNDRED_PERCENT + percent_units) * PRICE_SCALE * self._scale
+        b = fixed_units * _HUNDRED_PERCENT * self._scale
+        d = _HUNDRED_PERCENT * PRICE_SCALE
+        g = gcd(a, b, d)
+        self._a, self._b, self._d = a // g, b // g, d // g
+
+        # Цена в единицах 10^-PRICE_DECIMALS: (u * A + B * S) / (D * S)
+        ub = b * PRICE_SCALE
+        ud = d * PRICE_SCALE
+        g = gcd(a, ub, ud)
+        self._ua, self._ub, self._ud = a // g, ub // g, ud // g
+
+    def apply_ratio(self, num: int, den: int = 1) -> int:
+        """Наценка к цене num/den, результат в единицах 10^-round_to"""
+        if den == 1:
+            return self._div(num * self._a + self._b, self._d)
+        return self._div(num * self._a + self._b * den, self._d * den)
+
+    def apply_units(self, price_units: int) -> int:
+        """Наценка к цене в единицах 10^-PRICE_DECIMALS"""
+        return self._div(price_units * self._ua + self._ub, self._ud)
+
+    def apply_decimal(self, price: Number) -> Decimal:
+        """Наценка к цене, результат Decimal с round_to знаками"""
+        return from_units(self.apply_ratio(*to_ratio(price)), self.round_to)
+
+    def apply_float(self, price: Number) -> float:
+        """Наценка к цене, результат float"""
+        if isinstance(price, float):
+            return self.apply_units(round(price * PRICE_SCALE)) / self._scale
+        return self.apply_ratio(*to_ratio(price)) / self._scale
+
+    def __repr__(self) -> str:
+        return f"Markup(percent={self.percent}, fixed={self.fixed}, round_to={self.round_to}, mode={self.mode})"
+
+
+@lru_cache(maxsize=4096)
+def get_markup(percent: Number = 0, fixed: Number = 0, round_to: int = 2, mode=ROUND_HALF_UP) -> Markup:
+    """Наценка из кэша (параметры правил и городов повторяются)"""
+    return Markup(percent, fixed, round_to, mode)
+
+
+def apply_markup(price: Number, percent: Number = 0, fixed: Number = 0,
+                 round_to: int = 2, mode=ROUND_HALF_UP) -> Decimal:
+    """price * (1 + percent/100) + fixed с округлением до round_to знаков"""
+    return get_markup(percent, fixed, round_to, getattr(mode, 'value', mode)).apply_decimal(price)
+
+
+def apply_markup_float(price: Number, percent: Number = 0, fixed: Number = 0,
+                       round_to: int = 2, mode=ROUND_HALF_UP) -> float:
+    """То же, что apply_markup, но возвращает float"""
+    return get_markup(percent, fixed, round_to, getattr(mode, 'value', mode)).apply_float(price)
@@ -0,0 +1,86 @@
+"""
+Общий пул HTTP-соединений для клиентов бирж и внешних API
+
+Один долгоживущий httpx.AsyncClient на хост: keep-alive, HTTP/2 (если
+установлен пакет h2), лимит соединений на хост и корректное закрытие
+при остановке бота / веб-админки.
+"""
+
+import os
+import logging
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+HTTP_MAX_CONNECTIONS_PER_HOST = int(os.getenv("HTTP_MAX_CONNECTIONS_PER_HOST", 20))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", 10))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 60))  # секунды
+HTTP_DEFAULT_TIMEOUT = float(os.getenv("HTTP_DEFAULT_TIMEOUT", 10))  # секунды
+HTTP_ENABLE_HTTP2 = os.getenv("HTTP_ENABLE_HTTP2", "true").lower() == "true"
+
+try:
+    import h2  # noqa: F401
+    _H2_AVAILABLE = True
+except ImportError:
+    _H2_AVAILABLE = False
+
+
+# Клиенты по хосту: {"https://api.rapira.net": AsyncClient}
+_clients: Dict[str, httpx.AsyncClient] = {}
+
+
+def _host_key(url: str) -> str:
+    """Нормализует URL до scheme://host[:port]"""
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def get_http_client(url: str, timeout: Optional[float] = None) -> httpx.AsyncClient:
+    """
+    Возвращает общий клиент для хоста из url
+
+    Args:
+        url: Любой URL на нужном хосте (используются только scheme и host)
+        timeout: Таймаут по умолчанию для нового клиента (секунды)
+
+    Returns:
+        Долгоживущий httpx.AsyncClient с пулом keep-alive соединений
+    """
+    key = _host_key(url)
+    client = _clients.get(key)
+
+    if client is None or client.is_closed:
+        http2 = HTTP_ENABLE_HTTP2 and _H2_AVAILABLE
+        client = httpx.AsyncClient(
+            timeout=timeout if timeout is not None else HTTP_DEFAULT_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS_PER_HOST,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            http2=http2,
+        )
+        _clients[key] = client
+        logger.info(f"HTTP pool created for {key} (http2={http2}, max_connections={HTTP_MAX_CONNECTIONS_PER_HOST})")
+
+    return client
+
+
+async def close_http_clients():
+    """Закрывает все общие HTTP-клиенты (вызывается при остановке приложения)"""
+    clients = list(_clients.values())
+    _clients.clear()
+
+    for client in clients:
+        try:
+            await client.aclose()
+        except Exception as e:
+            logger.error(f"Failed to close HTTP client: {e}")
+
+    if clients:
+        logger.info(f"Closed {len(clients)} HTTP pools")
+
@@ -0,0 +1,202 @@
+"""
+Двухуровневый кэш: L1 в памяти процесса + L2 в Redis
+
+Бот и веб-админка - разные процессы. Когда админка меняет данные, она
+вызывает invalidate(): ключи удаляются из L2, а всем процессам по
+Redis pub/sub уходит сообщение, по которому они чистят свой L1.
+Поэтому TTL могут быть долгими без риска отдавать старые наценки.
+"""
+
+import asyncio
+import json
+import os
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from src.utils.cache import TTLCache
+from src.utils.redis_client import get_redis, pack, unpack
+from src.utils.single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация
+CACHE_INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+LAYERED_CACHE_PREFIX = "lc:"  # префикс ключей L2 в Redis
+
+# Префиксы ключей по доменам
+CITY_CACHE_PREFIX = "city:"     # города и наценки городов
+FX_CONFIG_CACHE_PREFIX = "fx:"  # источники, пары и правила FX
+
+# Маркер пустого результата в L2
+_NEGATIVE_L2 = b"\x00none"
+
+
+class LayeredCache:
+    """L1 (TTLCache) + L2 (Redis) с инвалидацией через pub/sub"""
+
+    def __init__(self, l1: Optional[TTLCache] = None):
+        self.l1 = l1 or TTLCache()
+        self._loads = SingleFlight()
+        self._hooks: List[Tuple[str, Callable[[str], Any]]] = []
+        self._listener: Optional[asyncio.Task] = None
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Callable[[], Awaitable[Any]],
+        ttl_seconds: float = 3600,
+        negative_ttl_seconds: Optional[float] = None
+    ) -> Any:
+        """
+        Возвращает значение из L1, затем из L2, иначе вызывает loader
+
+        Значение должно сериализоваться в JSON (dict/list/str/числа).
+        """
+        entry = self.l1.get_entry(key)
+        if entry is not None:
+            return entry.value
+
+        return await self._loads.do(
+            ("layered", key),
+            lambda: self._load(key, loader, ttl_seconds, negative_ttl_seconds)
+        )
+
+    async def _load(self, key, loader, ttl_seconds, negative_ttl_seconds) -> Any:
+        redis_key = LAYERED_CACHE_PREFIX + key
+        try:
+            raw = await get_redis().get(redis_key)
+            if raw is not None:
+                value = None if raw == _NEGATIVE_L2 else unpack(raw)
+                self.l1.set_nowait(key, value, ttl_seconds if value is not None else (negative_ttl_seconds or 1))
+                return value
+        except Exception as e:
+            logger.warning(f"L2 cache read failed for {key}: {e}")
+
+        value = await loader()
+
+        if value is None and not negative_ttl_seconds:
+            return None
+
+        ttl = ttl_seconds if value is not None else negative_ttl_seconds
+        self.l1.set_nowait(key, value, ttl)
+        try:
+            payload = _NEGATIVE_L2 if value is None else pack(value)
+            await get_redis().set(redis_key, payload, ex=max(int(ttl), 1))
+        except Exception as e:
+            logger.warning(f"L2 cache write failed for {key}: {e}")
+
+        return value
+
+    async def invalidate(self, key: str, prefix: bool = False):
+        """
+        Инвалидирует ключ (или все ключи с префиксом) во всех процессах
+
+        Args:
+            key: Ключ или префикс, например "city:"
+            prefix: True - удалить все ключи, начинающиеся с key
+        """
+        await self._apply_invalidation(key, prefix)
+
+        try:
+            redis = get_redis()
+            if prefix:
+                keys = [k async for k in redis.scan_iter(match=f"{LAYERED_CACHE_PREFIX}{key}*", count=500)]
+                if keys:
+                    await redis.delete(*keys)
+            else:
+                await redis.delete(LAYERED_CACHE_PREFIX + key)
+
+            await redis.publish(CACHE_INVALIDATION_CHANNEL, json.dumps({"key": key, "prefix": prefix}))
+        except Exception as e:
+            logger.error(f"Failed to publish cache invalidation for {key}: {e}")
+
+    def on_invalidate(self, prefix: str, callback: Callable[[str], Any]):
+        """Регистрирует callback(key), вызываемый при инвалидации ключей с префиксом"""
+        self._hooks.append((prefix, callback))
+
+    async def _apply_invalidation(self, key: str, prefix: bool):
+        """Чистит L1 и вызывает зарегистрированные хуки"""
+        if prefix:
+            self.l1.delete_prefix(key)
+        else:
+            await self.l1.delete(key)
+
+        for hook_prefix, callback in self._hooks:
+            if key.startswith(hook_prefix) or (prefix and hook_prefix.startswith(key)):
+                try:
+                    callback(key)
+                except Exception as e:
+                    logger.error(f"Cache invalidation hook failed for {key}: {e}")
+
+        logger.debug(f"Cache invalidated: {key} (prefix={prefix})")
+
+    async def _listen(self):
+        """Слушает канал инвалидации, переподключается при ошибках"""
+        while True:
+            pubsub = None
+            try:
+                pubsub = get_redis().pubsub()
+                await pubsub.subscribe(CACHE_INVALIDATION_CHANNEL)
+                logger.info(f"Subscribed to cache invalidation channel {CACHE_INVALIDATION_CHANNEL}")
+
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    try:
+                        data = json.loads(message["data"])
+                        await self._apply_invalidation(data["key"], bool(data.get("prefix")))
+                    except Exception as e:
+                        logger.error(f"Bad cache invalidation message {message.get('data')!r}: {e}")
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Cache invalidation listener error: {e}")
+                # Пока нет подписки, L1 мог пропустить сообщения - сбрасываем его
+                await self.l1.clear()
+                await asyncio.sleep(5)
+            finally:
+                if pubsub is not None:
+                    try:
+                        await pubsub.aclose()
+                    except Exception:
+                        pass
+
+    def start_listener(self):
+        """Запускает фоновую подписку на инвалидации"""
+        if self._listener is None or self._listener.done():
+            self._listener = asyncio.create_task(self._listen())
+
+    async def stop_listener(self):
+        """Останавливает подписку"""
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Статистика L1"""
+        return {
+            "l1": self.l1.get_stats(),
+            "listener_running": self._listener is not None and not self._listener.done(),
+        }
+
+
+# Глобальный экземпляр кэша
+_layered_cache: Optional[LayeredCache] = None
+
+
+def get_layered_cache() -> LayeredCache:
+    """Получает глобальный двухуровневый кэш"""
+    global _layered_cache
+    if _layered_cache is None:
+        _layered_cache = LayeredCache()
+    return _layered_cache
+
+
+async def invalidate_cache(key: str, prefix: bool = False):
+    """Инвалидирует ключ во всех процессах (удобная обертка)"""
+    await get_layered_cache().invalidate(key, prefix)
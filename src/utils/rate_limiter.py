@@ -0,0 +1,97 @@
+"""
+Ограничение частоты запросов к внешним API (token bucket на хост)
+"""
+
+import asyncio
+import os
+import time
+import logging
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+logger = logging.getLogger(__name__)
+
+# Конфигурация по умолчанию (для хостов без явных настроек)
+HTTP_RATE_LIMIT_RPS = float(os.getenv("HTTP_RATE_LIMIT_RPS", 20))
+HTTP_RATE_LIMIT_BURST = float(os.getenv("HTTP_RATE_LIMIT_BURST", 20))
+
+
+class TokenBucket:
+    """
+    Token bucket без блокировок
+
+    Каждый вызов acquire() резервирует токены сразу (баланс может уйти
+    в минус) и спит ровно столько, сколько нужно до их пополнения.
+    Благодаря этому ожидающие обслуживаются в порядке резервирования.
+    """
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = max(capacity, 1.0)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._waits = 0
+
+    def _refill(self, now: float):
+        elapsed = now - self._updated_at
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated_at = now
+
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Резервирует токены и возвращает время ожидания в секундах"""
+        self._refill(time.monotonic())
+        self._tokens -= tokens
+        if self._tokens >= 0:
+            return 0.0
+        return -self._tokens / self.rate
+
+    async def acquire(self, tokens: float = 1.0):
+        """Ждет, пока можно выполнить запрос"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            self._waits += 1
+            await asyncio.sleep(delay)
+
+    def get_stats(self) -> Dict[str, float]:
+        """Статистика для мониторинга"""
+        self._refill(time.monotonic())
+        return {
+            "rate": self.rate,
+            "capacity": self.capacity,
+            "tokens": round(self._tokens, 2),
+            "waits": self._waits,
+        }
+
+
+# Бакеты по хосту: {"api.rapira.net": TokenBucket}
+_buckets: Dict[str, TokenBucket] = {}
+
+
+def get_host_bucket(
+    url: str,
+    rate: Optional[float] = None,
+    capacity: Optional[float] = None
+) -> TokenBucket:
+    """
+    Возвращает общий token bucket для хоста из url
+
+    Параметры rate/capacity учитываются только при первом создании бакета.
+    """
+    host = urlsplit(url).netloc.lower() or url
+    bucket = _buckets.get(host)
+    if bucket is None:
+        bucket = TokenBucket(
+            rate=rate if rate is not None else HTTP_RATE_LIMIT_RPS,
+            capacity=capacity if capacity is not None else HTTP_RATE_LIMIT_BURST,
+        )
+        _buckets[host] = bucket
+        logger.debug(f"Rate limiter for {host}: {bucket.rate} rps, burst {bucket.capacity}")
+    return bucket
+
+
+def get_rate_limiter_stats() -> Dict[str, Dict[str, float]]:
+    """Статистика всех бакетов"""
+    return {host: bucket.get_stats() for host, bucket in _buckets.items()}
@@ -0,0 +1,219 @@
+"""
+Общий Redis-клиент приложения
+
+Один пул соединений на процесс: кэши, котировки, шина рыночных данных,
+RapiraProvider и FSM-хранилище aiogram работают через get_redis().
+
+- Время каждой команды (и каждого пайплайна целиком) собирается в
+  RedisMetrics, см. get_redis_stats().
+- set_many / get_many пишут и читают пачку ключей за один round-trip
+  (пайплайн SET ... EX и MGET), чтобы цикл опроса не делал запрос на символ.
+- pack / unpack - компактное бинарное представление горячих объектов
+  (msgpack, если установлен, иначе JSON из src/utils/serialization.py).
+  Значения msgpack помечены первым байтом, поэтому старые JSON-значения
+  читаются без миграции.
+"""
+
+import os
+import time
+import logging
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Mapping, Optional
+
+import redis.asyncio as aioredis
+from redis.asyncio.client import Pipeline
+
+from src.utils import serialization
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - необязательная зависимость
+    msgpack = None
+
+logger = logging.getLogger(__name__)
+
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_DB = int(os.getenv("REDIS_DB", 0))
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_CODEC = os.getenv("REDIS_CODEC", "msgpack").lower()  # msgpack | json
+
+_MSGPACK_MARKER = b"M"
+
+
+# ----------------------------------------------------------------------
+# Кодирование значений
+# ----------------------------------------------------------------------
+
+def pack(value: Any) -> bytes:
+    """Кодирует значение для Redis (msgpack с маркером или JSON)"""
+    if msgpack is not None and REDIS_CODEC == "msgpack":
+        return _MSGPACK_MARKER + msgpack.packb(value, default=serialization.json_default, use_bin_type=True)
+    return serialization.dumps(value)
+
+
+def unpack(raw: Optional[bytes]) -> Any:
+    """Декодирует значение, записанное pack() (или прежний JSON)"""
+    if raw is None:
+        return None
+    if isinstance(raw, str):
+        raw = raw.encode()
+    if raw[:1] == _MSGPACK_MARKER:
+        if msgpack is None:
+            raise ValueError("msgpack value in Redis, but msgpack is not installed")
+        return msgpack.unpackb(raw[1:], raw=False)
+    return serialization.loads(raw)
+
+
+# ----------------------------------------------------------------------
+# Метрики команд
+# ----------------------------------------------------------------------
+
+class _CommandStats:
+    __slots__ = ('calls', 'errors', 'total_ms', 'max_ms', 'samples')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples: Deque[float] = deque(maxlen=256)
+
+
+class RedisMetrics:
+    """Задержки Redis по командам (p95 - по последним 256 вызовам)"""
+
+    def __init__(self):
+        self._commands: Dict[str, _CommandStats] = {}
+
+    def record(self, command: str, elapsed_ms: float, error: bool = False):
+        stats = self._commands.get(command)
+        if stats is None:
+            stats = self._commands[command] = _CommandStats()
+        stats.calls += 1
+        stats.errors += error
+        stats.total_ms += elapsed_ms
+        stats.max_ms = max(stats.max_ms, elapsed_ms)
+        stats.samples.append(elapsed_ms)
+
+    def get_stats(self) -> Dict[str, Dict]:
+        result = {}
+        for command, stats in sorted(self._commands.items()):
+            ordered = sorted(stats.samples)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] if ordered else 0.0
+            result[command] = {
+                'calls': stats.calls,
+                'errors': stats.errors,
+                'avg_ms': round(stats.total_ms / stats.calls, 3) if stats.calls else 0.0,
+                'p95_ms': round(p95, 3),
+                'max_ms': round(stats.max_ms, 3),
+            }
+        return result
+
+    def reset(self):
+        self._commands.clear()
+
+
+_metrics = RedisMetrics()
+
+
+def _command_name(args) -> str:
+    name = args[0] if args else "?"
+    return (name.decode() if isinstance(name, bytes) else str(name)).upper()
+
+
+class InstrumentedPipeline(Pipeline):
+    """Пайплайн, который учитывает время выполнения пачки как PIPELINE"""
+
+    async def execute(self, raise_on_error: bool = True) -> List[Any]:
+        started = time.perf_counter()
+        error = False
+        try:
+            return await super().execute(raise_on_error)
+        except Exception:
+            error = True
+            raise
+        finally:
+            _metrics.record("PIPELINE", (time.perf_counter() - started) * 1000, error)
+
+
+class InstrumentedRedis(aioredis.Redis):
+    """Redis-клиент с замером времени каждой команды"""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        error = False
+        try:
+            return await super().execute_command(*args, **options)
+        except Exception:
+            error = True
+            raise
+        finally:
+            _metrics.record(_command_name(args), (time.perf_counter() - started) * 1000, error)
+
+    def pipeline(self, transaction: bool = True, shard_hint: Optional[str] = None) -> Pipeline:
+        return InstrumentedPipeline(self.connection_pool, self.response_callbacks, transaction, shard_hint)
+
+
+_redis: Optional[aioredis.Redis] = None
+
+
+def get_redis() -> aioredis.Redis:
+    """Получает общий Redis-клиент (один пул соединений на процесс)"""
+    global _redis
+    if _redis is None:
+        _redis = InstrumentedRedis(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            db=REDIS_DB,
+            max_connections=REDIS_MAX_CONNECTIONS,
+        )
+    return _redis
+
+
+# ----------------------------------------------------------------------
+# Пакетные операции
+# ----------------------------------------------------------------------
+
+async def set_many(mapping: Mapping[str, Any], ttl: Optional[int] = None, encode=pack) -> int:
+    """
+    Записывает пачку ключей за один round-trip
+
+    MSET не умеет TTL, поэтому при ttl - пайплайн из SET ... EX без транзакции.
+    """
+    if not mapping:
+        return 0
+    redis = get_redis()
+    if ttl is None:
+        await redis.mset({key: encode(value) for key, value in mapping.items()})
+    else:
+        pipe = redis.pipeline(transaction=False)
+        for key, value in mapping.items():
+            pipe.set(key, encode(value), ex=max(int(ttl), 1))
+        await pipe.execute()
+    return len(mapping)
+
+
+async def get_many(keys: Iterable[str], decode=unpack) -> Dict[str, Any]:
+    """Читает пачку ключей одним MGET; отсутствующие ключи не попадают в результат"""
+    keys = list(keys)
+    if not keys:
+        return {}
+    values = await get_redis().mget(keys)
+    return {key: decode(raw) for key, raw in zip(keys, values) if raw is not None}
+
+
+def get_redis_stats() -> Dict[str, Dict]:
+    """Задержки команд общего клиента для мониторинга"""
+    return _metrics.get_stats()
+
+
+async def close_redis():
+    """Закрывает общий Redis-клиент"""
+    global _redis
+    if _redis is not None:
+        try:
+            await _redis.aclose()
+        except Exception as e:
+            logger.error(f"Failed to close Redis client: {e}")
+        _redis = None
@@ -0,0 +1,78 @@
+"""
+Быстрая сериализация JSON
+
+Один сериализатор для ответов бирж, значений в Redis и JSON-ответов
+веб-админки. Если установлен orjson (и JSON_BACKEND не json) - используется
+он, иначе стандартный json. Результат у обоих бэкендов одинаковый:
+компактный JSON в UTF-8.
+
+- Decimal кодируется точной строкой ("81.53"), как раньше делали
+  эндпоинты через str(); вызывающему коду преобразовывать не нужно.
+- datetime / date - в ISO 8601 (как datetime.isoformat()).
+"""
+
+import os
+import json
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Union
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - необязательная зависимость
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+JSON_BACKEND = os.getenv("JSON_BACKEND", "auto").lower()  # auto | orjson | json
+
+if JSON_BACKEND == "orjson" and orjson is None:
+    logger.warning("JSON_BACKEND=orjson, but orjson is not installed - using json")
+
+USE_ORJSON = orjson is not None and JSON_BACKEND in ("auto", "orjson")
+BACKEND = "orjson" if USE_ORJSON else "json"
+
+
+def json_default(value: Any) -> Any:
+    """Типы, которых нет в JSON (годится и как default для msgpack)"""
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+if USE_ORJSON:
+    def dumps(value: Any, sort_keys: bool = False) -> bytes:
+        """Кодирует значение в JSON (bytes, UTF-8)"""
+        option = orjson.OPT_NON_STR_KEYS | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        return orjson.dumps(value, default=json_default, option=option)
+
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        """Разбирает JSON из bytes или str"""
+        return orjson.loads(data)
+else:
+    def dumps(value: Any, sort_keys: bool = False) -> bytes:
+        """Кодирует значение в JSON (bytes, UTF-8)"""
+        return json.dumps(
+            value, default=json_default, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":")
+        ).encode()
+
+    def loads(data: Union[bytes, bytearray, memoryview, str]) -> Any:
+        """Разбирает JSON из bytes или str"""
+        if isinstance(data, memoryview):
+            data = bytes(data)
+        return json.loads(data)
+
+
+def dumps_str(value: Any, sort_keys: bool = False) -> str:
+    """Кодирует значение в JSON-строку"""
+    return dumps(value, sort_keys=sort_keys).decode()
+
+
+def response_json(response) -> Any:
+    """Тело HTTP-ответа httpx как JSON (вместо response.json())"""
+    return loads(response.content)
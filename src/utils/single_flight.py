@@ -0,0 +1,75 @@
+"""
+Single-flight: объединение одинаковых одновременных запросов
+
+Пока запрос с ключом (source, endpoint, params) выполняется, все остальные
+вызовы с тем же ключом ждут его результат вместо отправки своего запроса.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def flight_key(source: str, endpoint: str, params: Optional[Dict] = None) -> Tuple:
+    """Ключ запроса: (source, endpoint, отсортированные params)"""
+    return (source, endpoint, tuple(sorted((params or {}).items())))
+
+
+class SingleFlight:
+    """Группа объединяемых запросов со счетчиками попаданий"""
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, key: Hashable, field: str):
+        source = key[0] if isinstance(key, tuple) and key else str(key)
+        stats = self._stats.setdefault(source, {"hits": 0, "misses": 0})
+        stats[field] += 1
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Выполняет func() или присоединяется к уже идущему вызову с тем же ключом
+
+        Отмена одного из ожидающих не отменяет общий запрос для остальных.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count(key, "hits")
+            return await asyncio.shield(task)
+
+        self._count(key, "misses")
+        task = asyncio.ensure_future(func())
+        self._inflight[key] = task
+
+        def _done(finished: asyncio.Task):
+            if self._inflight.get(key) is finished:
+                del self._inflight[key]
+            # Помечаем исключение прочитанным, даже если все ожидающие отменены
+            if not finished.cancelled():
+                finished.exception()
+
+        task.add_done_callback(_done)
+        return await asyncio.shield(task)
+
+    def in_flight(self) -> int:
+        """Количество выполняющихся запросов"""
+        return len(self._inflight)
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Счетчики по источникам: {"rapira": {"hits": 10, "misses": 3}}"""
+        return {source: dict(stats) for source, stats in self._stats.items()}
+
+
+# Глобальная группа для всех клиентов бирж
+_single_flight: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> SingleFlight:
+    """Получает глобальную single-flight группу"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -6,14 +6,32 @@ from starlette.middleware.sessions import SessionMiddleware
 import os
 import asyncpg
 import logging
-import httpx
 import asyncio
+from contextlib import asynccontextmanager
 from typing import Optional
 from datetime import datetime
 
+from src.utils.http_client import get_http_client, close_http_clients
+from src.utils.layered_cache import (
+    get_layered_cache, invalidate_cache, CITY_CACHE_PREFIX, FX_CONFIG_CACHE_PREFIX
+)
+from src.utils.redis_client import close_redis
+from src.web_admin.responses import FastJSONResponse
+
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Жизненный цикл приложения: подписка на инвалидации кэша и закрытие общих ресурсов"""
+    get_layered_cache().start_listener()
+    yield
+    await get_layered_cache().stop_listener()
+    await close_http_clients()
+    await close_redis()
+
+
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(SessionMiddleware, secret_key=os.getenv("ADMIN_SECRET_KEY", "supersecret"))
 templates = Jinja2Templates(directory="src/web_admin/templates")
 app.mount("/static", StaticFiles(directory="src/web_admin/static"), name="static")
@@ -1089,7 +1107,7 @@ from src.services.fx_scheduler import get_fx_scheduler
 # ============================================================================
 
 # API Endpoints (used by the new universal rates management page)
-@app.get("/api/fx/rates")
+@app.get("/api/fx/rates", response_class=FastJSONResponse)
 async def api_get_rates(
     base: Optional[str] = None,
     quote: Optional[str] = None,
@@ -1103,45 +1121,46 @@ async def api_get_rates(
     
     fx_service = await get_fx_service()
     
+    # Decimal и datetime кодирует FastJSONResponse (строкой и ISO 8601), минуя jsonable_encoder
     if base and quote:
         rate = await fx_service.get_final_rate(base, quote, source, allow_stale=stale_ok)
         if not rate:
             raise HTTPException(status_code=404, detail="Rate not found")
         
-            return {
+        return FastJSONResponse({
             "base": rate.base_currency,
             "quote": rate.quote_currency,
             "source": rate.source_code,
-            "final_price": str(rate.final_price),
-            "raw_price": str(rate.raw_price),
+            "final_price": rate.final_price,
+            "raw_price": rate.raw_price,
             "applied_rule_id": rate.applied_rule_id,
             "markup": {
-                "percent": str(rate.markup_percent) if rate.markup_percent else None,
-                "fixed": str(rate.markup_fixed) if rate.markup_fixed else None
+                "percent": rate.markup_percent or None,
+                "fixed": rate.markup_fixed or None
             },
-            "calculated_at": rate.calculated_at.isoformat(),
+            "calculated_at": rate.calculated_at,
             "stale": rate.stale,
-            "bid": str(rate.bid_price) if rate.bid_price else None,
-            "ask": str(rate.ask_price) if rate.ask_price else None
-        }
+            "bid": rate.bid_price or None,
+            "ask": rate.ask_price or None
+        })
     else:
         rates = await fx_service.get_all_final_rates(source, allow_stale=stale_ok)
         
-        return {
+        return FastJSONResponse({
             "rates": [
                 {
                     "base": r.base_currency,
                     "quote": r.quote_currency,
                     "source": r.source_code,
                     "internal_symbol": r.internal_symbol,
-                    "final_price": str(r.final_price),
-                    "raw_price": str(r.raw_price),
-                    "calculated_at": r.calculated_at.isoformat(),
+                    "final_price": r.final_price,
+                    "raw_price": r.raw_price,
+                    "calculated_at": r.calculated_at,
                     "stale": r.stale
                 }
                 for r in rates
             ]
-        }
+        })
 
 @app.post("/api/fx/sync")
 async def api_trigger_sync(
@@ -1216,6 +1235,7 @@ async def api_update_source(code: str, request: Request, user=Depends(get_curren
             WHERE code = $2 AND deleted_at IS NULL
         """, enabled, code)
     
+    await invalidate_cache(FX_CONFIG_CACHE_PREFIX, prefix=True)
     return {"success": True, "code": code, "enabled": enabled}
 
 @app.get("/api/fx/logs")
@@ -1319,6 +1339,7 @@ from src.services.rapira_simple import (
     get_rapira_simple_client, 
     CITIES
 )
+from src.services.pricing_matrix import get_pricing_engine
 
 # Legacy /admin/city-rates page removed - use /admin/rates-management instead
 
@@ -1346,7 +1367,7 @@ async def api_get_city_rate(
     
     return rate
 
-@app.get("/api/city-rates/all")
+@app.get("/api/city-rates/all", response_class=FastJSONResponse)
 async def api_get_all_city_rates(
     symbol: str,
     operation: str = "buy",
@@ -1356,85 +1377,43 @@ async def api_get_all_city_rates(
     if not user:
         raise HTTPException(status_code=401, detail="Unauthorized")
     
-    # Получаем базовый курс из Rapira один раз
-    client = await get_rapira_simple_client()
-    base_data = await client.get_base_rate(symbol)
+    # Курсы всех городов - одна строка матрицы цен (пересчитывается на каждом тике)
+    engine = await get_pricing_engine()
+    prices = await engine.quote_all(symbol, operation)
     
-    if not base_data or not (base_data.get('best_ask') or base_data.get('best_bid')):
-            return {
-                "success": False,
+    if not prices:
+        return {
+            "success": False,
             "error": "No base rate available",
             "symbol": symbol,
             "rates": {}
-            }
-            
-    # Выбираем базовую цену
-    base_rate = base_data['best_ask'] if operation == "buy" else base_data['best_bid']
-    if not base_rate:
-            return {
-                "success": False,
-            "error": "No rate for operation",
-            "symbol": symbol,
-            "rates": {}
         }
     
-    # Получаем все города и их наценки одним запросом
-    pool = await get_db_pool()
-    async with pool.acquire() as conn:
-        cities_data = await conn.fetch("""
-            SELECT 
-                c.code,
-                c.name,
-                c.markup_buy,
-                c.markup_sell,
-                COALESCE(cpm.markup_buy, c.markup_buy) as city_markup_buy,
-                COALESCE(cpm.markup_sell, c.markup_sell) as city_markup_sell,
-                COALESCE(cpm.markup_fixed, c.markup_fixed) as markup_fixed
-            FROM cities c
-            LEFT JOIN city_pair_markups cpm ON cpm.city_id = c.id 
-                AND cpm.pair_symbol = $1 
-                AND cpm.enabled = true
-            WHERE c.enabled = true
-            ORDER BY c.sort_order, c.name
-        """, symbol)
-    
-    results = {}
-    
-    for city in cities_data:
-        # Выбираем наценку в зависимости от операции
-        if operation == "buy":
-            markup_percent = float(city['city_markup_buy'])
-        else:
-            markup_percent = float(city['city_markup_sell'])
-        markup_fixed = float(city['markup_fixed'])
-        
-        # Применяем наценку
-        from decimal import Decimal
-        final_rate = float(base_rate) * (1 + markup_percent / 100) + markup_fixed
-        final_rate = round(final_rate, 2)
-        
-        results[city['code']] = {
+    results = {
+        code: {
             'symbol': symbol,
-            'city': city['code'],
-            'city_name': city['name'],
-            'best_source': 'rapira',
-            'base_rate': float(base_rate),
-            'final_rate': final_rate,
-            'markup_percent': markup_percent,
-            'markup_fixed': markup_fixed,
+            'city': code,
+            'city_name': price.city_name,
+            'best_source': price.source,
+            'base_rate': price.base_rate,
+            'final_rate': price.final_rate,
+            'markup_percent': price.markup_percent,
+            'markup_fixed': price.markup_fixed,
             'operation': operation,
-            'rapira_rate': float(base_rate),
+            'rapira_rate': price.base_rate,
             'grinex_rate': None,
-            'timestamp': base_data['timestamp'].isoformat() if hasattr(base_data['timestamp'], 'isoformat') else str(base_data['timestamp'])
+            'timestamp': price.timestamp
         }
+        for code, price in prices.items()
+    }
     
-        return {
+    return FastJSONResponse({
         "success": True,
         "symbol": symbol,
         "operation": operation,
         "rates": results,
-        "timestamp": datetime.now().isoformat()
-    }
+        "timestamp": datetime.now()
+    })
 
 @app.post("/api/city-rates/update-markup")
 async def api_update_city_markup(
@@ -1457,6 +1436,7 @@ async def api_update_city_markup(
                 AND deleted_at IS NULL
         """, percent, f"%город: {city}%")
     
+    await invalidate_cache(FX_CONFIG_CACHE_PREFIX, prefix=True)
     return {"success": True, "city": city, "percent": percent}
 
 @app.get("/api/rapira/base-rate")
@@ -1572,6 +1552,7 @@ async def api_create_city(
                 VALUES ($1, $2, $3, $4, $5, $6, $7)
             """, code, name, markup_buy, markup_sell, markup_fixed, preferred_source, enabled)
             
+            await invalidate_cache(CITY_CACHE_PREFIX, prefix=True)
             return {"success": True, "code": code, "name": name}
         except Exception as e:
             from fastapi import HTTPException
@@ -1632,6 +1613,7 @@ async def api_update_city(
             
             query = f"UPDATE cities SET {', '.join(updates)} WHERE id = ${idx}"
             await conn.execute(query, *values)
+            await invalidate_cache(CITY_CACHE_PREFIX, prefix=True)
         
         return {"success": True, "city_id": city_id}
 
@@ -1648,6 +1630,7 @@ async def api_delete_city(
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute("DELETE FROM cities WHERE id = $1", city_id)
+        await invalidate_cache(CITY_CACHE_PREFIX, prefix=True)
         
         return {"success": True, "city_id": city_id}
 
@@ -1742,6 +1725,7 @@ async def api_create_city_pair_markup(
                 markup_fixed = EXCLUDED.markup_fixed,
                 updated_at = NOW()
         """, city_id, pair_symbol, markup_buy, markup_sell, markup_fixed)
+        await invalidate_cache(CITY_CACHE_PREFIX, prefix=True)
         
         return {"success": True}
 
@@ -1758,6 +1742,7 @@ async def api_delete_city_pair_markup(
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute("DELETE FROM city_pair_markups WHERE id = $1", markup_id)
+        await invalidate_cache(CITY_CACHE_PREFIX, prefix=True)
         
         return {"success": True}
 
@@ -1817,6 +1802,7 @@ async def api_create_source_pair(
                 ON CONFLICT (base_currency, quote_currency) DO NOTHING
             """, base, quote, enabled)
             
+            await invalidate_cache(FX_CONFIG_CACHE_PREFIX, prefix=True)
             return {
                 "success": True,
                 "pair_id": pair_id,
@@ -1879,6 +1865,7 @@ async def api_delete_source_pair(
     pool = await get_db_pool()
     async with pool.acquire() as conn:
         await conn.execute("DELETE FROM fx_source_pair WHERE id = $1", pair_id)
+        await invalidate_cache(FX_CONFIG_CACHE_PREFIX, prefix=True)
         
         return {"success": True, "pair_id": pair_id}
 
@@ -2045,16 +2032,16 @@ async def send_telegram_message(chat_id: int, text: str, parse_mode: Optional[st
         payload["parse_mode"] = parse_mode
     
     try:
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            response = await client.post(url, json=payload)
-            result = response.json()
-            
-            if result.get("ok"):
-                logger.info(f"Message sent to {chat_id}")
-                return True
-            else:
-                logger.error(f"Failed to send message to {chat_id}: {result.get('description')}")
-                return False
+        client = get_http_client(url, timeout=10.0)
+        response = await client.post(url, json=payload, timeout=10.0)
+        result = response.json()
+        
+        if result.get("ok"):
+            logger.info(f"Message sent to {chat_id}")
+            return True
+        else:
+            logger.error(f"Failed to send message to {chat_id}: {result.get('description')}")
+            return False
     except Exception as e:
         logger.error(f"Error sending message to {chat_id}: {e}")
         return False
\ No newline at end of file
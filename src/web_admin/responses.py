@@ -0,0 +1,21 @@
+"""
+JSON-ответы веб-админки через быстрый сериализатор (src/utils/serialization.py)
+"""
+
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+from src.utils.serialization import dumps
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    JSONResponse на orjson (или json, если orjson не установлен)
+
+    Decimal и datetime кодируются сериализатором: эндпоинты отдают значения
+    моделей как есть, без str() и isoformat() на каждое поле.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,94 @@
+"""
+Общие фикстуры тестов: поддельные соединение и пул asyncpg
+"""
+
+import inspect
+
+import pytest
+
+
+class NullContext:
+    """async with, возвращающий value"""
+
+    def __init__(self, value=None):
+        self.value = value
+
+    async def __aenter__(self):
+        return self.value
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+class FakeConn:
+    """
+    Соединение asyncpg, записывающее запросы в calls: (метод, запрос, аргументы)
+
+    fail_with - исключение первой записи (COPY или executemany);
+    on_fetch / on_fetchval - ответы на чтение: функция (query, *args),
+    может быть асинхронной.
+    """
+
+    def __init__(self, fail_with=None, on_fetch=None, on_fetchval=None):
+        self.calls = []
+        self.fail_with = fail_with
+        self.on_fetch = on_fetch
+        self.on_fetchval = on_fetchval
+
+    def queries(self, method=None):
+        return [query for kind, query, _ in self.calls if method is None or kind == method]
+
+    def _fail(self):
+        if self.fail_with:
+            error, self.fail_with = self.fail_with, None
+            raise error
+
+    async def _answer(self, handler, default, query, args):
+        if handler is None:
+            return default
+        result = handler(query, *args)
+        return await result if inspect.isawaitable(result) else result
+
+    async def execute(self, query, *args):
+        self.calls.append(('execute', query, args))
+
+    async def executemany(self, query, rows):
+        self._fail()
+        self.calls.append(('executemany', query, list(rows)))
+
+    async def copy_records_to_table(self, table, records, columns):
+        self._fail()
+        self.calls.append(('copy', table, list(records)))
+
+    async def fetch(self, query, *args):
+        self.calls.append(('fetch', query, args))
+        return await self._answer(self.on_fetch, [], query, args)
+
+    async def fetchval(self, query, *args):
+        self.calls.append(('fetchval', query, args))
+        return await self._answer(self.on_fetchval, None, query, args)
+
+    def transaction(self):
+        return NullContext()
+
+
+class FakePool:
+    """Пул asyncpg с одним FakeConn; acquired - сколько раз брали соединение"""
+
+    def __init__(self, conn=None):
+        self.conn = conn or FakeConn()
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+        return NullContext(self.conn)
+
+
+@pytest.fixture
+def pg_conn():
+    return FakeConn()
+
+
+@pytest.fixture
+def pg_pool(pg_conn):
+    return FakePool(pg_conn)
@@ -0,0 +1,75 @@
+"""
+Тесты адаптивного интервала опроса
+"""
+
+import time
+from datetime import datetime
+from decimal import Decimal
+
+from src.services.adaptive_polling import AdaptivePoller, PollSchedule
+from src.services.rate_snapshot import RateQuote
+
+
+def quote(symbol: str, bid: str, ask: str) -> RateQuote:
+    return RateQuote(symbol, "rapira", Decimal(bid), Decimal(ask), datetime.now(), time.monotonic(), 1)
+
+
+class TestAdaptivePoller:
+    """Интервал между min и max по спросу и волатильности"""
+
+    def test_idle_symbol_uses_max_interval(self):
+        poller = AdaptivePoller(enabled=True)
+        assert poller.interval("BTC/USDT", 2, 30) == 30
+
+    def test_demand_speeds_up_polling(self):
+        poller = AdaptivePoller(enabled=True)
+        for _ in range(5):
+            poller.record_lookup("USDT/RUB")
+        interval = poller.interval("USDT/RUB", 2, 30)
+        assert 2 < interval < 30
+
+        for _ in range(50):
+            poller.record_lookup("USDT/RUB")
+        assert poller.interval("USDT/RUB", 2, 30) == 2
+
+    def test_volatility_speeds_up_polling(self):
+        poller = AdaptivePoller(enabled=True)
+        poller.on_tick(quote("USDT/RUB", "80.00", "80.10"))
+        poller.on_tick(quote("USDT/RUB", "80.00", "80.10"))
+        assert poller.interval("USDT/RUB", 2, 30) == 30
+
+        for _ in range(10):
+            poller.on_tick(quote("USDT/RUB", "81.00", "81.10"))
+            poller.on_tick(quote("USDT/RUB", "80.00", "80.10"))
+        assert poller.interval("USDT/RUB", 2, 30) == 2
+
+    def test_group_uses_hottest_symbol(self):
+        poller = AdaptivePoller(enabled=True)
+        for _ in range(20):
+            poller.record_lookup("USDT/RUB")
+        assert poller.interval(["BTC/USDT", "USDT/RUB"], 15, 60) == 15
+
+
+class TestPollSchedule:
+    """Опрашиваются только пары с подошедшим сроком"""
+
+    def test_hot_symbol_becomes_due_immediately(self):
+        poller = AdaptivePoller(enabled=True)
+        schedule = PollSchedule(poller, min_interval=0, max_interval=30)
+
+        assert schedule.due(["USDT/RUB", "BTC/USDT"]) == ["USDT/RUB", "BTC/USDT"]
+        schedule.mark_polled(["USDT/RUB", "BTC/USDT"])
+        assert schedule.due(["USDT/RUB", "BTC/USDT"]) == []
+
+        # Спрос появился после опроса - пара горячая, срок подходит сразу
+        for _ in range(20):
+            poller.record_lookup("USDT/RUB")
+        assert schedule.due(["USDT/RUB", "BTC/USDT"]) == ["USDT/RUB"]
+
+        stats = schedule.get_stats()
+        assert stats["intervals"]["BTC/USDT"]["interval_seconds"] == 30
+        assert stats["intervals"]["USDT/RUB"]["interval_seconds"] == 0
+
+    def test_disabled_uses_base_interval(self):
+        schedule = PollSchedule(AdaptivePoller(enabled=False), 2, 30, base_interval=5)
+        assert schedule.interval("USDT/RUB") == 5
@@ -0,0 +1,159 @@
+"""
+Тесты in-process кэша (TTL, вытеснение, stale-while-revalidate)
+"""
+
+import asyncio
+import pytest
+from unittest.mock import patch
+
+from src.utils import cache as cache_module
+from src.utils.cache import TTLCache, cached_query
+
+
+class TestTTLCache:
+    """Тесты TTLCache"""
+
+    @pytest.mark.asyncio
+    async def test_set_get_delete(self):
+        cache = TTLCache(max_entries=100, shards=4)
+        await cache.set("city_markup:moscow", {"markup_buy": 0.5}, ttl_seconds=60)
+
+        assert await cache.get("city_markup:moscow") == {"markup_buy": 0.5}
+        await cache.delete("city_markup:moscow")
+        assert await cache.get("city_markup:moscow") is None
+
+    @pytest.mark.asyncio
+    async def test_ttl_uses_monotonic_clock(self):
+        cache = TTLCache()
+        with patch("src.utils.cache.time.monotonic", return_value=1000.0):
+            await cache.set("k", "v", ttl_seconds=10)
+        with patch("src.utils.cache.time.monotonic", return_value=1005.0):
+            assert await cache.get("k") == "v"
+        with patch("src.utils.cache.time.monotonic", return_value=1011.0):
+            assert await cache.get("k") is None
+        assert len(cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction_bounds_size(self):
+        cache = TTLCache(max_entries=3, shards=1, policy="lru")
+        for key in ("a", "b", "c"):
+            await cache.set(key, key)
+        await cache.get("a")  # "a" становится самым свежим
+        await cache.set("d", "d")
+
+        assert len(cache) == 3
+        assert await cache.get("b") is None
+        assert await cache.get("a") == "a"
+        assert cache.get_stats()["evictions"] == 1
+
+    @pytest.mark.asyncio
+    async def test_lfu_eviction(self):
+        cache = TTLCache(max_entries=2, shards=1, policy="lfu")
+        await cache.set("hot", 1)
+        await cache.set("cold", 2)
+        for _ in range(3):
+            await cache.get("hot")
+        await cache.set("new", 3)
+
+        assert await cache.get("cold") is None
+        assert await cache.get("hot") == 1
+
+    @pytest.mark.asyncio
+    async def test_lfu_admits_new_key_into_full_shard(self):
+        cache = TTLCache(max_entries=3, shards=1, policy="lfu")
+        for key, reads in (("a", 3), ("b", 1), ("c", 2)):
+            await cache.set(key, key)
+            for _ in range(reads):
+                await cache.get(key)
+
+        await cache.set("new", "new")
+        assert await cache.get("new") == "new"
+        assert await cache.get("b") is None  # наименее читаемый
+
+        # Теперь реже всех читался "new" (1 раз) - он и вытесняется
+        await cache.set("newer", "newer")
+        assert await cache.get("newer") == "newer"
+        assert await cache.get("new") is None
+        assert len(cache) == 3
+
+    @pytest.mark.asyncio
+    async def test_lfu_index_follows_delete_and_clear(self):
+        cache = TTLCache(max_entries=2, shards=1, policy="lfu")
+        await cache.set("a", 1)
+        await cache.set("b", 2)
+        await cache.get("b")
+        await cache.delete("a")
+        await cache.set("c", 3)
+        await cache.set("d", 4)  # вытесняет "c", а не читаемый "b"
+
+        assert await cache.get("b") == 2
+        assert await cache.get("d") == 4
+        await cache.clear()
+        await cache.set("e", 5)
+        assert await cache.get("e") == 5
+
+    @pytest.mark.asyncio
+    async def test_memory_accounting(self):
+        cache = TTLCache(max_entries=100, shards=2)
+        await cache.set("k", "x" * 1000)
+        assert cache.get_stats()["approx_memory_bytes"] > 1000
+        await cache.clear()
+        assert cache.get_stats()["approx_memory_bytes"] == 0
+
+    def test_stats_do_not_list_entries(self):
+        stats = TTLCache().get_stats()
+        assert "entries" not in stats
+        assert stats["total_entries"] == 0
+
+
+class TestCachedQuery:
+    """Тесты cached_query"""
+
+    @pytest.fixture(autouse=True)
+    def fresh_cache(self):
+        with patch.object(cache_module, "_global_cache", TTLCache()):
+            yield
+
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_run_query_once(self):
+        calls = 0
+
+        async def query():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"markup_buy": 1.0}
+
+        results = await asyncio.gather(*(cached_query("k", query) for _ in range(10)))
+        assert calls == 1
+        assert all(r == {"markup_buy": 1.0} for r in results)
+
+    @pytest.mark.asyncio
+    async def test_negative_caching(self):
+        calls = 0
+
+        async def query():
+            nonlocal calls
+            calls += 1
+            return None
+
+        assert await cached_query("missing", query, negative_ttl_seconds=30) is None
+        assert await cached_query("missing", query, negative_ttl_seconds=30) is None
+        assert calls == 1
+
+    @pytest.mark.asyncio
+    async def test_stale_while_revalidate(self):
+        values = iter(["old", "new"])
+
+        async def query():
+            return next(values)
+
+        with patch("src.utils.cache.time.monotonic", return_value=1000.0):
+            assert await cached_query("k", query, ttl_seconds=10, stale_ttl_seconds=100) == "old"
+
+        with patch("src.utils.cache.time.monotonic", return_value=1050.0):
+            # Устаревшее значение отдается сразу, обновление идет в фоне
+            assert await cached_query("k", query, ttl_seconds=10, stale_ttl_seconds=100) == "old"
+            await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            assert await cached_query("k", query, ttl_seconds=10, stale_ttl_seconds=100) == "new"
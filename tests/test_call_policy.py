@@ -0,0 +1,167 @@
+"""
+Тесты политики вызовов бирж: deadline, hedging, circuit breaker
+"""
+
+import asyncio
+import time
+import pytest
+import httpx
+
+from src.utils.call_policy import CallPolicy, CircuitBreaker, CircuitOpenError, DeadlineExceeded
+
+
+def http_error(status: int) -> httpx.HTTPStatusError:
+    request = httpx.Request("GET", "https://example.test")
+    return httpx.HTTPStatusError(f"HTTP {status}", request=request, response=httpx.Response(status, request=request))
+
+
+class TestDeadline:
+    """Задержка ограничена deadline, а не расписанием повторов"""
+
+    @pytest.mark.asyncio
+    async def test_hanging_source_bounded_by_deadline(self):
+        policy = CallPolicy("test", max_attempts=5, backoff=1.0, hedge=False)
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        started = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            await policy.call(hang, deadline=0.1)
+        assert time.monotonic() - started < 0.3
+
+    @pytest.mark.asyncio
+    async def test_retries_within_budget(self):
+        policy = CallPolicy("test", max_attempts=3, backoff=0.01, hedge=False)
+        calls = []
+
+        async def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise http_error(502)
+            return "ok"
+
+        assert await policy.call(flaky, deadline=1) == "ok"
+        assert policy.get_stats()["retries"] == 2
+
+    @pytest.mark.asyncio
+    async def test_client_error_not_retried(self):
+        policy = CallPolicy("test", max_attempts=3, backoff=0.01, hedge=False)
+        calls = []
+
+        async def not_found():
+            calls.append(1)
+            raise http_error(404)
+
+        with pytest.raises(httpx.HTTPStatusError):
+            await policy.call(not_found, deadline=1)
+        assert len(calls) == 1
+        assert policy.breaker.state == CircuitBreaker.CLOSED
+
+
+class TestHedging:
+    """Страхующий запрос после p95"""
+
+    @pytest.mark.asyncio
+    async def test_hedge_wins_over_slow_primary(self):
+        policy = CallPolicy("test", hedge=True)
+        policy._latencies.extend([0.01] * 50)
+        calls = []
+
+        async def request():
+            calls.append(1)
+            # Первый запрос "завис", страхующий отвечает сразу
+            await asyncio.sleep(5 if len(calls) == 1 else 0)
+            return len(calls)
+
+        started = time.monotonic()
+        assert await policy.call(request, deadline=1) == 2
+        assert time.monotonic() - started < 0.5
+        stats = policy.get_stats()
+        assert stats["hedges"] == 1
+        assert stats["hedge_wins"] == 1
+
+
+class TestCircuitBreaker:
+    """Breaker размыкается и пропускает пробный запрос"""
+
+    @pytest.mark.asyncio
+    async def test_open_fails_fast_then_probes(self):
+        policy = CallPolicy("test", max_attempts=1, hedge=False, breaker=CircuitBreaker(2, 0.1))
+        calls = []
+
+        async def down():
+            calls.append(1)
+            raise httpx.ConnectError("refused")
+
+        for _ in range(2):
+            with pytest.raises(httpx.ConnectError):
+                await policy.call(down)
+        assert policy.breaker.state == CircuitBreaker.OPEN
+
+        with pytest.raises(CircuitOpenError):
+            await policy.call(down)
+        assert len(calls) == 2
+        assert policy.get_stats()["short_circuits"] == 1
+
+        await asyncio.sleep(0.11)
+
+        async def up():
+            return "ok"
+
+        assert await policy.call(up) == "ok"
+        assert policy.breaker.state == CircuitBreaker.CLOSED
+
+    @pytest.mark.asyncio
+    async def test_client_error_does_not_reset_or_close(self):
+        policy = CallPolicy("test", max_attempts=1, hedge=False, breaker=CircuitBreaker(2, 0.1))
+
+        async def down():
+            raise httpx.ConnectError("refused")
+
+        async def not_found():
+            raise http_error(404)
+
+        # 4xx между сетевыми ошибками не сбрасывает счетчик
+        for func in (down, not_found, down):
+            with pytest.raises(Exception):
+                await policy.call(func)
+        assert policy.breaker.state == CircuitBreaker.OPEN
+
+        # Пробный запрос с 4xx не замыкает breaker
+        await asyncio.sleep(0.11)
+        with pytest.raises(httpx.HTTPStatusError):
+            await policy.call(not_found)
+        assert policy.breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            await policy.call(not_found)
+
+    @pytest.mark.asyncio
+    async def test_cancelled_probe_reopens_breaker(self):
+        policy = CallPolicy("test", max_attempts=1, hedge=False, breaker=CircuitBreaker(1, 0.1))
+
+        async def down():
+            raise httpx.ConnectError("refused")
+
+        async def hang():
+            await asyncio.sleep(10)
+
+        with pytest.raises(httpx.ConnectError):
+            await policy.call(down)
+        await asyncio.sleep(0.11)
+
+        probe = asyncio.ensure_future(policy.call(hang, deadline=5))
+        await asyncio.sleep(0.01)
+        probe.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await probe
+        assert policy.breaker.state == CircuitBreaker.OPEN
+
+        # После reset_timeout снова пропускается пробный запрос
+        await asyncio.sleep(0.11)
+
+        async def up():
+            return "ok"
+
+        assert await policy.call(up) == "ok"
+        assert policy.breaker.state == CircuitBreaker.CLOSED
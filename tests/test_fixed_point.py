@@ -0,0 +1,65 @@
+"""
+Тесты целочисленной арифметики цен
+"""
+
+import random
+from decimal import Decimal, ROUND_HALF_UP, ROUND_DOWN, ROUND_UP, ROUND_HALF_EVEN
+
+import pytest
+
+from src.utils.fixed_point import (
+    Markup, apply_markup, apply_markup_float, quote_decimals, round_decimal, round_float
+)
+
+DECIMAL_MODES = {
+    'ROUND_HALF_UP': ROUND_HALF_UP,
+    'ROUND_DOWN': ROUND_DOWN,
+    'ROUND_UP': ROUND_UP,
+    'BANKERS': ROUND_HALF_EVEN,
+}
+
+
+def decimal_markup(price, percent, fixed, round_to, mode):
+    """Эталон: прежний расчет через Decimal"""
+    value = price * (Decimal('1') + percent / Decimal('100')) + fixed
+    return value.quantize(Decimal('0.1') ** round_to, rounding=DECIMAL_MODES[mode])
+
+
+class TestRounding:
+    """Округление совпадает с Decimal.quantize"""
+
+    @pytest.mark.parametrize("mode", list(DECIMAL_MODES))
+    def test_round_decimal_matches_quantize(self, mode):
+        for value in ['1.235', '1.225', '1.234', '1.239', '-1.235', '-1.225', '-0.001', '2.5', '0']:
+            expected = Decimal(value).quantize(Decimal('0.01'), rounding=DECIMAL_MODES[mode])
+            assert round_decimal(Decimal(value), 2, mode) == expected
+
+    def test_float_is_rounded_as_written(self):
+        # round(1.005, 2) == 1.0 из-за двоичного представления
+        assert round_float(1.005, 2) == 1.01
+        assert round_float(81.525, 2, 'BANKERS') == 81.52
+
+    def test_quote_decimals(self):
+        assert quote_decimals("USDT/RUB") == 2
+        assert quote_decimals("BTC/USDT") == 4
+        assert quote_decimals("XYZ") == 2
+
+
+class TestMarkup:
+    """Наценка совпадает с прежним Decimal-расчетом"""
+
+    @pytest.mark.parametrize("mode", list(DECIMAL_MODES))
+    def test_matches_decimal_path(self, mode):
+        rng = random.Random(42)
+        for _ in range(500):
+            price = Decimal(rng.randint(1, 20_000_000)).scaleb(-rng.randint(2, 6))
+            percent = Decimal(rng.randint(-500, 500)).scaleb(-2)
+            fixed = Decimal(rng.randint(-100, 100)).scaleb(-2)
+            round_to = rng.choice([0, 2, 4])
+            assert Markup(percent, fixed, round_to, mode).apply_decimal(price) == \
+                decimal_markup(price, percent, fixed, round_to, mode)
+
+    def test_float_and_decimal_inputs(self):
+        assert apply_markup(Decimal('100.00'), Decimal('2.5'), Decimal('5.0')) == Decimal('107.50')
+        assert apply_markup_float(81.90, 1.0, 0.1) == 82.82
+        assert apply_markup_float(81.50, -0.5, 0.1) == 81.19
@@ -2,11 +2,13 @@
 Тесты для FX модуля (валютные курсы с наценками)
 """
 
+import asyncio
 import pytest
 from decimal import Decimal
-from datetime import datetime
+from datetime import datetime, timedelta
 
-from src.services.fx_rates import FXRatesService, RoundingMode
+from src.services.fx_rates import FXRatesService, FXSource, FXSourcePair, RoundingMode, RuleIndex
+from src.services.market_data_bus import MarketBatch
 
 
 class TestMarkupCalculations:
@@ -262,6 +264,272 @@ class TestEdgeCases:
         assert result == Decimal('1006000.00')
 
 
+class TestRuleIndex:
+    """Тесты индекса правил с окнами действия"""
+    
+    class Rule:
+        def __init__(self, level, source_id, pair_id, percent, valid_from=None, valid_to=None):
+            self.level = level
+            self.source_id = source_id
+            self.source_pair_id = pair_id
+            self.percent = percent
+            self.valid_from = valid_from
+            self.valid_to = valid_to
+    
+    def test_promo_window_switches_rule(self):
+        """Промо-правило действует только в своем окне"""
+        start = datetime(2025, 1, 1, 12, 0)
+        end = datetime(2025, 1, 1, 14, 0)
+        promo = self.Rule('pair', 1, 10, Decimal('0.5'), valid_from=start, valid_to=end)
+        base = self.Rule('source', 1, None, Decimal('2.0'))
+        index = RuleIndex([promo, base])
+        
+        before = (start - timedelta(hours=1)).timestamp()
+        during = (start + timedelta(hours=1)).timestamp()
+        after = (end + timedelta(seconds=1)).timestamp()
+        
+        assert index.find(1, 10, before) is base
+        assert index.find(1, 10, during) is promo
+        assert index.find(1, 10, end.timestamp()) is promo
+        assert index.find(1, 10, after) is base
+        # Другие пары источника промо не затрагивает
+        assert index.find(1, 11, during) is base
+    
+    def test_result_cached_within_window(self):
+        index = RuleIndex([self.Rule('global', None, None, Decimal('1.0'))])
+        now = datetime(2025, 1, 1).timestamp()
+        
+        first = index.find(1, 10, now)
+        index._by_pair[10] = [(None, None, self.Rule('pair', 1, 10, Decimal('9')))]
+        # Правила не менялись (setter не вызывался) - отдается кэш
+        assert index.find(1, 10, now + 60) is first
+    
+    def test_setter_rebuilds_index(self):
+        service = FXRatesService()
+        service._rules_cache = [self.Rule('global', None, None, Decimal('1.0'))]
+        assert service._find_applicable_rule(1, 10).percent == Decimal('1.0')
+        
+        service._rules_cache = [self.Rule('pair', 1, 10, Decimal('3.0'))]
+        assert service._find_applicable_rule(1, 10).percent == Decimal('3.0')
+        assert len(service._rules_cache) == 1
+
+
+class TestSyncBatching:
+    """Синхронизация пишет все пары пакетно, одной транзакцией"""
+    
+    @pytest.mark.asyncio
+    async def test_sync_uses_batched_upserts(self, pg_pool):
+        service = FXRatesService()
+        pool = pg_pool
+        service._pool = pool
+        service._cache_updated_at = datetime.now()
+        service._sources_cache = {
+            'rapira': FXSource(id=1, code='rapira', name='Rapira', enabled=True,
+                               auth_type='none', api_base_url=None, config={})
+        }
+        service._pairs_cache = {1: [
+            FXSourcePair(id=i, source_id=1, source_symbol=f"PAIR{i}", base_currency='X',
+                         quote_currency='RUB', internal_symbol=f"X{i}/RUB", enabled=True, config={})
+            for i in range(50)
+        ]}
+        
+        # Пакет шины рыночных данных: PAIR0 запрошена, но без котировки
+        batch = MarketBatch(
+            source='rapira',
+            rates={f"PAIR{i}": {'best_bid': Decimal('80.5'), 'best_ask': Decimal('80.5')} for i in range(1, 50)},
+            requested=[f"PAIR{i}" for i in range(50)]
+        )
+        
+        result = await service.sync_source_rates('rapira', market_batch=batch)
+        
+        assert result['pairs_succeeded'] == 49
+        assert result['pairs_failed'] == 1
+        assert result['status'] == 'partial'
+        # Одно соединение: raw, final и модель чтения пакетами, одна запись лога
+        assert pool.acquired == 1
+        kinds = [call[0] for call in pool.conn.calls]
+        assert kinds == ['executemany', 'executemany', 'executemany', 'execute']
+        assert len(pool.conn.calls[0][2]) == 49
+        assert all(row[3] == Decimal('80.5') for row in pool.conn.calls[1][2])
+        assert 'fx_rate_view' in pool.conn.calls[2][1]
+        view_row = pool.conn.calls[2][2][0]
+        assert view_row[2:4] == ('rapira', 'X1/RUB')
+        assert view_row[8] == Decimal('80.5')  # bid
+    
+    @pytest.mark.asyncio
+    async def test_failing_pair_does_not_abort_sync(self, pg_pool, monkeypatch):
+        service = FXRatesService()
+        service._pool = pg_pool
+        service._cache_updated_at = datetime.now()
+        service._sources_cache = {
+            'rapira': FXSource(id=1, code='rapira', name='Rapira', enabled=True,
+                               auth_type='none', api_base_url=None, config={})
+        }
+        service._pairs_cache = {1: [
+            FXSourcePair(id=i, source_id=1, source_symbol=f"PAIR{i}", base_currency='X',
+                         quote_currency='RUB', internal_symbol=f"X{i}/RUB", enabled=True, config={})
+            for i in range(3)
+        ]}
+        build = service._build_final_rate_row
+        
+        def build_final_rate_row(source, pair, price, at):
+            if pair.id == 1:
+                raise ArithmeticError("bad markup")
+            return build(source, pair, price, at)
+        
+        monkeypatch.setattr(service, '_build_final_rate_row', build_final_rate_row)
+        batch = MarketBatch(
+            source='rapira',
+            rates={f"PAIR{i}": {'best_bid': Decimal('80.5'), 'best_ask': Decimal('80.5')} for i in range(3)},
+            requested=[f"PAIR{i}" for i in range(3)]
+        )
+        
+        result = await service.sync_source_rates('rapira', market_batch=batch)
+        
+        assert result['status'] == 'partial'
+        assert (result['pairs_succeeded'], result['pairs_failed']) == (2, 1)
+        assert result['errors'] == ['PAIR1: bad markup']
+        assert [row[1] for row in pg_pool.conn.calls[0][2]] == [0, 2]
+    
+    @pytest.mark.asyncio
+    async def test_bus_batches_are_written_at_fx_cadence(self, pg_pool):
+        service = FXRatesService()
+        pool = pg_pool
+        service._pool = pool
+        service._cache_updated_at = datetime.now()
+        service._sources_cache = {
+            'rapira': FXSource(id=1, code='rapira', name='Rapira', enabled=True,
+                               auth_type='none', api_base_url=None, config={})
+        }
+        service._pairs_cache = {1: [
+            FXSourcePair(id=i, source_id=1, source_symbol=f"PAIR{i}", base_currency='X',
+                         quote_currency='RUB', internal_symbol=f"X{i}/RUB", enabled=True, config={})
+            for i in range(2)
+        ]}
+        
+        # Циклы шины только копят котировки (последняя по символу), в БД не пишут
+        for price in ('80.1', '80.2', '80.3'):
+            batch = MarketBatch(source='rapira', rates={'PAIR0': {'best_bid': Decimal(price), 'best_ask': Decimal(price)}},
+                                requested=['PAIR0'])
+            assert await service.ingest_market_batch(batch) == 1
+        await service.ingest_market_batch(MarketBatch(
+            source='rapira', rates={'PAIR1': {'best_bid': Decimal('1'), 'best_ask': Decimal('1')}}, requested=['PAIR1']
+        ))
+        assert pool.conn.calls == []
+        
+        # Синхронизация по расписанию FX: одна запись пакетом и одна строка fx_sync_log
+        result = await service.sync_source_rates('rapira')
+        assert result['pairs_succeeded'] == 2
+        raw_rows = pool.conn.calls[0][2]
+        assert [row[2] for row in raw_rows] == [Decimal('80.3'), Decimal('1')]
+        assert sum('fx_sync_log' in call[1] for call in pool.conn.calls) == 1
+        assert service._market_pending == {}
+
+
+
+def _source_row(id, code, enabled=True, updated_at=None):
+    return {'id': id, 'code': code, 'name': code, 'enabled': enabled, 'auth_type': 'public',
+            'api_base_url': None, 'config': {}, 'created_at': None, 'updated_at': updated_at}
+
+
+def _pair_row(id, source_id, symbol, enabled=True, updated_at=None):
+    return {'id': id, 'source_id': source_id, 'source_symbol': symbol, 'base_currency': 'USDT',
+            'quote_currency': 'RUB', 'internal_symbol': 'USDT/RUB', 'enabled': enabled, 'config': {},
+            'created_at': None, 'updated_at': updated_at}
+
+
+def _rule_row(id, percent, enabled=True, deleted_at=None, updated_at=None):
+    return {'id': id, 'level': 'global', 'source_id': None, 'source_pair_id': None,
+            'percent': Decimal(percent), 'fixed': Decimal('0'), 'rounding_mode': 'ROUND_HALF_UP',
+            'round_to': 2, 'enabled': enabled, 'valid_from': None, 'valid_to': None, 'description': None,
+            'created_at': None, 'updated_at': updated_at, 'deleted_at': deleted_at}
+
+
+class _ConfigTables:
+    """Таблицы конфигурации: полная выборка и выборка изменений (updated_at > $1)"""
+    
+    def __init__(self, conn, full, delta=None):
+        self.full = full
+        self.delta = delta or {}
+        conn.on_fetch = self.fetch
+        conn.on_fetchval = self.now
+        self.conn = conn
+    
+    async def now(self, query, *args):
+        await asyncio.sleep(0)
+        return datetime(2026, 1, 1, 12, 0, len(self.conn.calls) % 60)
+    
+    def fetch(self, query, *args):
+        table = query.split('FROM ')[1].split()[0]
+        source = self.delta if 'updated_at >' in query else self.full
+        return source.get(table, [])
+
+
+class TestConfigRefresh:
+    """Инкрементальное обновление источников, пар и правил"""
+    
+    @pytest.mark.asyncio
+    async def test_delta_applies_only_changed_rows(self, pg_conn, pg_pool):
+        conn = pg_conn
+        tables = _ConfigTables(conn, full={
+            'fx_source': [_source_row(1, 'rapira')],
+            'fx_source_pair': [_pair_row(10, 1, 'USDT/RUB'), _pair_row(11, 1, 'BTC/USDT')],
+            'fx_markup_rule': [_rule_row(100, '1.0')],
+        })
+        service = FXRatesService()
+        service._pool = pg_pool
+        
+        await service._refresh_cache()
+        assert [p.id for p in service._pairs_cache[1]] == [10, 11]
+        assert service._find_applicable_rule(1, 10).percent == Decimal('1.0')
+        
+        # Пару выключили, правило изменили - приходят только эти строки
+        tables.delta = {
+            'fx_source_pair': [_pair_row(11, 1, 'BTC/USDT', enabled=False)],
+            'fx_markup_rule': [_rule_row(100, '2.5')],
+        }
+        conn.calls.clear()
+        service._cache_updated_at = None
+        await service._refresh_cache()
+        
+        assert all('updated_at >' in q for q in conn.queries() if q.startswith('SELECT *'))
+        assert [p.id for p in service._pairs_cache[1]] == [10]
+        assert service._find_applicable_rule(1, 10).percent == Decimal('2.5')
+        assert service.get_config_stats()['changed_rows'] == 2
+        
+        # Выключенный источник скрывает свои пары
+        tables.delta = {'fx_source': [_source_row(1, 'rapira', enabled=False)]}
+        service._cache_updated_at = None
+        await service._refresh_cache()
+        assert service._sources_cache == {} and service._pairs_cache == {}
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_callers_refresh_once(self, pg_conn, pg_pool):
+        _ConfigTables(pg_conn, full={'fx_source': [_source_row(1, 'rapira')]})
+        service = FXRatesService()
+        service._pool = pg_pool
+        
+        await asyncio.gather(*(service._refresh_cache() for _ in range(10)))
+        
+        assert sum(q == "SELECT now()" for q in pg_conn.queries()) == 1
+        assert service.get_config_stats()['full'] == 1
+    
+    @pytest.mark.asyncio
+    async def test_invalidation_forces_full_reload(self, pg_conn, pg_pool):
+        tables = _ConfigTables(pg_conn, full={'fx_source': [_source_row(1, 'rapira')]})
+        service = FXRatesService()
+        service._pool = pg_pool
+        await service._refresh_cache()
+        
+        # Источник удален (дельтой не виден) - админка инвалидирует кэш
+        tables.full = {}
+        service.invalidate_cache('fx:source')
+        await service._refresh_cache()
+        
+        assert service._sources_cache == {}
+        assert service.get_config_stats()['full'] == 2
+
+
 if __name__ == '__main__':
     pytest.main([__file__, '-v'])
 
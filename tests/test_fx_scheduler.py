@@ -0,0 +1,68 @@
+"""
+Тесты параллельной синхронизации источников FX
+"""
+
+import asyncio
+import time
+import pytest
+
+from src.services import fx_scheduler
+from src.services.fx_scheduler import FXRatesScheduler, SourceSyncStats
+
+
+class FakeFXService:
+    """Сервис, у которого grinex завис, а rapira отвечает быстро"""
+
+    def __init__(self):
+        self.finished = {}
+
+    async def sync_source_rates(self, source_code):
+        if source_code == 'grinex':
+            await asyncio.sleep(10)
+        self.finished[source_code] = time.monotonic()
+        return {"pairs_processed": 2, "pairs_succeeded": 2, "pairs_failed": 0, "status": "success"}
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    service = FakeFXService()
+
+    async def get_service():
+        return service
+
+    async def get_sources(self):
+        return [{'code': 'grinex', 'config': {}}, {'code': 'rapira', 'config': {}}]
+
+    monkeypatch.setattr(fx_scheduler, "get_fx_service", get_service)
+    monkeypatch.setattr(FXRatesScheduler, "_get_enabled_sources", get_sources)
+
+    sched = FXRatesScheduler()
+    sched._source_stats['grinex'] = SourceSyncStats(interval=60, timeout=0.05)
+    sched._source_stats['rapira'] = SourceSyncStats(interval=60, timeout=1)
+    sched.service = service
+    return sched
+
+
+class TestParallelSync:
+    """Медленный источник не задерживает остальные"""
+
+    @pytest.mark.asyncio
+    async def test_slow_source_does_not_block_fast(self, scheduler):
+        started = time.monotonic()
+        await scheduler._sync_all_sources()
+
+        assert scheduler.service.finished['rapira'] - started < 0.05
+        assert 'grinex' not in scheduler.service.finished
+
+        status = scheduler.get_status()['sources']
+        assert status['rapira']['last_status'] == 'success'
+        assert status['rapira']['runs'] == 1
+        assert status['grinex']['last_status'] == 'timeout'
+        assert status['grinex']['timeouts'] == 1
+        assert status['grinex']['last_ms'] >= 50
+
+    def test_source_setting_priority(self, monkeypatch):
+        monkeypatch.setenv("FX_SYNC_INTERVAL_GRINEX", "120")
+        assert fx_scheduler._source_setting('grinex', {}, 'interval', 60) == 120
+        assert fx_scheduler._source_setting('grinex', '{"sync_interval_seconds": 30}', 'interval', 60) == 30
+        assert fx_scheduler._source_setting('rapira', None, 'interval', 60) == 60
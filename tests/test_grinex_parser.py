@@ -0,0 +1,101 @@
+"""
+Тесты разбора тикеров Grinex по схеме ответа
+"""
+
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import AsyncMock
+
+import pytest
+
+from src.services.grinex import GrinexClient
+
+
+@pytest.fixture
+def client():
+    return GrinexClient()
+
+
+class TestParseTicker:
+    """Одиночный тикер"""
+
+    def test_binance_like_format(self, client):
+        ticker = client._parse_ticker({
+            "symbol": "USDTRUB", "lastPrice": "81.5", "bidPrice": 81.4, "askPrice": "81.6",
+            "volume": 1000, "priceChangePercent": "-0.5", "time": 1735787045000,
+        })
+        assert ticker.symbol == "USDTRUB"
+        assert ticker.last_price == Decimal("81.5")
+        assert ticker.bid == Decimal("81.4")
+        assert ticker.ask == Decimal("81.6")
+        assert ticker.volume_24h == Decimal("1000")
+        assert ticker.change_24h == Decimal("-0.5")
+        assert ticker.high_24h is None
+        assert ticker.timestamp == datetime.fromtimestamp(1735787045)
+
+    def test_alias_priority_and_fallthrough(self, client):
+        # lastPrice пустой - берется следующий вариант; нечисловое значение пропускается
+        ticker = client._parse_ticker({"pair": "btcrub", "lastPrice": None, "last": "bad", "c": "1.25"})
+        assert ticker.symbol == "btcrub"
+        assert ticker.last_price == Decimal("1.25")
+
+        # Единственный вариант ключа с нечисловым значением - поле пустое, тикер разбирается
+        ticker = client._parse_ticker({"pair": "btcrub", "last": "1.5", "bid": "n/a"})
+        assert ticker.last_price == Decimal("1.5")
+        assert ticker.bid is None
+
+    def test_iso_timestamp_and_default(self, client):
+        ticker = client._parse_ticker({"s": "X", "c": "1", "t": "2025-01-02T03:04:05Z"})
+        assert ticker.timestamp.isoformat() == "2025-01-02T03:04:05+00:00"
+
+        before = datetime.now()
+        assert client._parse_ticker({"s": "X", "c": "1"}).timestamp >= before
+
+    def test_without_symbol(self, client):
+        assert client._parse_ticker({"symbol": "", "last": "1"}) is None
+        assert client._parse_ticker({"last": "1"}) is None
+
+    def test_schema_detected_once_per_shape(self, client):
+        for price in ("1", "2", "3"):
+            client._parse_ticker({"symbol": "A", "last": price})
+        client._parse_ticker({"pair": "B", "last": "1"})
+        assert len(client._ticker_schemas) == 2
+
+
+class TestBulk:
+    """Пачка /api/v1/tickers за один проход"""
+
+    @pytest.mark.asyncio
+    async def test_list_response(self, client):
+        data = [
+            {"symbol": f"c{n}rub", "last": str(n), "bid": str(n - 0.5), "at": 1, "timestamp": 1735787045}
+            for n in range(1, 1001)
+        ]
+        data.append("garbage")
+        client._make_request = AsyncMock(return_value=(data, 1.0))
+
+        tickers = await client.get_all_tickers()
+
+        assert len(tickers) == 1000
+        assert tickers["c7rub"].bid == Decimal("6.5")
+        assert len(client._ticker_schemas) == 1
+        assert tickers["c1rub"].timestamp is tickers["c1000rub"].timestamp
+
+    @pytest.mark.asyncio
+    async def test_dict_response_uses_outer_symbol(self, client):
+        data = {"usdtrub": {"buy": "81.4", "last": "81.5"}, "btcrub": {"symbol": "ignored", "last": "1"}}
+        client._make_request = AsyncMock(return_value=(data, 1.0))
+
+        tickers = await client.get_all_tickers()
+
+        assert set(tickers) == {"usdtrub", "btcrub"}
+        assert tickers["usdtrub"].last_price == Decimal("81.5")
+        assert "symbol" not in data["usdtrub"]  # ответ не изменяется
+
+    @pytest.mark.asyncio
+    async def test_bad_item_is_skipped(self, client):
+        data = [{"symbol": "A", "last": "1", "t": "not a date"}, {"symbol": "B", "last": "2", "t": 1}]
+        client._make_request = AsyncMock(return_value=(data, 1.0))
+
+        tickers = await client.get_all_tickers()
+        assert list(tickers) == ["B"]
@@ -0,0 +1,126 @@
+"""
+Тесты двухуровневого кэша (L1 + Redis)
+"""
+
+import fnmatch
+import pytest
+
+from src.utils import layered_cache
+from src.utils.cache import TTLCache
+from src.utils.layered_cache import LayeredCache
+
+
+class FakeRedis:
+    """Минимальный in-memory Redis для тестов"""
+
+    def __init__(self):
+        self.data = {}
+        self.published = []
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value.encode() if isinstance(value, str) else value
+
+    async def delete(self, *keys):
+        for key in keys:
+            self.data.pop(key, None)
+
+    async def scan_iter(self, match=None, count=None):
+        for key in list(self.data):
+            if fnmatch.fnmatch(key, match):
+                yield key
+
+    async def publish(self, channel, message):
+        self.published.append((channel, message))
+
+
+class BrokenRedis:
+    async def get(self, key):
+        raise ConnectionError("redis down")
+
+    async def set(self, key, value, ex=None):
+        raise ConnectionError("redis down")
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(layered_cache, "get_redis", lambda: redis)
+    return redis
+
+
+class TestLayeredCache:
+    """Тесты LayeredCache"""
+
+    @pytest.mark.asyncio
+    async def test_l2_shared_between_processes(self, fake_redis):
+        calls = 0
+
+        async def load():
+            nonlocal calls
+            calls += 1
+            return {"markup_buy": 0.5}
+
+        bot_cache = LayeredCache(TTLCache(shards=2))
+        admin_cache = LayeredCache(TTLCache(shards=2))
+
+        assert await bot_cache.get_or_load("city:markup:moscow", load) == {"markup_buy": 0.5}
+        assert await admin_cache.get_or_load("city:markup:moscow", load) == {"markup_buy": 0.5}
+        assert calls == 1
+
+    @pytest.mark.asyncio
+    async def test_invalidate_prefix_clears_l1_l2_and_publishes(self, fake_redis):
+        cache = LayeredCache(TTLCache(shards=2))
+        hooked = []
+        cache.on_invalidate("city:", hooked.append)
+
+        async def load():
+            return {"markup_buy": 0.5}
+
+        await cache.get_or_load("city:markup:moscow", load)
+        await cache.get_or_load("city:dict", load)
+        await cache.invalidate("city:", prefix=True)
+
+        assert len(cache.l1) == 0
+        assert fake_redis.data == {}
+        assert len(fake_redis.published) == 1
+        assert hooked == ["city:"]
+
+    @pytest.mark.asyncio
+    async def test_remote_invalidation_message_clears_l1(self, fake_redis):
+        cache = LayeredCache(TTLCache(shards=2))
+
+        async def load():
+            return 1
+
+        await cache.get_or_load("fx:config", load)
+        await cache._apply_invalidation("fx:", True)
+        assert cache.l1.get_entry("fx:config") is None
+
+    @pytest.mark.asyncio
+    async def test_redis_failure_falls_back_to_loader(self, monkeypatch):
+        monkeypatch.setattr(layered_cache, "get_redis", lambda: BrokenRedis())
+        cache = LayeredCache(TTLCache(shards=2))
+
+        async def load():
+            return ["moscow"]
+
+        assert await cache.get_or_load("city:dict", load) == ["moscow"]
+        # Значение все равно попало в L1
+        assert cache.l1.get_entry("city:dict").value == ["moscow"]
+
+    @pytest.mark.asyncio
+    async def test_negative_result_cached(self, fake_redis):
+        cache = LayeredCache(TTLCache(shards=2))
+        calls = 0
+
+        async def load():
+            nonlocal calls
+            calls += 1
+            return None
+
+        assert await cache.get_or_load("city:markup:unknown", load, negative_ttl_seconds=30) is None
+        assert await cache.get_or_load("city:markup:unknown", load, negative_ttl_seconds=30) is None
+        assert calls == 1
@@ -0,0 +1,124 @@
+"""
+Тесты шины рыночных данных
+"""
+
+import pytest
+from decimal import Decimal
+
+from src.services import market_data_bus
+from src.services.adaptive_polling import AdaptivePoller, PollSchedule
+from src.services.market_data_bus import MarketDataBus
+from src.services.rapira_simple import BatchRatesResult
+from src.services.rate_snapshot import RateSnapshotStore
+
+
+@pytest.fixture(autouse=True)
+def _fresh_snapshot(monkeypatch):
+    # Символы, запрошенные хендлерами в других тестах, не должны попадать в цикл
+    store = RateSnapshotStore()
+    monkeypatch.setattr(market_data_bus, 'get_rate_snapshot_store', lambda: store)
+    return store
+
+
+class _Fetcher:
+    """Биржа, считающая запросы по символам"""
+
+    def __init__(self, failing=()):
+        self.requested = []
+        self.failing = set(failing)
+
+    async def __call__(self, symbols):
+        self.requested.extend(symbols)
+        result = BatchRatesResult()
+        for symbol in symbols:
+            if symbol in self.failing:
+                result.errors[symbol] = "HTTP 502"
+            else:
+                result.rates[symbol] = {'symbol': symbol, 'best_bid': Decimal('80'), 'best_ask': Decimal('81')}
+        return result
+
+
+def _symbols(*symbols):
+    async def provider():
+        return {'rapira': list(symbols)}
+    return provider
+
+
+class TestMarketDataBus:
+    """Один запрос на символ за цикл и рассылка подписчикам"""
+
+    @pytest.mark.asyncio
+    async def test_each_symbol_fetched_once_per_cycle(self):
+        fetcher = _Fetcher()
+        bus = MarketDataBus()
+        bus.register_source('rapira', fetcher)
+        received = {}
+
+        async def rates_table(batch):
+            received['rates_table'] = sorted(batch.rates)
+            return len(batch.rates)
+
+        async def fx(batch):
+            received['fx'] = sorted(batch.rates)
+
+        bus.subscribe('rates_table', rates_table, _symbols('USDT/RUB', 'BTC/USDT'))
+        bus.subscribe('fx', fx, _symbols('USDT/RUB', 'ETH/USDT'))
+
+        batch = await bus.poll('rapira')
+
+        assert sorted(fetcher.requested) == ['BTC/USDT', 'ETH/USDT', 'USDT/RUB']
+        assert received['rates_table'] == received['fx'] == ['BTC/USDT', 'ETH/USDT', 'USDT/RUB']
+        assert batch.results['rates_table'] == 3
+
+    @pytest.mark.asyncio
+    async def test_failing_subscriber_is_isolated(self):
+        bus = MarketDataBus()
+        bus.register_source('rapira', _Fetcher(failing=['BTC/USDT']))
+        delivered = []
+
+        async def broken(batch):
+            raise RuntimeError("db down")
+
+        async def healthy(batch):
+            delivered.append(batch)
+
+        bus.subscribe('broken', broken, _symbols('USDT/RUB', 'BTC/USDT'))
+        bus.subscribe('healthy', healthy)
+
+        batch = await bus.poll('rapira')
+
+        assert len(delivered) == 1
+        assert isinstance(batch.results['broken'], RuntimeError)
+        assert batch.errors == {'BTC/USDT': 'HTTP 502'}
+        stats = bus.get_stats()
+        assert stats['subscribers']['broken']['errors'] == 1
+        assert stats['sources']['rapira']['errors'] == 1
+
+    @pytest.mark.asyncio
+    async def test_explicit_symbols_and_empty_cycle(self):
+        fetcher = _Fetcher()
+        bus = MarketDataBus()
+        bus.register_source('rapira', fetcher)
+
+        batch = await bus.poll('rapira', symbols=['USDT/RUB'])
+        assert fetcher.requested == ['USDT/RUB']
+        assert batch.requested == ['USDT/RUB']
+        assert await bus.poll('rapira', symbols=[]) is None
+
+    @pytest.mark.asyncio
+    async def test_unknown_source(self):
+        with pytest.raises(ValueError):
+            await MarketDataBus().poll('grinex')
+
+    @pytest.mark.asyncio
+    async def test_failed_symbols_stay_due(self):
+        fetcher = _Fetcher(failing=['BTC/USDT'])
+        bus = MarketDataBus()
+        bus.register_source('rapira', fetcher)
+        schedule = PollSchedule(AdaptivePoller(), min_interval=60, max_interval=60)
+
+        await bus.poll('rapira', schedule=schedule, symbols=['USDT/RUB', 'BTC/USDT'])
+        fetcher.requested.clear()
+        await bus.poll('rapira', schedule=schedule, symbols=['USDT/RUB', 'BTC/USDT'])
+
+        assert fetcher.requested == ['BTC/USDT']
@@ -0,0 +1,162 @@
+"""
+Тесты потокового получения курсов (локальный WebSocket-сервер)
+"""
+
+import asyncio
+import json
+import pytest
+from decimal import Decimal
+
+import websockets
+
+from src.services import rate_snapshot
+from src.services.market_stream import (
+    BookMessage, JsonBookFeed, LiveOrderBook, MarketFeed, MarketStream
+)
+
+
+@pytest.fixture(autouse=True)
+def fresh_snapshot(monkeypatch):
+    store = rate_snapshot.RateSnapshotStore()
+    monkeypatch.setattr(rate_snapshot, "_rate_snapshot_store", store)
+    return store
+
+
+async def wait_for(predicate, timeout=2.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not predicate():
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("condition not reached")
+        await asyncio.sleep(0.01)
+
+
+class TestLiveOrderBook:
+    """Тесты стакана"""
+
+    def test_snapshot_and_delta(self):
+        book = LiveOrderBook("USDT/RUB")
+        book.apply(BookMessage("USDT/RUB", True, bids=[(81.5, 10), (81.4, 5)], asks=[(81.9, 3)], seq=1))
+        book.apply(BookMessage("USDT/RUB", False, bids=[(81.5, 0)], asks=[(81.8, 1)], seq=2))
+
+        assert book.best_bid() == 81.4
+        assert book.best_ask() == 81.8
+
+    def test_sequence_gap_requires_resync(self):
+        book = LiveOrderBook("USDT/RUB")
+        book.apply(BookMessage("USDT/RUB", True, bids=[(81.5, 10)], seq=1))
+        assert book.apply(BookMessage("USDT/RUB", False, bids=[(81.6, 1)], seq=3)) is False
+
+
+class TestMarketFeed:
+    """Контракт адаптера фида"""
+
+    def test_incomplete_feed_fails_at_instantiation(self):
+        class SubscribeOnlyFeed(MarketFeed):
+            def subscribe_messages(self, symbols):
+                return []
+
+        with pytest.raises(TypeError):
+            SubscribeOnlyFeed("wss://example.invalid")
+        assert JsonBookFeed("wss://example.invalid", "rapira").source == "rapira"
+
+
+class TestMarketStream:
+    """Поток против локального сервера"""
+
+    @pytest.mark.asyncio
+    async def test_stream_publishes_and_falls_back_to_polling(self, fresh_snapshot):
+        subscriptions = []
+
+        async def handler(ws):
+            subscriptions.append(json.loads(await ws.recv()))
+            await ws.send(json.dumps({
+                "type": "snapshot", "symbol": "USDT/RUB", "seq": 1,
+                "bids": [[81.5, 10]], "asks": [[81.9, 5]],
+            }))
+            await ws.send(json.dumps({
+                "type": "update", "symbol": "USDT/RUB", "seq": 2,
+                "bids": [[81.6, 2]], "asks": [],
+            }))
+            await asyncio.sleep(0.2)
+
+        polled = []
+
+        async def poller(symbols):
+            polled.append(list(symbols))
+            return {"USDT/RUB": (80.0, 80.5)}
+
+        server = await websockets.serve(handler, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        stream = MarketStream(
+            JsonBookFeed(f"ws://127.0.0.1:{port}", "rapira"),
+            ["USDT/RUB"],
+            poller=poller,
+            stale_seconds=1,
+            poll_interval=0.05,
+            max_backoff=0.1,
+        )
+
+        try:
+            stream.start()
+            await wait_for(lambda: stream.is_live("USDT/RUB"))
+            await wait_for(lambda: fresh_snapshot.get("USDT/RUB").best_bid == Decimal("81.6"))
+            assert subscriptions[0]["symbols"] == ["USDT/RUB"]
+            assert fresh_snapshot.get("USDT/RUB").best_ask == Decimal("81.9")
+
+            # Сервер пропал - символ обслуживается опросом
+            server.close()
+            await server.wait_closed()
+            await wait_for(lambda: not stream.is_live("USDT/RUB"))
+            await wait_for(lambda: fresh_snapshot.get("USDT/RUB").best_bid == Decimal("80.0"))
+            assert polled
+            assert stream.get_stats()["reconnects"] >= 1
+        finally:
+            await stream.stop()
+            server.close()
+
+    @pytest.mark.asyncio
+    async def test_quiet_symbol_is_polled_while_socket_is_busy(self, fresh_snapshot):
+        async def handler(ws):
+            await ws.recv()
+            await ws.send(json.dumps({
+                "type": "snapshot", "symbol": "BTC/USDT", "seq": 1,
+                "bids": [[60000, 1]], "asks": [[60100, 1]],
+            }))
+            # USDT/RUB обновляется постоянно, BTC/USDT замолкает
+            seq = 0
+            while True:
+                seq += 1
+                await ws.send(json.dumps({
+                    "type": "snapshot", "symbol": "USDT/RUB", "seq": seq,
+                    "bids": [[81.5, 10]], "asks": [[81.9, 5]],
+                }))
+                await asyncio.sleep(0.02)
+
+        polled = []
+
+        async def poller(symbols):
+            polled.append(sorted(symbols))
+            return {symbol: (1.0, 2.0) for symbol in symbols}
+
+        server = await websockets.serve(handler, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        stream = MarketStream(
+            JsonBookFeed(f"ws://127.0.0.1:{port}", "rapira"),
+            ["USDT/RUB", "BTC/USDT"],
+            poller=poller,
+            stale_seconds=0.3,
+            poll_interval=0.05,
+        )
+
+        try:
+            stream.start()
+            await wait_for(lambda: stream.is_live("USDT/RUB") and stream.is_live("BTC/USDT"))
+            polled.clear()
+
+            await wait_for(lambda: not stream.is_live("BTC/USDT"))
+            await wait_for(lambda: ["BTC/USDT"] in polled)
+            assert stream.connected and stream.is_live("USDT/RUB")
+            assert stream.get_stats()["polled_symbols"] == 1
+        finally:
+            await stream.stop()
+            server.close()
@@ -0,0 +1,59 @@
+"""
+Тесты компактного стакана и VWAP
+"""
+
+import random
+import pytest
+
+from src.services.order_book import OrderBook
+
+
+def naive_vwap(levels, amount, descending):
+    """Прежний алгоритм: сортировка и проход по уровням"""
+    total_qty = 0.0
+    weighted = 0.0
+    for price, qty in sorted(levels, key=lambda x: x[0], reverse=descending):
+        if total_qty >= amount:
+            break
+        use = min(qty, amount - total_qty)
+        weighted += price * use
+        total_qty += use
+    return weighted / total_qty if total_qty else None
+
+
+class TestOrderBook:
+    """Тесты OrderBook"""
+
+    def test_sides_sorted_from_best(self):
+        book = OrderBook("USDT/RUB", bids=[(94.8, 3), (95.0, 1)], asks=[(95.7, 3), (95.5, 1)])
+        assert book.best_bid() == 95.0
+        assert book.best_ask() == 95.5
+        assert [level.price for level in book.bids] == [95.0, 94.8]
+        assert len(book.asks) == 2
+
+    def test_vwap_matches_linear_scan(self):
+        rng = random.Random(7)
+        bids = [(round(90 + rng.random() * 5, 2), rng.randint(1, 5000)) for _ in range(200)]
+        asks = [(round(95 + rng.random() * 5, 2), rng.randint(1, 5000)) for _ in range(200)]
+        # Уникальные цены (в стакане уровень = цена)
+        bids = list(dict(bids).items())
+        asks = list(dict(asks).items())
+        book = OrderBook("USDT/RUB", bids, asks)
+
+        for amount in (1, 999, 50000, 10**9):
+            assert book.vwap(True, amount) == pytest.approx(naive_vwap(bids, amount, True))
+            assert book.vwap(False, amount) == pytest.approx(naive_vwap(asks, amount, False))
+
+    def test_apply_delta_updates_cumulative_depth(self):
+        book = OrderBook("USDT/RUB", asks=[(95.5, 1000), (95.6, 2000)])
+        book.apply_delta(asks=[(95.4, 500), (95.5, 0), (95.6, 1500)])
+
+        assert book.best_ask() == 95.4
+        assert book.asks.to_pairs() == [[95.4, 500], [95.6, 1500]]
+        assert book.asks.depth == 2000
+        assert book.vwap(False, 1000) == pytest.approx((95.4 * 500 + 95.6 * 500) / 1000)
+
+    def test_empty_side(self):
+        book = OrderBook("USDT/RUB")
+        assert book.vwap(True, 100) is None
+        assert book.best_bid() is None
@@ -0,0 +1,81 @@
+"""
+Тесты матрицы цен город × пара × сторона
+"""
+
+import pytest
+from decimal import Decimal
+
+from src.services.pricing_matrix import PricingEngine
+from src.services.rate_snapshot import RateSnapshotStore
+
+
+@pytest.fixture
+def engine():
+    engine = PricingEngine()
+    engine.set_markups(
+        [
+            ("moscow", "Москва", 0.0, 0.0, 0.0),
+            ("rostov", "Ростов-на-Дону", 1.0, -0.5, 0.1),
+        ],
+        [("rostov", "BTC/USDT", 2.0, -1.0, 0.0)],
+    )
+    store = RateSnapshotStore()
+    store.subscribe(engine.on_tick)
+    engine.store = store
+    return engine
+
+
+class TestPricingEngine:
+    """Тесты PricingEngine"""
+
+    def test_tick_recomputes_all_cities(self, engine):
+        engine.store.publish("USDT/RUB", Decimal("81.50"), Decimal("81.90"))
+
+        rostov_buy = engine.lookup("USDT/RUB", "rostov", "buy")
+        assert rostov_buy.final_rate == round(81.90 * 1.01 + 0.1, 2)
+        assert rostov_buy.city_name == "Ростов-на-Дону"
+        assert engine.lookup("USDT/RUB", "rostov", "sell").final_rate == round(81.50 * 0.995 + 0.1, 2)
+        assert engine.lookup("USDT/RUB", "moscow", "buy").final_rate == 81.90
+
+        # Новый тик - новая строка
+        engine.store.publish("USDT/RUB", Decimal("82.00"), Decimal("82.40"))
+        assert engine.lookup("USDT/RUB", "moscow", "buy").final_rate == 82.40
+
+    def test_pair_override(self, engine):
+        engine.store.publish("BTC/USDT", Decimal("60000"), Decimal("60100"))
+        assert engine.lookup("BTC/USDT", "rostov", "buy").markup_percent == 2.0
+        assert engine.markup("USDT/RUB", "rostov", "buy") == (1.0, 0.1)
+
+    def test_markup_change_recomputes_existing_rows(self, engine):
+        engine.store.publish("USDT/RUB", Decimal("81.50"), Decimal("81.90"))
+        engine.set_markups([("moscow", "Москва", 1.0, 0.0, 0.0)])
+
+        assert engine.lookup("USDT/RUB", "moscow", "buy").final_rate == round(81.90 * 1.01, 2)
+        assert engine.lookup("USDT/RUB", "rostov", "buy") is None
+
+    def test_all_cities_in_display_order(self, engine):
+        engine.store.publish("USDT/RUB", Decimal("81.50"), Decimal("81.90"))
+        assert list(engine.lookup_all("USDT/RUB", "sell")) == ["moscow", "rostov"]
+
+    def test_stale_quote_not_served(self, engine):
+        engine.store.publish("USDT/RUB", Decimal("81.50"), Decimal("81.90"))
+        assert engine.lookup("USDT/RUB", "moscow", "buy", max_age=-1) is None
+
+    @pytest.mark.asyncio
+    async def test_client_rates_without_markup(self, engine, monkeypatch):
+        from src.services import client_rates, pricing_matrix
+
+        async def pairs():
+            return ["USDT/RUB"]
+
+        async def get_engine():
+            return engine
+
+        engine.store.publish("USDT/RUB", Decimal("81.50"), Decimal("81.90"))
+        monkeypatch.setattr(client_rates, "get_available_pairs", pairs)
+        monkeypatch.setattr(pricing_matrix, "get_pricing_engine", get_engine)
+        # Наценку пары в городе сняли после расчета строки
+        monkeypatch.setattr(engine, "markup", lambda *args: None)
+
+        rates = await client_rates.get_client_rates("rostov")
+        assert rates["USDT/RUB"]["buy"]["markup"] == rates["USDT/RUB"]["sell"]["markup"] == 0.0
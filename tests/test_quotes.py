@@ -0,0 +1,178 @@
+"""
+Тесты котировок для заявок
+"""
+
+import json
+import time
+import pytest
+
+from src.services import best_rate, quotes
+from src.services.quotes import QuoteService, QUOTE_KEY_PREFIX
+
+
+class _FakeRedis:
+    """Redis в памяти (set с ex, get)"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+
+    async def get(self, key):
+        return self.data.get(key)
+
+
+class _BrokenRedis:
+    """Redis, на каждую команду отвечающий ошибкой соединения"""
+
+    async def set(self, key, value, ex=None):
+        raise ConnectionError("redis down")
+
+    async def get(self, key):
+        raise ConnectionError("redis down")
+
+
+class _FakeState:
+    """FSMContext в памяти"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get_data(self):
+        return dict(self.data)
+
+    async def update_data(self, **kwargs):
+        self.data.update(kwargs)
+
+
+@pytest.fixture
+def rates(monkeypatch):
+    """Подменяет расчет курса; rates['final_rate'] можно менять в тесте"""
+    current = {'final_rate': 95.5, 'calls': 0}
+
+    async def get_best_city_rate(symbol, city, operation):
+        current['calls'] += 1
+        return {
+            'best_source': 'rapira',
+            'base_rate': 94.0,
+            'final_rate': current['final_rate'],
+            'markup_percent': 1.5,
+            'markup_fixed': 0,
+        }
+
+    monkeypatch.setattr(best_rate, 'get_best_city_rate', get_best_city_rate)
+    return current
+
+
+@pytest.fixture
+def service(monkeypatch):
+    service = QuoteService(ttl_seconds=60, secret='test', redis=_FakeRedis())
+    monkeypatch.setattr(quotes, '_quote_service', service)
+    return service
+
+
+class TestQuoteService:
+    """Выдача и проверка котировок"""
+
+    @pytest.mark.asyncio
+    async def test_issue_and_get(self, rates, service):
+        quote = await service.issue('USDT/RUB', 'moscow', 'buy')
+        assert quote.final_rate == 95.5
+        assert quote.source == 'rapira'
+
+        loaded = await service.get(service.token(quote))
+        assert loaded == quote
+
+    @pytest.mark.asyncio
+    async def test_get_or_issue_reuses_quote(self, rates, service):
+        first = await service.get_or_issue(None, 'USDT/RUB', 'moscow', 'buy')
+        rates['final_rate'] = 97.0
+
+        again = await service.get_or_issue(service.token(first), 'USDT/RUB', 'moscow', 'buy')
+        assert again.final_rate == 95.5
+        assert rates['calls'] == 1
+
+        # Другой город - новая котировка
+        other = await service.get_or_issue(service.token(first), 'USDT/RUB', 'spb', 'buy')
+        assert other.final_rate == 97.0
+        assert other.quote_id != first.quote_id
+
+    @pytest.mark.asyncio
+    async def test_tampered_quote_is_rejected(self, rates, service):
+        quote = await service.issue('USDT/RUB', 'moscow', 'buy')
+        key = f"{QUOTE_KEY_PREFIX}{quote.quote_id}"
+        stored = json.loads(service.redis.data[key])
+        stored['final_rate'] = 1.0
+        service.redis.data[key] = json.dumps(stored)
+
+        assert await service.get(service.token(quote)) is None
+        assert service.get_stats()['invalid'] == 1
+
+    @pytest.mark.asyncio
+    async def test_expired_quote_is_rejected(self, rates, service, monkeypatch):
+        quote = await service.issue('USDT/RUB', 'moscow', 'buy')
+        later = time.time() + 120
+        monkeypatch.setattr(quotes.time, 'time', lambda: later)
+        assert await service.get(service.token(quote)) is None
+
+    @pytest.mark.asyncio
+    async def test_rate_unavailable(self, monkeypatch, service):
+        async def no_rate(symbol, city, operation):
+            return None
+        monkeypatch.setattr(best_rate, 'get_best_city_rate', no_rate)
+        assert await service.issue('USDT/RUB', 'moscow', 'buy') is None
+
+
+class TestFlow:
+    """Котировка в FSM-сценарии"""
+
+    @pytest.mark.asyncio
+    async def test_flow_keeps_rate_until_confirm(self, rates, service):
+        state = _FakeState()
+        quote = await quotes.get_flow_quote(state, 'USDT/RUB', 'moscow', 'sell')
+        assert state.data['quote_token'] == service.token(quote)
+
+        rates['final_rate'] = 99.0
+        assert (await quotes.get_flow_quote(state, 'USDT/RUB', 'moscow', 'sell')).final_rate == 95.5
+
+        confirmed, expired = await quotes.confirm_flow_quote(state)
+        assert confirmed == quote and not expired
+        snapshot = json.loads(quotes.rate_snapshot_json(confirmed))
+        assert snapshot['final_rate'] == 95.5
+        assert snapshot['quote_id'] == quote.quote_id
+
+    @pytest.mark.asyncio
+    async def test_confirm_expired_quote(self, rates, service):
+        state = _FakeState()
+        await quotes.get_flow_quote(state, 'USDT/RUB', 'moscow', 'buy')
+        service.redis.data.clear()  # TTL в Redis истек
+
+        assert await quotes.confirm_flow_quote(state) == (None, True)
+
+    @pytest.mark.asyncio
+    async def test_confirm_without_quote(self, service):
+        # Сценарий без курса (оплата инвойса в USDT)
+        assert await quotes.confirm_flow_quote(_FakeState()) == (None, False)
+
+    @pytest.mark.asyncio
+    async def test_redis_outage_does_not_block_confirm(self, rates, service, monkeypatch):
+        monkeypatch.setattr(service, '_redis', _BrokenRedis())
+        state = _FakeState()
+
+        quote = await quotes.get_flow_quote(state, 'USDT/RUB', 'moscow', 'buy')
+        assert quote.final_rate == 95.5 and not quote.stored
+        assert state.data.get('quote_token') is None
+
+        assert await quotes.confirm_flow_quote(state) == (None, False)
+
+    @pytest.mark.asyncio
+    async def test_redis_read_error_is_not_expiry(self, rates, service, monkeypatch):
+        state = _FakeState()
+        await quotes.get_flow_quote(state, 'USDT/RUB', 'moscow', 'buy')
+        monkeypatch.setattr(service, '_redis', _BrokenRedis())
+
+        with pytest.raises(quotes.QuoteStoreError):
+            await service.get(state.data['quote_token'])
+        assert await quotes.confirm_flow_quote(state) == (None, False)
+        assert service.get_stats()['expired'] == 0
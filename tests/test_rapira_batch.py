@@ -0,0 +1,104 @@
+"""
+Тесты пакетного получения курсов Rapira и token bucket
+"""
+
+import asyncio
+import pytest
+import httpx
+from unittest.mock import AsyncMock, patch
+
+from src.services.rapira import RapiraProvider
+from src.services.rapira_simple import RapiraSimpleClient
+from src.utils.rate_limiter import TokenBucket
+
+
+def _plate(ask: float, bid: float) -> dict:
+    return {
+        "ask": {"items": [{"price": ask}]},
+        "bid": {"items": [{"price": bid}]},
+    }
+
+
+class TestTokenBucket:
+    """Тесты token bucket"""
+
+    def test_burst_without_wait(self):
+        bucket = TokenBucket(rate=10, capacity=5)
+        delays = [bucket.reserve() for _ in range(5)]
+        assert delays == [0.0] * 5
+
+    def test_wait_after_burst(self):
+        bucket = TokenBucket(rate=10, capacity=2)
+        bucket.reserve()
+        bucket.reserve()
+        # Третий запрос ждет пополнения одного токена (~0.1s)
+        delay = bucket.reserve()
+        assert 0.05 < delay <= 0.1
+        # Четвертый - еще одного
+        assert bucket.reserve() > delay
+
+    def test_invalid_rate(self):
+        with pytest.raises(ValueError):
+            TokenBucket(rate=0, capacity=1)
+
+
+class TestBatchRates:
+    """Тесты параллельного получения курсов"""
+
+    @pytest.mark.asyncio
+    async def test_partial_results_with_errors(self):
+        """Ошибка по одной паре не мешает остальным"""
+        def handler(request: httpx.Request) -> httpx.Response:
+            symbol = request.url.params["symbol"]
+            if symbol == "BTC/USDT":
+                return httpx.Response(502, json={})
+            return httpx.Response(200, json=_plate(81.83, 81.50))
+
+        client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        with patch("src.services.rapira_simple.get_http_client", return_value=client):
+            rapira = RapiraSimpleClient()
+            batch = await rapira.get_multiple_rates_detailed(["USDT/RUB", "BTC/USDT", "USDT/RUB"])
+
+        assert list(batch.rates) == ["USDT/RUB"]
+        assert str(batch.rates["USDT/RUB"]["best_ask"]) == "81.83"
+        assert "BTC/USDT" in batch.errors
+        await client.aclose()
+
+    @pytest.mark.asyncio
+    async def test_requests_run_concurrently(self):
+        """N пар занимают примерно одно RTT, а не N"""
+        in_flight = 0
+        max_in_flight = 0
+
+        async def fake_fetch(symbol):
+            nonlocal in_flight, max_in_flight
+            in_flight += 1
+            max_in_flight = max(max_in_flight, in_flight)
+            await asyncio.sleep(0.05)
+            in_flight -= 1
+            return {"symbol": symbol, "best_ask": 1, "best_bid": 1}
+
+        rapira = RapiraSimpleClient()
+        symbols = [f"PAIR{i}/USDT" for i in range(20)]
+        with patch.object(rapira, "_fetch_base_rate", side_effect=fake_fetch):
+            rates = await rapira.get_multiple_rates(symbols)
+
+        assert len(rates) == 20
+        assert max_in_flight == 20
+
+
+class TestProviderRateLimit:
+    """RapiraProvider расходует тот же token bucket хоста"""
+
+    @pytest.mark.asyncio
+    async def test_provider_request_takes_host_token(self):
+        client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, json={})))
+        provider = RapiraProvider()
+        assert provider._bucket is RapiraSimpleClient()._bucket
+
+        with patch("src.services.rapira.get_http_client", return_value=client), \
+             patch.object(provider._bucket, "acquire", new=AsyncMock()) as acquire:
+            await provider._do_request("https://api.rapira.net/market/exchange-plate-mini", {"symbol": "USDT/RUB"})
+
+        acquire.assert_awaited_once()
+        await client.aclose()
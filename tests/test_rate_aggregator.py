@@ -0,0 +1,199 @@
+"""
+Тесты параллельного опроса источников курса
+"""
+
+import time
+import asyncio
+from datetime import datetime, timezone
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+from src.services import grinex
+from src.services.rate_aggregator import RateAggregator, SourceRate, fetch_grinex_rate
+
+
+def _source(code, bid, ask, delay=0.0, stale=False, error=None):
+    async def fetch(symbol, deadline):
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return SourceRate(code, bid, ask, stale=stale)
+    return fetch
+
+
+def _aggregator(deadline=0.2, **sources):
+    aggregator = RateAggregator(deadline=deadline)
+    for code, fetcher in sources.items():
+        aggregator.register(code, fetcher)
+    return aggregator
+
+
+class TestCollect:
+    """Опрос с общим deadline"""
+
+    @pytest.mark.asyncio
+    async def test_best_by_side(self):
+        aggregator = _aggregator(
+            rapira=_source('rapira', 81.0, 82.0),
+            grinex=_source('grinex', 81.5, 82.5),
+        )
+        result = await aggregator.collect('USDT/RUB', sources=['rapira', 'grinex'])
+
+        assert result.best('buy').source == 'rapira'   # минимальный ask
+        assert result.best('sell').source == 'grinex'  # максимальный bid
+        assert not result.late and not result.failed
+
+    @pytest.mark.asyncio
+    async def test_sources_are_queried_concurrently(self):
+        aggregator = _aggregator(
+            deadline=1.0,
+            a=_source('a', 1.0, 2.0, delay=0.1),
+            b=_source('b', 1.0, 2.0, delay=0.1),
+            c=_source('c', 1.0, 2.0, delay=0.1),
+        )
+        started = time.monotonic()
+        result = await aggregator.collect('USDT/RUB', sources=['a', 'b', 'c'])
+
+        assert len(result.rates) == 3
+        assert time.monotonic() - started < 0.25
+
+    @pytest.mark.asyncio
+    async def test_slow_source_is_late(self):
+        aggregator = _aggregator(
+            deadline=0.05,
+            rapira=_source('rapira', 81.0, 82.0),
+            grinex=_source('grinex', 90.0, 80.0, delay=0.2),
+        )
+        result = await aggregator.collect('USDT/RUB', sources=['rapira', 'grinex'])
+
+        assert result.late == ['grinex']
+        assert result.best('buy').source == 'rapira'
+        assert result.duration_ms < 150
+
+        # Опоздавший ответ учитывается в статистике, когда приходит
+        await asyncio.sleep(0.2)
+        stats = aggregator.get_stats()['sources']['grinex']
+        assert stats['late'] == 1
+        assert stats['late_arrived'] == 1
+
+    @pytest.mark.asyncio
+    async def test_hanging_source_is_shared_and_cancelled(self):
+        calls = []
+
+        async def hang(symbol, deadline):
+            calls.append(symbol)
+            await asyncio.sleep(10)
+
+        aggregator = RateAggregator(deadline=0.02, late_factor=10)
+        aggregator.register('grinex', hang)
+
+        for _ in range(3):
+            result = await aggregator.collect('USDT/RUB', sources=['grinex'])
+            assert result.late == ['grinex']
+        assert calls == ['USDT/RUB']
+
+        # Опоздавший запрос отменяется через deadline × late_factor
+        await asyncio.sleep(0.2)
+        assert not aggregator._inflight and not aggregator._late_tasks
+        assert aggregator.get_stats()['sources']['grinex']['late_cancelled'] == 1
+
+    @pytest.mark.asyncio
+    async def test_failing_source_does_not_block(self):
+        aggregator = _aggregator(
+            rapira=_source('rapira', 81.0, 82.0),
+            grinex=_source('grinex', None, None, error=ConnectionError('404')),
+        )
+        result = await aggregator.collect('USDT/RUB', sources=['rapira', 'grinex'])
+
+        assert 'grinex' in result.failed
+        assert result.best('sell').bid == 81.0
+
+    @pytest.mark.asyncio
+    async def test_fresh_preferred_over_stale(self):
+        aggregator = _aggregator(
+            rapira=_source('rapira', 81.0, 82.0),
+            grinex=_source('grinex', 85.0, 79.0, stale=True),
+        )
+        result = await aggregator.collect('USDT/RUB', sources=['rapira', 'grinex'])
+        assert result.best('buy').source == 'rapira'
+
+        # Только устаревшие - берем лучший из них
+        del result.rates['rapira']
+        assert result.best('buy').source == 'grinex'
+
+    @pytest.mark.asyncio
+    async def test_only_enabled_sources(self):
+        aggregator = _aggregator(
+            rapira=_source('rapira', 81.0, 82.0),
+            grinex=_source('grinex', 81.5, 82.5),
+        )
+        aggregator._enabled = ['rapira']
+        aggregator._enabled_at = time.monotonic()
+
+        result = await aggregator.collect('USDT/RUB')
+        assert list(result.rates) == ['rapira']
+
+
+class TestBestCityRate:
+    """Лучший курс города поверх агрегатора"""
+
+    @pytest.mark.asyncio
+    async def test_missing_side_is_no_rate(self, monkeypatch):
+        from src.services import best_rate
+
+        aggregator = _aggregator(rapira=_source('rapira', 81.0, None))
+
+        async def sources():
+            return ['rapira']
+
+        monkeypatch.setattr(aggregator, 'sources', sources)
+        monkeypatch.setattr(best_rate, 'get_rate_aggregator', lambda: aggregator)
+
+        assert await best_rate.get_best_city_rate('USDT/RUB', 'moscow', 'buy') is None
+
+
+class TestGrinexSource:
+    """Тикер Grinex через REST API"""
+
+    @staticmethod
+    def _client(monkeypatch, handler):
+        client = grinex.GrinexClient()
+
+        async def get_client():
+            return client
+
+        monkeypatch.setattr(grinex, "get_grinex_client", get_client)
+        return client, httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+    @pytest.mark.asyncio
+    async def test_iso_z_timestamp(self, monkeypatch):
+        now = datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+        def handler(request):
+            return httpx.Response(200, json={"symbol": "AGGZRUB", "bid": "81.4", "ask": "81.6", "timestamp": now})
+
+        _, http = self._client(monkeypatch, handler)
+        with patch("src.services.grinex.get_http_client", return_value=http):
+            rate = await fetch_grinex_rate("AGGZ/RUB", deadline=1)
+
+        assert rate.bid == 81.4 and rate.ask == 81.6
+        assert rate.stale is False
+        await http.aclose()
+
+    @pytest.mark.asyncio
+    async def test_repeated_404_stops_hitting_network(self, monkeypatch):
+        requests = []
+
+        def handler(request):
+            requests.append(request.url.path)
+            return httpx.Response(404, json={})
+
+        _, http = self._client(monkeypatch, handler)
+        with patch("src.services.grinex.get_http_client", return_value=http):
+            for _ in range(5):
+                assert await fetch_grinex_rate("AGG404/RUB", deadline=1) is None
+
+        assert requests == ["/api/v1/ticker/AGG404RUB"]
+        await http.aclose()
@@ -0,0 +1,59 @@
+"""
+Тесты отслеживания свежести курсов
+"""
+
+import time
+from datetime import datetime
+
+from src.services.rate_freshness import FreshnessTracker, is_stale
+
+
+def _at(seconds_ago):
+    return datetime.fromtimestamp(time.time() - seconds_ago)
+
+
+class TestFreshnessTracker:
+    """Сроки годности и переходы fresh -> stale"""
+
+    def test_is_stale_derived_from_calculated_at(self):
+        assert not is_stale(_at(10), threshold=60)
+        assert is_stale(_at(61), threshold=60)
+
+    def test_expire_returns_transition_once(self):
+        tracker = FreshnessTracker(threshold=60)
+        tracker.touch(1, 10, _at(120), 'grinex/USDT/RUB')
+        tracker.touch(1, 11, _at(5))
+
+        transitions = tracker.expire()
+        assert [key for key, _ in transitions] == [(1, 10)]
+        assert tracker.expire() == []
+        assert tracker.is_stale(1, 10) is True
+        assert tracker.is_stale(1, 11) is False
+        assert tracker.is_stale(2, 99) is None
+
+    def test_touch_extends_deadline(self):
+        tracker = FreshnessTracker(threshold=60)
+        tracker.touch(1, 10, _at(50))
+        tracker.touch(1, 10, _at(0))
+
+        # Старая запись в куче отбрасывается, срок - по последнему курсу
+        assert tracker.expire(now=time.time() + 30) == []
+        assert tracker.next_deadline() > time.time() + 50
+        assert len(tracker.expire(now=time.time() + 61)) == 1
+
+    def test_recovery_after_stale(self):
+        tracker = FreshnessTracker(threshold=60)
+        tracker.touch(1, 10, _at(120))
+        tracker.expire()
+        tracker.touch(1, 10, _at(0))
+
+        stats = tracker.get_stats()
+        assert stats['stale'] == 0
+        assert stats['recovered'] == 1
+
+    def test_earlier_deadline_wakes_tracker(self):
+        tracker = FreshnessTracker(threshold=60)
+        tracker.touch(1, 10, _at(0))
+        tracker._wakeup.clear()
+        tracker.touch(1, 11, _at(30))
+        assert tracker._wakeup.is_set()
@@ -0,0 +1,145 @@
+"""
+Тесты пакетной записи истории тиков
+"""
+
+import pytest
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from asyncpg.exceptions import CheckViolationError
+
+from src.services import rate_history
+from src.services.rate_history import (
+    RateHistoryWriter,
+    build_candles,
+    floor_time,
+    pick_resolution,
+)
+
+
+@pytest.fixture
+def history_conn(monkeypatch, pg_conn, pg_pool):
+    """Соединение, через которое пишет RateHistoryWriter"""
+    async def get_pool():
+        return pg_pool
+    monkeypatch.setattr(rate_history, 'get_pg_pool', get_pool)
+    return pg_conn
+
+
+T0 = datetime(2026, 1, 1, 12, 0, 10)
+
+
+def _tick(pair_id, price, seconds):
+    price = Decimal(price)
+    return (1, pair_id, price, price, None, T0 + timedelta(seconds=seconds))
+
+
+class TestCandles:
+    """Свечи пачки"""
+
+    def test_floor_time(self):
+        at = datetime(2026, 1, 1, 12, 34, 56, 789)
+        assert floor_time(at, timedelta(minutes=1)) == datetime(2026, 1, 1, 12, 34)
+        assert floor_time(at, timedelta(hours=1)) == datetime(2026, 1, 1, 12, 0)
+
+    def test_ohlc_by_tick_time(self):
+        # Тики не по порядку: open/close берутся по времени, а не по порядку в пачке
+        ticks = [_tick(7, '81.2', 20), _tick(7, '81.0', 5), _tick(7, '81.5', 30), _tick(7, '80.9', 40)]
+        candle, = build_candles(ticks, timedelta(minutes=1))
+        assert candle.bucket == datetime(2026, 1, 1, 12, 0)
+        assert (candle.open, candle.high, candle.low, candle.close) == (
+            Decimal('81.0'), Decimal('81.5'), Decimal('80.9'), Decimal('80.9')
+        )
+        assert candle.ticks == 4
+
+    def test_split_by_pair_and_bucket(self):
+        ticks = [_tick(1, '10', 0), _tick(1, '11', 60), _tick(2, '20', 0)]
+        assert len(build_candles(ticks, timedelta(minutes=1))) == 3
+        assert len(build_candles(ticks, timedelta(hours=1))) == 2
+
+
+class TestWriter:
+    """Буфер и сброс"""
+
+    @pytest.mark.asyncio
+    async def test_flush_copies_ticks_and_upserts_rollups(self, history_conn):
+        conn = history_conn
+        writer = RateHistoryWriter(batch_size=100)
+        writer.add_many([_tick(1, '10', 0), _tick(1, '11', 1)])
+
+        assert await writer.flush() == 2
+
+        kinds = [call[0] for call in conn.calls]
+        assert kinds == ['copy', 'executemany', 'executemany']
+        assert conn.calls[0][1] == 'fx_rate_snapshot'
+        assert len(conn.calls[0][2]) == 2
+        assert 'fx_rate_ohlc_1m' in conn.calls[1][1]
+        assert 'fx_rate_ohlc_1h' in conn.calls[2][1]
+        assert writer.get_stats()['buffered'] == 0
+        assert await writer.flush() == 0
+
+    def test_batch_size_wakes_flusher(self):
+        writer = RateHistoryWriter(batch_size=2)
+        writer.add(*_tick(1, '10', 0))
+        assert not writer._wakeup.is_set()
+        writer.add(*_tick(1, '10', 1))
+        assert writer._wakeup.is_set()
+
+    def test_buffer_is_bounded(self):
+        writer = RateHistoryWriter(batch_size=100, max_buffer=3)
+        writer.add_many(_tick(1, '10', i) for i in range(5))
+        stats = writer.get_stats()
+        assert stats['buffered'] == 3
+        assert stats['dropped'] == 2
+
+    @pytest.mark.asyncio
+    async def test_failed_flush_keeps_ticks(self, history_conn):
+        conn = history_conn
+        conn.fail_with = ConnectionError("db down")
+        writer = RateHistoryWriter(batch_size=100)
+        writer.add(*_tick(1, '10', 0))
+
+        assert await writer.flush() == 0
+        assert writer.get_stats()['buffered'] == 1
+        assert await writer.flush() == 1
+
+    @pytest.mark.asyncio
+    async def test_missing_partition_is_created(self, history_conn):
+        conn = history_conn
+        conn.fail_with = CheckViolationError('no partition of relation "fx_rate_snapshot" found for row')
+        writer = RateHistoryWriter(batch_size=100)
+        writer.add(*_tick(1, '10', 0))
+
+        assert await writer.flush() == 1
+        assert any('ensure_partition' in call[1] for call in conn.calls if call[0] == 'execute')
+
+    @pytest.mark.asyncio
+    async def test_partitions_for_every_day_of_buffer(self, history_conn):
+        # Буфер за три дня простоя БД: партиция нужна на каждый день, а не на первый и последний
+        conn = history_conn
+        conn.fail_with = CheckViolationError('no partition of relation "fx_rate_snapshot" found for row')
+        writer = RateHistoryWriter(batch_size=100)
+        writer.add_many(_tick(1, '10', day * 86400 + i) for day in range(3) for i in range(2))
+
+        assert await writer.flush() == 6
+        days = [call[2][0] for call in conn.calls if call[0] == 'execute' and 'ensure_partition' in call[1]]
+        assert days == [date(2026, 1, 1), date(2026, 1, 2), date(2026, 1, 3)]
+
+    @pytest.mark.asyncio
+    async def test_other_errors_do_not_create_partitions(self, history_conn):
+        conn = history_conn
+        conn.fail_with = Exception('no partition, but not a check violation')
+        writer = RateHistoryWriter(batch_size=100)
+        writer.add(*_tick(1, '10', 0))
+
+        assert await writer.flush() == 0
+        assert not any('ensure_partition' in call[1] for call in conn.calls)
+
+
+class TestResolution:
+    """Выбор таблицы по длине периода"""
+
+    def test_pick_resolution(self):
+        assert pick_resolution(T0, T0 + timedelta(minutes=30)) == 'raw'
+        assert pick_resolution(T0, T0 + timedelta(days=10)) == '1h'
+        assert pick_resolution(T0, T0 + timedelta(hours=12), max_points=1000) == '1m'
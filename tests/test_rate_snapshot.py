@@ -0,0 +1,97 @@
+"""
+Тесты in-memory снапшота курсов
+"""
+
+import pytest
+from decimal import Decimal
+from unittest.mock import AsyncMock, patch
+
+from src.services.rate_snapshot import RateSnapshotStore
+
+
+class TestRateSnapshotStore:
+    """Тесты хранилища котировок"""
+
+    def test_publish_and_get(self):
+        store = RateSnapshotStore()
+        store.publish("USDT/RUB", Decimal("81.50"), Decimal("81.83"))
+
+        quote = store.get("USDT/RUB")
+        assert quote.best_bid == Decimal("81.50")
+        assert quote.best_ask == Decimal("81.83")
+        assert quote.source == "rapira"
+        assert store.get("BTC/USDT") is None
+        assert store.get("USDT/RUB", source="grinex") is None
+
+    def test_versions_increase(self):
+        store = RateSnapshotStore()
+        first = store.publish("USDT/RUB", Decimal("1"), Decimal("2"))
+        second = store.publish("USDT/RUB", Decimal("1.1"), Decimal("2.1"))
+
+        assert second.version > first.version
+        assert store.version == second.version
+        assert store.get("USDT/RUB").best_bid == Decimal("1.1")
+
+    def test_staleness_bound(self):
+        store = RateSnapshotStore()
+        store.publish("USDT/RUB", Decimal("1"), Decimal("2"))
+
+        with patch("src.services.rate_snapshot.time.monotonic", return_value=10**9):
+            assert store.get("USDT/RUB", max_age=15) is None
+            assert store.get("USDT/RUB") is not None
+
+    def test_subscribers_notified(self):
+        store = RateSnapshotStore()
+        seen = []
+        store.subscribe(seen.append)
+        store.subscribe(lambda quote: 1 / 0)  # ошибка подписчика не ломает публикацию
+
+        store.publish("USDT/RUB", Decimal("1"), Decimal("2"))
+        assert [q.symbol for q in seen] == ["USDT/RUB"]
+
+    def test_tracked_symbols_expire_and_are_capped(self):
+        store = RateSnapshotStore(track_ttl=60, max_tracked=2)
+        with patch("src.services.rate_snapshot.time.monotonic", return_value=1000):
+            store.track("USDT/RUB")
+            store.track("BTC/USDT")
+            store.track("USDT/RUB")
+            store.track("ETH/USDT")  # вытесняет давно не запрошенный BTC/USDT
+            assert store.tracked_symbols() == ["ETH/USDT", "USDT/RUB"]
+
+        with patch("src.services.rate_snapshot.time.monotonic", return_value=1050):
+            store.track("USDT/RUB")
+        with patch("src.services.rate_snapshot.time.monotonic", return_value=1100):
+            assert store.tracked_symbols() == ["USDT/RUB"]
+
+
+class TestSnapshotReadPath:
+    """Хендлеры читают курс из снапшота без запроса к бирже"""
+
+    @pytest.mark.asyncio
+    async def test_hit_does_not_call_exchange(self):
+        from src.services import rapira_simple
+
+        store = RateSnapshotStore()
+        store.publish("USDT/RUB", Decimal("81.50"), Decimal("81.83"))
+
+        with patch.object(rapira_simple, "get_rate_snapshot_store", return_value=store), \
+             patch.object(rapira_simple, "get_rapira_simple_client", new_callable=AsyncMock) as client:
+            data = await rapira_simple.get_base_rate_snapshot("USDT/RUB")
+
+        client.assert_not_called()
+        assert data["best_ask"] == Decimal("81.83")
+        assert store.tracked_symbols() == ["USDT/RUB"]
+
+    @pytest.mark.asyncio
+    async def test_unknown_symbol_is_not_tracked(self):
+        from src.services import rapira_simple
+
+        store = RateSnapshotStore()
+        client = AsyncMock()
+        client.get_base_rate.return_value = None
+
+        with patch.object(rapira_simple, "get_rate_snapshot_store", return_value=store), \
+             patch.object(rapira_simple, "get_rapira_simple_client", new=AsyncMock(return_value=client)):
+            assert await rapira_simple.get_base_rate_snapshot("NOPE/RUB") is None
+
+        assert store.tracked_symbols() == []
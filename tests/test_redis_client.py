@@ -0,0 +1,124 @@
+"""
+Тесты общего Redis-клиента: кодирование, метрики, пакетная запись
+"""
+
+import json
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+
+from src.utils import redis_client
+from src.utils.redis_client import RedisMetrics, pack, unpack, set_many, get_many
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    def set(self, key, value, ex=None):
+        self.commands.append((key, value, ex))
+
+    async def execute(self):
+        self.redis.executed += 1
+        for key, value, ex in self.commands:
+            self.redis.data[key] = value
+            self.redis.ttl[key] = ex
+        return [True] * len(self.commands)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.ttl = {}
+        self.executed = 0
+
+    def pipeline(self, transaction=True):
+        assert transaction is False
+        return FakePipeline(self)
+
+    async def mset(self, mapping):
+        self.executed += 1
+        self.data.update(mapping)
+
+    async def mget(self, keys):
+        self.executed += 1
+        return [self.data.get(key) for key in keys]
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    redis = FakeRedis()
+    monkeypatch.setattr(redis_client, "get_redis", lambda: redis)
+    return redis
+
+
+class TestCodec:
+    """pack / unpack"""
+
+    def test_round_trip(self):
+        value = {"symbol": "USDT/RUB", "bids": [[81.5, 1000.0]], "last_ts": None}
+        assert unpack(pack(value)) == value
+
+    def test_decimal_and_datetime(self):
+        ts = datetime(2025, 1, 2, 3, 4, 5)
+        assert unpack(pack({"rate": Decimal("81.25"), "ts": ts})) == {"rate": "81.25", "ts": ts.isoformat()}
+
+    def test_reads_legacy_json(self):
+        legacy = json.dumps({"symbol": "BTC/USDT", "ts": 1})
+        assert unpack(legacy) == {"symbol": "BTC/USDT", "ts": 1}
+        assert unpack(legacy.encode()) == {"symbol": "BTC/USDT", "ts": 1}
+        assert unpack(None) is None
+
+    def test_json_codec(self, monkeypatch):
+        monkeypatch.setattr(redis_client, "REDIS_CODEC", "json")
+        raw = pack({"a": 1})
+        assert raw == b'{"a":1}'
+        assert unpack(raw) == {"a": 1}
+
+
+class TestMetrics:
+    def test_stats(self):
+        metrics = RedisMetrics()
+        for ms in range(1, 101):
+            metrics.record("GET", float(ms))
+        metrics.record("SET", 5.0, error=True)
+
+        stats = metrics.get_stats()
+        assert stats["GET"]["calls"] == 100
+        assert stats["GET"]["avg_ms"] == 50.5
+        assert stats["GET"]["p95_ms"] == 96.0
+        assert stats["GET"]["max_ms"] == 100.0
+        assert stats["SET"]["errors"] == 1
+
+
+class TestBatch:
+    """set_many / get_many - один round-trip на пачку"""
+
+    @pytest.mark.asyncio
+    async def test_set_many_with_ttl_is_one_pipeline(self, fake_redis):
+        written = await set_many({f"rapira:rate:{s}": 1.5 for s in ("A", "B", "C")}, ttl=60)
+
+        assert written == 3
+        assert fake_redis.executed == 1
+        assert set(fake_redis.ttl.values()) == {60}
+        assert unpack(fake_redis.data["rapira:rate:B"]) == 1.5
+
+    @pytest.mark.asyncio
+    async def test_set_many_without_ttl_uses_mset(self, fake_redis):
+        await set_many({"a": 1, "b": 2})
+        assert fake_redis.executed == 1
+        assert fake_redis.ttl == {}
+
+    @pytest.mark.asyncio
+    async def test_get_many_skips_missing(self, fake_redis):
+        await set_many({"a": {"x": 1}})
+        assert await get_many(["a", "missing"]) == {"a": {"x": 1}}
+        assert fake_redis.executed == 2
+
+    @pytest.mark.asyncio
+    async def test_empty_batch_skips_redis(self, fake_redis):
+        assert await set_many({}) == 0
+        assert await get_many([]) == {}
+        assert fake_redis.executed == 0
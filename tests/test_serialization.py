@@ -0,0 +1,52 @@
+"""
+Тесты сериализатора JSON и JSON-ответа веб-админки
+"""
+
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+
+import pytest
+
+from src.utils import serialization
+from src.utils.serialization import dumps, dumps_str, loads
+
+
+class TestSerialization:
+    def test_decimal_is_exact_string(self):
+        value = {"final_price": Decimal("81.5300000001"), "markup": Decimal("0")}
+        assert loads(dumps(value)) == {"final_price": "81.5300000001", "markup": "0"}
+
+    def test_datetime_matches_isoformat(self):
+        naive = datetime(2025, 1, 2, 3, 4, 5, 123456)
+        aware = datetime(2025, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        assert loads(dumps([naive, aware])) == [naive.isoformat(), aware.isoformat()]
+
+    def test_compact_utf8(self):
+        raw = dumps({"city_name": "Ростов-на-Дону", "rate": 81.5})
+        assert raw == '{"city_name":"Ростов-на-Дону","rate":81.5}'.encode()
+        assert dumps_str({"b": 1, "a": 2}, sort_keys=True) == '{"a":2,"b":1}'
+
+    def test_loads_accepts_str_and_bytes(self):
+        assert loads('{"a":[1,2.5,null]}') == loads(b'{"a":[1,2.5,null]}') == {"a": [1, 2.5, None]}
+
+    def test_unknown_type_raises(self):
+        with pytest.raises(TypeError):
+            dumps({"value": object()})
+
+    def test_matches_stdlib(self):
+        payload = {"symbol": "USDT/RUB", "bids": [[81.5, 1000.0], [81.49, 2.5]], "ts": 1700000000000}
+        assert loads(dumps(payload)) == json.loads(json.dumps(payload))
+
+
+@pytest.mark.skipif(serialization.orjson is None, reason="orjson is not installed")
+def test_backend_is_orjson_when_installed():
+    assert serialization.BACKEND == "orjson"
+
+
+def test_fast_json_response_renders_decimal():
+    from src.web_admin.responses import FastJSONResponse
+
+    response = FastJSONResponse({"final_price": Decimal("82.65"), "calculated_at": datetime(2025, 1, 2)})
+    assert response.media_type == "application/json"
+    assert json.loads(response.body) == {"final_price": "82.65", "calculated_at": "2025-01-02T00:00:00"}
@@ -0,0 +1,76 @@
+"""
+Тесты объединения одинаковых запросов (single-flight)
+"""
+
+import asyncio
+import pytest
+
+from src.utils.single_flight import SingleFlight, flight_key
+
+
+class TestSingleFlight:
+    """Тесты SingleFlight"""
+
+    @pytest.mark.asyncio
+    async def test_concurrent_calls_share_one_request(self):
+        group = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return {"price": 81.83}
+
+        key = flight_key("rapira", "/market/exchange-plate-mini", {"symbol": "USDT/RUB"})
+        results = await asyncio.gather(*(group.do(key, fetch) for _ in range(50)))
+
+        assert calls == 1
+        assert all(r == {"price": 81.83} for r in results)
+        assert group.get_stats() == {"rapira": {"hits": 49, "misses": 1}}
+        assert group.in_flight() == 0
+
+    @pytest.mark.asyncio
+    async def test_sequential_calls_not_cached(self):
+        group = SingleFlight()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        key = flight_key("grinex", "/api/v1/tickers")
+        assert await group.do(key, fetch) == 1
+        assert await group.do(key, fetch) == 2
+
+    @pytest.mark.asyncio
+    async def test_error_propagates_to_all_waiters(self):
+        group = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("HTTP 502")
+
+        key = flight_key("rapira", "/open/market/rates")
+        results = await asyncio.gather(*(group.do(key, fetch) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+
+    @pytest.mark.asyncio
+    async def test_cancelled_waiter_does_not_cancel_others(self):
+        group = SingleFlight()
+
+        async def fetch():
+            await asyncio.sleep(0.05)
+            return "ok"
+
+        key = flight_key("rapira", "/x")
+        first = asyncio.ensure_future(group.do(key, fetch))
+        second = asyncio.ensure_future(group.do(key, fetch))
+        await asyncio.sleep(0.01)
+        first.cancel()
+
+        assert await second == "ok"
+
+    def test_key_ignores_param_order(self):
+        assert flight_key("a", "/e", {"x": 1, "y": 2}) == flight_key("a", "/e", {"y": 2, "x": 1})